@@ -2,6 +2,7 @@ from configparser import NoOptionError, NoSectionError
 from pathlib import Path
 
 from pbench import PbenchConfig
+from pbench.common.compression import get_codec
 from pbench.common.constants import (
     DEFAULT_PBENCH_AGENT_INSTALL_DIR,
     DEFAULT_PBENCH_AGENT_RUN_DIR,
@@ -71,6 +72,13 @@ class PbenchAgentConfig(PbenchConfig):
         except (NoOptionError, NoSectionError):
             self.scp_opts = DEFAULT_SCP_OPTS
 
+        try:
+            self.compression = get_codec(
+                self.get("pbench-agent", "compression", fallback=None)
+            )
+        except ValueError as exc:
+            raise BadConfig(f"{exc}: {self.files}")
+
         try:
             self._unittests = self.get("pbench-agent", "debug_unittest")
         except Exception:
@@ -15,11 +15,37 @@ import requests
 
 from pbench.agent import PbenchAgentConfig
 from pbench.cli import CliContext
-from pbench.common import MetadataLog
+from pbench.common import MetadataLog, upload
 from pbench.common.exceptions import BadMDLogFormat
-from pbench.common.utils import md5sum, validate_hostname
+from pbench.common.utils import validate_hostname
 
-TarballRecord = collections.namedtuple("TarballRecord", ["name", "length", "md5"])
+TarballRecord = collections.namedtuple(
+    "TarballRecord", ["name", "length", "md5", "sha256"]
+)
+
+
+def tarball_record(tarball: Path) -> TarballRecord:
+    """Describe an existing tar ball, reading it just once to compute both its
+    MD5 and SHA256 hashes.
+
+    Args:
+        tarball: the tar ball
+
+    Returns:
+        A named tuple consisting of the Path object of the tar ball, its
+        length, and its MD5 and SHA256 hash values.
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    length = 0
+    with tarball.open("rb") as f:
+        for buf in iter(partial(f.read, 2**20), b""):
+            length += len(buf)
+            md5.update(buf)
+            sha256.update(buf)
+    return TarballRecord(
+        name=tarball, length=length, md5=md5.hexdigest(), sha256=sha256.hexdigest()
+    )
 
 
 class MakeResultTb:
@@ -70,7 +96,8 @@ class MakeResultTb:
                                 not exist
             NotADirectoryError  if either the result or target directories are
                                 not actual directories
-            RuntimeError        if it cannot find the 'tar' command on the PATH
+            RuntimeError        if it cannot find the 'tar' command, or the
+                                configured compression command, on the PATH
             ValueError          if the given controller is not a valid host
                                 name
         """
@@ -80,9 +107,9 @@ class MakeResultTb:
         self.tar_path = shutil.which("tar")
         if self.tar_path is None:
             raise RuntimeError("External 'tar' executable not found")
-        self.xz_path = shutil.which("xz")
-        if self.xz_path is None:
-            raise RuntimeError("External 'xz' executable not found")
+        self.codec = config.compression
+        if self.codec.program and shutil.which(self.codec.program) is None:
+            raise RuntimeError(f"External {self.codec.program!r} executable not found")
         self.result_dir = self._check_result_target_dir(result_dir, "Result")
         self.target_dir = self._check_result_target_dir(target_dir, "Target")
         self.config = config
@@ -190,10 +217,13 @@ class MakeResultTb:
         sure it is valid, and then the "run.raw_size" and the
         "pbench.tar-ball-creation-timestamp" fields are added.
 
-        The tar ball is created, verified, and the MD5 sum value is generated.
+        The tar ball is created, compressed with the configured codec (using
+        a single compression thread if requested), and written to the target
+        directory; its length and its MD5 and SHA256 hash values are computed
+        as it is written, rather than by reading the tar ball again.
 
         Returns a named tuple consisting of the Path object of the created tar
-        ball, its length, and its MD5 checksum value.
+        ball, its length, and its MD5 and SHA256 hash values.
 
         Raises
           - FileNotFoundError  if the result directory does not have a
@@ -207,38 +237,53 @@ class MakeResultTb:
         pbench_run_name = self.result_dir.name
         self.verify_metadata(pbench_run_name)
 
-        tarball = self.target_dir / f"{pbench_run_name}.tar.xz"
+        tarball = self.target_dir / f"{pbench_run_name}{self.codec.suffix}"
         e_file = self.target_dir / f"{pbench_run_name}.tar.err"
-        args = [self.tar_path, "--create", "--force-local"]
-        if single_threaded:
-            args.append("--xz")
-        args.append(pbench_run_name)
+        args = [self.tar_path, "--create", "--force-local", pbench_run_name]
+        compress = self.codec.compress_command(threads=1 if single_threaded else 0)
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        tar_len = 0
         try:
-            # Invoke tar directly for efficiency.
-            with tarball.open("w") as ofp, e_file.open("w") as efp:
-                if single_threaded:
-                    xz_proc = None
+            # Invoke tar directly for efficiency, piping its output through
+            # the compression command, and read the result back through a
+            # pipe so that we can hash it as we write the tar ball.
+            with tarball.open("wb") as ofp, e_file.open("w") as efp:
+                if compress is None:
+                    comp_proc = None
                 else:
-                    xz_proc = subprocess.Popen(
-                        [self.xz_path, "-T0"],
+                    comp_proc = subprocess.Popen(
+                        compress,
                         cwd=str(self.target_dir),
                         stdin=subprocess.PIPE,
-                        stdout=ofp,
+                        stdout=subprocess.PIPE,
                         stderr=efp,
                     )
                 tar_proc = subprocess.Popen(
                     args,
                     cwd=str(self.result_dir.parent),
                     stdin=None,
-                    stdout=xz_proc.stdin if xz_proc else ofp,
+                    stdout=comp_proc.stdin if comp_proc else subprocess.PIPE,
                     stderr=efp,
                 )
+                if comp_proc:
+                    # Now that the `tar` command holds the input pipe of the
+                    # compression command, we close our end of it, so that
+                    # the compression command sees the end of its input when
+                    # the `tar` command exits.
+                    comp_proc.stdin.close()
+                    stream = comp_proc.stdout
+                else:
+                    stream = tar_proc.stdout
+                for buf in iter(partial(stream.read, 2**20), b""):
+                    ofp.write(buf)
+                    tar_len += len(buf)
+                    md5.update(buf)
+                    sha256.update(buf)
+                stream.close()
                 tar_proc.wait()
-                if xz_proc:
-                    # Now that the `tar` command has exited, we close the
-                    # `stdin` of the `xz` command to shut it down.
-                    xz_proc.stdin.close()
-                    xz_proc.wait()
+                if comp_proc:
+                    comp_proc.wait()
         except Exception as exc:
             msg = self._unlink_tarball(
                 tarball, f"Tar ball creation failed for {self.result_dir}, {exc}"
@@ -246,10 +291,11 @@ class MakeResultTb:
             raise RuntimeError(msg)
         else:
             if tar_proc.returncode == 0:
-                if xz_proc is not None and xz_proc.returncode != 0:
+                if comp_proc is not None and comp_proc.returncode != 0:
                     msg = self._unlink_tarball(
                         tarball,
-                        f"Failed to create tar ball; 'xz' return code: {xz_proc.returncode:d}",
+                        f"Failed to create tar ball; '{self.codec.program}'"
+                        f" return code: {comp_proc.returncode:d}",
                     )
                     raise RuntimeError(msg)
                 else:
@@ -264,22 +310,19 @@ class MakeResultTb:
                             unlink_exc,
                         )
             else:
-                # We explicitly ignore the return code from the optional 'xz' process.
+                # We explicitly ignore the return code from the optional
+                # compression process.
                 msg = self._unlink_tarball(
                     tarball,
                     f"Failed to create tar ball; 'tar' return code: {tar_proc.returncode:d}",
                 )
                 raise RuntimeError(msg)
-        try:
-            (tar_len, tar_md5) = md5sum(tarball)
-        except Exception:
-            msg = self._unlink_tarball(
-                tarball,
-                f"Failed to verify and generate MD5 for created tar ball, '{tarball}'",
-            )
-            raise RuntimeError(msg)
-
-        return TarballRecord(name=tarball, length=tar_len, md5=tar_md5)
+        return TarballRecord(
+            name=tarball,
+            length=tar_len,
+            md5=md5.hexdigest(),
+            sha256=sha256.hexdigest(),
+        )
 
 
 class CopyResult:
@@ -311,12 +354,15 @@ class CopyResult:
         if metadata:
             self.params["metadata"] = metadata
 
-    def push(self, tarball: Path, tarball_md5: str) -> requests.Response:
+    def push(
+        self, tarball: Path, tarball_md5: str, tarball_sha256: Optional[str] = None
+    ) -> requests.Response:
         """Push a tarball to the configured destination.
 
         Args
-            tarball: A path to a xz compressed tar file
+            tarball: A path to a compressed tar file
             tarball_md5: the MD5 hash of tarball
+            tarball_sha256: the SHA256 hash of tarball, if known
 
         Returns:
             A Requests object representing the last outgoing HTTP call
@@ -411,12 +457,18 @@ class CopyResultToServer(CopyResult):
         self.uri = f"{uri}/upload/{{name}}"
         self.headers.update({"Authorization": f"Bearer {token}"})
 
-    def push(self, tarball: Path, tarball_md5: str) -> requests.Response:
+    def push(
+        self, tarball: Path, tarball_md5: str, tarball_sha256: Optional[str] = None
+    ) -> requests.Response:
         """Push a tarball to a Pbench Server.
 
+        A tarball larger than the upload chunk size is sent in chunks, several
+        at a time, resuming any earlier interrupted upload of the tarball.
+
         Args
-            tarball: A path to a xz compressed tar file
+            tarball: A path to a compressed tar file
             tarball_md5: the MD5 hash of tarball
+            tarball_sha256: the SHA256 hash of tarball, if known
 
         Returns:
             A Response object representing the server PUT HTTP call
@@ -426,12 +478,19 @@ class CopyResultToServer(CopyResult):
         """
         if not tarball.exists():
             raise FileNotFoundError(f"Tar ball '{tarball}' does not exist")
-        self.headers["Content-MD5"] = tarball_md5
+        # NOTE: we don't modify our own headers, so that several tar balls
+        # can be pushed at once.
+        headers = {**self.headers, "Content-MD5": tarball_md5}
         tar_uri = self.uri.format(name=tarball.name)
         with tarball.open("rb") as f:
-            return requests.put(
-                tar_uri, data=f, headers=self.headers, params=self.params
-            )
+            if f.seek(0, os.SEEK_END) <= upload.CHUNK_SIZE:
+                f.seek(0)
+                return requests.put(
+                    tar_uri, data=f, headers=headers, params=self.params
+                )
+        return upload.upload_chunks(
+            requests, tar_uri, tarball, headers=headers, params=self.params
+        )
 
 
 class CopyResultToRelay(CopyResult):
@@ -454,12 +513,15 @@ class CopyResultToRelay(CopyResult):
         super().__init__(logger, access, metadata)
         self.uri = f"{relay}/{{sha256}}"
 
-    def push(self, tarball: Path, tarball_md5: str) -> requests.Response:
+    def push(
+        self, tarball: Path, tarball_md5: str, tarball_sha256: Optional[str] = None
+    ) -> requests.Response:
         """Push a tarball to a Relay server.
 
         This involves three steps:
 
-        1. PUT the tarball to the relay server with a SHA256 object ID.
+        1. PUT the tarball to the relay server with a SHA256 object ID (which
+           we compute, reading the tarball, unless the caller knows it).
         2. Compile information about the tarball into a relay manifest file.
         3. PUT the relay manifest file with its own SHA256 object ID.
 
@@ -470,8 +532,9 @@ class CopyResultToRelay(CopyResult):
         Pbench Server relay API will require to pull the result.
 
         Args
-            tarball: A path to a xz compressed tar file
+            tarball: A path to a compressed tar file
             tarball_md5: the MD5 hash of tarball
+            tarball_sha256: the SHA256 hash of tarball, if known
 
         Returns:
             A Response object representing the last HTTP operation response; if
@@ -484,20 +547,25 @@ class CopyResultToRelay(CopyResult):
             raise FileNotFoundError(f"Tar ball '{tarball!s}' does not exist")
         try:
             with tarball.open("rb") as f:
-                d = hashlib.sha256()
-                for buf in iter(partial(f.read, 2**20), b""):
-                    d.update(buf)
-                tar_uri = self.uri.format(sha256=d.hexdigest())
+                if not tarball_sha256:
+                    d = hashlib.sha256()
+                    for buf in iter(partial(f.read, 2**20), b""):
+                        d.update(buf)
+                    tarball_sha256 = d.hexdigest()
+                    f.seek(0)  # rewind since re-opening doesn't work
+                tar_uri = self.uri.format(sha256=tarball_sha256)
                 self.logger.debug("Relay tarball %s", tar_uri)
 
-                f.seek(0)  # rewind since re-opening doesn't work
                 r = requests.put(tar_uri, data=f, headers=self.headers)
                 if not r.ok:
                     return r
-            self.params.update(
-                {"name": tarball.name, "uri": tar_uri, "md5": tarball_md5}
-            )
-            manifest = bytes(json.dumps(self.params, sort_keys=True), encoding="utf-8")
+            params = {
+                **self.params,
+                "name": tarball.name,
+                "uri": tar_uri,
+                "md5": tarball_md5,
+            }
+            manifest = bytes(json.dumps(params, sort_keys=True), encoding="utf-8")
             d = hashlib.sha256(manifest)
             manifest_uri = self.uri.format(sha256=d.hexdigest())
             self.logger.debug(
@@ -9,6 +9,7 @@
 #   sudo dnf install python3-bottle python3-daemon
 #   sudo pip3 install python-pidfile
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import DuplicateSectionError
 from datetime import datetime
 import errno
@@ -19,12 +20,14 @@ import logging
 import os
 from pathlib import Path
 import shutil
+from socketserver import ThreadingMixIn
 import subprocess
 import sys
 import tempfile
-from threading import Condition, Lock, Thread
-from typing import Any, Dict, List, NamedTuple, Tuple
-from wsgiref.simple_server import make_server, WSGIRequestHandler
+from threading import BoundedSemaphore, Condition, Lock, Thread
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
 
 from bottle import abort, Bottle, request, ServerAdapter
 from daemon import DaemonContext
@@ -45,6 +48,7 @@ from pbench.agent.redis_utils import RedisChannelSubscriber, wait_for_conn_and_k
 from pbench.agent.toolmetadata import ToolMetadata
 from pbench.agent.utils import collect_local_info
 from pbench.common import MetadataLog
+from pbench.common.compression import Codec, DEFAULT_CODEC, get_codec
 from pbench.common.utils import canonicalize
 
 # Logging format string for unit tests
@@ -55,9 +59,23 @@ fmtstr = "%(asctime)s %(levelname)s %(process)s %(thread)s %(name)s %(funcName)s
 # Read in 64 KB chunks off the wire for HTTP PUT requests.
 _BUFFER_SIZE = 65536
 
+# Maximum length of a chunk size line, or a trailer line, in a "chunked"
+# request body.
+_MAX_CHUNK_LINE = 1024
+
 # Maximum size of the tar ball for collected tool data.
 _MAX_TOOL_DATA_SIZE = 2**30
 
+# Default maximum number of Tool Meister PUT requests received concurrently.
+_MAX_RECEIVERS = 16
+
+# Default number of threads extracting received tar balls.
+_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Name of the file, in the "tm" directory of the benchmark run directory,
+# where we record the timing of each Tool Meister's data transfer.
+_TIMING_LOG = "tds-timing.log"
+
 # Expected metadata from received state signals
 METADATA_KEYS = {"group", "directory", "args"}
 
@@ -77,18 +95,82 @@ def _now(when):
         return datetime.utcnow().isoformat()
 
 
+def _read_chunked(iostr) -> Iterator[bytes]:
+    """_read_chunked - decode a request body sent with the "chunked" transfer
+    encoding, yielding the data as it arrives.
+
+    The WSGI server we use leaves the body of a request as it is on the wire,
+    so we decode it ourselves.  Any chunk extensions and trailer fields are
+    ignored.
+
+    Raises a ToolDataSinkError if the body is malformed or truncated.
+    """
+    while True:
+        line = iostr.readline(_MAX_CHUNK_LINE)
+        try:
+            size = int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise ToolDataSinkError(f"Invalid chunk size line, {line!r}")
+        if size == 0:
+            break
+        remaining = size
+        while remaining > 0:
+            buf = iostr.read(min(remaining, _BUFFER_SIZE))
+            if not buf:
+                raise ToolDataSinkError("Unexpected end of chunked data")
+            remaining -= len(buf)
+            yield buf
+        if iostr.readline(_MAX_CHUNK_LINE) not in (b"\r\n", b"\n"):
+            raise ToolDataSinkError("Missing end of chunk")
+    while iostr.readline(_MAX_CHUNK_LINE).strip():
+        pass
+
+
 class DataSinkWsgiServer(ServerAdapter):
     """DataSinkWsgiServer - a re-implementation of Bottle's WSGIRefServer
     where we have access to the underlying WSGIServer instance in order to
     invoke its stop() method, and we also provide an WSGIRequestHandler with
     an opinionated logging implementation.
+
+    Each request is handled in its own thread, so that Tool Meisters can send
+    their data concurrently, but no more than `max_receivers` requests are
+    handled at one time: further connections wait to be accepted.
     """
 
-    def __init__(self, *args, logger=None, **kw):
+    def __init__(self, *args, logger=None, max_receivers=_MAX_RECEIVERS, **kw):
         if logger is None:
             raise Exception("DataSinkWsgiServer requires a logger")
         super().__init__(*args, **kw)
 
+        class DataSinkThreadingWsgiServer(ThreadingMixIn, WSGIServer):
+            """DataSinkThreadingWsgiServer - a WSGIServer handling each
+            request in a separate thread, limited to `max_receivers` threads
+            at a time.
+            """
+
+            daemon_threads = True
+            _receivers = BoundedSemaphore(max_receivers)
+
+            def process_request(self, request, client_address):
+                """process_request - wait for a free receiver before starting
+                a thread to handle the request.
+                """
+                self._receivers.acquire()
+                try:
+                    super().process_request(request, client_address)
+                except Exception:
+                    self._receivers.release()
+                    raise
+
+            def process_request_thread(self, request, client_address):
+                """process_request_thread - handle the request, and then free
+                its receiver.
+                """
+                try:
+                    super().process_request_thread(request, client_address)
+                finally:
+                    self._receivers.release()
+
         class DataSinkWsgiRequestHandler(WSGIRequestHandler):
             """DataSinkWsgiRequestHandler - a WSGIRequestHandler that uses the
             provided logger object.
@@ -124,6 +206,7 @@ class DataSinkWsgiServer(ServerAdapter):
                     str(size),
                 )
 
+        self.options["server_class"] = DataSinkThreadingWsgiServer
         self.options["handler_class"] = DataSinkWsgiRequestHandler
         self._server = None
         self._err_code = None
@@ -216,9 +299,13 @@ class BaseCollector:
         tool_metadata,
         tar_path,
         logger,
+        codec=None,
     ):
         """Constructor - responsible for recording the arguments, and creating
         the Environment() for template rendering.
+
+        The collected data is compressed with the given codec, or the default
+        codec if none is given.
         """
         self.templates_path = pbench_bin / "templates"
         assert (
@@ -230,6 +317,7 @@ class BaseCollector:
         self.tool_metadata = tool_metadata
         self.tar_path = tar_path
         self.logger = logger
+        self.codec = codec if codec is not None else get_codec()
 
         self.run = []
         self.tool_group_dir = self.benchmark_run_dir.local / f"tools-{self.tool_group}"
@@ -393,8 +481,9 @@ class PromCollector(BaseCollector):
         args = [
             self.tar_path,
             "--remove-files",
-            "-Jcf",
-            f"{self.tool_group_dir}/prometheus_data.tar.xz",
+            "--create",
+            *self.codec.tar_create_args(),
+            f"--file={self.tool_group_dir}/prometheus_data{self.codec.suffix}",
             "-C",
             f"{self.tool_group_dir}/",
             "prometheus",
@@ -602,8 +691,9 @@ class PcpCollector(BaseCollector):
         args = [
             self.tar_path,
             "--remove-files",
-            "-Jcf",
-            f"{self.tool_group_dir}/pcp_data.tar.xz",
+            "--create",
+            *self.codec.tar_create_args(),
+            f"--file={self.tool_group_dir}/pcp_data{self.codec.suffix}",
             "-C",
             f"{self.tool_group_dir}/",
             "pcp",
@@ -761,6 +851,9 @@ class ToolDataSinkParams(NamedTuple):
     tool_trigger: str
     tools: Dict[str, str]
     instance_uuid: str
+    max_receivers: Optional[int] = None
+    extract_workers: Optional[int] = None
+    compression: str = DEFAULT_CODEC
 
     def __str__(self) -> str:
         """A string containing a deterministic representation of the params"""
@@ -789,6 +882,9 @@ class ToolDataSink(Bottle):
                 tool_trigger=params["tool_trigger"],
                 tools=params["tools"],
                 instance_uuid=params["instance_uuid"],
+                max_receivers=params.get("max_receivers"),
+                extract_workers=params.get("extract_workers"),
+                compression=params.get("compression", DEFAULT_CODEC),
             )
         except KeyError as exc:
             raise ToolDataSinkError(f"Invalid parameter block, missing key {exc}")
@@ -822,6 +918,10 @@ class ToolDataSink(Bottle):
         self.optional_md = tdsp.optional_md
         self.params = tdsp
         self.logger = logger
+        try:
+            self.codec = get_codec(tdsp.compression)
+        except ValueError as exc:
+            raise ToolDataSinkError(f"Invalid parameter block, {exc}")
         # Initialize internal state
         self.action = None
         self.data_ctx = None
@@ -850,6 +950,18 @@ class ToolDataSink(Bottle):
         self._tm_log_capture_thread_state = None
         self.tm_log_capture_thread = None
         self._num_tms = 0
+        # Received tar balls are extracted by a pool of worker threads, so
+        # that the web server threads can move on to the next PUT request.
+        # The names of the hosts whose data could not be extracted are
+        # collected for the current data action.
+        self._extract_pool = ThreadPoolExecutor(
+            max_workers=tdsp.extract_workers or _EXTRACT_WORKERS,
+            thread_name_prefix="tds-extract",
+        )
+        self._extract_failures = set()
+        self._timing_lock = Lock()
+        # The names of the hosts whose data is currently being streamed to us.
+        self._streaming = set()
 
     def __enter__(self):
         # Setup the Bottle server route and the WSGI server instance.
@@ -864,7 +976,10 @@ class ToolDataSink(Bottle):
             callback=self.put_document,
         )
         self._server = DataSinkWsgiServer(
-            host=self.params.bind_hostname, port=self.params.port, logger=self.logger
+            host=self.params.bind_hostname,
+            port=self.params.port,
+            logger=self.logger,
+            max_receivers=self.params.max_receivers or _MAX_RECEIVERS,
         )
         self.web_server_thread = Thread(target=self.web_server_run)
         self.web_server_thread.start()
@@ -930,6 +1045,9 @@ class ToolDataSink(Bottle):
         except Exception:
             self.logger.exception("Errors joining with web server thread on exit")
 
+        self.logger.debug("Waiting for tool data extractions to finish ...")
+        self._extract_pool.shutdown(wait=True)
+
         self.logger.debug("Waiting for the log capture thread to exit ...")
         try:
             self.tm_log_capture_thread.join()
@@ -1611,6 +1729,7 @@ class ToolDataSink(Bottle):
                         self.tool_metadata,
                         self.tar_path,
                         logger=self.logger,
+                        codec=self.codec,
                     )
                     self._prom_server.launch()
                 if pcp_tool_dict:
@@ -1628,6 +1747,7 @@ class ToolDataSink(Bottle):
                         redis_host=self.redis_host,
                         redis_port=self.redis_port,
                         logger=self.logger,
+                        codec=self.codec,
                     )
                     self._pcp_server.launch()
             elif action == "end":
@@ -1652,6 +1772,7 @@ class ToolDataSink(Bottle):
                 self.directory = local_dir
 
                 # Forward to TMs
+                self._extract_failures.clear()
                 ret_val = self._forward_tms(data)
                 if ret_val == 0:
                     # Wait for all data
@@ -1659,6 +1780,13 @@ class ToolDataSink(Bottle):
                     self._wait_for_all_data()
                     # At this point all tracking data should be "dormant" again.
                     ret_val = self._wait_for_tms()
+                    if self._extract_failures:
+                        self.logger.error(
+                            "Failed to extract the '%s' data of: %s",
+                            action,
+                            ", ".join(sorted(self._extract_failures)),
+                        )
+                        ret_val = 1
 
                 # To be safe, clear the data context and directory to catch
                 # bad PUTs
@@ -1699,10 +1827,18 @@ class ToolDataSink(Bottle):
         The put_document method is called by threads serving web requests.
         There can be N threads configured at one time calling this method.
 
-        Public method, returns None, raises no exceptions directly, calls the
-        Bottle abort() method for error handling.
+        The data is either a tar ball, of the size given by the content-length
+        header and with the MD5 given by the md5sum header, or a stream of tar
+        data sent with the "chunked" transfer encoding (see _put_stream()),
+        compressed with the codec named by the optional "Pbench-Compression"
+        header (by default, xz).
+
+        Public method, returns None (or, for streamed data, its size and MD5),
+        raises no exceptions directly, calls the Bottle abort() method for
+        error handling.
 
         """
+        started = time.monotonic()
         try:
             content_length = 0
             exp_md5 = ""
@@ -1740,6 +1876,19 @@ class ToolDataSink(Bottle):
                         if not tm_tracker["transient_tools"]:
                             abort(400, "Not expecting tool data from Tool Meister")
 
+            target_dir = self.directory
+            if not target_dir.is_dir():
+                self.logger.error("ERROR - directory, '%s', does not exist", target_dir)
+                abort(500, "INTERNAL ERROR")
+
+            try:
+                codec = get_codec(request.get("HTTP_PBENCH_COMPRESSION"))
+            except ValueError as exc:
+                abort(400, str(exc))
+
+            if "chunked" in request.get("HTTP_TRANSFER_ENCODING", "").lower():
+                return self._put_stream(hostname, target_dir, codec, started)
+
             try:
                 content_length = int(request["CONTENT_LENGTH"])
             except ValueError:
@@ -1756,11 +1905,7 @@ class ToolDataSink(Bottle):
                 self.logger.exception(request.keys())
                 abort(400, "Missing required md5sum header")
 
-            target_dir = self.directory
-            if not target_dir.is_dir():
-                self.logger.error("ERROR - directory, '%s', does not exist", target_dir)
-                abort(500, "INTERNAL ERROR")
-            host_data_tb_name = target_dir / f"{hostname}.tar.xz"
+            host_data_tb_name = target_dir / f"{hostname}{codec.suffix}"
             if host_data_tb_name.exists():
                 abort(409, f"{host_data_tb_name} already uploaded")
             host_data_tb_md5 = Path(f"{host_data_tb_name}.md5")
@@ -1834,42 +1979,99 @@ class ToolDataSink(Bottle):
                         host_data_tb_name,
                     )
 
-            # Now unpack that tar ball
+            # Hand the tar ball off to be unpacked: the Tool Meister is not
+            # kept waiting, but we only consider its data posted once the tar
+            # ball is unpacked.
+            timing = dict(
+                action=self.action,
+                hostname=hostname,
+                size=total_bytes,
+                receive=round(time.monotonic() - started, 6),
+            )
+            self._extract_pool.submit(
+                self._extract, hostname, host_data_tb_name, timing, time.monotonic()
+            )
+        except Exception:
+            self.logger.exception("Uncaught error")
+            abort(500, "INTERNAL ERROR")
+
+    def _put_stream(
+        self, hostname: str, target_dir: Path, codec: Codec, started: float
+    ) -> Dict[str, Any]:
+        """_put_stream - unpack tool data streamed to us by a Tool Meister.
+
+        A Tool Meister streaming its data sends the output of `tar` as it is
+        generated, using the "chunked" transfer encoding, so neither it nor
+        we know the size or the MD5 of the data in advance.  We pipe the data
+        straight into `tar` to unpack it, and return the size and the MD5 of
+        the data we received so the Tool Meister can verify it was received
+        intact.
+
+        Calls the Bottle abort() method for error handling.
+        """
+        with self._lock:
+            if hostname in self._streaming:
+                abort(409, f"Data from '{hostname}' already being received")
+            self._streaming.add(hostname)
+        try:
             o_file = target_dir / f"{hostname}.tar.out"
             e_file = target_dir / f"{hostname}.tar.err"
+            h = hashlib.md5()
+            total_bytes = 0
+            with o_file.open("w") as ofp, e_file.open("w") as efp:
+                tar = subprocess.Popen(
+                    [self.tar_path, "--extract", *codec.tar_extract_args(), "--file=-"],
+                    cwd=target_dir,
+                    stdin=subprocess.PIPE,
+                    stdout=ofp,
+                    stderr=efp,
+                )
+                try:
+                    for buf in _read_chunked(request["wsgi.input"]):
+                        total_bytes += len(buf)
+                        if total_bytes > _MAX_TOOL_DATA_SIZE:
+                            raise ToolDataSinkError("Content object too large")
+                        h.update(buf)
+                        tar.stdin.write(buf)
+                    tar.stdin.close()
+                except BrokenPipeError:
+                    # The tar process exited early; its exit status tells us
+                    # why.
+                    pass
+                except Exception as exc:
+                    tar.kill()
+                    tar.wait()
+                    if isinstance(exc, ToolDataSinkError):
+                        abort(400, str(exc))
+                    raise
+                returncode = tar.wait()
+            if returncode != 0:
+                self.logger.error(
+                    "Failed to extract data streamed from '%s'; return code: %d",
+                    hostname,
+                    returncode,
+                )
+                abort(500, "INTERNAL ERROR")
+            if total_bytes <= 0:
+                abort(400, "No data received")
+            self.logger.debug("Successfully unpacked data from %s", hostname)
             try:
-                # Invoke tar directly for efficiency.
-                with o_file.open("w") as ofp, e_file.open("w") as efp:
-                    cp = subprocess.run(
-                        [self.tar_path, "-xf", host_data_tb_name],
-                        cwd=target_dir,
-                        stdin=None,
-                        stdout=ofp,
-                        stderr=efp,
-                    )
+                o_file.unlink()
+                e_file.unlink()
             except Exception:
                 self.logger.exception(
-                    "Failed to extract tar ball, '%s'", host_data_tb_name
+                    "Error removing tar output files of '%s'", hostname
                 )
-                abort(500, "INTERNAL ERROR")
-            else:
-                if cp.returncode != 0:
-                    self.logger.error(
-                        "Failed to create tar ball; return code: %d", cp.returncode
-                    )
-                    abort(500, "INTERNAL ERROR")
-                else:
-                    self.logger.debug("Successfully unpacked %s", host_data_tb_name)
-                    try:
-                        o_file.unlink()
-                        e_file.unlink()
-                        host_data_tb_md5.unlink()
-                        host_data_tb_name.unlink()
-                    except Exception:
-                        self.logger.exception(
-                            "Error removing unpacked tar ball '%s' and it's .md5",
-                            host_data_tb_name,
-                        )
+            md5 = h.hexdigest()
+            timing = dict(
+                action=self.action,
+                hostname=hostname,
+                size=total_bytes,
+                receive=round(time.monotonic() - started, 6),
+                stream=True,
+                status="success",
+            )
+            self._record_timing(target_dir, timing)
 
             # Tell the waiting "watcher" thread that another PUT document has
             # arrived.
@@ -1878,9 +2080,100 @@ class ToolDataSink(Bottle):
                 assert tm_tracker["posted"] == "waiting", f"tm_tracker = {tm_tracker!r}"
                 tm_tracker["posted"] = "dormant"
                 self._cv.notify()
+            return dict(md5=md5, size=total_bytes)
+        finally:
+            with self._lock:
+                self._streaming.discard(hostname)
+
+    def _extract(
+        self,
+        hostname: str,
+        host_data_tb_name: Path,
+        timing: Dict[str, Any],
+        queued: float,
+    ):
+        """_extract - unpack the tar ball received from a Tool Meister, and
+        mark its data as posted.
+
+        Called by the extraction worker threads, this method raises no
+        exceptions: failures are logged, and recorded so that the action
+        waiting for the data reports them.
+        """
+        started = time.monotonic()
+        timing["queued"] = round(started - queued, 6)
+        target_dir = host_data_tb_name.parent
+        host_data_tb_md5 = Path(f"{host_data_tb_name}.md5")
+        o_file = target_dir / f"{hostname}.tar.out"
+        e_file = target_dir / f"{hostname}.tar.err"
+        success = False
+        try:
+            # Invoke tar directly for efficiency.
+            with o_file.open("w") as ofp, e_file.open("w") as efp:
+                cp = subprocess.run(
+                    [self.tar_path, "-xf", host_data_tb_name],
+                    cwd=target_dir,
+                    stdin=None,
+                    stdout=ofp,
+                    stderr=efp,
+                )
         except Exception:
-            self.logger.exception("Uncaught error")
-            abort(500, "INTERNAL ERROR")
+            self.logger.exception("Failed to extract tar ball, '%s'", host_data_tb_name)
+        else:
+            if cp.returncode != 0:
+                self.logger.error(
+                    "Failed to extract tar ball, '%s'; return code: %d",
+                    host_data_tb_name,
+                    cp.returncode,
+                )
+            else:
+                success = True
+                self.logger.debug("Successfully unpacked %s", host_data_tb_name)
+                try:
+                    o_file.unlink()
+                    e_file.unlink()
+                    host_data_tb_md5.unlink()
+                    host_data_tb_name.unlink()
+                except Exception:
+                    self.logger.exception(
+                        "Error removing unpacked tar ball '%s' and it's .md5",
+                        host_data_tb_name,
+                    )
+        timing["extract"] = round(time.monotonic() - started, 6)
+        timing["status"] = "success" if success else "failure"
+        self._record_timing(target_dir, timing)
+
+        # Tell the waiting "watcher" thread that another PUT document has
+        # arrived.
+        with self._lock:
+            if not success:
+                self._extract_failures.add(hostname)
+            tm_tracker = self._tm_tracking[hostname]
+            assert tm_tracker["posted"] == "waiting", f"tm_tracker = {tm_tracker!r}"
+            tm_tracker["posted"] = "dormant"
+            self._cv.notify()
+
+    def _record_timing(self, target_dir: Path, timing: Dict[str, Any]):
+        """_record_timing - append the timing of a Tool Meister's data
+        transfer to the timing log in the run directory.
+
+        Each line of the log is a JSON object giving the action, the directory
+        (relative to the run directory) and the host name; the size of the
+        data; and the number of seconds spent receiving it, waiting for an
+        extraction worker, and extracting it (or, for streamed data, which is
+        extracted as it is received, just the number of seconds spent
+        receiving it).
+        """
+        try:
+            directory = str(target_dir.relative_to(self.benchmark_run_dir.local))
+        except ValueError:
+            directory = str(target_dir)
+        record = dict(directory=directory, **timing)
+        timing_log = self.benchmark_run_dir.local / "tm" / _TIMING_LOG
+        try:
+            with self._timing_lock, timing_log.open("a") as fp:
+                fp.write(f"{json.dumps(record, sort_keys=True)}\n")
+        except Exception as exc:
+            self.logger.warning("Failed to record timing in %s: %s", timing_log, exc)
 
 
 def get_logger(
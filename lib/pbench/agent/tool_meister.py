@@ -70,8 +70,12 @@ from pbench.agent.redis_utils import (
 )
 from pbench.agent.toolmetadata import ToolMetadata
 from pbench.agent.utils import collect_local_info
+from pbench.common.compression import DEFAULT_CODEC, get_codec
 from pbench.common.utils import canonicalize, md5sum
 
+# Read tar output in 64 KB chunks when streaming tool data.
+_BUFFER_SIZE = 65536
+
 # Logging format string for unit tests
 fmtstr_ut = "%(levelname)s %(name)s %(funcName)s -- %(message)s"
 fmtstr = "%(asctime)s %(levelname)s %(process)s %(thread)s %(name)s %(funcName)s %(lineno)d -- %(message)s"
@@ -694,6 +698,8 @@ class ToolMeisterParams(NamedTuple):
     tool_metadata: ToolMetadata
     tools: Dict[str, str]
     instance_uuid: str
+    stream_data: bool = False
+    compression: str = DEFAULT_CODEC
 
     def __str__(self) -> str:
         """A string containing a deterministic representation of the params"""
@@ -740,7 +746,11 @@ class ToolMeister:
                 "tool-1": [ "--opt-0", "--opt-1", ..., "--opt-N" ],
                 ...,
                 "tool-N": [ "--opt-0", "--opt-1", ..., "--opt-N" ]
-            }
+            },
+            "stream_data": "<optional; true to stream tool data to the Tool"
+                          " Data Sink rather than sending a tar ball>",
+            "compression": "<optional; the codec, '<name>[:<level>]', with"
+                          " which to compress tool data, 'xz' by default>"
         }
 
     Each action message should contain three pieces of data: the action to
@@ -786,6 +796,8 @@ class ToolMeister:
                 tool_metadata=ToolMetadata.tool_md_from_dict(params["tool_metadata"]),
                 tools=params["tools"],
                 instance_uuid=params["instance_uuid"],
+                stream_data=bool(params.get("stream_data", False)),
+                compression=params.get("compression", DEFAULT_CODEC),
             )
         except KeyError as exc:
             raise ToolMeisterError(f"Invalid parameter block, missing key {exc}")
@@ -830,6 +842,10 @@ class ToolMeister:
         self.tar_path = tar_path
         self.sysinfo_dump = sysinfo_dump
         self._params = tm_params
+        try:
+            self._codec = get_codec(tm_params.compression)
+        except ValueError as exc:
+            raise ToolMeisterError(f"Invalid parameter block, {exc}")
         self._rs = redis_server
         self.logger = logger
         self._usable_tools = dict()
@@ -1334,9 +1350,9 @@ class ToolMeister:
         tar_file: Path,
     ) -> subprocess.CompletedProcess:
         """
-        Creates a tar file at a given tar file path. This method invokes tar
-        directly for efficiency.  If an error occurs, it will retry with all
-        warnings suppressed.
+        Creates a tar file at a given tar file path, compressed with the
+        configured codec.  This method invokes tar directly for efficiency.
+        If an error occurs, it will retry with all warnings suppressed.
 
         Arguments:
 
@@ -1363,7 +1379,7 @@ class ToolMeister:
         tar_args = [
             self.tar_path,
             "--create",
-            "--xz",
+            *self._codec.tar_create_args(),
             "--force-local",
             f"--file={tar_file}",
             directory.name,
@@ -1413,10 +1429,13 @@ class ToolMeister:
                 directory.name == self._params.hostname
             ), f"Expected directory target with <hostname>, '{directory}'"
 
+        if self._params.stream_data:
+            return self._stream_directory(directory, uri, ctx)
+
         failures = 0
         target_dir = directory.name
         parent_dir = directory.parent
-        tar_file = parent_dir / f"{target_dir}.tar.xz"
+        tar_file = parent_dir / f"{target_dir}{self._codec.suffix}"
 
         try:
             if self._create_tar(directory, tar_file).returncode != 0:
@@ -1453,7 +1472,7 @@ class ToolMeister:
                     self._params.tool_group,
                     self._directory,
                 )
-                headers = {"md5sum": tar_md5}
+                headers = {"md5sum": tar_md5, "Pbench-Compression": self._codec.name}
                 url = (
                     f"http://{self._params.tds_hostname}:{self._params.tds_port}/{uri}"
                     f"/{ctx}/{self._params.hostname}"
@@ -1526,6 +1545,156 @@ class ToolMeister:
                 )
         return failures
 
+    def _stream_directory(self, directory: Path, uri: str, ctx: str) -> int:
+        """Stream a tar ball of the given directory via PUT to the URL
+        constructed from the "uri" fragment, using the provided context.
+
+        Rather than creating the tar ball on disk, computing its MD5, and then
+        sending it, we send the output of `tar` as it is generated, using the
+        "chunked" transfer encoding, and compute its MD5 on the way.  The Tool
+        Data Sink unpacks the data as it arrives, and responds with the MD5 of
+        the data it received, which must match ours.  If `tar` fails, we
+        abandon the request before the end of the data, and re-try once with
+        all warnings suppressed; the tool data is only removed once the Tool
+        Data Sink has received the complete output of a successful `tar`.
+
+        The arguments are the same as for _send_directory().
+
+        Returns 0 on success, # of failures otherwise.
+        """
+        failures = 0
+        parent_dir = directory.parent
+        url = (
+            f"http://{self._params.tds_hostname}:{self._params.tds_port}/{uri}"
+            f"/{ctx}/{self._params.hostname}"
+        )
+        tar_args = [
+            self.tar_path,
+            "--create",
+            *self._codec.tar_create_args(),
+            "--force-local",
+            "--file=-",
+            directory.name,
+        ]
+        self.logger.debug(
+            "%s: starting stream_data group=%s, directory=%s",
+            self._params.hostname,
+            self._params.tool_group,
+            self._directory,
+        )
+        retries = 200
+        response = None
+        while response is None:
+            h = hashlib.md5()
+            with tempfile.TemporaryFile() as efp:
+                tar = subprocess.Popen(
+                    tar_args,
+                    cwd=parent_dir,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=efp,
+                )
+
+                def body():
+                    while True:
+                        buf = tar.stdout.read(_BUFFER_SIZE)
+                        if not buf:
+                            break
+                        h.update(buf)
+                        yield buf
+                    # If tar failed, abandon the request before the end of
+                    # the data, so that the Tool Data Sink discards what it
+                    # received.
+                    returncode = tar.wait()
+                    if returncode != 0:
+                        raise subprocess.CalledProcessError(returncode, tar_args)
+
+                try:
+                    response = requests.put(
+                        url,
+                        headers={"Pbench-Compression": self._codec.name},
+                        data=body(),
+                    )
+                except (
+                    ConnectionRefusedError,
+                    requests.exceptions.ConnectionError,
+                ) as exc:
+                    self.logger.debug("%s", exc)
+                    tar.kill()
+                    # Try until we get a connection.
+                    retries -= 1
+                    if retries <= 0:
+                        raise
+                except subprocess.CalledProcessError as exc:
+                    efp.seek(0)
+                    self.logger.warning(
+                        "Tarball creation failed with %d (stderr '%s') on %s",
+                        exc.returncode,
+                        efp.read().decode("utf-8", errors="replace"),
+                        directory,
+                    )
+                    if "--warning=none" in tar_args:
+                        break
+                    # Re-try once with all warnings suppressed, as for
+                    # _create_tar().
+                    tar_args.insert(2, "--warning=none")
+                    continue
+                finally:
+                    tar.stdout.close()
+                    returncode = tar.wait()
+                if response is None:
+                    time.sleep(0.1)
+
+        if response is None:
+            # The tar command failed even with all warnings suppressed, so we
+            # keep the tool data.
+            failures += 1
+        elif returncode != 0:
+            self.logger.error(
+                "PUT '%s' sent the output of tar, which exited with %d",
+                url,
+                returncode,
+            )
+            failures += 1
+        elif response.status_code != 200:
+            self.logger.error(
+                "PUT '%s' failed with '%d', '%s'",
+                url,
+                response.status_code,
+                response.text,
+            )
+            failures += 1
+        elif response.json().get("md5") != h.hexdigest():
+            self.logger.error(
+                "PUT '%s' received data with MD5 %s, but sent data with MD5 %s",
+                url,
+                response.json().get("md5"),
+                h.hexdigest(),
+            )
+            failures += 1
+        else:
+            self.logger.debug(
+                "PUT '%s' succeeded ('%d', '%s')",
+                url,
+                response.status_code,
+                response.text,
+            )
+            try:
+                shutil.rmtree(parent_dir)
+            except Exception:
+                self.logger.exception(
+                    "Failed to remove tool data hierarchy, '%s'", parent_dir
+                )
+                failures += 1
+        self.logger.info(
+            "%s: PUT %s completed %s %s",
+            self._params.hostname,
+            uri,
+            self._params.tool_group,
+            directory,
+        )
+        return failures
+
     def send_tools(self, data: Dict[str, str]) -> int:
         """Send any collected tool data to the Tool Data Sink.
 
@@ -111,6 +111,16 @@ of the Pbench Tool Meister servers and clients:
         specification (in that order) with a semicolon: e.g.,
         "bindhost:bindport;connectionhost:connectionport"
 
+  - PBENCH_TOOL_DATA_STREAM set to "yes" to have remote Tool Meisters stream
+    their tool data to the Tool Data Sink, rather than first writing a tar
+    ball to disk
+
+  - PBENCH_TOOL_DATA_COMPRESSION set to the codec, "<name>[:<level>]", with
+    which Tool Meisters and the Tool Data Sink compress their tool data, where
+    the name is one of "xz", "zstd", or "none"; by default, the codec is the
+    "compression" setting of the Pbench Agent configuration (itself "xz" by
+    default)
+
 The environment variable _PBENCH_TOOL_MEISTER_START_LOG_LEVEL can be defined to
 specify the logging level (e.g., _PBENCH_TOOL_MEISTER_START_LOG_LEVEL=debug);
 by default only INFO, WARNING, and ERROR are included.
@@ -140,6 +150,7 @@ import uuid
 
 import redis
 
+from pbench.agent import PbenchAgentConfig
 from pbench.agent.constants import (
     cli_tm_channel_prefix,
     def_redis_port,
@@ -165,6 +176,8 @@ from pbench.agent.utils import (
     TemplateSsh,
     warn_log,
 )
+from pbench.common.compression import DEFAULT_CODEC, get_codec
+from pbench.common.exceptions import BadConfig
 from pbench.common.utils import Cleanup, validate_hostname
 
 # The --orchestrate parameter default choice, and the full list of choices.
@@ -229,6 +242,7 @@ class ReturnCode(BaseReturnCode):
     INVALIDTMDATA = 42
     TOOLINSTALLFAILURES = 43
     EXCCREATEUUID = 44
+    BADCOMPRESSION = 45
 
 
 class CleanupTime(Exception):
@@ -747,6 +761,27 @@ def terminate_no_wait(
         logger.debug("publish('terminate') = %r", ret)
 
 
+def tool_data_compression() -> str:
+    """Return the codec specification with which the tool data is compressed.
+
+    The PBENCH_TOOL_DATA_COMPRESSION environment variable takes precedence
+    over the "compression" setting of the Pbench Agent configuration named by
+    the _PBENCH_AGENT_CONFIG environment variable; without either, the tool
+    data is compressed with the default codec.
+
+    Raises ValueError if the environment variable does not name a valid
+    codec, and BadConfig if the Pbench Agent configuration is not valid.
+    """
+    compression = os.environ.get("PBENCH_TOOL_DATA_COMPRESSION")
+    if compression:
+        get_codec(compression)
+        return compression
+    cfg_name = os.environ.get("_PBENCH_AGENT_CONFIG")
+    if not cfg_name:
+        return DEFAULT_CODEC
+    return str(PbenchAgentConfig(cfg_name).compression)
+
+
 def start(_prog: str, cli_params: Namespace) -> int:
     """Main program for tool meister start.
 
@@ -918,6 +953,17 @@ def start(_prog: str, cli_params: Namespace) -> int:
     # See if anybody told us to use certain options with SSH commands.
     ssh_opts = os.environ.get("ssh_opts", "")
 
+    # See if remote Tool Meisters should stream their data to the Tool Data
+    # Sink.
+    stream_data = os.environ.get("PBENCH_TOOL_DATA_STREAM", "no") == "yes"
+
+    # See which codec should compress the tool data.
+    try:
+        compression = tool_data_compression()
+    except (BadConfig, ValueError) as exc:
+        logger.error("invalid tool data compression: %s", exc)
+        return ReturnCode.BADCOMPRESSION
+
     # Load optional metadata environment variables
     optional_md = dict(
         script=os.environ.get("benchmark", ""),
@@ -1116,6 +1162,8 @@ def start(_prog: str, cli_params: Namespace) -> int:
                 tool_metadata=tool_metadata.getFullData(),
                 tools=tools,
                 instance_uuid=instance_uuid,
+                stream_data=stream_data,
+                compression=compression,
             )
             # Create a separate key for the Tool Meister that will be on that host
             tm_param_key = f"tm-{tool_group.name}-{host}"
@@ -1144,6 +1192,7 @@ def start(_prog: str, cli_params: Namespace) -> int:
             tool_trigger=tool_group.trigger,
             tools=tool_group_data,
             instance_uuid=instance_uuid,
+            compression=compression,
             # The following are optional
             optional_md=optional_md,
         )
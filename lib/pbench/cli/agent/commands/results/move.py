@@ -1,13 +1,16 @@
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import os
+from pathlib import Path
 import shutil
 import socket
 import tempfile
-from typing import List
+import threading
+from typing import List, Optional
 
 import click
 
 from pbench.agent.base import BaseCommand
-from pbench.agent.results import CopyResult, MakeResultTb
+from pbench.agent.results import CopyResult, MakeResultTb, TarballRecord
 from pbench.cli import CliContext, pass_cli_context, sort_click_command_parameters
 from pbench.cli.agent.commands.results.results_options import results_common_options
 from pbench.cli.agent.options import common_options
@@ -26,152 +29,291 @@ class MoveResults(BaseCommand):
     This command is responsible for finding all the existing pbench data
     directories on the local host (controller), packaging each of them up as a
     tar ball, and sending it to the remote pbench server.
+
+    In "pipeline" mode, result directories are packaged while the tar balls of
+    others are sent, so that neither the CPU nor the network sits idle while
+    the other works.
     """
 
     def __init__(self, context: CliContext):
         super().__init__(context)
+        self.runs_copied = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def execute(
+        self,
+        single_threaded: bool,
+        delete: bool = True,
+        pipeline: bool = False,
+        package_jobs: int = 1,
+        upload_jobs: int = 1,
+    ) -> int:
+        """Move (or copy) all the result directories to the Pbench Server.
+
+        By default each result directory is packaged as a tar ball, and the
+        tar ball is uploaded, before moving to the next one. In "pipeline"
+        mode, result directories are packaged while the tar balls of others
+        are uploaded, several at a time for each.
 
-    def execute(self, single_threaded: bool, delete: bool = True) -> int:
-        runs_copied = 0
-        failures = 0
-        no_of_tb = 0
+        Args:
+            single_threaded: use a single compression thread for each tar ball
+            delete: remove each result directory once it is uploaded
+            pipeline: package and upload result directories concurrently
+            package_jobs: the number of tar balls made at once, in pipeline
+                mode
+            upload_jobs: the number of tar balls uploaded at once, in pipeline
+                mode
+
+        Returns:
+            0 on success, 1 if any result directory could not be moved
+        """
+        self.runs_copied = 0
+        self.failures = 0
         crt = CopyResult.cli_create(self.context, self.config, self.logger)
 
         with tempfile.TemporaryDirectory(
             dir=self.config.pbench_tmp, prefix="pbench-results-move."
         ) as temp_dir:
-            for dirent in self.config.pbench_run.iterdir():
-                if not dirent.is_dir():
-                    continue
-                if dirent.name.startswith("tools-") or dirent.name == "tmp":
-                    continue
-
-                no_of_tb += 1
-                result_dir = dirent
-
-                try:
-                    mrt = MakeResultTb(
-                        str(result_dir),
-                        temp_dir,
-                        self.context.controller,
-                        self.config,
-                        self.logger,
-                    )
-                except MakeResultTb.AlreadyCopied:
-                    self.logger.info(f"Already copied {result_dir}")
-                    continue
-                except MakeResultTb.BenchmarkRunning:
-                    self.logger.warning(
-                        f"Skipping {result_dir}: the benchmark appears to be"
-                        " running.  If that's incorrect, remove the"
-                        f" {result_dir}/.running directory and try again"
-                    )
-                    continue
-                except (NotADirectoryError, FileNotFoundError) as exc:
-                    self.logger.error(str(exc))
-                    failures += 1
-                    continue
-
-                try:
-                    result_tb_name, _, result_tb_md5 = mrt.make_result_tb(
-                        single_threaded=single_threaded
-                    )
-                except BadMDLogFormat as exc:
-                    self.logger.warning(str(exc))
-                    failures += 1
-                    continue
-                except FileNotFoundError as exc:
-                    self.logger.error(str(exc))
-                    failures += 1
-                    continue
-                except RuntimeError as exc:
-                    self.logger.warning("Error encountered making tar ball, '%s'", exc)
-                    failures += 1
-                    continue
-                except Exception as exc:
-                    self.logger.error(
-                        "Unexpected error occurred making tar ball for '%s', '%s'",
-                        result_dir,
-                        exc,
-                    )
-                    failures += 1
-                    continue
-
-                try:
-                    res = crt.push(result_tb_name, result_tb_md5)
-                    if not res.ok:
-                        try:
-                            msg = res.json()["message"]
-                        except Exception:
-                            msg = res.text if res.text else res.reason
-                        raise CopyResult.FileUploadError(msg)
-                    if self.context.relay:
-                        click.echo(f"RELAY {result_tb_name.name}: {res.url}")
-                except Exception as exc:
-                    if isinstance(exc, (CopyResult.FileUploadError, RuntimeError)):
-                        msg = "Error uploading file"
-                    else:
-                        msg = "Unexpected error occurred copying tar ball remotely"
-                    self.logger.error("%s, '%s', %s", msg, result_tb_name, exc)
-                    failures += 1
-                    # We don't know why this operation failed; regardless,
-                    # trying to copy another tar ball remotely does not have
-                    # much chance of success.
-                    break
-                else:
-                    runs_copied += 1
-                finally:
-                    try:
-                        # We always remove the constructed tar ball, regardless of success
-                        # or failure, since we keep the result directory below on failure.
-                        os.remove(result_tb_name)
-                    except OSError as exc:
-                        self.logger.error(
-                            "Failed to remove '%s', '%s'", result_tb_name, exc
-                        )
-
-                if delete:
-                    try:
-                        shutil.rmtree(result_dir)
-                    except OSError:
-                        self.logger.error(
-                            "Failed to remove the %s directory hierarchy", result_dir
-                        )
-                        failures += 1
-                        # If we can't hold up the contract of removing the
-                        # local directory tree that was copied, we exit the
-                        # loop that is processing result directories.  Not
-                        # being able to remove the local directory tree will
-                        # usually indicate a serious problem that needs to be
-                        # resolved before doing anything else.
-                        break
-                else:
-                    copied = result_dir.parent / f"{result_dir.name}.copied"
-                    try:
-                        copied.touch()
-                    except OSError as exc:
-                        self.logger.error(
-                            "Failed to create '.copied' file marker for '%s', '%s'",
-                            result_dir,
-                            exc,
-                        )
-                        failures += 1
-                        # If we can't hold up the contract of marking a
-                        # directory as copied remotely, we exit the loop that
-                        # is processing result directories.  If we can't
-                        # create an empty file on the file system where the
-                        # result directory lives, it likely indicates bigger
-                        # problems.
+            result_dirs = [
+                dirent
+                for dirent in self.config.pbench_run.iterdir()
+                if dirent.is_dir()
+                and not (dirent.name.startswith("tools-") or dirent.name == "tmp")
+            ]
+            if pipeline:
+                self._pipeline(
+                    crt,
+                    result_dirs,
+                    temp_dir,
+                    single_threaded,
+                    delete,
+                    package_jobs,
+                    upload_jobs,
+                )
+            else:
+                for result_dir in result_dirs:
+                    tarball = self._make(result_dir, temp_dir, single_threaded)
+                    if tarball and not self._upload(crt, result_dir, tarball, delete):
                         break
 
         action = "moved" if delete else "copied"
         click.echo(
-            f"Status: total # of result directories considered {no_of_tb:d},"
-            f" successfully {action} {runs_copied:d}, encountered"
-            f" {failures:d} failures"
+            f"Status: total # of result directories considered {len(result_dirs):d},"
+            f" successfully {action} {self.runs_copied:d}, encountered"
+            f" {self.failures:d} failures"
         )
 
-        return 0 if failures == 0 else 1
+        return 0 if self.failures == 0 else 1
+
+    def _count(self, copied: int = 0, failures: int = 0):
+        """Count result directories copied, and failures."""
+        with self.lock:
+            self.runs_copied += copied
+            self.failures += failures
+
+    def _pipeline(
+        self,
+        crt: CopyResult,
+        result_dirs: List[Path],
+        temp_dir: str,
+        single_threaded: bool,
+        delete: bool,
+        package_jobs: int,
+        upload_jobs: int,
+    ):
+        """Package result directories while uploading the tar balls of
+        others.
+
+        Each of a pool of threads packages one result directory at a time,
+        and hands its tar ball to another pool of threads which upload them.
+        To bound the space taken by the tar balls, a result directory isn't
+        packaged while as many tar balls as there are threads are waiting to
+        be, or being, uploaded. As in sequential mode, a failure to upload a
+        tar ball (or to remove or mark the uploaded result directory) stops
+        the move: no more result directories are packaged or uploaded.
+
+        Args:
+            crt: the CopyResult object used to upload the tar balls
+            result_dirs: the result directories
+            temp_dir: the directory in which to make the tar balls
+            single_threaded: use a single compression thread for each tar ball
+            delete: remove each result directory once it is uploaded
+            package_jobs: the number of tar balls made at once
+            upload_jobs: the number of tar balls uploaded at once
+        """
+        stop = threading.Event()
+        pending = threading.BoundedSemaphore(package_jobs + upload_jobs)
+
+        def make(result_dir: Path) -> Optional[TarballRecord]:
+            pending.acquire()
+            tarball = None
+            try:
+                if not stop.is_set():
+                    tarball = self._make(result_dir, temp_dir, single_threaded)
+            finally:
+                if not tarball:
+                    pending.release()
+            return tarball
+
+        def upload(result_dir: Path, tarball: TarballRecord):
+            try:
+                if stop.is_set():
+                    self._remove(tarball.name)
+                elif not self._upload(crt, result_dir, tarball, delete):
+                    stop.set()
+            finally:
+                pending.release()
+
+        with ThreadPoolExecutor(max_workers=upload_jobs) as uploaders:
+            with ThreadPoolExecutor(max_workers=package_jobs) as packagers:
+                made = {packagers.submit(make, d): d for d in result_dirs}
+                for future in as_completed(made):
+                    tarball = future.result()
+                    if tarball:
+                        uploaders.submit(upload, made[future], tarball)
+
+    def _make(
+        self, result_dir: Path, temp_dir: str, single_threaded: bool
+    ) -> Optional[TarballRecord]:
+        """Package a result directory as a tar ball.
+
+        Args:
+            result_dir: the result directory
+            temp_dir: the directory in which to make the tar ball
+            single_threaded: use a single compression thread
+
+        Returns:
+            The tar ball, or None if the result directory was skipped or could
+            not be packaged
+        """
+        try:
+            mrt = MakeResultTb(
+                str(result_dir),
+                temp_dir,
+                self.context.controller,
+                self.config,
+                self.logger,
+            )
+        except MakeResultTb.AlreadyCopied:
+            self.logger.info(f"Already copied {result_dir}")
+            return None
+        except MakeResultTb.BenchmarkRunning:
+            self.logger.warning(
+                f"Skipping {result_dir}: the benchmark appears to be"
+                " running.  If that's incorrect, remove the"
+                f" {result_dir}/.running directory and try again"
+            )
+            return None
+        except (NotADirectoryError, FileNotFoundError) as exc:
+            self.logger.error(str(exc))
+            self._count(failures=1)
+            return None
+
+        try:
+            return mrt.make_result_tb(single_threaded=single_threaded)
+        except BadMDLogFormat as exc:
+            self.logger.warning(str(exc))
+        except FileNotFoundError as exc:
+            self.logger.error(str(exc))
+        except RuntimeError as exc:
+            self.logger.warning("Error encountered making tar ball, '%s'", exc)
+        except Exception as exc:
+            self.logger.error(
+                "Unexpected error occurred making tar ball for '%s', '%s'",
+                result_dir,
+                exc,
+            )
+        self._count(failures=1)
+        return None
+
+    def _remove(self, tarball: Path):
+        """Remove a tar ball."""
+        try:
+            os.remove(tarball)
+        except OSError as exc:
+            self.logger.error("Failed to remove '%s', '%s'", tarball, exc)
+
+    def _upload(
+        self,
+        crt: CopyResult,
+        result_dir: Path,
+        tarball: TarballRecord,
+        delete: bool,
+    ) -> bool:
+        """Upload the tar ball of a result directory, and then remove the
+        result directory, or mark it as copied.
+
+        Args:
+            crt: the CopyResult object used to upload the tar ball
+            result_dir: the result directory
+            tarball: the tar ball of the result directory
+            delete: remove the result directory once it is uploaded
+
+        Returns:
+            False if no more result directories should be moved
+        """
+        try:
+            res = crt.push(tarball.name, tarball.md5, tarball.sha256)
+            if not res.ok:
+                try:
+                    msg = res.json()["message"]
+                except Exception:
+                    msg = res.text if res.text else res.reason
+                raise CopyResult.FileUploadError(msg)
+            if self.context.relay:
+                click.echo(f"RELAY {tarball.name.name}: {res.url}")
+        except Exception as exc:
+            if isinstance(exc, (CopyResult.FileUploadError, RuntimeError)):
+                msg = "Error uploading file"
+            else:
+                msg = "Unexpected error occurred copying tar ball remotely"
+            self.logger.error("%s, '%s', %s", msg, tarball.name, exc)
+            self._count(failures=1)
+            # We don't know why this operation failed; regardless,
+            # trying to copy another tar ball remotely does not have
+            # much chance of success.
+            return False
+        else:
+            self._count(copied=1)
+        finally:
+            # We always remove the constructed tar ball, regardless of success
+            # or failure, since we keep the result directory below on failure.
+            self._remove(tarball.name)
+
+        if delete:
+            try:
+                shutil.rmtree(result_dir)
+            except OSError:
+                self.logger.error(
+                    "Failed to remove the %s directory hierarchy", result_dir
+                )
+                self._count(failures=1)
+                # If we can't hold up the contract of removing the
+                # local directory tree that was copied, we stop
+                # processing result directories.  Not being able to
+                # remove the local directory tree will usually indicate a
+                # serious problem that needs to be resolved before doing
+                # anything else.
+                return False
+        else:
+            copied = result_dir.parent / f"{result_dir.name}.copied"
+            try:
+                copied.touch()
+            except OSError as exc:
+                self.logger.error(
+                    "Failed to create '.copied' file marker for '%s', '%s'",
+                    result_dir,
+                    exc,
+                )
+                self._count(failures=1)
+                # If we can't hold up the contract of marking a
+                # directory as copied remotely, we stop processing
+                # result directories.  If we can't create an empty file
+                # on the file system where the result directory lives, it
+                # likely indicates bigger problems.
+                return False
+        return True
 
 
 @sort_click_command_parameters
@@ -195,7 +337,26 @@ class MoveResults(BaseCommand):
 @click.option(
     "--xz-single-threaded",
     is_flag=True,
-    help="Use single threaded compression with 'xz'",
+    help="Use single threaded compression",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Package result directories while uploading others",
+)
+@click.option(
+    "--package-jobs",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of result directories packaged at once (implies --pipeline if greater than 1)",
+)
+@click.option(
+    "--upload-jobs",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of tar balls uploaded at once (implies --pipeline if greater than 1)",
 )
 @pass_cli_context
 def main(
@@ -206,6 +367,9 @@ def main(
     delete: bool,
     metadata: List,
     xz_single_threaded: bool,
+    pipeline: bool,
+    package_jobs: int,
+    upload_jobs: int,
     server: str,
     relay: str,
 ):
@@ -243,7 +407,13 @@ def main(
     context.relay = relay
 
     try:
-        rv = MoveResults(context).execute(xz_single_threaded, delete=delete)
+        rv = MoveResults(context).execute(
+            xz_single_threaded,
+            delete=delete,
+            pipeline=pipeline or package_jobs > 1 or upload_jobs > 1,
+            package_jobs=package_jobs,
+            upload_jobs=upload_jobs,
+        )
     except Exception as exc:
         click.echo(exc, err=True)
         rv = 1
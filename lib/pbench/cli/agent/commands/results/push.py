@@ -5,11 +5,10 @@ from typing import List
 import click
 
 from pbench.agent.base import BaseCommand
-from pbench.agent.results import CopyResult
+from pbench.agent.results import CopyResult, tarball_record
 from pbench.cli import CliContext, pass_cli_context, sort_click_command_parameters
 from pbench.cli.agent.commands.results.results_options import results_common_options
 from pbench.cli.agent.options import common_options
-from pbench.common.utils import md5sum
 
 
 class ResultsPush(BaseCommand):
@@ -18,9 +17,9 @@ class ResultsPush(BaseCommand):
 
     def execute(self) -> int:
         tarball = Path(self.context.result_tb_name)
-        _, tarball_md5 = md5sum(tarball)
+        record = tarball_record(tarball)
         crt = CopyResult.cli_create(self.context, self.config, self.logger)
-        res = crt.push(tarball, tarball_md5)
+        res = crt.push(tarball, record.md5, record.sha256)
 
         if res.ok and self.context.relay:
             click.echo(f"RELAY {tarball.name}: {res.url}")
@@ -0,0 +1,50 @@
+import time
+
+import click
+
+from pbench.cli import pass_cli_context
+from pbench.cli.server import config_setup
+from pbench.cli.server.options import common_options
+from pbench.common.logger import get_pbench_logger
+from pbench.server import BadConfig
+from pbench.server.dataset_jobs import DatasetJobs
+
+
+@click.command(name="pbench-dataset-jobs")
+@pass_cli_context
+@click.option(
+    "--poll",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Keep polling for queued jobs every POLL seconds (default: exit when done)",
+)
+@common_options
+def dataset_jobs(context: object, poll: int):
+    """
+    Perform the queued background jobs which update the access and owner of
+    datasets, or delete them, along with their Elasticsearch documents.
+    \f
+
+    Args:
+        context: Click context (contains shared `--config` value)
+        poll: Seconds to wait between checks for queued jobs, or 0 to exit
+            once the queued jobs are done
+    """
+    try:
+        config = config_setup(context)
+        logger = get_pbench_logger("pbench-dataset-jobs", config)
+        jobs = DatasetJobs(config, logger)
+        while True:
+            done = jobs.run()
+            if done:
+                logger.info("Performed {} dataset jobs", done)
+            if not poll:
+                break
+            time.sleep(poll)
+        rv = 0
+    except Exception as exc:
+        logger.exception("An error occurred performing dataset jobs: {}", exc)
+        click.echo(exc, err=True)
+        rv = 2 if isinstance(exc, BadConfig) else 1
+
+    click.get_current_context().exit(rv)
@@ -0,0 +1,53 @@
+import time
+
+import click
+
+from pbench.cli import pass_cli_context
+from pbench.cli.server import config_setup
+from pbench.cli.server.options import common_options
+from pbench.common.logger import get_pbench_logger
+from pbench.server import BadConfig
+from pbench.server.relay_pull import RelayPull
+
+
+@click.command(name="pbench-relay-pull")
+@pass_cli_context
+@click.option(
+    "--poll",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Keep polling for queued transfers every POLL seconds (default: exit when done)",
+)
+@common_options
+def relay_pull(context: object, poll: int):
+    """
+    Perform the queued background transfers of dataset tarballs from relay
+    servers, and complete the intake of the datasets.
+    \f
+
+    Args:
+        context: Click context (contains shared `--config` value)
+        poll: Seconds to wait between checks for queued transfers, or 0 to
+            exit once the queued transfers are done
+    """
+    try:
+        config = config_setup(context)
+        logger = get_pbench_logger("pbench-relay-pull", config)
+        pull = RelayPull(config, logger)
+        requeued = pull.recover()
+        if requeued:
+            logger.info("Requeued {} interrupted relay transfers", requeued)
+        while True:
+            done = pull.run()
+            if done:
+                logger.info("Completed {} relay transfers", done)
+            if not poll and not pull.transfers:
+                break
+            time.sleep(poll if poll else 1)
+        rv = 0
+    except Exception as exc:
+        logger.exception("An error occurred performing relay transfers: {}", exc)
+        click.echo(exc, err=True)
+        rv = 2 if isinstance(exc, BadConfig) else 1
+
+    click.get_current_context().exit(rv)
@@ -1,6 +1,8 @@
 from enum import Enum
+from http import HTTPStatus
 import os
 from pathlib import Path
+import time
 from typing import Iterator, Optional
 from urllib import parse
 
@@ -9,6 +11,7 @@ from requests.structures import CaseInsensitiveDict
 
 from pbench.client.oidc_admin import OIDCAdmin
 from pbench.client.types import Dataset, JSONOBJECT
+from pbench.common import upload
 
 
 class PbenchClientError(Exception):
@@ -31,6 +34,20 @@ class IncorrectParameterCount(PbenchClientError):
         return f"API template {self.api} requires {self.cnt} parameters ({self.uri_params})"
 
 
+class OperationFailed(PbenchClientError):
+    """This exception is raised when a background operation on a dataset
+    finishes in the FAILED state.
+    """
+
+    def __init__(self, dataset_id: str, operation: str, message: Optional[str]):
+        self.dataset_id = dataset_id
+        self.operation = operation
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"{self.operation} of {self.dataset_id} failed: {self.message}"
+
+
 class API(Enum):
     """Define the supported Pbench Server V1 API endpoints.
 
@@ -61,6 +78,7 @@ class API(Enum):
 class PbenchServerClient:
     DEFAULT_SCHEME = "https"
     DEFAULT_PAGE_SIZE = 100
+    POLL_INTERVAL = 1.0  # Seconds between checks of a queued operation
 
     def __init__(self, host: str):
         """Create a Pbench Server client object.
@@ -373,12 +391,18 @@ class PbenchServerClient:
         file containing the MD5. It also requires that a user session be logged
         in on the PbenchServerClient.
 
+        A tarball larger than the chunk size is uploaded in chunks, several at
+        a time; if an earlier upload of the tarball was interrupted, only the
+        chunks the server hasn't received are sent.
+
         Args:
             tarball: path to a tarball file with a companion MD5 file
             kwargs: Use to override automatically generated headers
                 md5: override companion MD5 value
                 controller: override metadata.log controller
                 filename: override the actual filename to provoke an error
+                chunk_size: override the default chunk size
+                workers: override the default number of concurrent chunks
 
         Raises:
             FileNotFound: The file or the companion MD5 file is missing
@@ -401,30 +425,107 @@ class PbenchServerClient:
             "content-type": "application/octet-stream",
         }
 
+        uri_params = {"filename": kwargs.get("filename", tarball.name)}
+        chunk_size = kwargs.get("chunk_size", upload.CHUNK_SIZE)
+        if tarball.stat().st_size > chunk_size:
+            return upload.upload_chunks(
+                self.session,
+                self._uri(API.UPLOAD, uri_params),
+                tarball,
+                headers=self._headers(headers),
+                params=query_parameters,
+                chunk_size=chunk_size,
+                workers=kwargs.get("workers", upload.WORKERS),
+            )
+
         with tarball.open("rb") as f:
             return self.put(
                 api=API.UPLOAD,
-                uri_params={"filename": kwargs.get("filename", tarball.name)},
+                uri_params=uri_params,
                 headers=headers,
                 params=query_parameters,
                 data=f,
                 raise_error=False,
             )
 
-    def remove(self, dataset_id: str) -> requests.Response:
+    def remove(self, dataset_id: str, wait: bool = True) -> requests.Response:
         """Delete (remove) a dataset resource.
 
+        The server deletes the dataset in the background: unless told not to,
+        wait for it to finish.
+
         Args:
             dataset_id: the resource ID of the targeted dataset
+            wait: wait for the server to finish deleting the dataset
+
+        Raises:
+            OperationFailed: The server failed to delete the dataset
 
         Returns:
             The DELETE response object
         """
-        return self.delete(
+        response = self.delete(
             api=API.DATASETS,
             uri_params={"dataset": dataset_id},
             raise_error=False,
         )
+        if wait and response.status_code == HTTPStatus.ACCEPTED:
+            self._check_operation(dataset_id, "DELETE")
+        return response
+
+    def wait_for_operation(
+        self, dataset_id: str, operation: str, timeout: float = 120.0
+    ) -> Optional[JSONOBJECT]:
+        """Wait for a queued operation on a dataset (e.g., "UPDATE" or
+        "DELETE") to finish.
+
+        Args:
+            dataset_id: the resource ID of the targeted dataset
+            operation: the name of the operation
+            timeout: the maximum number of seconds to wait
+
+        Raises:
+            TimeoutError: The operation didn't finish in time
+
+        Returns:
+            The final state and message of the operation, or None if the
+            dataset is gone (which is how a DELETE finishes)
+        """
+        deadline = time.time() + timeout
+        while True:
+            response = self.get(
+                api=API.DATASETS_METADATA,
+                uri_params={"dataset": dataset_id},
+                params={"metadata": ["dataset.operations"]},
+                raise_error=False,
+            )
+            if response.status_code == HTTPStatus.NOT_FOUND and operation == "DELETE":
+                return None
+            response.raise_for_status()
+            status = response.json()["dataset.operations"].get(operation)
+            if status and status["state"] in ("OK", "FAILED"):
+                return status
+            if time.time() > deadline:
+                raise TimeoutError(
+                    f"{operation} of {dataset_id} didn't finish in {timeout} seconds: {status}"
+                )
+            time.sleep(self.POLL_INTERVAL)
+
+    def _check_operation(self, dataset_id: str, operation: str):
+        """Wait for a queued operation on a dataset to finish, and check that
+        it succeeded.
+
+        Args:
+            dataset_id: the resource ID of the targeted dataset
+            operation: the name of the operation
+
+        Raises:
+            OperationFailed: The operation finished in the FAILED state
+            TimeoutError: The operation didn't finish in time
+        """
+        status = self.wait_for_operation(dataset_id, operation)
+        if status and status["state"] == "FAILED":
+            raise OperationFailed(dataset_id, operation, status.get("message"))
 
     def get_list(self, **kwargs) -> Iterator[Dataset]:
         """Return a list of datasets matching the specific search criteria and
@@ -440,6 +541,11 @@ class PbenchServerClient:
         specified) at the specified offset in the list of matches. (As if a
         direct call to the raw GET API had been made.)
 
+        We page by "cursor", which the server can find much more quickly than
+        a deep offset, unless the "sort" keys include a metadata key, which
+        the server can only page by offset. We don't need the server to count
+        the total number of matches.
+
         Args:
             kwargs: query criteria
                 metadata: list of requested metadata paths
@@ -449,6 +555,7 @@ class PbenchServerClient:
                 start:  earliest creation date
                 end:    latest creation date
                 limit:  page size to override default
+                sort:   list of sort keys
 
         Returns:
             A list of Dataset objects
@@ -456,6 +563,16 @@ class PbenchServerClient:
         args = kwargs.copy()
         if "limit" not in args:
             args["limit"] = self.DEFAULT_PAGE_SIZE
+        if "offset" not in args:
+            sort = args.get("sort", [])
+            if isinstance(sort, str):
+                sort = sort.split(",")
+            if all(
+                k.startswith("dataset.") and not k.startswith("dataset.metalog")
+                for k in sort
+            ):
+                args["cursor"] = ""
+            args.setdefault("total", False)
         response = self.get(api=API.DATASETS_LIST, params=args, raise_error=False)
         json = response.json()
         assert response.ok, f"GET failed with {json['message']}"
@@ -498,28 +615,43 @@ class PbenchServerClient:
         ).json()
 
     def update(
-        self, dataset_id: str, access: Optional[str] = None, owner: Optional[str] = None
+        self,
+        dataset_id: str,
+        access: Optional[str] = None,
+        owner: Optional[str] = None,
+        wait: bool = True,
     ) -> JSONOBJECT:
         """Update the dataset access or owner
 
+        The server updates the dataset in the background: unless told not to,
+        wait for it to finish.
+
         Args:
             dataset_id: the resource ID of the targeted dataset
             access: set the access mode of the dataset (private, public)
             owner: set the owning username of the dataset (requires ADMIN)
+            wait: wait for the server to finish updating the dataset
+
+        Raises:
+            OperationFailed: The server failed to update the dataset
 
         Returns:
-            A JSON document containing the response
+            A JSON document containing the response to the update request; if
+            we waited, the update has been completed successfully
         """
         params = {}
         if access:
             params["access"] = access
         if owner:
             params["owner"] = owner
-        return self.post(
+        response = self.post(
             api=API.DATASETS,
             uri_params={"dataset": dataset_id},
             params=params,
         ).json()
+        if wait:
+            self._check_operation(dataset_id, "UPDATE")
+        return response
 
     def get_settings(self, key: str = "") -> JSONOBJECT:
         """Return requested server setting.
@@ -2,6 +2,8 @@ from pathlib import Path
 import re
 from typing import Any, Union
 
+from pbench.common.compression import tarball_stem
+
 # A set of types defined to conform to the semantic definition of a JSON
 # structure with Python syntax.
 JSONSTRING = str
@@ -61,7 +63,7 @@ class JSONMap:
 class Dataset(JSONMap):
     @staticmethod
     def stem(tarball: Union[str, Path]) -> str:
-        return Path(tarball).name.removesuffix(".tar.xz")
+        return tarball_stem(tarball) or Path(tarball).name
 
     @staticmethod
     def md5(tarball: Path) -> str:
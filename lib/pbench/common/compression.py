@@ -0,0 +1,166 @@
+"""Compression codecs for Pbench tar balls.
+
+The Pbench Agent compresses tool data and result tar balls with a codec
+chosen by a specification of the form "<name>[:<level>]":
+
+    xz      multi-threaded xz (the default), tar balls named "*.tar.xz"
+    zstd    multi-threaded zstd, tar balls named "*.tar.zst"
+    none    no compression (e.g., for transfers to a local host), tar balls
+            named "*.tar"
+
+The optional level is passed to the compression program (e.g., "zstd:19" or
+"xz:3").  The Pbench Server accepts tar balls compressed with any of the
+codecs, recognizing them by their suffix.
+"""
+
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+
+DEFAULT_CODEC = "xz"
+
+
+class Codec(NamedTuple):
+    """A compression codec for tar balls.
+
+    Attributes:
+        name: the codec name
+        suffix: the suffix of a tar ball compressed with the codec
+        program: the compression program, or None for no compression
+        levels: the range of compression levels the program accepts
+        level: the compression level, or None for the program's default
+    """
+
+    name: str
+    suffix: str
+    program: Optional[str]
+    levels: range
+    level: Optional[int] = None
+
+    def compress_command(self, threads: int = 0) -> Optional[List[str]]:
+        """Return the command which compresses its standard input to its
+        standard output.
+
+        Args:
+            threads: the number of compression threads, or 0 to use one per
+                CPU
+
+        Returns:
+            The command arguments, or None for no compression
+        """
+        if self.program is None:
+            return None
+        command = [self.program, f"-T{threads}"]
+        if self.program == "zstd":
+            command.append("-q")
+        if self.level is not None:
+            command.append(f"-{self.level}")
+        return command
+
+    def tar_create_args(self, threads: int = 0) -> List[str]:
+        """Return the `tar` arguments which create a tar ball compressed with
+        the codec.
+
+        Args:
+            threads: the number of compression threads, or 0 to use one per
+                CPU
+
+        Returns:
+            A list of `tar` arguments, empty for no compression
+        """
+        command = self.compress_command(threads)
+        if command is None:
+            return []
+        return [f"--use-compress-program={' '.join(command)}"]
+
+    def tar_extract_args(self) -> List[str]:
+        """Return the `tar` arguments which extract a tar ball compressed with
+        the codec.
+
+        `tar` recognizes the compression of a file it reads, but not of its
+        standard input, so these are needed only when extracting a stream.
+
+        Returns:
+            A list of `tar` arguments, empty for no compression
+        """
+        if self.program is None:
+            return []
+        return [f"--use-compress-program={self.program}"]
+
+    def __str__(self) -> str:
+        return self.name if self.level is None else f"{self.name}:{self.level}"
+
+
+_CODECS: Dict[str, Codec] = {
+    c.name: c
+    for c in (
+        Codec("xz", ".tar.xz", "xz", range(0, 10)),
+        Codec("zstd", ".tar.zst", "zstd", range(1, 20)),
+        Codec("none", ".tar", None, range(0)),
+    )
+}
+
+# The tar ball suffixes of all the codecs, with the default first
+TARBALL_SUFFIXES = tuple(c.suffix for c in _CODECS.values())
+
+
+def get_codec(spec: Optional[str] = None) -> Codec:
+    """Return the codec given by a specification "<name>[:<level>]".
+
+    Args:
+        spec: the codec specification, or None for the default codec
+
+    Raises:
+        ValueError if the specification isn't valid
+
+    Returns:
+        A Codec
+    """
+    name, _, level = (spec or DEFAULT_CODEC).strip().partition(":")
+    try:
+        codec = _CODECS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown compression codec {name!r}, must be one of"
+            f" {', '.join(_CODECS)}"
+        )
+    if not level:
+        return codec
+    try:
+        value = int(level)
+    except ValueError:
+        value = None
+    if value not in codec.levels:
+        raise ValueError(f"Invalid compression level {level!r} for {name!r}")
+    return codec._replace(level=value)
+
+
+def tarball_codec(path: Union[Path, str]) -> Optional[Codec]:
+    """Return the codec of a tar ball, recognized by its suffix.
+
+    Args:
+        path: the tar ball path
+
+    Returns:
+        The Codec, or None if the path isn't a tar ball name
+    """
+    name = Path(path).name
+    for codec in _CODECS.values():
+        if name.endswith(codec.suffix) and len(name) > len(codec.suffix):
+            return codec
+    return None
+
+
+def tarball_stem(path: Union[Path, str]) -> Optional[str]:
+    """Return the name of a tar ball without its suffix.
+
+    Args:
+        path: the tar ball path
+
+    Returns:
+        The stem of the tar ball name, or None if the path isn't a tar ball
+        name
+    """
+    codec = tarball_codec(path)
+    if codec is None:
+        return None
+    return Path(path).name[: -len(codec.suffix)]
@@ -0,0 +1,123 @@
+"""Upload a tarball to the Pbench Server in chunks.
+
+The Pbench Server upload API accepts a tarball as a series of chunks, each a
+PUT of a byte range of the file given by a "Content-Range" header. The chunks
+can be sent concurrently, and the server reports which byte ranges it has
+received, so an interrupted upload can be resumed by sending only the missing
+chunks, and a chunk which fails can be retried without starting over.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+# The default size of each chunk, and the default number of chunks to send
+# concurrently.
+CHUNK_SIZE = 64 * 1024 * 1024
+WORKERS = 4
+
+# The number of times we try to send each chunk, and the delay before the
+# first retry (which doubles for each retry after that).
+ATTEMPTS = 4
+RETRY_DELAY = 1.0
+
+
+def missing_chunks(
+    size: int, received: List[List[int]], chunk_size: int
+) -> List[Tuple[int, int]]:
+    """Return the byte ranges of the chunks which haven't been received.
+
+    Args:
+        size: the size of the tarball
+        received: the byte ranges already received, as sorted [start, end]
+            pairs (where `end` is the offset of the last byte)
+        chunk_size: the maximum size of a chunk
+
+    Returns:
+        A list of (start, end) chunk byte ranges
+    """
+    chunks = []
+    position = 0
+    for start, end in received + [[size, size]]:
+        for offset in range(position, start, chunk_size):
+            chunks.append((offset, min(offset + chunk_size, start) - 1))
+        position = max(position, end + 1)
+    return chunks
+
+
+def upload_chunks(
+    http: requests.Session,
+    url: str,
+    tarball: Path,
+    headers: Dict[str, str],
+    params: dict,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = WORKERS,
+) -> requests.Response:
+    """Upload a tarball in chunks, resuming any earlier upload of it.
+
+    Args:
+        http: the requests Session (or the requests module) to use
+        url: the upload API URL for the tarball
+        tarball: the tarball path
+        headers: the request headers, including the tarball's "Content-MD5"
+        params: the upload query parameters
+        chunk_size: the maximum size of a chunk
+        workers: the number of chunks to send concurrently
+
+    Returns:
+        The response to the request which completed the upload, or else the
+        response which reports the reason it didn't complete
+    """
+    size = tarball.stat().st_size
+    received = []
+    progress = http.get(url, headers=headers, params={"md5": headers["Content-MD5"]})
+    if progress.ok and progress.json().get("size") == size:
+        received = progress.json()["received"]
+    chunks = missing_chunks(size, received, chunk_size)
+    if not chunks:
+        # Everything was received, but the upload wasn't completed: sending
+        # any chunk again will complete it.
+        chunks = [(0, min(chunk_size, size) - 1)]
+
+    def put(chunk: Tuple[int, int]) -> Optional[requests.Response]:
+        start, end = chunk
+        with tarball.open("rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        chunk_headers = headers.copy()
+        chunk_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        delay = RETRY_DELAY
+        for attempt in range(ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                response = http.put(
+                    url, data=data, headers=chunk_headers, params=params
+                )
+            except requests.exceptions.ConnectionError:
+                if attempt == ATTEMPTS - 1:
+                    raise
+                continue
+            if response.status_code < HTTPStatus.INTERNAL_SERVER_ERROR:
+                break
+        return response
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        responses = list(pool.map(put, chunks))
+
+    # Report a failure if there was one; otherwise the completion of the
+    # upload; otherwise (if another client completed it concurrently) the
+    # last progress report.
+    for response in responses:
+        if not response.ok:
+            return response
+    for response in responses:
+        if response.status_code != HTTPStatus.ACCEPTED:
+            return response
+    return responses[-1]
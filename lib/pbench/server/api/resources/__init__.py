@@ -1598,6 +1598,34 @@ class ApiBase(Resource):
 
         return metadata
 
+    def _get_datasets_metadata(
+        self, datasets: List[Dataset], requested_items: List[str]
+    ) -> Dict[int, JSON]:
+        """Get requested metadata for a list of Datasets
+
+        This is equivalent to calling `_get_dataset_metadata` for each dataset,
+        but fetches the metadata of all the datasets together.
+
+        Args:
+            datasets : list of Dataset objects
+            requested_items : List of metadata key names
+
+        Raises:
+            MetadataSqlError : SQL error in retrieval
+
+        Returns:
+            A dict mapping each Dataset ID to a JSON object (Python dict)
+            containing a key-value pair for each requested metadata key present
+            on the dataset.
+        """
+        if not requested_items:
+            return {d.id: {} for d in datasets}
+
+        user: Optional[User] = None
+        if any(Metadata.get_native_key(i) == Metadata.USER for i in requested_items):
+            user = Auth.token_auth.current_user()
+        return Metadata.getvalues(datasets=datasets, keys=requested_items, user=user)
+
     def _set_dataset_metadata(
         self, dataset: Dataset, metadata: dict[str, JSONVALUE]
     ) -> dict[str, str]:
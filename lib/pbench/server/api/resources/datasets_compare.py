@@ -3,7 +3,7 @@ from urllib.request import Request
 
 from flask import current_app, jsonify
 from flask.wrappers import Response
-from pquisby.lib.post_processing import BenchmarkName, InputType, QuisbyProcessing
+from pquisby.lib.post_processing import BenchmarkName
 
 from pbench.server import OperationCode, PbenchServerConfig
 from pbench.server.api.resources import (
@@ -20,6 +20,10 @@ from pbench.server.api.resources import (
     ParamType,
     Schema,
 )
+from pbench.server.api.resources.quisby_cache import (
+    compare_quisby_data,
+    get_quisby_data_cached,
+)
 from pbench.server.cache_manager import (
     CacheManager,
     TarballNotFound,
@@ -93,31 +97,32 @@ class DatasetsCompare(ApiBase):
                     dataset.access,
                 )
             )
-        cache_m = CacheManager(self.config, current_app.logger)
-        stream_file = {}
+        benchmark_type = BenchmarkName.__members__.get(benchmark.upper())
+        if not benchmark_type:
+            raise APIAbort(
+                HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"Unsupported Benchmark: {benchmark}"
+            )
+
+        # Each dataset's Quisby processing is cached, so we only need to
+        # combine them.
+        cache_m = CacheManager.get_instance(self.config, current_app.logger)
+        results = {}
         for dataset in datasets:
             try:
-                tarball = cache_m.find_dataset(dataset.resource_id)
+                results[dataset.name] = get_quisby_data_cached(
+                    cache_m, dataset, benchmark_type
+                )
             except TarballNotFound as e:
                 raise APIInternalError(
                     f"Expected dataset with ID '{dataset.resource_id}' is missing from the cache manager."
                 ) from e
-            try:
-                file = tarball.extract(
-                    tarball.tarball_path, f"{tarball.name}/result.csv"
-                )
             except TarballUnpackError as e:
                 raise APIInternalError(str(e)) from e
-            stream_file[dataset.name] = file
-
-        benchmark_type = BenchmarkName.__members__.get(benchmark.upper())
-        if not benchmark_type:
-            raise APIAbort(
-                HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"Unsupported Benchmark: {benchmark}"
-            )
-        get_quisby_data = QuisbyProcessing().compare_csv_to_json(
-            benchmark_type, InputType.STREAM, stream_file
-        )
+            if results[dataset.name]["status"] != "success":
+                get_quisby_data = results[dataset.name]
+                break
+        else:
+            get_quisby_data = compare_quisby_data(benchmark_type, results)
         if get_quisby_data["status"] != "success":
             raise APIInternalError(
                 f"Quisby processing failure. Exception: {get_quisby_data['exception']}"
@@ -59,7 +59,7 @@ class DatasetsInventory(ApiBase):
         dataset = params.uri["dataset"]
         target = params.uri.get("target")
 
-        cache_m = CacheManager(self.config, current_app.logger)
+        cache_m = CacheManager.get_instance(self.config, current_app.logger)
         try:
             file_info = cache_m.filestream(dataset, target)
         except TarballNotFound as e:
@@ -1,5 +1,8 @@
+import base64
 from dataclasses import dataclass
+import datetime
 from http import HTTPStatus
+import json as jsonlib
 import logging
 from typing import Any, Callable, Optional
 from urllib.parse import urlencode, urlparse
@@ -9,7 +12,7 @@ from flask.json import jsonify
 from flask.wrappers import Request, Response
 from sqlalchemy import and_, asc, Boolean, cast, desc, func, Integer, or_, String
 from sqlalchemy.exc import ProgrammingError, StatementError
-from sqlalchemy.orm import aliased, Query
+from sqlalchemy.orm import aliased, InstrumentedAttribute, Query
 from sqlalchemy.sql.expression import Alias, BinaryExpression, ColumnElement
 
 from pbench.server import JSON, JSONOBJECT, OperationCode, PbenchServerConfig
@@ -272,6 +275,8 @@ class DatasetsList(ApiBase):
                     # Pagination
                     Parameter("offset", ParamType.INT),
                     Parameter("limit", ParamType.INT),
+                    Parameter("cursor", ParamType.STRING),
+                    Parameter("total", ParamType.BOOLEAN),
                     # Output control
                     Parameter("daterange", ParamType.BOOLEAN),
                     Parameter("keysummary", ParamType.BOOLEAN),
@@ -309,6 +314,9 @@ class DatasetsList(ApiBase):
             "limit": 10 -> dataset[0: 10]
             "offset": 20 -> dataset[20: total_items_count]
 
+        If "total" is false, the total items count is neither computed nor
+        returned.
+
         Args:
             query: A SQLAlchemy query object
             json: The query parameters in normalized JSON form
@@ -321,7 +329,12 @@ class DatasetsList(ApiBase):
         """
         paginated_result = {}
         query = query.distinct()
-        total_count = query.count()
+
+        # Counting the matches can cost as much as the query itself, so the
+        # client can ask us not to: then we ask for one more item than the
+        # limit to learn whether there's another page.
+        counted = json.get("total", True)
+        total_count = query.count() if counted else None
 
         # Shift the query search by user specified offset value,
         # otherwise return the batch of results starting from the
@@ -333,26 +346,164 @@ class DatasetsList(ApiBase):
         # Get the user specified limit, otherwise return all the items
         limit = json.get("limit")
         if limit:
-            query = query.limit(limit)
+            query = query.limit(limit if counted else limit + 1)
 
         Database.dump_query(query, current_app.logger)
 
         items = query.all()
+        if counted:
+            more = offset + len(items) < total_count
+        else:
+            more = bool(limit) and len(items) > limit
+            items = items[:limit]
         raw = raw_params.query.copy()
         next_offset = offset + len(items)
-        if next_offset < total_count:
+        if more:
             json["offset"] = str(next_offset)
             raw["offset"] = str(next_offset)
             parsed_url = urlparse(url)
             next_url = parsed_url._replace(query=urlencode_json(json)).geturl()
         else:
             if limit:
-                raw["offset"] = str(total_count)
+                raw["offset"] = str(total_count if counted else next_offset)
+            next_url = ""
+
+        paginated_result["parameters"] = raw
+        paginated_result["next_url"] = next_url
+        if counted:
+            paginated_result["total"] = total_count
+        return items, paginated_result
+
+    @staticmethod
+    def _encode_cursor(cursor: JSONOBJECT) -> str:
+        """Encode the position of a keyset page as an opaque URL-safe string
+
+        Args:
+            cursor: The cursor data
+
+        Returns:
+            The encoded cursor
+        """
+        text = jsonlib.dumps(cursor, separators=(",", ":"))
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> JSONOBJECT:
+        """Decode a cursor made by `_encode_cursor`
+
+        Args:
+            cursor: The encoded cursor
+
+        Raises:
+            APIAbort(BAD_REQUEST) if the cursor can't be decoded
+
+        Returns:
+            The cursor data
+        """
+        try:
+            decoded = jsonlib.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if type(decoded) is not dict or type(decoded.get("after")) is not list:
+                raise ValueError("not a cursor")
+        except ValueError as e:
+            raise APIAbort(HTTPStatus.BAD_REQUEST, f"Invalid cursor {cursor!r}") from e
+        return decoded
+
+    def get_keyset_obj(
+        self,
+        query: Query,
+        keyset: list[tuple[InstrumentedAttribute, bool]],
+        json: JSON,
+        raw_params: ApiParams,
+        url: str,
+    ) -> tuple[list[JSONOBJECT], dict[str, str]]:
+        """Helper function to return a page of datasets by "keyset" (or
+        cursor) pagination, and a paginated object containing the next page
+        url and total items count.
+
+        Rather than skipping some number of matches with OFFSET, which means
+        that the database has to find every one of them, we "seek" directly
+        to the first match which sorts after the last match of the previous
+        page. The position is given by an opaque "cursor" string: an empty
+        cursor selects the first page, and the "next_url" of each page gives
+        the cursor of the next.
+
+        The total count of matches is computed only for the first page (unless
+        "total" is false) and carried by the cursor to later pages.
+
+        Args:
+            query: A SQLAlchemy query object, sorted by the keyset columns
+            keyset: The Dataset columns of the sort, each with a flag which is
+                True for a descending sort; the last must be unique
+            json: The query parameters in normalized JSON form
+            raw_params: The original API parameters for reference
+            url: The API URL
+
+        Returns:
+            The list of Dataset objects matched by the query and a pagination
+            framework object.
+        """
+        paginated_result = {}
+        query = query.distinct()
+        sort = [f"{c.key}:{'desc' if d else 'asc'}" for c, d in keyset]
+
+        total_count = None
+        if json["cursor"]:
+            cursor = self._decode_cursor(json["cursor"])
+            if cursor.get("sort") != sort or len(cursor["after"]) != len(keyset):
+                raise APIAbort(
+                    HTTPStatus.BAD_REQUEST,
+                    "The cursor doesn't match the query's sort order",
+                )
+            total_count = cursor.get("total")
+
+            # Seek past the last item of the previous page: with sort keys
+            # (k1, k2, ...), that's the items with k1 after the last k1, or
+            # with the same k1 and k2 after the last k2, and so on.
+            values = []
+            for (column, _), value in zip(keyset, cursor["after"]):
+                if isinstance(column.type, TZDateTime):
+                    value = datetime.datetime.fromisoformat(value)
+                values.append(value)
+            terms = []
+            for i, ((column, descending), value) in enumerate(zip(keyset, values)):
+                after = column < value if descending else column > value
+                terms.append(
+                    and_(*[c == v for (c, _), v in zip(keyset[:i], values[:i])], after)
+                )
+            query = query.filter(or_(*terms))
+        elif json.get("total", True):
+            total_count = query.count()
+
+        # Ask for one more than the limit to learn whether there's another page
+        limit = json.get("limit")
+        if limit:
+            query = query.limit(limit + 1)
+
+        Database.dump_query(query, current_app.logger)
+
+        items = query.all()
+        raw = raw_params.query.copy()
+        if limit and len(items) > limit:
+            items = items[:limit]
+            after = []
+            for column, _ in keyset:
+                value = getattr(items[-1], column.key)
+                if isinstance(value, datetime.datetime):
+                    value = value.isoformat()
+                after.append(value)
+            cursor = {"sort": sort, "after": after}
+            if total_count is not None:
+                cursor["total"] = total_count
+            json["cursor"] = self._encode_cursor(cursor)
+            parsed_url = urlparse(url)
+            next_url = parsed_url._replace(query=urlencode_json(json)).geturl()
+        else:
             next_url = ""
 
         paginated_result["parameters"] = raw
         paginated_result["next_url"] = next_url
-        paginated_result["total"] = total_count
+        if total_count is not None:
+            paginated_result["total"] = total_count
         return items, paginated_result
 
     @staticmethod
@@ -634,8 +785,10 @@ class DatasetsList(ApiBase):
         """
 
         # Process a possible list of sort terms. By default, we sort by the
-        # dataset resource_id.
+        # dataset resource_id. For keyset pagination, we also keep track of the
+        # Dataset columns of the sort (or None for a Metadata sort key).
         sorters = []
+        keyset = []
         for sort in json.get("sort", ["dataset.resource_id"]):
             if ":" not in sort:
                 k = sort
@@ -673,17 +826,49 @@ class DatasetsList(ApiBase):
                             HTTPStatus.BAD_REQUEST, str(MetadataBadKey(k))
                         ) from e
                     sorter = order(c)
+                    keyset.append((c, order is desc))
             if sorter is None:
                 sorter = order(aliases[native_key].value[keys])
+                keyset.append(None)
             sorters.append(sorter)
 
+        # Keyset pagination needs a unique sort, so we finish with the
+        # resource_id; and we can only seek on a sort key with a well-defined
+        # order, so we don't allow sorting on Metadata keys, whose values may
+        # be missing or of mixed types.
+        cursor = "cursor" in json
+        if cursor:
+            if "offset" in json:
+                raise APIAbort(
+                    HTTPStatus.BAD_REQUEST,
+                    "'cursor' and 'offset' cannot be used together",
+                )
+            if None in keyset:
+                raise APIAbort(
+                    HTTPStatus.BAD_REQUEST,
+                    "'cursor' pagination can only sort on dataset columns",
+                )
+            keyset.append((Dataset.resource_id, False))
+            sorters.append(asc(Dataset.resource_id))
+
         # Apply our list of sort terms
         query = query.order_by(*sorters)
 
         try:
-            datasets, paginated_result = self.get_paginated_obj(
-                query=query, json=json, raw_params=raw_params, url=request.url
-            )
+            if cursor:
+                datasets, paginated_result = self.get_keyset_obj(
+                    query=query,
+                    keyset=keyset,
+                    json=json,
+                    raw_params=raw_params,
+                    url=request.url,
+                )
+            else:
+                datasets, paginated_result = self.get_paginated_obj(
+                    query=query, json=json, raw_params=raw_params, url=request.url
+                )
+        except APIAbort:
+            raise
         except (AttributeError, ProgrammingError, StatementError) as e:
             raise APIInternalError(
                 f"Constructed SQL for {json} isn't executable"
@@ -693,16 +878,28 @@ class DatasetsList(ApiBase):
 
         keys = json.get("metadata")
 
+        # Fetch the metadata for the whole page at once, rather than querying
+        # each key of each dataset. If that fails, fall back to fetching the
+        # metadata of each dataset separately, so that only the datasets
+        # whose metadata can't be fetched report none.
+        try:
+            metadata = self._get_datasets_metadata(datasets, keys)
+        except MetadataError:
+            metadata = None
+
         response = []
         for dataset in datasets:
             d = {
                 "name": dataset.name,
                 "resource_id": dataset.resource_id,
             }
-            try:
-                d["metadata"] = self._get_dataset_metadata(dataset, keys)
-            except MetadataError:
-                d["metadata"] = None
+            if metadata is not None:
+                d["metadata"] = metadata.get(dataset.id)
+            else:
+                try:
+                    d["metadata"] = self._get_dataset_metadata(dataset, keys)
+                except MetadataError:
+                    d["metadata"] = None
             response.append(d)
 
         paginated_result["results"] = response
@@ -3,7 +3,7 @@ from urllib.request import Request
 
 from flask import current_app, jsonify
 from flask.wrappers import Response
-from pquisby.lib.post_processing import BenchmarkName, InputType, QuisbyProcessing
+from pquisby.lib.post_processing import BenchmarkName
 
 from pbench.server import OperationCode, PbenchServerConfig
 from pbench.server.api.resources import (
@@ -19,12 +19,12 @@ from pbench.server.api.resources import (
     ParamType,
     Schema,
 )
+from pbench.server.api.resources.quisby_cache import get_quisby_data_cached
 from pbench.server.cache_manager import (
     CacheManager,
     TarballNotFound,
     TarballUnpackError,
 )
-from pbench.server.database import Dataset
 
 
 class DatasetsVisualize(ApiBase):
@@ -63,10 +63,10 @@ class DatasetsVisualize(ApiBase):
         """
 
         dataset = params.uri["dataset"]
-        cache_m = CacheManager(self.config, current_app.logger)
+        cache_m = CacheManager.get_instance(self.config, current_app.logger)
 
         try:
-            tarball = cache_m.find_dataset(dataset.resource_id)
+            cache_m.find_dataset(dataset.resource_id)
         except TarballNotFound as e:
             raise APIAbort(
                 HTTPStatus.NOT_FOUND, f"No dataset with ID '{e.tarball}' found"
@@ -82,16 +82,11 @@ class DatasetsVisualize(ApiBase):
                 HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"Unsupported Benchmark: {benchmark}"
             )
 
-        name = Dataset.stem(tarball.tarball_path)
         try:
-            file = tarball.extract(tarball.tarball_path, f"{name}/result.csv")
+            get_quisby_data = get_quisby_data_cached(cache_m, dataset, benchmark_type)
         except TarballUnpackError as e:
             raise APIInternalError(str(e)) from e
 
-        get_quisby_data = QuisbyProcessing().extract_data(
-            benchmark_type, dataset.name, InputType.STREAM, file
-        )
-
         if get_quisby_data["status"] != "success":
             raise APIInternalError(
                 f"Quisby processing failure. Exception: {get_quisby_data['exception']}"
@@ -5,6 +5,7 @@ import hashlib
 from http import HTTPStatus
 import os
 from pathlib import Path
+import re
 import shutil
 from typing import Any, IO, Optional
 
@@ -54,8 +55,13 @@ class Intake:
 
 @dataclass
 class Access:
+    """How to read the tarball: either a byte stream to be copied and hashed,
+    or a file already holding the data to be moved into place and hashed.
+    """
+
     length: int
-    stream: IO[bytes]
+    stream: Optional[IO[bytes]]
+    path: Optional[Path] = None
 
 
 class IntakeBase(ApiBase):
@@ -69,12 +75,16 @@ class IntakeBase(ApiBase):
         optional metadata to be set.
     _stream: decodes the intake data and provides the length and byte IO
         stream to be read into a temporary file.
+
+    A subclass may also provide a _defer hook method to queue the transfer of
+    the tarball to be completed in the background, in which case _stream isn't
+    used.
     """
 
     CHUNK_SIZE = 65536
 
-    def __init__(self, config: PbenchServerConfig, schema: ApiSchema):
-        super().__init__(config, schema)
+    def __init__(self, config: PbenchServerConfig, *schemas: ApiSchema):
+        super().__init__(config, *schemas)
         self.temporary = config.ARCHIVE / CacheManager.TEMPORARY
         self.temporary.mkdir(mode=0o755, parents=True, exist_ok=True)
         method = list(self.schemas.schemas.keys())[0]
@@ -126,6 +136,113 @@ class IntakeBase(ApiBase):
             )
         return metadata
 
+    @staticmethod
+    def check_filename(filename: str):
+        """Check that the tarball name is acceptable
+
+        Args:
+            filename: The tarball name
+
+        Raises:
+            APIAbort if the name includes a path or isn't a tarball name
+        """
+        if os.path.basename(filename) != filename:
+            raise APIAbort(HTTPStatus.BAD_REQUEST, "Filename must not contain a path")
+
+        if not Dataset.is_tarball(filename):
+            raise APIAbort(
+                HTTPStatus.BAD_REQUEST,
+                "File extension not supported, must be one of"
+                f" {', '.join(Dataset.TARBALL_SUFFIXES)}",
+            )
+
+    @staticmethod
+    def check_md5(md5: str):
+        """Check that a tarball MD5 is well formed
+
+        The MD5 is the dataset's resource ID, and names the tarball's
+        directories in the server's upload area.
+
+        Args:
+            md5: The MD5 given by the client
+
+        Raises:
+            APIAbort if the MD5 isn't 32 lowercase hexadecimal digits
+        """
+        if not re.fullmatch(r"[0-9a-f]{32}", md5):
+            raise APIAbort(HTTPStatus.BAD_REQUEST, f"Invalid MD5 {md5!r}")
+
+    @staticmethod
+    def check_duplicate(dataset: Dataset) -> bool:
+        """Check whether an existing dataset with the MD5 of a new tarball can
+        be replaced.
+
+        A dataset whose UPLOAD operation is queued or in progress (as for a
+        relayed tarball being transferred in the background) can't be
+        replaced; nor can a dataset which was uploaded successfully, which we
+        assume is the same tarball. A dataset whose upload failed is replaced
+        by the new upload.
+
+        Args:
+            dataset: The existing dataset
+
+        Returns:
+            True if the dataset should be replaced, False if the new tarball is
+            a duplicate
+
+        Raises:
+            APIAbort if the dataset's upload is incomplete
+        """
+        state = None
+        for operation in dataset.operations:
+            if operation.name == OperationName.UPLOAD:
+                state = operation.state
+        if state in (OperationState.READY, OperationState.WORKING):
+            raise APIAbort(
+                HTTPStatus.CONFLICT,
+                f"Dataset {dataset.name!r} is already being uploaded",
+            )
+        return state == OperationState.FAILED
+
+    def _set_metadata(
+        self, dataset: Dataset, metadata: JSONOBJECT, attributes: JSONOBJECT
+    ):
+        """Set the default deletion time of a new dataset, and the metadata
+        requested by the client.
+
+        Args:
+            dataset: The new dataset
+            metadata: The validated metadata requested by the client
+            attributes: The audit attributes of the intake, which record any
+                metadata failures
+
+        Raises:
+            APIInternalError on failure
+        """
+        try:
+            retention_days = self.config.default_retention_period
+        except Exception as e:
+            raise APIInternalError(
+                f"Unable to get integer retention days: {e!s}"
+            ) from e
+
+        # Calculate a default deletion time for the dataset, based on the
+        # time it was uploaded rather than the time it was originally
+        # created which might much earlier.
+        try:
+            retention = datetime.timedelta(days=retention_days)
+            deletion = dataset.uploaded + retention
+            Metadata.setvalue(
+                dataset=dataset,
+                key=Metadata.SERVER_DELETION,
+                value=UtcTimeHelper(deletion).to_iso_string(),
+            )
+            f = self._set_dataset_metadata(dataset, metadata)
+            if f:
+                attributes["failures"] = f
+        except Exception as e:
+            raise APIInternalError(f"Unable to set metadata: {e!s}") from e
+
     def _identify(self, args: ApiParams, request: Request) -> Intake:
         """Identify the tarball to be streamed.
 
@@ -154,6 +271,78 @@ class IntakeBase(ApiBase):
         """
         raise NotImplementedError()
 
+    def _defer(
+        self,
+        intake: Intake,
+        dataset: Dataset,
+        audit: Audit,
+        metadata: JSONOBJECT,
+        attributes: JSONOBJECT,
+    ) -> Optional[Response]:
+        """Optionally queue the transfer of the tarball to be completed in the
+        background.
+
+        By default the tarball is streamed immediately, using _stream; a
+        subclass may instead queue the transfer, completing the intake of the
+        dataset elsewhere, and return the API response.
+
+        Args:
+            intake: The Intake parameters produced by _identify
+            dataset: The new dataset
+            audit: The root (BEGIN) audit record of the intake
+            metadata: The validated metadata requested by the client
+            attributes: The audit attributes of the intake
+
+        Returns:
+            The API response, or None to stream the tarball now
+        """
+        return None
+
+    def _receive(self, stream: Access, tar_full_path: Path) -> tuple[int, str]:
+        """Copy the tarball byte stream to a file, hashing it as we go
+
+        Args:
+            stream: The Access object produced by _stream
+            tar_full_path: The path of the file to write
+
+        Returns:
+            The number of bytes received and their MD5
+
+        Raises:
+            APIInternalError on failure
+        """
+
+        # NOTE: We know that the MD5 is unique at this point; so even if
+        # two tarballs with the same name are uploaded concurrently, by
+        # writing into a temporary directory named for the MD5 we're
+        # assured that they can't conflict.
+        bytes_received = 0
+        try:
+            with tar_full_path.open(mode="wb") as ofp:
+                hash_md5 = hashlib.md5()
+
+                while True:
+                    chunk = stream.stream.read(self.CHUNK_SIZE)
+                    bytes_received += len(chunk)
+                    if len(chunk) == 0 or bytes_received > stream.length:
+                        break
+                    ofp.write(chunk)
+                    hash_md5.update(chunk)
+        except OSError as exc:
+            # NOTE: Werkzeug doesn't support status 509, so the abort call
+            # in _dispatch will fail. Rather than figure out how to fix
+            # that, just report as an internal error.
+            if exc.errno == errno.ENOSPC:
+                msg = f"Out of space on {tar_full_path.root}"
+            else:
+                msg = f"Unexpected error {exc.errno} encountered during file upload"
+            raise APIInternalError(msg) from exc
+        except Exception as e:
+            raise APIInternalError(
+                "Unexpected error encountered during file upload"
+            ) from e
+        return bytes_received, hash_md5.hexdigest()
+
     def _intake(
         self, args: ApiParams, request: Request, context: ApiContext
     ) -> Response:
@@ -167,7 +356,9 @@ class IntakeBase(ApiBase):
         1) PUT /api/v1/upload/<filename>
         2) POST /api/v1/relay/<uri>
 
-        If the new dataset is created successfully, return 201 (CREATED).
+        If the new dataset is created successfully, return 201 (CREATED); if
+        the transfer of the tarball is queued by the _defer hook, return its
+        response (normally 202, ACCEPTED).
 
         The tarball name must be unique on the Pbench Server. If the name
         given matches an existing dataset, and has an identical MD5 resource ID
@@ -218,49 +409,9 @@ class IntakeBase(ApiBase):
             metadata = self.process_metadata(intake.metadata)
             attributes = {"access": intake.access, "metadata": metadata}
 
-            if os.path.basename(filename) != filename:
-                raise APIAbort(
-                    HTTPStatus.BAD_REQUEST, "Filename must not contain a path"
-                )
-
-            if not Dataset.is_tarball(filename):
-                raise APIAbort(
-                    HTTPStatus.BAD_REQUEST,
-                    f"File extension not supported, must be {Dataset.TARBALL_SUFFIX}",
-                )
-
+            self.check_filename(filename)
             dataset_name = Dataset.stem(filename)
 
-            # NOTE: we isolate each uploaded tarball into a private MD5-based
-            # subdirectory in order to retain the original tarball stem name
-            # for the cache manager while giving us protection against multiple
-            # tarballs with the same name. (A duplicate MD5 will have already
-            # failed, so that's not a concern.)
-            try:
-                tmp_dir = self.temporary / intake.md5
-                tmp_dir.mkdir()
-            except FileExistsError as e:
-                raise APIAbort(
-                    HTTPStatus.CONFLICT,
-                    "Temporary upload directory already exists",
-                ) from e
-            tar_full_path = tmp_dir / filename
-            md5_full_path = tmp_dir / f"{filename}.md5"
-
-            bytes_received = 0
-            usage = shutil.disk_usage(tar_full_path.parent)
-            current_app.logger.info(
-                "{} {} (pre): {:.3}% full, {} remaining",
-                self.name,
-                tar_full_path.name,
-                float(usage.used) / float(usage.total) * 100.0,
-                humanize.naturalsize(usage.free),
-            )
-
-            current_app.logger.info(
-                "{} {} for {} to {}", self.name, filename, username, tar_full_path
-            )
-
             # Create a tracking dataset object; it'll begin in UPLOADING state
             try:
                 dataset = Dataset(
@@ -278,15 +429,31 @@ class IntakeBase(ApiBase):
                     dataset_name,
                 )
                 try:
-                    Dataset.query(resource_id=intake.md5)
+                    duplicate = Dataset.query(resource_id=intake.md5)
                 except DatasetNotFound as e:
                     raise APIInternalError(
                         f"Duplicate dataset {intake.md5!r} ({dataset_name!r}) is missing"
                     ) from e
-                else:
+                if not self.check_duplicate(duplicate):
                     response = jsonify(dict(message="Dataset already exists"))
                     response.status_code = HTTPStatus.OK
                     return response
+
+                # The earlier upload of the dataset failed, so we replace it.
+                current_app.logger.info(
+                    "Replacing dataset {} after its failed upload", duplicate
+                )
+                try:
+                    duplicate.delete()
+                    dataset = Dataset(
+                        owner=authorized_user,
+                        name=dataset_name,
+                        resource_id=intake.md5,
+                        access=intake.access,
+                    )
+                    dataset.add()
+                except Exception as e:
+                    raise APIInternalError("Unable to replace dataset") from e
             except APIAbort:
                 raise  # Propagate an APIAbort exception to the outer block
             except Exception as e:
@@ -305,6 +472,42 @@ class IntakeBase(ApiBase):
                 attributes=attributes,
             )
 
+            # Our helper may queue the transfer of the tarball to be completed
+            # in the background rather than streaming it now.
+            response = self._defer(intake, dataset, audit, metadata, attributes)
+            if response:
+                return response
+
+            # NOTE: we isolate each uploaded tarball into a private MD5-based
+            # subdirectory in order to retain the original tarball stem name
+            # for the cache manager while giving us protection against multiple
+            # tarballs with the same name. (A duplicate MD5 will have already
+            # failed, so that's not a concern.)
+            try:
+                path = self.temporary / intake.md5
+                path.mkdir()
+                tmp_dir = path
+            except FileExistsError as e:
+                raise APIAbort(
+                    HTTPStatus.CONFLICT,
+                    "Temporary upload directory already exists",
+                ) from e
+            tar_full_path = tmp_dir / filename
+            md5_full_path = tmp_dir / f"{filename}.md5"
+
+            usage = shutil.disk_usage(tar_full_path.parent)
+            current_app.logger.info(
+                "{} {} (pre): {:.3}% full, {} remaining",
+                self.name,
+                tar_full_path.name,
+                float(usage.used) / float(usage.total) * 100.0,
+                humanize.naturalsize(usage.free),
+            )
+
+            current_app.logger.info(
+                "{} {} for {} to {}", self.name, filename, username, tar_full_path
+            )
+
             # Now we're ready to pull the tarball, so ask our helper for the
             # length and data stream.
             stream = self._stream(intake, request)
@@ -320,44 +523,39 @@ class IntakeBase(ApiBase):
             # error recovery.
             recovery.add(lambda: tar_full_path.unlink(missing_ok=True))
 
-            # NOTE: We know that the MD5 is unique at this point; so even if
-            # two tarballs with the same name are uploaded concurrently, by
-            # writing into a temporary directory named for the MD5 we're
-            # assured that they can't conflict.
-            try:
-                with tar_full_path.open(mode="wb") as ofp:
-                    hash_md5 = hashlib.md5()
+            if stream.path:
+                # The data has already been received, so we only need to move
+                # it into place and hash it; on error, we move it back so that
+                # the upload can be completed later.
+                def restore():
+                    if tar_full_path.exists():
+                        tar_full_path.rename(stream.path)
 
-                    while True:
-                        chunk = stream.stream.read(self.CHUNK_SIZE)
-                        bytes_received += len(chunk)
-                        if len(chunk) == 0 or bytes_received > stream.length:
-                            break
-                        ofp.write(chunk)
-                        hash_md5.update(chunk)
-            except OSError as exc:
-                # NOTE: Werkzeug doesn't support status 509, so the abort call
-                # in _dispatch will fail. Rather than figure out how to fix
-                # that, just report as an internal error.
-                if exc.errno == errno.ENOSPC:
-                    msg = f"Out of space on {tar_full_path.root}"
-                else:
-                    msg = f"Unexpected error {exc.errno} encountered during file upload"
-                raise APIInternalError(msg) from exc
-            except Exception as e:
-                raise APIInternalError(
-                    "Unexpected error encountered during file upload"
-                ) from e
+                try:
+                    stream.path.rename(tar_full_path)
+                    recovery.add(restore)
+                    bytes_received = tar_full_path.stat().st_size
+                    hash_md5 = hashlib.md5()
+                    with tar_full_path.open("rb") as ifp:
+                        for chunk in iter(lambda: ifp.read(self.CHUNK_SIZE), b""):
+                            hash_md5.update(chunk)
+                    md5 = hash_md5.hexdigest()
+                except OSError as exc:
+                    raise APIInternalError(
+                        f"Unable to read {stream.path} as {tar_full_path}: {exc}"
+                    ) from exc
+            else:
+                bytes_received, md5 = self._receive(stream, tar_full_path)
 
             if bytes_received != stream.length:
                 raise APIAbort(
                     HTTPStatus.BAD_REQUEST,
                     f"Expected {stream.length} bytes but received {bytes_received} bytes",
                 )
-            elif hash_md5.hexdigest() != intake.md5:
+            elif md5 != intake.md5:
                 raise APIAbort(
                     HTTPStatus.BAD_REQUEST,
-                    f"MD5 checksum {hash_md5.hexdigest()} does not match expected {intake.md5}",
+                    f"MD5 checksum {md5} does not match expected {intake.md5}",
                 )
 
             # From this point attempt to remove the MD5 file on error exit
@@ -371,7 +569,7 @@ class IntakeBase(ApiBase):
 
             # Create a cache manager object
             try:
-                cache_m = CacheManager(self.config, current_app.logger)
+                cache_m = CacheManager.get_instance(self.config, current_app.logger)
             except Exception as e:
                 raise APIInternalError("Unable to map the cache manager") from e
 
@@ -425,33 +623,14 @@ class IntakeBase(ApiBase):
                 ) from exc
 
             try:
-                retention_days = self.config.default_retention_period
-            except Exception as e:
-                raise APIInternalError(
-                    f"Unable to get integer retention days: {e!s}"
-                ) from e
-
-            # Calculate a default deletion time for the dataset, based on the
-            # time it was uploaded rather than the time it was originally
-            # created which might much earlier.
-            try:
-                retention = datetime.timedelta(days=retention_days)
-                deletion = dataset.uploaded + retention
                 Metadata.setvalue(
                     dataset=dataset,
                     key=Metadata.TARBALL_PATH,
                     value=str(tarball.tarball_path),
                 )
-                Metadata.setvalue(
-                    dataset=dataset,
-                    key=Metadata.SERVER_DELETION,
-                    value=UtcTimeHelper(deletion).to_iso_string(),
-                )
-                f = self._set_dataset_metadata(dataset, metadata)
-                if f:
-                    attributes["failures"] = f
             except Exception as e:
                 raise APIInternalError(f"Unable to set metadata: {e!s}") from e
+            self._set_metadata(dataset, metadata, attributes)
 
             # Finally, update the operational state and Audit success.
             try:
@@ -1,17 +1,12 @@
-from collections import defaultdict
-from dataclasses import dataclass
 from datetime import datetime
 from http import HTTPStatus
-import json
-import re
-from typing import Any, Callable, Iterator, List, Optional
+from typing import Any, Callable, List, Optional
 from urllib.parse import urljoin
 from urllib.request import Request
 
 from dateutil import rrule
 from dateutil.relativedelta import relativedelta
-from elasticsearch import Elasticsearch, helpers, VERSION
-from flask import current_app, jsonify
+from flask import current_app, jsonify, url_for
 from flask.wrappers import Response
 import requests
 
@@ -33,7 +28,6 @@ from pbench.server.api.resources import (
 )
 import pbench.server.auth.auth as Auth
 from pbench.server.database.database import Database
-from pbench.server.database.models.audit import AuditReason, AuditStatus
 from pbench.server.database.models.datasets import (
     Dataset,
     Metadata,
@@ -42,6 +36,7 @@ from pbench.server.database.models.datasets import (
 )
 from pbench.server.database.models.templates import Template
 from pbench.server.database.models.users import User
+from pbench.server.sync import Sync
 
 
 class MissingBulkSchemaParameters(SchemaError):
@@ -487,27 +482,18 @@ class ElasticBase(ApiBase):
         return self._call(requests.get, params, context)
 
 
-@dataclass
-class BulkResults:
-    errors: int
-    count: int
-    report: defaultdict
-
-
 class ElasticBulkBase(ApiBase):
     """
-    A base class for bulk Elasticsearch queries that allows subclasses to
-    provide a generator to produce bulk command documents with common setup and
-    results processing.
+    A base class for bulk Elasticsearch operations on the documents of a
+    dataset, which allows subclasses to validate the request and provide the
+    parameters of a background job to perform it.
 
     This class extends the ApiBase class in order to connect the post
-    and get methods to Flask's URI routing algorithms. It implements a common
-    mechanism for calling the Elasticsearch package streaming_bulk helper, and
-    processing the response documents.
+    and delete methods to Flask's URI routing algorithms. It implements a
+    common mechanism for queuing the operation's background job, which is
+    performed by the `pbench-dataset-jobs` worker (see DatasetJobs).
     """
 
-    EXCEPTION_NAME = re.compile(r"^(\w+)")
-
     def __init__(
         self,
         config: PbenchServerConfig,
@@ -540,7 +526,6 @@ class ElasticBulkBase(ApiBase):
 
         api_name = self.__class__.__name__
 
-        self.elastic_uri = config.get("Indexing", "uri")
         self.config = config
 
         # Look for a parameter of type DATASET. It may be defined in any of the
@@ -563,23 +548,14 @@ class ElasticBulkBase(ApiBase):
             self.schemas[ApiMethod.POST].authorization == ApiAuthorizationType.DATASET
         ), f"API {self.__class__.__name__} authorization type must be DATASET"
 
-    def generate_actions(
-        self,
-        params: ApiParams,
-        dataset: Dataset,
-        context: ApiContext,
-        map: dict[str, list[str]],
-    ) -> Iterator[dict]:
+    def prepare(
+        self, params: ApiParams, dataset: Dataset, context: ApiContext
+    ) -> JSONOBJECT:
         """
-        Generate a series of Elasticsearch bulk operation actions driven by the
-        dataset document map. For example:
+        Validate a bulk operation request and return the parameters of the
+        background job which will perform it. For example:
 
-        {
-            "_op_type": "update",
-            "_index": index_name,
-            "_id": document_id,
-            "doc": {"authorization": {"access": new_access}}
-        }
+        {"access": "public", "owner": None}
 
         This is an abstract method that must be implemented by a subclass.
 
@@ -587,103 +563,15 @@ class ElasticBulkBase(ApiBase):
             params: Type-normalized client request body JSON
             dataset: The associated Dataset object
             context: The operation's ApiContext
-            map: Elasticsearch index document map
+
+        Raises:
+            MissingParameters, UnauthorizedAdminAccess
 
         Returns:
-            Sequence of Elasticsearch bulk action dict objects
+            The job parameters, which are passed to the background job
         """
         raise NotImplementedError()
 
-    def complete(
-        self, dataset: Dataset, context: ApiContext, summary: JSONOBJECT
-    ) -> None:
-        """
-        Complete a bulk Elasticsearch operation, perhaps by modifying the
-        source Dataset resource.
-
-        This is an abstract method that may be implemented by a subclass to
-        perform some completion action; the default is to do nothing.
-
-        Args:
-            dataset: The associated Dataset object.
-            context: The operation's ApiContext
-            summary: The summary document of the operation:
-                ok      Count of successful actions
-                failure Count of failing actions
-        """
-        pass
-
-    def _analyze_bulk(
-        self, results: Iterator[tuple[bool, Any]], context: ApiContext
-    ) -> BulkResults:
-        """Elasticsearch returns one response result per action. Each is a
-        JSON document where the first-level key is the action name
-        ("update", "delete", etc.) and the value of that key includes the
-        action's "status", "_index", etc; and, on failure, an "error" key
-        the value of which gives the type and reason for the failure.
-
-        We assume there will be a single first-level key corresponding to
-        the action generated by the subclass and we use that without any
-        validation to access the status information.
-
-        Internally report a summary of successes and Elasticsearch failure
-        reasons: this will look something like
-
-        {
-          "ok": {
-            "index1": 1,
-            "index2": 500,
-            ...
-          },
-          "elasticsearch failure reason 1": {
-            "index2": 5,
-            "index5": 10
-            ...
-          },
-          "elasticsearch failure reason 2": {
-            "index3": 2,
-            "index4": 15
-            ...
-          }
-        }
-        """
-        report = defaultdict(lambda: defaultdict(int))
-        errors = 0
-        count = 0
-
-        for ok, response in results:
-            count += 1
-            u = response[context["attributes"].action]
-            status = "ok"
-            if "error" in u:
-                e = u["error"]
-                # The bulk helper seems to return a stringified exception
-                # as the "error" key value, at least in some cases. The
-                # documentation is not entirely clear, so to be safe this
-                # handles either a stringified exception or the standard
-                # Elasticsearch server bulk action response, where "error"
-                # is a dict with details. If the type of "error" isn't
-                # either of these, just stringify it.
-                #
-                # For the stringified exception, we try to extract the
-                # leading exception name (e.g., 'ConnectionError(...)') for
-                # a simpler and more readable error report key; if the
-                # pattern doesn't match, use the entire string.
-                if isinstance(e, str):
-                    match = self.EXCEPTION_NAME.match(e)
-                    if match:
-                        status = match[1]
-                    else:
-                        status = e
-                elif isinstance(e, dict) and "reason" in e:
-                    status = e["reason"]
-                else:
-                    status = str(e)
-                errors += 1
-            index = u["_index"]
-            report[status][index] += 1
-        return BulkResults(errors=errors, count=count, report=report)
-
     def _post(
         self, params: ApiParams, request: Request, context: ApiContext
     ) -> Response:
@@ -737,7 +625,15 @@ class ElasticBulkBase(ApiBase):
         self, params: ApiParams, request: Request, context: ApiContext
     ) -> Response:
         """
-        Perform the requested operation, and handle any exceptions.
+        Queue the requested operation as a background job, and handle any
+        exceptions.
+
+        Updating or deleting every Elasticsearch document of a large dataset
+        takes far too long to do within the API call, so we just mark the
+        dataset's operation READY, recording the job parameters with it, for
+        the `pbench-dataset-jobs` worker. The response gives the URI of the
+        dataset's "dataset.operations" metadata, which reports the progress
+        and outcome of the job.
 
         Args:
             params: Type-normalized client parameters
@@ -754,6 +650,7 @@ class ElasticBulkBase(ApiBase):
         dataset = self.schemas.get_param_by_type(
             ApiMethod.POST, ParamType.DATASET, params
         ).value
+        component = context["attributes"].operation_name
 
         operation = (
             Database.db_session.query(Operation)
@@ -768,72 +665,58 @@ class ElasticBulkBase(ApiBase):
                 HTTPStatus.CONFLICT,
                 f"Dataset is working on {operation.name.name}",
             )
-
-        map = Metadata.getvalue(dataset=dataset, key=Metadata.INDEX_MAP)
+        queued = (
+            Database.db_session.query(Operation)
+            .filter(
+                Operation.dataset_ref == dataset.id,
+                Operation.name == component,
+                Operation.state == OperationState.READY,
+            )
+            .first()
+        )
+        if queued:
+            raise APIAbort(
+                HTTPStatus.CONFLICT, f"Dataset {component.name} is already queued"
+            )
 
         # If we don't have an Elasticsearch index-map, then the dataset isn't
-        # indexed and we skip the Elasticsearch actions.
-        if map:
-            # Build an Elasticsearch instance to manage the bulk update
-            elastic = Elasticsearch(self.elastic_uri)
-            current_app.logger.info("Elasticsearch {} [{}]", elastic, VERSION)
-
-            # NOTE: because both generate_actions and streaming_bulk return
-            # generators, the entire sequence is inside a single try block.
-            try:
-                results = helpers.streaming_bulk(
-                    elastic,
-                    self.generate_actions(params, dataset, context, map),
-                    raise_on_exception=False,
-                    raise_on_error=False,
-                )
-                report = self._analyze_bulk(results, context)
-            except UnauthorizedAdminAccess as e:
-                raise APIAbort(e.http_status, str(e))
-            except MissingParameters as e:
-                raise APIAbort(e.http_status, str(e))
-            except Exception as e:
-                raise APIInternalError("Unexpected backend error") from e
-        elif context["attributes"].require_map:
+        # indexed and the job will skip the Elasticsearch actions.
+        map = Metadata.getvalue(dataset=dataset, key=Metadata.INDEX_MAP)
+        if not map and context["attributes"].require_map:
             raise APIAbort(
                 HTTPStatus.CONFLICT,
                 f"Operation unavailable: dataset {dataset.resource_id} is not indexed.",
             )
-        else:
-            report = BulkResults(errors=0, count=0, report={})
 
-        summary: JSONOBJECT = {
-            "ok": report.count - report.errors,
-            "failure": report.errors,
-        }
-        auditing: dict[str, Any] = context["auditing"]
-        attributes: JSONOBJECT = {"summary": summary}
-        auditing["attributes"] = attributes
+        try:
+            job = self.prepare(params, dataset, context)
+        except (MissingParameters, UnauthorizedAdminAccess) as e:
+            raise APIAbort(e.http_status, str(e))
 
-        # Let the subclass complete the operation
         try:
-            self.complete(dataset, context, summary)
-        except Exception as e:
-            attributes["message"] = str(e)
-            auditing["status"] = AuditStatus.WARNING
-            auditing["reason"] = AuditReason.INTERNAL
-            raise APIInternalError("Unexpected completion error") from e
-
-        # Return the summary document as the success response, or abort with an
-        # internal error if we tried to operate on Elasticsearch documents but
-        # experienced total failure. Either way, the operation can be retried
-        # if some documents failed to update.
-        #
-        # TODO: switching to `pyesbulk` will automatically handle retrying on
-        # non-terminal errors, but this requires some cleanup work on the
-        # pyesbulk side.
-        if report.count and report.errors == report.count:
-            auditing["status"] = AuditStatus.WARNING
-            auditing["reason"] = AuditReason.INTERNAL
-            attributes[
-                "message"
-            ] = f"Unable to {context['attributes'].action} some indexed documents"
-            raise APIInternalError(
-                f"Failed to {context['attributes'].action} any of {report.count} Elasticsearch documents: {json.dumps(report.report)}"
+            Sync(current_app.logger, component).update(
+                dataset=dataset,
+                state=OperationState.READY,
+                message="Queued",
+                params=job,
             )
-        return jsonify(summary)
+        except Exception as e:
+            raise APIInternalError("Unable to queue the operation") from e
+
+        auditing: dict[str, Any] = context["auditing"]
+        auditing["attributes"] = {"job": job}
+
+        status = url_for(
+            "datasets_metadata",
+            dataset=dataset.resource_id,
+            metadata="dataset.operations",
+        )
+        response = jsonify(
+            {
+                "message": f"{context['attributes'].action} queued",
+                "status": status,
+            }
+        )
+        response.status_code = HTTPStatus.ACCEPTED
+        response.headers["Location"] = status
+        return response
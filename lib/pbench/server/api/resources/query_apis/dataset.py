@@ -1,7 +1,3 @@
-from typing import Any, Iterator
-
-from flask import current_app
-
 from pbench.server import JSONOBJECT, OperationCode, PbenchServerConfig
 from pbench.server.api.resources import (
     ApiAttributes,
@@ -17,14 +13,8 @@ from pbench.server.api.resources import (
 )
 from pbench.server.api.resources.query_apis import ApiContext, ElasticBulkBase
 import pbench.server.auth.auth as Auth
-from pbench.server.cache_manager import CacheManager
 from pbench.server.database.models.audit import AuditType
-from pbench.server.database.models.datasets import (
-    Dataset,
-    OperationName,
-    OperationState,
-)
-from pbench.server.sync import Sync
+from pbench.server.database.models.datasets import Dataset, OperationName
 
 
 class Datasets(ElasticBulkBase):
@@ -33,6 +23,9 @@ class Datasets(ElasticBulkBase):
      the owner and/or access in the Dataset table and in each Elasticsearch document
     "authorization" sub-document associated with the dataset
 
+    The operation is queued for the `pbench-dataset-jobs` worker, and its
+    progress reported through the dataset's "dataset.operations" metadata.
+
     Called as `POST /api/v1/datasets/{resource_id}?access=public&owner=user`
     or DELETE /api/v1/datasets/{resource_id}
     """
@@ -78,98 +71,36 @@ class Datasets(ElasticBulkBase):
             ),
         )
 
-    def generate_actions(
-        self,
-        params: ApiParams,
-        dataset: Dataset,
-        context: ApiContext,
-        map: dict[str, list[str]],
-    ) -> Iterator[dict]:
+    def prepare(
+        self, params: ApiParams, dataset: Dataset, context: ApiContext
+    ) -> JSONOBJECT:
         """
-        Generate a series of Elasticsearch bulk update actions driven by the
-        dataset document map.
+        Validate the request and return the parameters of the background job
+        which will update the access and/or owner of the dataset, or delete
+        it.
 
         Args:
             params: API parameters
             dataset: the Dataset object
-            context: CONTEXT to pass to complete
-            map: Elasticsearch index document map
-
-        Returns:
-            A generator for Elasticsearch bulk update actions
-        """
-        action = context["attributes"].action
-
-        sync = Sync(
-            logger=current_app.logger, component=context["attributes"].operation_name
-        )
-        sync.update(dataset=dataset, state=OperationState.WORKING)
-        context["sync"] = sync
-        es_doc = {}
-
-        if action == "update":
-            access = params.query.get("access")
-            owner = params.query.get("owner")
-            if not access and not owner:
-                raise MissingParameters(["access", "owner"])
-            if access:
-                context["access"] = es_doc["access"] = access
-            if owner:
-                authorized_user = Auth.token_auth.current_user()
-                if not authorized_user.is_admin():
-                    raise UnauthorizedAdminAccess(authorized_user, OperationCode.UPDATE)
-                context["owner"] = es_doc["owner"] = owner
-
-        # Generate a series of bulk operations, which will be passed to
-        # the Elasticsearch bulk helper.
-        #
-        # Note that the "doc" specifies explicit instructions for updating only
-        # the "access" and/or "owner" field(s) of the "authorization" subdocument:
-        # no other data will be modified.
-
-        for index, ids in map.items():
-            for id in ids:
-                es_action = {"_op_type": action, "_index": index, "_id": id}
-                if es_doc:
-                    es_action["doc"] = es_doc
-                yield es_action
+            context: API context
 
-    def complete(
-        self, dataset: Dataset, context: ApiContext, summary: JSONOBJECT
-    ) -> None:
-        """
-        Complete the operation by deleting or updating the access/owner of the
-        Dataset object.
-
-        Note that an exception will be caught outside this class.
+        Raises:
+            MissingParameters: neither access nor owner given for an update
+            UnauthorizedAdminAccess: a non-admin user tried to change the owner
 
-        Args:
-            dataset: Dataset object
-            context: CONTEXT dictionary
-            summary: summary of the bulk operation
-                ok: count of successful updates
-                failure: count of failures
+        Returns:
+            The job parameters: {"access": access, "owner": owner} for an
+            update, or an empty object for a delete
         """
-        auditing: dict[str, Any] = context["auditing"]
-        attributes = auditing["attributes"]
-        action = context["attributes"].action
-        if summary["failure"] == 0:
-            if action == "update":
-                access = context.get("access")
-                if access:
-                    attributes["access"] = access
-                    dataset.access = access
-                owner = context.get("owner")
-                if owner:
-                    attributes["owner"] = owner
-                    dataset.owner_id = owner
-                dataset.update()
-                context["sync"].update(dataset=dataset, state=OperationState.OK)
-            elif action == "delete":
-                cache_m = CacheManager(self.config, current_app.logger)
-                cache_m.delete(dataset.resource_id)
-                dataset.delete()
-        else:
-            context["sync"].error(
-                dataset=dataset, message=f"Unable to {action} some indexed documents"
-            )
+        if context["attributes"].action != "update":
+            return {}
+
+        access = params.query.get("access")
+        owner = params.query.get("owner")
+        if not access and not owner:
+            raise MissingParameters(["access", "owner"])
+        if owner:
+            authorized_user = Auth.token_auth.current_user()
+            if not authorized_user.is_admin():
+                raise UnauthorizedAdminAccess(authorized_user, OperationCode.UPDATE)
+        return {"access": access, "owner": owner}
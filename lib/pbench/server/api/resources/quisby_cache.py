@@ -0,0 +1,111 @@
+from importlib.metadata import PackageNotFoundError, version
+import io
+import json
+from typing import Optional
+
+from pquisby.lib.post_processing import BenchmarkName, InputType, QuisbyProcessing
+
+from pbench.server import JSONOBJECT
+from pbench.server.cache_manager import CacheManager
+from pbench.server.database.models.datasets import Dataset
+
+try:
+    QUISBY_VERSION = version("pquisby")
+except PackageNotFoundError:
+    QUISBY_VERSION = "unknown"
+
+
+def get_quisby_data_cached(
+    cache_m: CacheManager, dataset: Dataset, benchmark: BenchmarkName
+) -> JSONOBJECT:
+    """Return the Quisby processing of a dataset's result.csv file.
+
+    A dataset's result data never changes, so we keep the processed result
+    in the cache manager's extract cache, keyed by the Quisby version, the
+    benchmark type, and the dataset name (which Quisby includes in its
+    result). A failure is not cached.
+
+    The processed results share the extract cache's size and age limits with
+    the extracted files, so they can be evicted like any other entry, and
+    they aren't kept at all when the extract cache is disabled (its size is
+    0), in which case each call processes the result.csv again.
+
+    Args:
+        cache_m: A CacheManager object
+        dataset: The dataset
+        benchmark: The dataset's benchmark type
+
+    Raises:
+        TarballNotFound if the dataset tarball isn't found
+        CacheManagerError on failure to extract result.csv
+
+    Returns:
+        The Quisby `extract_data` result for the dataset
+    """
+    failure = None
+
+    def process() -> Optional[io.BytesIO]:
+        nonlocal failure
+        tarball = cache_m.find_dataset(dataset.resource_id)
+        name = Dataset.stem(tarball.tarball_path)
+        with cache_m.extract(dataset.resource_id, f"{name}/result.csv") as stream:
+            data = stream.read().decode()
+        result = QuisbyProcessing().extract_data(
+            benchmark, dataset.name, InputType.STREAM, data
+        )
+        if result["status"] != "success":
+            failure = result
+            return None
+        return io.BytesIO(json.dumps(result).encode())
+
+    key = f"quisby/{QUISBY_VERSION}/{benchmark.name}/{dataset.name}"
+    stream = cache_m.extract_cache.get(dataset.resource_id, key, process)
+    if stream is None:
+        return failure
+    with stream:
+        return json.load(stream)
+
+
+class _ProcessedQuisby(QuisbyProcessing):
+    """Quisby processing of data which has already been processed: the data
+    given for each dataset is the result of `extract_data`.
+
+    This relies on Quisby's `compare_csv_to_json` processing the data of each
+    dataset through `self.extract_data`, so we record the datasets we see to
+    make sure that it still does. (The pquisby version is pinned in the
+    server requirements, and a unit test checks the comparison against
+    Quisby's own.)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.processed: set[str] = set()
+
+    def extract_data(self, test_name, dataset_name, input_type, data):
+        self.processed.add(dataset_name)
+        return data
+
+
+def compare_quisby_data(
+    benchmark: BenchmarkName, results: dict[str, JSONOBJECT]
+) -> JSONOBJECT:
+    """Combine the Quisby processing of several datasets into a comparison,
+    as Quisby's `compare_csv_to_json` would do from their CSV data.
+
+    Args:
+        benchmark: The datasets' benchmark type
+        results: The `get_quisby_data_cached` result of each dataset, by name
+
+    Raises:
+        RuntimeError if Quisby didn't use the processed results
+
+    Returns:
+        The Quisby comparison result
+    """
+    quisby = _ProcessedQuisby()
+    result = quisby.compare_csv_to_json(benchmark, InputType.STREAM, results)
+    if result["status"] == "success" and quisby.processed != set(results):
+        raise RuntimeError(
+            f"Quisby {QUISBY_VERSION} didn't compare the processed results"
+        )
+    return result
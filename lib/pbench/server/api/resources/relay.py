@@ -1,14 +1,16 @@
 from http import HTTPStatus
+from typing import Optional
 
-from flask import Response
+from flask import current_app, jsonify, Response, url_for
 from flask.wrappers import Request
 import requests
 
-from pbench.server import PbenchServerConfig
+from pbench.server import JSONOBJECT, PbenchServerConfig
 from pbench.server.api.resources import (
     APIAbort,
     ApiAuthorizationType,
     ApiContext,
+    APIInternalError,
     ApiMethod,
     ApiParams,
     ApiSchema,
@@ -16,9 +18,14 @@ from pbench.server.api.resources import (
     ParamType,
     Schema,
 )
-from pbench.server.api.resources.intake_base import Access, Intake, IntakeBase
-from pbench.server.database.models.audit import AuditType, OperationCode
-from pbench.server.database.models.datasets import Dataset
+from pbench.server.api.resources.intake_base import Intake, IntakeBase
+from pbench.server.database.models.audit import Audit, AuditType, OperationCode
+from pbench.server.database.models.datasets import (
+    Dataset,
+    OperationName,
+    OperationState,
+)
+from pbench.server.sync import Sync
 
 
 class Relay(IntakeBase):
@@ -62,7 +69,7 @@ class Relay(IntakeBase):
             metadata: An optional list of "key:value" metadata strings
 
         This information will be captured in an Intake instance for use by the
-        base class and by the _stream method.
+        base class and by the _defer method.
 
         Args:
             args: API parameters
@@ -101,41 +108,67 @@ class Relay(IntakeBase):
             raise APIAbort(
                 HTTPStatus.BAD_GATEWAY, f"Relay info missing {str(e)!r}"
             ) from e
+        self.check_md5(md5)
 
         return Intake(name, md5, access, metadata, uri)
 
-    def _stream(self, intake: Intake, request: Request) -> Access:
-        """Determine how to access the tarball byte stream
-
-        Using the _intake information captured in the Intake instance, perform
-        a follow-up GET operation to the URI provided by the Relay config file,
-        returning the length header and the IO stream.
+    def _defer(
+        self,
+        intake: Intake,
+        dataset: Dataset,
+        audit: Audit,
+        metadata: JSONOBJECT,
+        attributes: JSONOBJECT,
+    ) -> Optional[Response]:
+        """Queue the transfer of the tarball from the relay server.
+
+        Streaming a large tarball from the relay server would tie up a server
+        process for as long as the transfer takes, so we only set the
+        requested metadata of the new dataset, and mark its UPLOAD operation
+        READY, recording the relay URI and name of the tarball with it, for
+        the `pbench-relay-pull` worker. The response gives the URI of the
+        dataset's "dataset.operations" metadata, which reports the progress
+        and outcome of the transfer.
 
         Args:
             intake: The Intake parameters produced by _identify
-            request: The Flask request object
+            dataset: The new dataset
+            audit: The root (BEGIN) audit record of the intake, which the
+                worker will complete
+            metadata: The validated metadata requested by the client
+            attributes: The audit attributes of the intake
 
         Returns:
-            An Access object with the data byte stream and length
+            The API response
 
         Raises:
-            APIAbort on failure
+            APIInternalError on failure
         """
-        response: requests.Response = requests.get(
-            url=intake.uri, stream=True, headers={"Accept": "application/octet-stream"}
-        )
-        if not response.ok:
-            raise APIAbort(
-                response.status_code,
-                f"Unable to retrieve relay tarball: {response.reason!r}",
-            )
+        self._set_metadata(dataset, metadata, attributes)
         try:
-            length = int(response.headers["Content-length"])
-            return Access(length, response.raw)
+            Sync(current_app.logger, OperationName.UPLOAD).update(
+                dataset=dataset,
+                state=OperationState.READY,
+                message="Queued",
+                params={
+                    "uri": intake.uri,
+                    "name": intake.name,
+                    "audit": audit.id,
+                    "attributes": attributes,
+                },
+            )
         except Exception as e:
-            raise APIAbort(
-                HTTPStatus.BAD_REQUEST, f"Unable to retrieve relay tarball: {str(e)!r}"
-            ) from e
+            raise APIInternalError("Unable to queue the relay transfer") from e
+
+        status = url_for(
+            "datasets_metadata",
+            dataset=dataset.resource_id,
+            metadata="dataset.operations",
+        )
+        response = jsonify({"message": "relay queued", "status": status})
+        response.status_code = HTTPStatus.ACCEPTED
+        response.headers["Location"] = status
+        return response
 
     def _post(self, args: ApiParams, request: Request, context: ApiContext) -> Response:
         """Launch the Relay operation from an HTTP POST"""
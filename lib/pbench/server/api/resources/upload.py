@@ -1,6 +1,16 @@
+import datetime
+import fcntl
 from http import HTTPStatus
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import tempfile
+import time
+from typing import IO, NamedTuple, Optional
 
-from flask import Response
+from flask import current_app, jsonify, Response
 from flask.wrappers import Request
 
 from pbench.server import PbenchServerConfig
@@ -8,6 +18,7 @@ from pbench.server.api.resources import (
     APIAbort,
     ApiAuthorizationType,
     ApiContext,
+    APIInternalError,
     ApiMethod,
     ApiParams,
     ApiSchema,
@@ -16,12 +27,306 @@ from pbench.server.api.resources import (
     Schema,
 )
 from pbench.server.api.resources.intake_base import Access, Intake, IntakeBase
+import pbench.server.auth.auth as Auth
 from pbench.server.database.models.audit import AuditType, OperationCode
-from pbench.server.database.models.datasets import Dataset
+from pbench.server.database.models.datasets import Dataset, DatasetNotFound
+from pbench.server.database.models.users import User
+
+
+class Chunk(NamedTuple):
+    """A byte range of a tarball, from `start` up to and including `end`."""
+
+    start: int
+    end: int
+
+
+class UploadSession:
+    """The chunks received so far of a tarball uploaded in pieces.
+
+    A client can upload a large tarball as a series of chunks, each a PUT of
+    a byte range of the file given by a "Content-Range" header. The chunks
+    may be sent in any order, concurrently, and again after a failure; once
+    every byte of the tarball has been received, the request which completed
+    the set completes the upload.
+
+    A session is identified by the MD5 of the tarball (which is also the
+    resource ID of the dataset), and is kept in a directory of the server's
+    upload area. It holds a "session.json" file recording the tarball's name
+    and size and the user uploading it, and a file for each chunk, named for
+    its byte range.
+
+    As each chunk arrives, any chunks which continue the start of the tarball
+    are appended to a "data" file, so that the tarball is assembled as soon
+    as the last chunk arrives. The length of the data is kept in a "state"
+    file.
+    """
+
+    INFO = "session.json"
+    DATA = "data"
+    STATE = "state"
+    LOCK = "lock"
+    ASSEMBLING = "assembling"
+    CHUNK_NAME = re.compile(r"(\d+)-(\d+)")
+
+    def __init__(self, temporary: Path, md5: str):
+        """Identify the session of a tarball
+
+        Args:
+            temporary: The server's upload directory
+            md5: The MD5 of the tarball
+        """
+        self.md5 = md5
+        self.path = temporary / f"{md5}.chunks"
+        self.claimed: Optional[IO[str]] = None
+
+    @classmethod
+    def expire(cls, temporary: Path, max_age: datetime.timedelta) -> list[Path]:
+        """Remove the sessions which haven't received a chunk for too long.
+
+        Saving a chunk changes the session directory, so its modification time
+        is the time the last chunk was received.
+
+        Args:
+            temporary: The server's upload directory
+            max_age: The time after which an idle session is abandoned
+
+        Returns:
+            The paths of the sessions removed
+        """
+        limit = time.time() - max_age.total_seconds()
+        expired = []
+        for path in temporary.glob("*.chunks"):
+            try:
+                if path.stat().st_mtime < limit:
+                    shutil.rmtree(path)
+                    expired.append(path)
+            except FileNotFoundError:
+                pass
+        return expired
+
+    def info(self) -> Optional[dict]:
+        """Return the session information, or None if there's no session
+
+        Returns:
+            A dict with the tarball "name", "size", and uploading "user"
+        """
+        try:
+            return json.loads((self.path / self.INFO).read_text())
+        except FileNotFoundError:
+            return None
+
+    def open(self, name: str, size: int, user: User):
+        """Find or start the session for the upload of a tarball by a user,
+        checking that it matches any existing session.
+
+        Args:
+            name: The tarball name
+            size: The tarball size
+            user: The uploading user
+
+        Raises:
+            APIAbort if the session belongs to another user or another file
+        """
+        self.path.mkdir(exist_ok=True)
+        info = {"name": name, "size": size, "user": user.id}
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".")
+        with os.fdopen(fd, "w") as fp:
+            json.dump(info, fp)
+        try:
+            # Linking fails if another request has already started the
+            # session, so this is atomic.
+            os.link(tmp, self.path / self.INFO)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+        current = self.info()
+        if current["user"] != user.id:
+            raise APIAbort(
+                HTTPStatus.FORBIDDEN,
+                f"An upload of {self.md5} by another user is in progress",
+            )
+        if current != info:
+            raise APIAbort(
+                HTTPStatus.BAD_REQUEST,
+                f"An upload of {current['name']} ({current['size']} bytes) with"
+                f" MD5 {self.md5} is in progress",
+            )
+
+    def chunks(self) -> list[Chunk]:
+        """Return the chunks received but not yet assembled, sorted by
+        position."""
+        chunks = []
+        for file in self.path.iterdir():
+            match = self.CHUNK_NAME.fullmatch(file.name)
+            if match:
+                chunks.append(Chunk(int(match.group(1)), int(match.group(2))))
+        return sorted(chunks)
+
+    def received(self) -> list[Chunk]:
+        """Return the byte ranges received so far, merging adjacent and
+        overlapping chunks."""
+        length = self._load()
+        ranges: list[Chunk] = [Chunk(0, length - 1)] if length else []
+        for chunk in self.chunks():
+            if ranges and chunk.start <= ranges[-1].end + 1:
+                if chunk.end > ranges[-1].end:
+                    ranges[-1] = Chunk(ranges[-1].start, chunk.end)
+            else:
+                ranges.append(chunk)
+        return ranges
+
+    def write(self, chunk: Chunk, stream: IO[bytes]):
+        """Save a chunk, and assemble it with any others which now continue
+        the start of the tarball.
+
+        The chunk is written under a temporary name and renamed into place
+        only when it's complete.
+
+        Args:
+            chunk: The byte range
+            stream: The chunk data
+
+        Raises:
+            APIAbort if the stream doesn't hold the whole chunk
+        """
+        length = chunk.end - chunk.start + 1
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as ofp:
+                received = 0
+                while received <= length:
+                    data = stream.read(IntakeBase.CHUNK_SIZE)
+                    if not data:
+                        break
+                    received += len(data)
+                    ofp.write(data)
+            if received != length:
+                raise APIAbort(
+                    HTTPStatus.BAD_REQUEST,
+                    f"Expected {length} bytes but received {received} bytes",
+                )
+            os.rename(tmp, self._chunk_path(chunk))
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+        self._assemble()
+
+    def claim(self) -> bool:
+        """Claim the right to complete the upload, which only one request may
+        do.
+
+        The claim is a lock on the "assembling" file, which is held until it's
+        released, or the session removed; if the server process dies while
+        completing the upload, the lock is dropped, and a later request can
+        complete the upload.
+
+        Returns:
+            True if this request should complete the upload
+        """
+        try:
+            claimed = (self.path / self.ASSEMBLING).open("w")
+        except FileNotFoundError:
+            # Another request has completed the upload
+            return False
+        try:
+            fcntl.flock(claimed, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            claimed.close()
+            return False
+        self.claimed = claimed
+        return True
+
+    def release(self):
+        """Release the claim to complete the upload, so that the upload can be
+        completed by a later request."""
+        if self.claimed:
+            self.claimed.close()
+            self.claimed = None
+
+    def access(self) -> Access:
+        """Return how to read the assembled tarball.
+
+        Returns:
+            An Access object giving the path of the assembled data
+        """
+        return Access(self._load(), None, path=self.path / self.DATA)
+
+    def remove(self):
+        """Remove the session."""
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.release()
+
+    def _chunk_path(self, chunk: Chunk) -> Path:
+        return self.path / f"{chunk.start}-{chunk.end}"
+
+    def _load(self) -> int:
+        """Return the length of the assembled data."""
+        try:
+            return int((self.path / self.STATE).read_text())
+        except FileNotFoundError:
+            return 0
+
+    def _save(self, length: int):
+        """Record the length of the assembled data.
+
+        Args:
+            length: The length of the data
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".")
+        with os.fdopen(fd, "w") as fp:
+            fp.write(str(length))
+        os.rename(tmp, self.path / self.STATE)
+
+    def _assemble(self):
+        """Append the chunks which continue the assembled data.
+
+        The first chunk is simply renamed to become the data; each chunk is
+        removed once it has been assembled. If a request fails part way
+        through, the data is truncated to the length last recorded. Once the
+        whole tarball has been assembled, the data is left alone, as it may
+        have been moved away by the request completing the upload.
+        """
+        with (self.path / self.LOCK).open("w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            length = self._load()
+            if length >= self.info()["size"]:
+                return
+            data = self.path / self.DATA
+            if data.exists():
+                os.truncate(data, length)
+            elif length:
+                # The data has been lost, so start again.
+                length = 0
+                self._save(length)
+            for chunk in self.chunks():
+                if chunk.start > length:
+                    break
+                file = self._chunk_path(chunk)
+                if chunk.end >= length:
+                    if length:
+                        with file.open("rb") as ifp, data.open("ab") as ofp:
+                            ifp.seek(length - chunk.start)
+                            shutil.copyfileobj(ifp, ofp, IntakeBase.CHUNK_SIZE)
+                    else:
+                        file.rename(data)
+                    length = chunk.end + 1
+                    self._save(length)
+                file.unlink(missing_ok=True)
 
 
 class Upload(IntakeBase):
-    """Accept a dataset from a client"""
+    """Accept a dataset from a client
+
+    A tarball can be uploaded by a single PUT of the whole file, or, by giving
+    a "Content-Range" header, in a series of chunks (see UploadSession). The
+    GET method reports the progress of a chunked upload, so that a client can
+    resume an interrupted upload by sending only the missing chunks.
+    """
+
+    CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+    # The default number of hours before an idle chunked upload is abandoned
+    SESSION_MAX_AGE_HOURS = 24
 
     def __init__(self, config: PbenchServerConfig):
         super().__init__(
@@ -43,6 +348,21 @@ class Upload(IntakeBase):
                 audit_name="upload",
                 authorization=ApiAuthorizationType.NONE,
             ),
+            ApiSchema(
+                ApiMethod.GET,
+                OperationCode.READ,
+                uri_schema=Schema(Parameter("filename", ParamType.STRING)),
+                query_schema=Schema(Parameter("md5", ParamType.STRING, required=True)),
+                audit_type=AuditType.NONE,
+                authorization=ApiAuthorizationType.NONE,
+            ),
+        )
+        self.session_max_age = datetime.timedelta(
+            hours=config.getint(
+                "pbench-server",
+                "upload-session-max-age-hours",
+                fallback=self.SESSION_MAX_AGE_HOURS,
+            )
         )
 
     def _identify(self, args: ApiParams, request: Request) -> Intake:
@@ -85,6 +405,7 @@ class Upload(IntakeBase):
                 HTTPStatus.BAD_REQUEST,
                 "Missing required 'Content-MD5' header value",
             )
+        self.check_md5(md5sum)
 
         return Intake(filename, md5sum, access, metadata, uri=None)
 
@@ -93,7 +414,8 @@ class Upload(IntakeBase):
 
         Check that the "Content-Length" header value is not 0.
 
-        The Flask request object provides the input data stream.
+        The Flask request object provides the input data stream; or, for a
+        chunked upload, the upload session provides the assembled tarball.
 
         Args:
             intake: The Intake parameters produced by _identify
@@ -105,6 +427,9 @@ class Upload(IntakeBase):
         Raises:
             APIAbort on failure
         """
+        if "Content-Range" in request.headers:
+            session = UploadSession(self.temporary, intake.md5)
+            return session.access()
         try:
             length_string = request.headers["Content-Length"]
             content_length = int(length_string)
@@ -129,4 +454,144 @@ class Upload(IntakeBase):
 
     def _put(self, args: ApiParams, request: Request, context: ApiContext) -> Response:
         """Launch the upload operation from an HTTP PUT"""
+        if "Content-Range" in request.headers:
+            return self._put_chunk(args, request, context)
         return self._intake(args, request, context)
+
+    @staticmethod
+    def _session_response(
+        session: UploadSession, message: str, status: HTTPStatus
+    ) -> Response:
+        """Report the progress of a chunked upload
+
+        Args:
+            session: The upload session
+            message: A message for the client
+            status: The HTTP status
+
+        Returns:
+            A Response giving the tarball size and the byte ranges received
+        """
+        info = session.info()
+        response = jsonify(
+            {
+                "message": message,
+                "size": info["size"] if info else None,
+                "received": session.received() if info else [],
+            }
+        )
+        response.status_code = status
+        return response
+
+    def _put_chunk(
+        self, args: ApiParams, request: Request, context: ApiContext
+    ) -> Response:
+        """Accept one chunk of a tarball uploaded in pieces
+
+        The client gives the byte range of the chunk in a "Content-Range"
+        header, as "bytes <start>-<end>/<size>". Every chunk must carry the
+        same "Content-MD5" value, the MD5 of the whole tarball, and the same
+        query parameters.
+
+        If the upload is still incomplete, we return 202 (ACCEPTED) along with
+        the byte ranges received so far. The request which completes the
+        upload assembles the tarball and returns the result of the upload.
+
+        Args:
+            args: API parameters
+            request: The original Request object
+            context: API context dictionary
+
+        Returns:
+            A Response
+        """
+        user = Auth.token_auth.current_user()
+        if not user:
+            raise APIAbort(HTTPStatus.UNAUTHORIZED, "Verifying user_id failed")
+        intake = self._identify(args, request)
+        self.check_filename(intake.name)
+        match = self.CONTENT_RANGE.fullmatch(request.headers["Content-Range"])
+        if not match:
+            raise APIAbort(
+                HTTPStatus.BAD_REQUEST,
+                f"Invalid 'Content-Range' header {request.headers['Content-Range']!r}",
+            )
+        start, end, size = (int(g) for g in match.groups())
+        if start > end or end >= size:
+            raise APIAbort(
+                HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                f"Invalid 'Content-Range' header {request.headers['Content-Range']!r}",
+            )
+        try:
+            duplicate = Dataset.query(resource_id=intake.md5)
+        except DatasetNotFound:
+            pass
+        else:
+            if not self.check_duplicate(duplicate):
+                response = jsonify(dict(message="Dataset already exists"))
+                response.status_code = HTTPStatus.OK
+                return response
+
+        for path in UploadSession.expire(self.temporary, self.session_max_age):
+            current_app.logger.info("Removed abandoned upload session {}", path)
+
+        session = UploadSession(self.temporary, intake.md5)
+        try:
+            session.open(intake.name, size, user)
+            session.write(Chunk(start, end), request.stream)
+        except OSError as e:
+            raise APIInternalError(
+                f"Unable to save chunk {start}-{end} of {intake.name}: {e}"
+            ) from e
+        if session.received() != [Chunk(0, size - 1)]:
+            return self._session_response(
+                session, "Chunk received", HTTPStatus.ACCEPTED
+            )
+        if not session.claim():
+            return self._session_response(
+                session, "Upload is being completed", HTTPStatus.ACCEPTED
+            )
+
+        # We have the whole tarball: pass it through the normal upload path,
+        # which will check its MD5 and move it into place. If there's something
+        # wrong with the data, the client will need to start again; but after
+        # an internal error, we keep the session so that the client can
+        # complete the upload by sending any chunk again.
+        try:
+            response = self._intake(args, request, context)
+        except APIInternalError:
+            session.release()
+            raise
+        except Exception:
+            session.remove()
+            raise
+        session.remove()
+        return response
+
+    def _get(self, args: ApiParams, request: Request, context: ApiContext) -> Response:
+        """Report the progress of a chunked upload
+
+        GET /api/v1/upload/<filename>?md5=<md5>
+
+        Args:
+            args: API parameters
+                URI parameters: filename
+                Query parameters: md5 of the tarball
+            request: The original Request object
+            context: API context dictionary
+
+        Returns:
+            A Response giving the tarball size and the byte ranges received
+        """
+        user = Auth.token_auth.current_user()
+        if not user:
+            raise APIAbort(HTTPStatus.UNAUTHORIZED, "Verifying user_id failed")
+        self.check_md5(args.query["md5"])
+        session = UploadSession(self.temporary, args.query["md5"])
+        info = session.info()
+        if not info or info["user"] != user.id or info["name"] != args.uri["filename"]:
+            raise APIAbort(
+                HTTPStatus.NOT_FOUND,
+                f"No upload of {args.uri['filename']} is in progress",
+            )
+        return self._session_response(session, "Upload in progress", HTTPStatus.OK)
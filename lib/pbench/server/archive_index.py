@@ -0,0 +1,520 @@
+"""Random access to the members of a compressed tarball.
+
+Extracting a member with `tarfile` means decompressing the tarball from
+its start, and, since `TarFile.getmember` loads the full list of members,
+all the way to its end. An `ArchiveIndex` records where the data of each
+member lies in the uncompressed tar stream, so that we can go straight to
+it.
+
+The xz format carries its own index of the compressed blocks in a stream,
+which tells us where each block starts in the file and which part of the
+uncompressed data it holds: with that we only decompress the blocks which
+hold the member. (The Pbench Agent compresses tarballs with `xz -T0`, which
+writes a multi-block stream.) When there is no usable block index, we fall
+back to decompressing from the start, but only as far as the end of the
+member.
+
+The Pbench Agent can also be configured to compress tarballs with zstd,
+which `tarfile` can't read, or not to compress them at all. We read a zstd
+tarball through a `zstd` decompression process, from the start of the
+stream to the end of the member, and we read the member of an uncompressed
+tarball directly.
+"""
+
+from contextlib import contextmanager
+import io
+import json
+import lzma
+import os
+from pathlib import Path
+import subprocess
+import tarfile
+from typing import BinaryIO, IO, Iterator, NamedTuple, Optional
+import zlib
+
+from pbench.common.compression import tarball_codec
+
+# The size of the chunks in which we read and decompress data
+_CHUNK = 256 * 1024
+
+_XZ_HEADER_MAGIC = b"\xfd7zXZ\x00"
+_XZ_FOOTER_MAGIC = b"YZ"
+_XZ_HEADER_SIZE = 12
+_XZ_FOOTER_SIZE = 12
+
+
+class XzBlock(NamedTuple):
+    """The location of a compressed block within an xz file.
+
+    Attributes:
+        offset: the offset of the block in the file
+        length: the length of the block in the file, including padding
+        start: the offset of the block's data in the uncompressed stream
+        size: the length of the block's uncompressed data
+    """
+
+    offset: int
+    length: int
+    start: int
+    size: int
+
+
+def _varint(buf: bytes, pos: int) -> tuple[int, int]:
+    """Decode an xz variable length integer.
+
+    Args:
+        buf: the encoded data
+        pos: the position of the integer within the data
+
+    Returns:
+        A tuple of the value and the position following it
+    """
+    value = 0
+    for i in range(9):
+        byte = buf[pos + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, pos + i + 1
+    raise ValueError("bad xz variable length integer")
+
+
+def read_xz_blocks(fp: BinaryIO) -> Optional[list[XzBlock]]:
+    """Read the block index of an xz file.
+
+    We only handle files holding a single xz stream (optionally followed by
+    stream padding), which is what `xz` writes.
+
+    Args:
+        fp: the xz file, opened for binary reading
+
+    Returns:
+        The list of blocks, or None if the file isn't a single xz stream
+    """
+    header = fp.read(_XZ_HEADER_SIZE)
+    if len(header) != _XZ_HEADER_SIZE or not header.startswith(_XZ_HEADER_MAGIC):
+        return None
+    end = fp.seek(0, os.SEEK_END)
+    while end >= _XZ_HEADER_SIZE + _XZ_FOOTER_SIZE + 4:
+        fp.seek(end - 4)
+        if fp.read(4) != b"\0\0\0\0":
+            break
+        end -= 4
+    fp.seek(end - _XZ_FOOTER_SIZE)
+    footer = fp.read(_XZ_FOOTER_SIZE)
+    if footer[10:] != _XZ_FOOTER_MAGIC or footer[8:10] != header[6:8]:
+        return None
+    index_size = (int.from_bytes(footer[4:8], "little") + 1) * 4
+    index_start = end - _XZ_FOOTER_SIZE - index_size
+    if index_start < _XZ_HEADER_SIZE:
+        return None
+    fp.seek(index_start)
+    index = fp.read(index_size)
+    if index[0] != 0 or zlib.crc32(index[:-4]) != int.from_bytes(index[-4:], "little"):
+        return None
+    count, pos = _varint(index, 1)
+    blocks = []
+    offset = _XZ_HEADER_SIZE
+    start = 0
+    for _ in range(count):
+        unpadded, pos = _varint(index, pos)
+        size, pos = _varint(index, pos)
+        length = (unpadded + 3) & ~3
+        blocks.append(XzBlock(offset, length, start, size))
+        offset += length
+        start += size
+
+    # If the blocks don't exactly fill the space up to the index, then this
+    # is a concatenation of streams, and the index describes only the last.
+    if offset != index_start:
+        return None
+    return blocks
+
+
+def _xz_block_chunks(
+    fp: BinaryIO, header: bytes, blocks: list[XzBlock], offset: int, size: int
+) -> Iterator[bytes]:
+    """Generate the uncompressed data in a range of an xz stream, only
+    decompressing the blocks which hold it.
+
+    Each block is decoded independently by prefixing it with the stream
+    header, which makes it look like the first block of a stream.
+
+    Args:
+        fp: the xz file, opened for binary reading
+        header: the stream header of the file
+        blocks: the block index of the file
+        offset: the start of the range in the uncompressed stream
+        size: the length of the range
+
+    Returns:
+        A generator of chunks of uncompressed data
+    """
+    end = offset + size
+    for block in blocks:
+        if block.start + block.size <= offset:
+            continue
+        if block.start >= end:
+            break
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        fp.seek(block.offset)
+        remaining = block.length
+        pending = header
+        pos = block.start
+        stop = min(end, block.start + block.size)
+        while pos < stop:
+            if decompressor.needs_input:
+                chunk = fp.read(min(_CHUNK, remaining))
+                if not chunk:
+                    raise EOFError(f"xz block at {block.offset} is truncated")
+                remaining -= len(chunk)
+                data = pending + chunk
+                pending = b""
+            else:
+                data = b""
+            out = decompressor.decompress(data, _CHUNK)
+            low = max(offset, pos) - pos
+            high = min(stop, pos + len(out)) - pos
+            if low < high:
+                yield out[low:high]
+            pos += len(out)
+
+
+def _range_chunks(stream: BinaryIO, offset: int, size: int) -> Iterator[bytes]:
+    """Generate the data in a range of a stream, seeking to the start of the
+    range if the stream allows it, and otherwise reading up to it.
+
+    Args:
+        stream: the stream, opened for binary reading
+        offset: the start of the range in the stream
+        size: the length of the range
+
+    Returns:
+        A generator of chunks of data
+    """
+    stop = offset + size
+    if stream.seekable():
+        stream.seek(offset)
+    else:
+        while offset > 0:
+            skipped = len(stream.read(min(_CHUNK, offset)))
+            if not skipped:
+                raise EOFError(f"stream ends before {stop}")
+            offset -= skipped
+    while size > 0:
+        chunk = stream.read(min(_CHUNK, size))
+        if not chunk:
+            raise EOFError(f"stream ends before {stop}")
+        size -= len(chunk)
+        yield chunk
+
+
+def _linear_chunks(fp: BinaryIO, offset: int, size: int) -> Iterator[bytes]:
+    """Generate the uncompressed data in a range of an xz file by
+    decompressing it from the start.
+
+    Args:
+        fp: the xz file, opened for binary reading
+        offset: the start of the range in the uncompressed stream
+        size: the length of the range
+
+    Returns:
+        A generator of chunks of uncompressed data
+    """
+    with lzma.open(fp) as stream:
+        yield from _range_chunks(stream, offset, size)
+
+
+def _zstd_chunks(tarball: Path, offset: int, size: int) -> Iterator[bytes]:
+    """Generate the uncompressed data in a range of a zstd file by
+    decompressing it from the start with a `zstd` process.
+
+    Args:
+        tarball: the zstd file path
+        offset: the start of the range in the uncompressed stream
+        size: the length of the range
+
+    Returns:
+        A generator of chunks of uncompressed data
+    """
+    with subprocess.Popen(
+        ["zstd", "-dcq", str(tarball)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ) as zstd:
+        try:
+            yield from _range_chunks(zstd.stdout, offset, size)
+        finally:
+            zstd.kill()
+
+
+@contextmanager
+def open_tarball(tarball: Path) -> Iterator[tarfile.TarFile]:
+    """Open a tarball to read its members in order, like `tarfile.open`.
+
+    A zstd tarball is read as a stream from a `zstd` process, so its members
+    can't be extracted out of order.
+
+    Args:
+        tarball: the tarball path
+
+    Returns:
+        A context manager yielding a TarFile
+    """
+    codec = tarball_codec(tarball)
+    if codec is None or codec.name != "zstd":
+        with tarfile.open(tarball, "r:*") as tar:
+            yield tar
+        return
+    with subprocess.Popen(
+        ["zstd", "-dcq", str(tarball)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ) as zstd:
+        try:
+            with tarfile.open(fileobj=zstd.stdout, mode="r|") as tar:
+                yield tar
+        finally:
+            zstd.kill()
+
+
+def extract_member(tarball: Path, name: str) -> Optional[IO[bytes]]:
+    """Read a member of a tarball by reading the tarball in order, like
+    `TarFile.extractfile`.
+
+    This is for the members which aren't in an archive index (e.g., sparse
+    files). It works for any tarball which `open_tarball` can read, and reads
+    only as far as the member, but since a zstd tarball can't be read out of
+    order the member's data is returned in memory.
+
+    Args:
+        tarball: the tarball path
+        name: the name of the member
+
+    Raises:
+        KeyError if the tarball has no such member
+
+    Returns:
+        A binary stream of the member's data, or None if the member doesn't
+        have data
+    """
+    with open_tarball(tarball) as tar:
+        for member in tar:
+            if member.name != name:
+                continue
+            stream = tar.extractfile(member)
+            if stream is None:
+                return None
+            with stream:
+                return io.BytesIO(stream.read())
+    raise KeyError(f"{name} is not a member of {tarball.name}")
+
+
+class _ChunkReader(io.RawIOBase):
+    """A readable binary stream over a generator of chunks, which closes the
+    underlying file when it's closed."""
+
+    def __init__(self, chunks: Iterator[bytes], fp: BinaryIO):
+        self.chunks = chunks
+        self.fp = fp
+        self.buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        count = min(len(b), len(self.buffer))
+        b[:count] = self.buffer[:count]
+        self.buffer = self.buffer[count:]
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.chunks.close()
+            self.fp.close()
+        super().close()
+
+
+class ArchiveIndex:
+    """An index of the locations of the members of a tarball.
+
+    The index maps each member name to the offset and size of its data in
+    the uncompressed tar stream, or to None for a member which has no data
+    (such as a directory). A symlink or hard link to a regular file maps to
+    the data of that file.
+
+    Sparse files, which don't have a simple location, are left out of the
+    index.
+
+    The index also describes every member, in archive order, by its type,
+    size, and link target, which is enough to answer questions about the
+    contents of the tarball without reading it.
+    """
+
+    # Version of the format of a saved index; an index with a different
+    # version is ignored and rebuilt.
+    VERSION = 2
+
+    def __init__(
+        self,
+        members: dict[str, Optional[tuple[int, int]]],
+        entries: dict[str, tuple[str, int, str]],
+    ):
+        """Construct an index from a mapping of member names to locations
+
+        Args:
+            members: the location of the data of each member
+            entries: the type, size, and link target of each member
+        """
+        self.members = members
+        self.entries = entries
+
+    @classmethod
+    def build(cls, tarball: Path) -> "ArchiveIndex":
+        """Build the index of a tarball, reading it once from start to end.
+
+        Args:
+            tarball: the tarball path
+
+        Returns:
+            An ArchiveIndex
+        """
+        members: dict[str, Optional[tuple[int, int]]] = {}
+        entries: dict[str, tuple[str, int, str]] = {}
+        links: dict[str, str] = {}
+        with open_tarball(tarball) as tar:
+            for member in tar:
+                entries[member.name] = (
+                    member.type.decode(),
+                    member.size,
+                    member.linkname,
+                )
+                if member.issparse():
+                    continue
+                if member.isreg():
+                    members[member.name] = (member.offset_data, member.size)
+                    continue
+                members[member.name] = None
+                if member.issym():
+                    links[member.name] = os.path.normpath(
+                        os.path.join(os.path.dirname(member.name), member.linkname)
+                    )
+                elif member.islnk():
+                    links[member.name] = member.linkname
+        for name, target in links.items():
+            # Follow chains of links, giving up on loops
+            for _ in range(len(links)):
+                if target not in links:
+                    break
+                target = links[target]
+            members[name] = members.get(target)
+        return cls(members, entries)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ArchiveIndex"]:
+        """Load a saved index.
+
+        Args:
+            path: the index file path
+
+        Returns:
+            An ArchiveIndex, or None if there is no usable saved index
+        """
+        try:
+            saved = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if saved.get("version") != cls.VERSION:
+            return None
+        return cls(
+            {n: tuple(loc) if loc else None for n, loc in saved["members"].items()},
+            {n: tuple(entry) for n, entry in saved["entries"].items()},
+        )
+
+    def save(self, path: Path):
+        """Save the index.
+
+        The index is written under a temporary name and then renamed, so
+        that a concurrent reader never sees a partial index.
+
+        Args:
+            path: the index file path
+        """
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(
+                json.dumps(
+                    {
+                        "version": self.VERSION,
+                        "members": self.members,
+                        "entries": self.entries,
+                    },
+                    separators=(",", ":"),
+                )
+            )
+            tmp.rename(path)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def tar_members(self) -> list[tarfile.TarInfo]:
+        """Describe the members of the tarball, in archive order.
+
+        Returns:
+            A list of TarInfo objects with the name, type, size, and link
+            target of each member
+        """
+        members = []
+        for name, (kind, size, linkname) in self.entries.items():
+            member = tarfile.TarInfo(name)
+            member.type = kind.encode()
+            member.size = size
+            member.linkname = linkname
+            members.append(member)
+        return members
+
+    def open(self, tarball: Path, name: str) -> Optional[IO[bytes]]:
+        """Open a member of the tarball for reading, like
+        `TarFile.extractfile`.
+
+        Args:
+            tarball: the tarball path
+            name: the name of a member which is in the index
+
+        Raises:
+            KeyError if the member isn't in the index
+
+        Returns:
+            A binary stream of the member's data, or None if the member
+            doesn't have data
+        """
+        location = self.members[name]
+        if location is None:
+            return None
+        offset, size = location
+        codec = tarball_codec(tarball)
+        fp = tarball.open("rb")
+        try:
+            if codec is not None and codec.name == "none":
+                chunks = _range_chunks(fp, offset, size)
+            elif codec is not None and codec.name == "zstd":
+                chunks = _zstd_chunks(tarball, offset, size)
+            else:
+                blocks = read_xz_blocks(fp)
+                if blocks is None:
+                    fp.seek(0)
+                    chunks = _linear_chunks(fp, offset, size)
+                else:
+                    fp.seek(0)
+                    header = fp.read(_XZ_HEADER_SIZE)
+                    chunks = _xz_block_chunks(fp, header, blocks, offset, size)
+        except Exception:
+            fp.close()
+            raise
+        return io.BufferedReader(_ChunkReader(chunks, fp))
@@ -1,18 +1,124 @@
+from collections import OrderedDict
+import hashlib
 from http import HTTPStatus
+from threading import Lock
+import time
 from typing import Optional
 
 from flask import current_app, Flask, request
 from flask_httpauth import HTTPTokenAuth
 from flask_restful import abort
+from sqlalchemy.orm import make_transient_to_detached
 
-from pbench.server import PbenchServerConfig
+from pbench.server import JSONOBJECT, PbenchServerConfig
 from pbench.server.auth import OpenIDClient
+from pbench.server.database.database import Database
 from pbench.server.database.models.api_keys import APIKey
 from pbench.server.database.models.users import User
 
+
+class TokenCache:
+    """A bounded cache of the users of recently verified authorization tokens.
+
+    A client generally makes many API calls with the same token, and each
+    would otherwise decode the OIDC token and look up (and update) its user
+    in the database. Instead we remember the user each token was verified
+    for, keyed by a hash of the token so that the tokens themselves aren't
+    kept, for a limited time which never extends past the expiration of the
+    token.
+
+    API keys aren't remembered: an API key can be deleted at any time, and
+    every server process must stop accepting it at once.
+    """
+
+    # Fallback limits of the cache, which we expect to be defined in
+    # pbench-server-default.cfg
+    SIZE = 1024
+    LIFETIME = 60
+
+    def __init__(self, size: int = SIZE, lifetime: int = LIFETIME):
+        """Construct an empty cache.
+
+        Args:
+            size : The maximum number of tokens remembered (0 disables the
+                cache)
+            lifetime : The number of seconds a token is remembered
+        """
+        self.size = size
+        self.lifetime = lifetime
+        self.lock = Lock()
+        self.entries: OrderedDict[bytes, tuple[float, JSONOBJECT]] = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[User]:
+        """Return the user for which the token was verified, if the token is
+        still remembered.
+
+        The User object is attached to the current database session without
+        querying the database.
+
+        Args:
+            token : authorization token string
+
+        Returns:
+            The User object, or None if the token isn't remembered
+        """
+        key = self._key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+            else:
+                if entry:
+                    del self.entries[key]
+                self.counters["misses"] += 1
+                return None
+        user = User(**entry[1])
+        make_transient_to_detached(user)
+        return Database.db_session.merge(user, load=False)
+
+    def put(self, token: str, user: User, expiration: Optional[float] = None):
+        """Remember the user for which a token was verified.
+
+        Args:
+            token : authorization token string
+            user : The token's user
+            expiration : The time (in seconds since the epoch) at which the
+                token expires, if it does
+        """
+        if self.size <= 0 or self.lifetime <= 0:
+            return
+        deadline = time.time() + self.lifetime
+        if expiration:
+            deadline = min(deadline, expiration)
+        columns = {"id": user.id, "username": user.username, "_roles": user._roles}
+        key = self._key(token)
+        with self.lock:
+            self.entries[key] = (deadline, columns)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all tokens."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache counters: the number of "hits" and "misses"."""
+        with self.lock:
+            return dict(self.counters)
+
+
 # Module public
 token_auth = HTTPTokenAuth("Bearer")
 oidc_client: OpenIDClient = None
+token_cache = TokenCache()
 
 
 def setup_app(app: Flask, server_config: PbenchServerConfig):
@@ -25,11 +131,24 @@ def setup_app(app: Flask, server_config: PbenchServerConfig):
     We attempt to construct an OpenID Client object for third party token
     verification if the configuration is provided.
 
+    The cache of verified tokens is sized from the Pbench Server
+    "token-cache-size" and "token-cache-seconds" values.
+
     Args:
         server_config : Parsed Pbench server configuration
     """
     app.secret_key = server_config.get("flask-app", "secret-key")
 
+    global token_cache
+    token_cache = TokenCache(
+        size=server_config.getint(
+            "pbench-server", "token-cache-size", fallback=TokenCache.SIZE
+        ),
+        lifetime=server_config.getint(
+            "pbench-server", "token-cache-seconds", fallback=TokenCache.LIFETIME
+        ),
+    )
+
     global oidc_client
     try:
         oidc_client = OpenIDClient.construct_oidc_client(server_config)
@@ -133,7 +252,13 @@ def verify_auth_oidc(auth_token: str) -> Optional[User]:
     If that fails, it will then attempt to validate it as a Pbench Server API key.
 
     If the token is a valid access token (and not if it is an API key),
-    we will import its contents into the internal user database.
+    we will import its contents into the internal user database, unless the
+    user is already recorded with the same name and roles.
+
+    A verified access token is remembered in the token cache, so that
+    subsequent requests using it need neither be verified nor query the
+    database. An API key is looked up in the database on every request, so
+    that a deleted key is refused by every server process.
 
     Args:
         auth_token : Token to authenticate
@@ -141,16 +266,22 @@ def verify_auth_oidc(auth_token: str) -> Optional[User]:
     Returns:
         User object if the verification succeeds, None on failure.
     """
+    user = token_cache.get(auth_token)
+    if user:
+        return user
+
     try:
         token_payload = oidc_client.token_introspect(token=auth_token)
     except Exception:
         try:
-            return verify_auth_api_key(auth_token)
+            user = verify_auth_api_key(auth_token)
         except Exception:
             current_app.logger.exception(
                 "Unexpected exception occurred while verifying the API key {}",
                 auth_token,
             )
+        else:
+            return user
         raise
     else:
         # Extract what we want to cache from the access token
@@ -165,8 +296,11 @@ def verify_auth_oidc(auth_token: str) -> Optional[User]:
         if not user:
             user = User(id=user_id, username=username, roles=roles)
             user.add()
-        else:
+        elif user.username != username or user.roles != roles:
             user.update(username=username, roles=roles)
+        # The token was verified, so any "exp" claim is a valid number
+        exp = token_payload.get("exp")
+        token_cache.put(auth_token, user, expiration=float(exp) if exp else None)
         return user
 
     return None
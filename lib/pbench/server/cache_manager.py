@@ -1,17 +1,23 @@
 from collections import deque
 from dataclasses import dataclass
 from enum import auto, Enum
+import errno
+import json
 from logging import Logger
+import os
 from pathlib import Path
 import shlex
 import shutil
+import stat
 import subprocess
 import tarfile
-from typing import IO, Optional, Union
+from typing import IO, Iterable, Optional, Union
 
 from pbench.common import MetadataLog, selinux
 from pbench.server import JSONOBJECT, PbenchServerConfig
+from pbench.server.archive_index import ArchiveIndex, extract_member
 from pbench.server.database.models.datasets import Dataset
+from pbench.server.extract_cache import ExtractCache
 from pbench.server.utils import get_tarball_md5
 
 
@@ -173,6 +179,363 @@ def make_cache_object(dir_path: Path, path: Path) -> CacheObject:
     )
 
 
+# Map the file type bits of a stat mode to tarfile member types.
+_TAR_TYPES = {
+    stat.S_IFREG: tarfile.REGTYPE,
+    stat.S_IFDIR: tarfile.DIRTYPE,
+    stat.S_IFLNK: tarfile.SYMTYPE,
+    stat.S_IFIFO: tarfile.FIFOTYPE,
+    stat.S_IFCHR: tarfile.CHRTYPE,
+    stat.S_IFBLK: tarfile.BLKTYPE,
+}
+
+
+def make_tar_members(
+    root: Path, order: Optional[Iterable[str]] = None
+) -> list[tarfile.TarInfo]:
+    """Describe an unpacked tarball tree as the list of tarball members from
+    which it was extracted.
+
+    This allows the indexer to work from the unpacked files without reading
+    (and decompressing) the tarball a second time. The members are listed in
+    the given order, normally the archive order reported by `tar` as it
+    unpacked the tree; any others follow, with directories preceding their
+    contents. As in `tarfile`, a regular file sharing an inode with one
+    listed earlier is recorded as a hard link to it.
+
+    Args:
+        root: the directory into which the tarball was unpacked
+        order: the member names, in archive order
+
+    Returns:
+        A list of TarInfo objects with names relative to the root
+    """
+    found: dict[str, tuple[tarfile.TarInfo, os.stat_result]] = {}
+
+    def walk(directory: Path, prefix: str):
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            st = entry.stat(follow_symlinks=False)
+            member = tarfile.TarInfo(f"{prefix}{entry.name}")
+            member.mode = stat.S_IMODE(st.st_mode)
+            member.mtime = int(st.st_mtime)
+            member.type = _TAR_TYPES.get(stat.S_IFMT(st.st_mode), tarfile.REGTYPE)
+            if member.type == tarfile.SYMTYPE:
+                member.linkname = os.readlink(entry.path)
+            found[member.name] = (member, st)
+            if member.type == tarfile.DIRTYPE:
+                walk(Path(entry.path), f"{member.name}/")
+
+    walk(root, "")
+
+    names: dict[str, None] = {}
+    for name in order or ():
+        name = os.path.normpath(name)
+        if name in found:
+            names[name] = None
+    names.update(dict.fromkeys(found))
+
+    members: list[tarfile.TarInfo] = []
+    inodes: dict[tuple[int, int], str] = {}
+    for name in names:
+        member, st = found[name]
+        if member.type == tarfile.REGTYPE:
+            inode = (st.st_dev, st.st_ino)
+            if st.st_nlink > 1 and inode in inodes:
+                member.type = tarfile.LNKTYPE
+                member.linkname = inodes[inode]
+            else:
+                inodes[inode] = member.name
+                member.size = st.st_size
+        members.append(member)
+    return members
+
+
+def _resolve_member(
+    members: dict[str, tarfile.TarInfo], name: str
+) -> Optional[tarfile.TarInfo]:
+    """Resolve a relative path within a tarball's members the way
+    `Path.resolve(strict=True)` would within the unpacked tree, following
+    symlinks along the way.
+
+    Args:
+        members: the tarball members, keyed by name
+        name: a path relative to the root of the tarball
+
+    Returns:
+        The member at the resolved location, or None if the path doesn't
+        resolve to a member (it's dangling, loops, or escapes the tarball)
+    """
+    parts = deque(Path(name).parts)
+    resolved: list[str] = []
+    hops = 0
+    member = None
+    while parts:
+        part = parts.popleft()
+        if part == ".":
+            continue
+        if part == "..":
+            if not resolved:
+                return None
+            resolved.pop()
+            member = members.get("/".join(resolved)) if resolved else None
+            continue
+        resolved.append(part)
+        member = members.get("/".join(resolved))
+        if member is None:
+            return None
+        if member.issym():
+            hops += 1
+            if hops > 40 or member.linkname.startswith("/"):
+                return None
+            resolved.pop()
+            parts.extendleft(reversed(Path(member.linkname).parts))
+    return member
+
+
+def make_cache_map_from_members(members: list[tarfile.TarInfo]) -> JSONOBJECT:
+    """Build the cache map of a tarball from its list of members, without
+    unpacking it.
+
+    The result has the same form, and the same CacheObject details, as the
+    map which `Tarball.cache_map` builds from the unpacked tree, except that
+    symlinks are never resolved through an absolute link target.
+
+    Args:
+        members: the tarball members
+
+    Returns:
+        The cache map of the tarball
+    """
+    by_name = {m.name.rstrip("/"): m for m in members}
+    cmap: JSONOBJECT = {}
+
+    def node(path: Path) -> JSONOBJECT:
+        """Find (or create) the cache map entry for a path and all its
+        parent directories."""
+        entries = cmap
+        for i, part in enumerate(path.parts):
+            if part not in entries:
+                location = Path(*path.parts[: i + 1])
+                entries[part] = {
+                    "details": CacheObject(
+                        name=part,
+                        location=location,
+                        resolve_path=None,
+                        resolve_type=None,
+                        size=None,
+                        type=CacheType.DIRECTORY,
+                    ),
+                    "children": {},
+                }
+            if i < len(path.parts) - 1:
+                entries = entries[part].setdefault("children", {})
+        return entries[path.parts[-1]]
+
+    for name, member in by_name.items():
+        location = Path(name)
+        details = node(location)["details"]
+        if member.issym():
+            details.type = CacheType.SYMLINK
+            link_path = Path(member.linkname)
+            target = None
+            if not link_path.is_absolute():
+                target = _resolve_member(by_name, str(location.parent / link_path))
+            if target is None:
+                details.resolve_path = link_path
+                details.resolve_type = CacheType.OTHER
+            else:
+                details.resolve_path = Path(target.name.rstrip("/"))
+                if target.isdir():
+                    details.resolve_type = CacheType.DIRECTORY
+                elif target.isfile() or target.islnk():
+                    details.resolve_type = CacheType.FILE
+                else:
+                    details.resolve_type = CacheType.OTHER
+        elif member.islnk():
+            details.type = CacheType.FILE
+            target = by_name.get(member.linkname.rstrip("/"))
+            details.size = target.size if target else member.size
+        elif member.isfile():
+            details.type = CacheType.FILE
+            details.size = member.size
+        elif not member.isdir():
+            details.type = CacheType.OTHER
+
+    # Only directories carry children in a cache map
+    dirs = deque([cmap])
+    while dirs:
+        for entry in dirs.popleft().values():
+            if entry["details"].type == CacheType.DIRECTORY:
+                dirs.append(entry.setdefault("children", {}))
+            else:
+                entry.pop("children", None)
+    return cmap
+
+
+def cache_map_to_manifest(cmap: JSONOBJECT) -> JSONOBJECT:
+    """Convert a cache map to a compact JSON-serializable manifest.
+
+    Names and locations are implied by the nesting of the manifest, and
+    details which are None are omitted.
+
+    Args:
+        cmap: a cache map
+
+    Returns:
+        The manifest of the cache map
+    """
+    manifest = {}
+    for name, entry in cmap.items():
+        details: CacheObject = entry["details"]
+        item = {"type": details.type.name}
+        if details.size is not None:
+            item["size"] = details.size
+        if details.resolve_path is not None:
+            item["resolve_path"] = str(details.resolve_path)
+        if details.resolve_type is not None:
+            item["resolve_type"] = details.resolve_type.name
+        if "children" in entry:
+            item["children"] = cache_map_to_manifest(entry["children"])
+        manifest[name] = item
+    return manifest
+
+
+def cache_map_from_manifest(
+    manifest: JSONOBJECT, parent: Optional[Path] = None
+) -> JSONOBJECT:
+    """Rebuild a cache map from its manifest.
+
+    Args:
+        manifest: a manifest created by `cache_map_to_manifest`
+        parent: the location of the directory containing the manifest's
+            entries, or None for the root
+
+    Returns:
+        The cache map
+    """
+    cmap = {}
+    for name, item in manifest.items():
+        location = parent / name if parent else Path(name)
+        resolve_path = item.get("resolve_path")
+        resolve_type = item.get("resolve_type")
+        entry = {
+            "details": CacheObject(
+                name=name,
+                location=location,
+                resolve_path=Path(resolve_path) if resolve_path is not None else None,
+                resolve_type=CacheType[resolve_type] if resolve_type else None,
+                size=item.get("size"),
+                type=CacheType[item["type"]],
+            )
+        }
+        if "children" in item:
+            entry["children"] = cache_map_from_manifest(item["children"], location)
+        cmap[name] = entry
+    return cmap
+
+
+class TarballIndex:
+    """A persistent index of the locations of the dataset tarballs in the
+    ARCHIVE tree, by resource ID.
+
+    Without it, finding a dataset tarball means reading the MD5 file of each
+    tarball in the ARCHIVE tree until we find the one with the resource ID.
+    Each entry is a symbolic link, named for a resource ID, to the tarball's
+    path relative to the index directory, e.g.,
+
+        INDEX/<resource_id> -> ../<controller>/<name>.tar.xz
+
+    so that entries can be created and removed atomically by any server
+    process without locking, and an entry can be checked simply by
+    following it.
+
+    The index is maintained as tarballs are created, discovered, and deleted;
+    it is an optimization, so failing to update it isn't fatal.
+    """
+
+    # The name of the index directory within the ARCHIVE tree
+    DIRECTORY = "INDEX"
+
+    def __init__(self, archive_root: Path, logger: Logger):
+        """Construct a TarballIndex object
+
+        Args:
+            archive_root: The root of the ARCHIVE tree
+            logger: A Pbench python Logger
+        """
+        self.archive_root = archive_root
+        self.root = archive_root / self.DIRECTORY
+        self.logger = logger
+
+    def _entry(self, resource_id: str) -> Optional[Path]:
+        """Return the path of the index entry for a resource ID, or None if
+        the resource ID can't be the name of an entry.
+        """
+        return self.root / resource_id if resource_id.isalnum() else None
+
+    def find(self, resource_id: str) -> Optional[Path]:
+        """Return the path of the tarball recorded for a resource ID.
+
+        An entry which no longer leads to a tarball is removed.
+
+        Args:
+            resource_id: Dataset resource ID
+
+        Returns:
+            The path of the tarball, or None if there's no valid entry
+        """
+        entry = self._entry(resource_id)
+        if not entry:
+            return None
+        try:
+            link = Path(os.readlink(entry))
+        except OSError:
+            return None
+        path = self.archive_root.joinpath(*link.parts[1:])
+        if link.parts[0] == ".." and path.is_file():
+            return path
+        self.remove(resource_id)
+        return None
+
+    def add(self, resource_id: str, path: Path):
+        """Record the location of a tarball.
+
+        Args:
+            resource_id: Dataset resource ID
+            path: The path of the tarball within the ARCHIVE tree
+        """
+        entry = self._entry(resource_id)
+        if not entry:
+            return
+        link = Path("..") / path.relative_to(self.archive_root)
+        try:
+            if entry.is_symlink() and Path(os.readlink(entry)) == link:
+                return
+            self.root.mkdir(exist_ok=True, mode=0o755)
+            tmp = self.root / f".{resource_id}.{os.getpid()}"
+            tmp.unlink(missing_ok=True)
+            tmp.symlink_to(link)
+            tmp.rename(entry)
+        except Exception as e:
+            self.logger.warning("Unable to index {} at {}: {}", resource_id, path, e)
+
+    def remove(self, resource_id: str):
+        """Remove the entry for a resource ID, if there is one.
+
+        Args:
+            resource_id: Dataset resource ID
+        """
+        entry = self._entry(resource_id)
+        if not entry:
+            return
+        try:
+            entry.unlink(missing_ok=True)
+        except Exception as e:
+            self.logger.warning("Unable to remove index of {}: {}", resource_id, e)
+
+
 class Tarball:
     """Representation of an on-disk tarball.
 
@@ -184,11 +547,15 @@ class Tarball:
     database representations of a dataset.
     """
 
+    # Version of the format of the persistent cache map manifest; a manifest
+    # with a different version is ignored and rebuilt.
+    MANIFEST_VERSION = 1
+
     def __init__(self, path: Path, controller: "Controller"):
         """Construct a `Tarball` object instance
 
         Args:
-            path: The file path to a discovered tarball (.tar.xz file) in the
+            path: The file path to a discovered tarball (e.g., a .tar.xz file) in the
                 configured ARCHIVE directory for a controller.
             controller: The associated Controller object
         """
@@ -213,13 +580,24 @@ class Tarball:
         # Record hierarchy of a Tar ball
         self.cachemap: Optional[JSONOBJECT] = None
 
+        # Record the path of the persistent manifest of the cache map, which
+        # allows answering questions about the tarball's contents without
+        # unpacking it.
+        self.cachemap_path: Path = controller.cache / f"{self.resource_id}.map.json"
+
+        # Record the tarball members, as captured when it was unpacked
+        self.members: Optional[list[tarfile.TarInfo]] = None
+
         # Record the base of the unpacked files for cache management, which
         # is (self.cache / self.name) and will be None when the cache is
         # inactive.
         self.unpacked: Optional[Path] = None
 
         # Record the path of the companion MD5 file
-        self.md5_path: Path = path.with_suffix(".xz.md5")
+        self.md5_path: Path = Path(f"{path}.md5")
+
+        # Record the path of the companion archive index file
+        self.index_path: Path = Tarball.archive_index_path(path)
 
         # Record the name of the containing controller
         self.controller_name: str = controller.name
@@ -230,11 +608,11 @@ class Tarball:
     def check_unpacked(self):
         """Determine whether a tarball has been unpacked.
 
-        Look for the unpacked data root, and record it if found.
+        Look for the unpacked data root, and record it if found (or forget
+        it if it has since been removed).
         """
         unpack = self.cache / self.name
-        if unpack.is_dir():
-            self.unpacked = unpack
+        self.unpacked = unpack if unpack.is_dir() else None
 
     # Most of the "operational" methods below this point should be called only
     # through Controller and/or CacheManager methods, in order to properly manage
@@ -252,8 +630,60 @@ class Tarball:
     #   Remove the unpacked directory tree under CACHE when no longer needed.
     #
     # delete
-    #   Remove the tarball and MD5 file from ARCHIVE after uncaching the
-    #   unpacked directory tree.
+    #   Remove the tarball, MD5 file, and cache map manifest after uncaching
+    #   the unpacked directory tree.
+
+    @staticmethod
+    def _fsync(path: Path):
+        """Flush a file, or the entries of a directory, to stable storage.
+
+        Args:
+            path: The file or directory path
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _import_file(source: Path, directory: Path) -> Path:
+        """Make a file appear, complete and durable, in a directory.
+
+        The UPLOAD directory is in the ARCHIVE tree so that we can normally
+        hard link the file into place rather than copying its data; only if
+        that isn't possible (e.g., the directory is on a different file
+        system) do we copy it, under a temporary name which we link into
+        place once the copy is complete. Either way the link fails, rather
+        than replacing the file, if the destination already exists, and the
+        source file is left for the caller to remove.
+
+        Args:
+            source: The file to import
+            directory: The destination directory
+
+        Raises:
+            FileExistsError if the destination already exists
+
+        Returns:
+            The path of the imported file
+        """
+        destination = directory / source.name
+        Tarball._fsync(source)
+        try:
+            os.link(source, destination)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+                raise
+            tmp = directory / f".{source.name}.{os.getpid()}"
+            try:
+                shutil.copy2(source, tmp)
+                Tarball._fsync(tmp)
+                os.link(tmp, destination)
+            finally:
+                tmp.unlink(missing_ok=True)
+        Tarball._fsync(directory)
+        return destination
 
     @classmethod
     def create(cls, tarball: Path, controller: "Controller") -> "Tarball":
@@ -261,14 +691,16 @@ class Tarball:
 
         This moves a new tarball into the proper place along with the md5
         companion file. It returns the new Tarball object.
+
+        The MD5 file is imported, and made durable, before the tarball, so
+        that even after a crash a tarball in the ARCHIVE tree always has its
+        MD5 file.
         """
 
         # Validate the tarball suffix and extract the dataset name
         name = Dataset.stem(tarball)
 
-        # NOTE: with_suffix replaces only the final suffix, .xz, not the full
-        # standard .tar.xz
-        md5_source = tarball.with_suffix(".xz.md5")
+        md5_source = Path(f"{tarball}.md5")
 
         # If either expected destination file exists, something is wrong
         if (controller.path / tarball.name).exists():
@@ -276,29 +708,33 @@ class Tarball:
         if (controller.path / md5_source.name).exists():
             raise DuplicateTarball(name)
 
-        # Copy the MD5 file first; only if that succeeds, copy the tarball
+        # Import the MD5 file first; only if that succeeds, import the tarball
         # itself.
         try:
-            md5_destination = Path(shutil.copy2(md5_source, controller.path))
+            md5_destination = cls._import_file(md5_source, controller.path)
+        except FileExistsError as e:
+            raise DuplicateTarball(name) from e
         except Exception as e:
             controller.logger.error(
-                "ERROR copying dataset {} ({}) MD5: {}", name, tarball, e
+                "ERROR importing dataset {} ({}) MD5: {}", name, tarball, e
             )
             raise
 
         try:
-            destination = Path(shutil.copy2(tarball, controller.path))
+            destination = cls._import_file(tarball, controller.path)
         except Exception as e:
             try:
                 md5_destination.unlink()
-            except Exception as e:
+            except Exception as exc:
                 controller.logger.error(
-                    "Unable to recover by removing {} MD5 after tarball copy failure: {}",
+                    "Unable to recover by removing {} MD5 after tarball import failure: {}",
                     name,
-                    e,
+                    exc,
                 )
+            if isinstance(e, FileExistsError):
+                raise DuplicateTarball(name) from e
             controller.logger.error(
-                "ERROR copying dataset {} tarball {}: {}", name, tarball, e
+                "ERROR importing dataset {} tarball {}: {}", name, tarball, e
             )
             raise
 
@@ -311,14 +747,38 @@ class Tarball:
             # log it but do not abort
             controller.logger.error("Unable to set SELINUX context for {}: {}", name, e)
 
-        # If we were able to copy both files, remove the originals
+        # Import the archive index, if we have one; it's not essential, as it
+        # will be rebuilt if missing.
+        index_source = Tarball.archive_index_path(tarball)
+        if index_source.exists():
+            try:
+                cls._import_file(index_source, controller.path)
+                index_source.unlink()
+            except Exception as e:
+                controller.logger.warning(
+                    "Unable to import dataset {} archive index: {}", name, e
+                )
+
+        # If we were able to import both files, remove the originals
         try:
             tarball.unlink()
             md5_source.unlink()
         except Exception as e:
             controller.logger.error("Error removing incoming dataset {}: {}", name, e)
 
-        return cls(destination, controller)
+        tarball = cls(destination, controller)
+        controller.index.add(tarball.resource_id, destination)
+
+        # Save the cache map manifest now, from the archive index, so that
+        # we never need to read the tarball to answer questions about its
+        # contents.
+        try:
+            tarball.load_cache_map()
+        except Exception as e:
+            controller.logger.warning(
+                "Unable to build dataset {} cache map manifest: {}", name, e
+            )
+        return tarball
 
     def cache_map(self, dir_path: Path):
         """Builds Hierarchy structure of a Directory in a Dictionary
@@ -346,6 +806,67 @@ class Tarball:
 
         self.cachemap = cmap
 
+    def save_cache_map(self):
+        """Write the cache map to the persistent manifest file.
+
+        The file is written under a temporary name and then renamed so that
+        a reader never sees a partial manifest. Failure is logged, but not
+        fatal, as we can always rebuild the cache map.
+        """
+        tmp = self.cachemap_path.with_name(f"{self.cachemap_path.name}.tmp")
+        try:
+            tmp.write_text(
+                json.dumps(
+                    {
+                        "version": Tarball.MANIFEST_VERSION,
+                        "map": cache_map_to_manifest(self.cachemap),
+                    },
+                    separators=(",", ":"),
+                )
+            )
+            tmp.rename(self.cachemap_path)
+        except Exception as e:
+            self.logger.error(
+                "Unable to save cache map manifest for {}: {}", self.name, e
+            )
+            tmp.unlink(missing_ok=True)
+
+    def load_cache_map(self):
+        """Make sure that the cache map is available.
+
+        Use the persistent manifest if we have one; otherwise build the map
+        from the unpacked tree, if there is one, or from the member list of
+        the tarball's archive index, and save the manifest for next time. We
+        never decompress the tarball here: the manifest is normally saved
+        when the tarball is created or unpacked.
+
+        Raises:
+            TarballUnpackError if there is no source for the cache map
+        """
+        if self.cachemap is not None:
+            return
+        try:
+            manifest = json.loads(self.cachemap_path.read_text())
+            if manifest.get("version") == Tarball.MANIFEST_VERSION:
+                self.cachemap = cache_map_from_manifest(manifest["map"])
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning(
+                "Ignoring bad cache map manifest for {}: {}", self.name, e
+            )
+        if self.unpacked:
+            self.cache_map(self.unpacked)
+        else:
+            index = ArchiveIndex.load(self.index_path)
+            if index is None:
+                raise TarballUnpackError(
+                    self.tarball_path, "No cache map manifest or archive index"
+                )
+            self.cachemap = make_cache_map_from_members(index.tar_members())
+        self.save_cache_map()
+
     @staticmethod
     def traverse_cmap(path: Path, cachemap: dict) -> dict[str, dict]:
         """Sequentially traverses the cachemap to find the leaf of a
@@ -409,6 +930,7 @@ class Tarball:
                 " we expect relative path to the root directory."
             )
 
+        self.load_cache_map()
         c_map = self.traverse_cmap(path, self.cachemap)
         children = c_map["children"] if "children" in c_map else {}
         fd_info = c_map["details"].__dict__.copy()
@@ -428,11 +950,44 @@ class Tarball:
 
         return fd_info
 
+    @staticmethod
+    def archive_index_path(tarball_path: Path) -> Path:
+        """Returns the path of the archive index file of a tarball
+
+        Args:
+            tarball_path: absolute path of the tarball
+        """
+        return Path(f"{tarball_path}.idx")
+
+    @staticmethod
+    def get_archive_index(tarball_path: Path) -> ArchiveIndex:
+        """Returns the archive index of the tarball, building and saving it
+        if it doesn't already exist.
+
+        Args:
+            tarball_path: absolute path of the tarball
+        """
+        index_path = Tarball.archive_index_path(tarball_path)
+        index = ArchiveIndex.load(index_path)
+        if index is None:
+            index = ArchiveIndex.build(tarball_path)
+            try:
+                index.save(index_path)
+            except OSError:
+                # We can't save it, but we can still use it this time.
+                pass
+        return index
+
     @staticmethod
     def extract(tarball_path: Path, path: Path) -> Optional[IO[bytes]]:
         """Returns the file stream which yields the contents of
         a file at the specified path in the Tarball
 
+        The tarball's archive index allows us to decompress only the part of
+        the tarball holding the file; the index is built (from a single pass
+        over the tarball) and saved the first time it's needed, which is
+        normally when the server reads the metadata.log of a new upload.
+
         Args:
             tarball_path: absolute path of the tarball
             path: relative path within the tarball
@@ -441,7 +996,10 @@ class Tarball:
             BadDirpath on failure extracting the file from tarball
         """
         try:
-            return tarfile.open(tarball_path, "r:*").extractfile(path)
+            index = Tarball.get_archive_index(tarball_path)
+            if str(path) in index:
+                return index.open(tarball_path, str(path))
+            return extract_member(tarball_path, str(path))
         except Exception as exc:
             raise BadDirpath(
                 f"A problem occurred processing {str(path)!r} from {str(tarball_path)!r}: {exc}"
@@ -503,7 +1061,7 @@ class Tarball:
     @staticmethod
     def subprocess_run(
         command: str, working_dir: Path, exception: type[CacheManagerError], ctx: Path
-    ):
+    ) -> str:
         """Runs a command as a subprocess.
 
         Args:
@@ -518,6 +1076,9 @@ class Tarball:
             In the event of an error, will raise an instance of the class specified
             by the `exception` parameter, instantiated with the value of the
             `ctx` arguments and an explanatory message.
+
+        Returns:
+            The standard output of the command
         """
         cmd = shlex.split(command)
         try:
@@ -527,6 +1088,7 @@ class Tarball:
                 stdin=subprocess.DEVNULL,
                 capture_output=True,
                 text=True,
+                errors="surrogateescape",
             )
         except Exception as exc:
             raise exception(ctx, str(exc)) from exc
@@ -536,6 +1098,7 @@ class Tarball:
                     ctx,
                     f"{cmd[0]} exited with status {process.returncode}:  {process.stderr.strip()!r}",
                 )
+            return process.stdout
 
     def unpack(self):
         """Unpack a tarball into a temporary directory tree
@@ -559,24 +1122,39 @@ class Tarball:
         self.cache.mkdir(parents=True)
 
         try:
-            tar_command = f"tar -x --no-same-owner --delay-directory-restore --force-local --file='{str(self.tarball_path)}'"
-            self.subprocess_run(
+            # Preserve the modes of the members, so that we can describe
+            # them exactly, and list their names in archive order.
+            tar_command = f"tar -x -v --quoting-style=literal --same-permissions --no-same-owner --delay-directory-restore --force-local --file='{str(self.tarball_path)}'"
+            listing = self.subprocess_run(
                 tar_command, self.cache, TarballUnpackError, self.tarball_path
             )
 
+            # Capture the members of the tarball before we adjust the modes
+            # of the unpacked files below.
+            self.members = make_tar_members(
+                self.cache, listing.splitlines() if listing else None
+            )
+
             find_command = "find . ( -type d -exec chmod ugo+rx {} + ) -o ( -type f -exec chmod ugo+r {} + )"
             self.subprocess_run(
                 find_command, self.cache, TarballModeChangeError, self.cache
             )
         except Exception:
+            self.members = None
             shutil.rmtree(self.cache, ignore_errors=True)
             raise
         self.unpacked = self.cache / self.name
         self.cache_map(self.unpacked)
+        self.save_cache_map()
 
     def uncache(self):
-        """Remove the unpacked tarball directory and all contents."""
+        """Remove the unpacked tarball directory and all contents.
+
+        The cache map manifest is retained, so that we can still describe the
+        contents of the tarball.
+        """
         self.cachemap = None
+        self.members = None
         if self.unpacked:
             try:
                 shutil.rmtree(self.cache)
@@ -592,6 +1170,19 @@ class Tarball:
         files. There's nothing more we can do.
         """
         self.uncache()
+        self.controller.index.remove(self.resource_id)
+        try:
+            self.cachemap_path.unlink(missing_ok=True)
+        except Exception as e:
+            self.logger.error(
+                "cache map manifest unlink for {} failed with {}", self.name, e
+            )
+        try:
+            self.index_path.unlink(missing_ok=True)
+        except Exception as e:
+            self.logger.error(
+                "archive index unlink for {} failed with {}", self.name, e
+            )
         if self.md5_path:
             try:
                 self.md5_path.unlink()
@@ -631,7 +1222,7 @@ class Controller:
         if directory.exists() and not any(directory.iterdir()):
             directory.rmdir()
 
-    def __init__(self, path: Path, cache: Path, logger: Logger):
+    def __init__(self, path: Path, cache: Path, logger: Logger, discover: bool = True):
         """Manage the representation of a controller archive on disk.
 
         In this context, the path parameter refers to a controller directory
@@ -642,6 +1233,8 @@ class Controller:
             path: Controller ARCHIVE directory path
             cache: The base of the cache tree
             logger: Logger object
+            discover: Discover the controller's tarballs; otherwise the
+                controller knows only the tarballs later added to it
         """
         self.logger = logger
 
@@ -654,6 +1247,9 @@ class Controller:
         # Remember the cache tree base
         self.cache = cache
 
+        # The index of tarball locations in the ARCHIVE tree
+        self.index = TarballIndex(path.parent, logger)
+
         # Provide a mapping from Tarball file name to object
         self.tarballs: dict[str, Tarball] = {}
 
@@ -663,22 +1259,37 @@ class Controller:
         # Discover the tarballs that already exist.
         # Depends on instance properties and should remain at the end of the
         # constructor!
-        self._discover_tarballs()
+        if discover:
+            self._discover_tarballs()
 
     def _discover_tarballs(self):
         """Discover the known tarballs
 
         Look in the ARCHIVE tree's controller directory for tarballs, and add
-        them to the known set. We also check for unpacked directories in the
-        CACHE tree matching the resource_id of any tarballs we find in order
-        to link them.
+        them to the known set, making sure that the index records them.
         """
         for file in self.path.iterdir():
             if file.is_file() and Dataset.is_tarball(file):
-                tarball = Tarball(file, self)
-                self.tarballs[tarball.name] = tarball
-                self.datasets[tarball.resource_id] = tarball
-                tarball.check_unpacked()
+                tarball = self.add_tarball(file)
+                self.index.add(tarball.resource_id, file)
+
+    def add_tarball(self, path: Path) -> Tarball:
+        """Add an existing tarball to the known set.
+
+        We also check for an unpacked directory in the CACHE tree matching
+        the resource_id of the tarball in order to link it.
+
+        Args:
+            path: The path of the tarball in the controller directory
+
+        Returns:
+            Tarball object
+        """
+        tarball = Tarball(path, self)
+        self.tarballs[tarball.name] = tarball
+        self.datasets[tarball.resource_id] = tarball
+        tarball.check_unpacked()
+        return tarball
 
     @classmethod
     def create(
@@ -686,12 +1297,14 @@ class Controller:
     ) -> "Controller":
         """Create a new controller directory under the ARCHIVE tree
 
+        The directory may already exist, but we don't discover its tarballs.
+
         Returns:
             Controller object
         """
         controller_dir = options.ARCHIVE / name
         controller_dir.mkdir(exist_ok=True, mode=0o755)
-        return cls(controller_dir, options.CACHE, logger)
+        return cls(controller_dir, options.CACHE, logger, discover=False)
 
     def create_tarball(self, tarfile: Path) -> Tarball:
         """Create a new dataset tarball object under the controller
@@ -757,8 +1370,11 @@ class CacheManager:
         a dataset. Within each ARCHIVE controller directory you'll find:
 
             A set of Pbench Agent dataset results, each comprising a ".tar.xz"
-            tar archive (conventionally referred to as a "tarball") and a
-            ".tar.xz.md5" MD5 file with the same base name.
+            tar archive (conventionally referred to as a "tarball", and which
+            may instead be a zstd compressed ".tar.zst" or an uncompressed
+            ".tar") and a ".tar.xz.md5" MD5 file with the same base name,
+            along with a ".tar.xz.idx" archive index file which records the
+            location of each file within the tarball.
 
     CACHE
 
@@ -772,6 +1388,22 @@ class CacheManager:
         a fully unpacked tarball tree for efficiency). After indexing, these
         directories are deleted, but the cache manager may dynamically unpack
         files or subtrees here during normal operation.
+
+        Alongside these directories, a "<resource_id>.map.json" manifest of
+        each dataset's cache map is kept until the dataset is deleted, so
+        that we can list and check the contents of a dataset without
+        unpacking it again.
+
+        The "EXTRACT" directory holds copies of individual files extracted
+        from dataset tarballs, managed by an ExtractCache.
+
+    The "INDEX" directory of the ARCHIVE tree is a TarballIndex, recording
+    the location of each dataset tarball, so that we can find a dataset
+    without searching the ARCHIVE tree.
+
+    The API server uses a single CacheManager in each (single threaded)
+    server process, returned by CacheManager.get_instance(), which keeps the
+    Tarball objects of the datasets it has most recently found.
     """
 
     # The CacheManager class provides a definition of a directory at the same level
@@ -784,6 +1416,52 @@ class CacheManager:
     # discovery will ignore this directory.
     TEMPORARY = "UPLOAD"
 
+    # The CacheManager class provides a definition of a directory within the
+    # CACHE tree where copies of individual files extracted from tarballs are
+    # kept.
+    EXTRACTED = "EXTRACT"
+
+    # Default limits on the extract cache: the total size, in MiB, and the
+    # number of hours an unused file is kept.
+    EXTRACT_CACHE_SIZE_MB = 1024
+    EXTRACT_CACHE_MAX_AGE_HOURS = 7 * 24
+
+    # The maximum number of datasets remembered by the process-wide instance
+    # (the Tarball objects of recently used datasets hold their cache maps)
+    INSTANCE_DATASETS = 256
+
+    # The process-wide instance returned by get_instance(), and the
+    # configuration for which it was constructed
+    _instance: Optional["CacheManager"] = None
+    _instance_options: Optional[PbenchServerConfig] = None
+
+    @classmethod
+    def get_instance(
+        cls, options: PbenchServerConfig, logger: Logger
+    ) -> "CacheManager":
+        """Return the process-wide CacheManager object, constructing it if
+        necessary.
+
+        Args:
+            options: PbenchServerConfig configuration object
+            logger: A Pbench python Logger
+
+        Returns:
+            The CacheManager object for the configuration
+        """
+        if cls._instance is None or cls._instance_options is not options:
+            instance = cls(options, logger)
+            instance.max_datasets = cls.INSTANCE_DATASETS
+            cls._instance = instance
+            cls._instance_options = options
+        return cls._instance
+
+    @classmethod
+    def clear_instance(cls):
+        """Discard the process-wide CacheManager object."""
+        cls._instance = None
+        cls._instance_options = None
+
     @staticmethod
     def delete_if_empty(directory: Path) -> None:
         """Delete a directory only if it exists and is empty.
@@ -819,6 +1497,31 @@ class CacheManager:
         # Record the root CACHE directory path
         self.cache_root: Path = self.options.CACHE
 
+        # Record the index of tarball locations in the ARCHIVE tree
+        self.index = TarballIndex(self.archive_root, logger)
+
+        # The maximum number of datasets to remember, or None to remember
+        # every dataset found
+        self.max_datasets: Optional[int] = None
+
+        # Keep copies of individually extracted files
+        size_mb = options.getint(
+            "pbench-server",
+            "extract-cache-size-mb",
+            fallback=self.EXTRACT_CACHE_SIZE_MB,
+        )
+        age_hours = options.getint(
+            "pbench-server",
+            "extract-cache-max-age-hours",
+            fallback=self.EXTRACT_CACHE_MAX_AGE_HOURS,
+        )
+        self.extract_cache = ExtractCache(
+            self.cache_root / self.EXTRACTED,
+            max_bytes=size_mb * 1024 * 1024,
+            max_age=age_hours * 60 * 60,
+            logger=logger,
+        )
+
         # Construct an index to refer to discovered controllers
         self.controllers: dict[str, Controller] = {}
 
@@ -874,7 +1577,9 @@ class CacheManager:
             controller: Name of the controller to clean up
         """
         archive = self.options.ARCHIVE / controller
-        if archive.exists() and not any(archive.glob(f"*{Dataset.TARBALL_SUFFIX}")):
+        if archive.exists() and not any(
+            Dataset.is_tarball(f) for f in archive.iterdir()
+        ):
             self.delete_if_empty(archive)
             del self.controllers[controller]
 
@@ -900,20 +1605,77 @@ class CacheManager:
         that represent datasets within them.
         """
         for file in self.archive_root.iterdir():
-            if file.is_dir() and file.name != CacheManager.TEMPORARY:
+            if self._is_controller(file):
                 self._add_controller(file)
 
+    @staticmethod
+    def _is_controller(directory: Path) -> bool:
+        """Determine whether an entry of the ARCHIVE tree is a controller
+        directory.
+
+        Args:
+            directory: A path within the ARCHIVE tree
+
+        Returns:
+            True if the path is a controller directory
+        """
+        return directory.is_dir() and directory.name not in (
+            CacheManager.TEMPORARY,
+            TarballIndex.DIRECTORY,
+        )
+
+    def _add_tarball(self, path: Path) -> Tarball:
+        """Add a single tarball of a controller to the known set, without
+        discovering the controller's other tarballs.
+
+        Args:
+            path: The path of a tarball in a controller directory
+
+        Returns:
+            Tarball object
+        """
+        controller = self.controllers.get(path.parent.name)
+        if not controller:
+            controller = Controller(
+                path.parent, self.options.CACHE, self.logger, discover=False
+            )
+            self.controllers[controller.name] = controller
+        tarball = controller.add_tarball(path)
+        self.tarballs[tarball.name] = tarball
+        self.datasets[tarball.resource_id] = tarball
+        self._evict()
+        return tarball
+
+    def _forget(self, tarball: Tarball):
+        """Remove a tarball from the known set, without touching its files.
+
+        Args:
+            tarball: Tarball object
+        """
+        for known in (self, tarball.controller):
+            if known.datasets.get(tarball.resource_id) is tarball:
+                del known.datasets[tarball.resource_id]
+            if known.tarballs.get(tarball.name) is tarball:
+                del known.tarballs[tarball.name]
+
+    def _evict(self):
+        """Forget the least recently used datasets beyond the maximum number
+        we remember."""
+        if self.max_datasets is None:
+            return
+        while len(self.datasets) > self.max_datasets:
+            self._forget(next(iter(self.datasets.values())))
+
     def find_dataset(self, dataset_id: str) -> Tarball:
-        """Search the ARCHIVE tree for a matching dataset tarball.
+        """Find the dataset tarball with a resource ID.
 
         This will build the Controller and Tarball object for that dataset if
-        they do not already exist.
+        they do not already exist; only the dataset's own tarball is
+        discovered, not the rest of the controller's.
 
-        FIXME: This builds the entire Controller, which will discover all
-        datasets within the controller. This could be streamlined.
-
-        This allows a targeted minimal entry for mutation without discovering
-        the entire tree.
+        The tarball is normally found through the TarballIndex; failing that
+        (e.g., for a dataset created before the index), we search the ARCHIVE
+        tree, adding each tarball we check to the index.
 
         Args:
             dataset_id: The resource ID of a dataset that might exist somewhere
@@ -926,18 +1688,31 @@ class CacheManager:
         Returns:
             A Tarball object representing the dataset that was found.
         """
-        if dataset_id in self.datasets:
-            return self.datasets[dataset_id]
-
-        # The dataset isn't already known; so search for it in the ARCHIVE tree
-        # and (if found) discover the controller containing that dataset.
-        for dir in self.archive_root.iterdir():
-            if dir.is_dir() and dir.name != self.TEMPORARY:
-                for file in dir.glob(f"*{Dataset.TARBALL_SUFFIX}"):
-                    md5 = get_tarball_md5(file)
-                    if md5 == dataset_id:
-                        self._add_controller(dir)
-                        return self.datasets[dataset_id]
+        tarball = self.datasets.get(dataset_id)
+        if tarball:
+            # Another server process may have deleted or uncached the dataset
+            # since we found it.
+            if tarball.tarball_path and tarball.tarball_path.exists():
+                del self.datasets[dataset_id]
+                self.datasets[dataset_id] = tarball
+                tarball.check_unpacked()
+                return tarball
+            self._forget(tarball)
+
+        path = self.index.find(dataset_id)
+        if path:
+            tarball = self._add_tarball(path)
+            if tarball.resource_id == dataset_id:
+                return tarball
+            self.index.remove(dataset_id)
+
+        # The dataset isn't in the index, so search for it in the ARCHIVE tree.
+        for dir in filter(self._is_controller, self.archive_root.iterdir()):
+            for file in filter(Dataset.is_tarball, dir.iterdir()):
+                md5 = get_tarball_md5(file)
+                self.index.add(md5, file)
+                if md5 == dataset_id:
+                    return self._add_tarball(file)
         raise TarballNotFound(dataset_id)
 
     # These are wrappers for controller and tarball operations which need to be
@@ -1006,6 +1781,7 @@ class CacheManager:
         tarball.metadata = metadata
         self.tarballs[tarball.name] = tarball
         self.datasets[tarball.resource_id] = tarball
+        self._evict()
         return tarball
 
     def unpack(self, dataset_id: str) -> Tarball:
@@ -1035,6 +1811,26 @@ class CacheManager:
         tmap = tarball.get_info(path)
         return tmap
 
+    def extract(self, dataset_id: str, path: str) -> Optional[IO[bytes]]:
+        """Return a stream of the contents of a file in a dataset tarball,
+        using the extract cache.
+
+        Args:
+            dataset_id: Dataset resource ID
+            path: path of the file within the tarball
+
+        Raises:
+            TarballNotFound if the dataset isn't found
+            BadDirpath on failure extracting the file
+
+        Returns:
+            A binary stream of the file contents
+        """
+        tarball = self.find_dataset(dataset_id)
+        return self.extract_cache.get(
+            dataset_id, path, lambda: tarball.extract(tarball.tarball_path, path)
+        )
+
     def filestream(self, dataset, target):
         tarball = self.find_dataset(dataset.resource_id)
         return tarball.filestream(target)
@@ -1060,6 +1856,7 @@ class CacheManager:
             tarball = self.find_dataset(dataset_id)
             name = tarball.name
             tarball.controller.delete(dataset_id)
+            self.extract_cache.forget(dataset_id)
             del self.datasets[dataset_id]
             del self.tarballs[name]
             self._clean_empties(tarball.controller_name)
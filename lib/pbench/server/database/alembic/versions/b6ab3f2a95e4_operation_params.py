@@ -0,0 +1,25 @@
+"""Add parameters to dataset operations
+
+Revision ID: b6ab3f2a95e4
+Revises: 1a91bc68d6de
+Create Date: 2026-10-17 10:12:45.301266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b6ab3f2a95e4"
+down_revision = "1a91bc68d6de"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("dataset_operations", sa.Column("params", sa.JSON(), nullable=True))
+    # ### end Alembic commands ###
+
+
+def downgrade() -> None:
+    op.drop_column("dataset_operations", "params")
+    # ### end Alembic commands ###
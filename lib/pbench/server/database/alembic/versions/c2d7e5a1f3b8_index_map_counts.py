@@ -0,0 +1,52 @@
+"""Replace the document ID lists of dataset index maps with counts
+
+The "server.index-map" metadata of a dataset recorded the ID of every
+Elasticsearch document indexed from it, which for a large dataset is tens of
+MB of JSON. The documents of a dataset can instead be found by query (by
+"run.id" or "run_data_parent"), so the map now records only the number of
+documents in each index.
+
+Revision ID: c2d7e5a1f3b8
+Revises: b6ab3f2a95e4
+Create Date: 2026-10-17 11:02:17.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c2d7e5a1f3b8"
+down_revision = "b6ab3f2a95e4"
+branch_labels = None
+depends_on = None
+
+metadata = sa.table(
+    "dataset_metadata",
+    sa.column("id", sa.Integer),
+    sa.column("key", sa.String),
+    sa.column("value", sa.JSON),
+)
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(metadata.c.id, metadata.c.value).where(metadata.c.key == "server")
+    ).all()
+    for id, value in rows:
+        index_map = value.get("index-map") if isinstance(value, dict) else None
+        if not isinstance(index_map, dict):
+            continue
+        value["index-map"] = {
+            index: len(ids) if isinstance(ids, list) else ids
+            for index, ids in index_map.items()
+        }
+        connection.execute(
+            metadata.update().where(metadata.c.id == id).values(value=value)
+        )
+
+
+def downgrade() -> None:
+    # The document IDs are gone: an index map can be rebuilt only by
+    # re-indexing the dataset.
+    pass
@@ -92,6 +92,20 @@ class Database:
             bind=engine.execution_options(isolation_level="SERIALIZABLE")
         )
 
+    @staticmethod
+    def reset_after_fork():
+        """Discard database connections inherited across a fork.
+
+        A forked child process must not use the pooled connections of its
+        parent, so we drop them (without closing the parent's sockets) and
+        forget any inherited session: new connections will be created on
+        demand by the child.
+        """
+        if Database.db_session is None:
+            return
+        Database.db_session.registry.clear()
+        Database.db_session.session_factory.kw["bind"].dispose(close=False)
+
     @staticmethod
     def dump_query(query: Query, logger: Logger, level: int = DEBUG):
         """Dump a fully resolved SQL query if DEBUG logging is enabled
@@ -10,6 +10,7 @@ from sqlalchemy import Column, Enum, event, ForeignKey, Integer, JSON, String, T
 from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Query, relationship, validates
 
+from pbench.common.compression import tarball_codec, tarball_stem, TARBALL_SUFFIXES
 from pbench.server.database.database import Database
 from pbench.server.database.models import TZDateTime
 from pbench.server.database.models.server_settings import (
@@ -33,7 +34,10 @@ class DatasetBadName(DatasetError):
         self.name: str = str(name)
 
     def __str__(self) -> str:
-        return f"File name {self.name!r} does not end in {Dataset.TARBALL_SUFFIX!r}"
+        return (
+            f"File name {self.name!r} does not end in one of"
+            f" {', '.join(repr(s) for s in Dataset.TARBALL_SUFFIXES)}"
+        )
 
 
 class DatasetSqlError(DatasetError):
@@ -324,7 +328,9 @@ class Dataset(Database.Base):
         "Operation", back_populates="dataset", cascade="all, delete-orphan"
     )
 
-    TARBALL_SUFFIX = ".tar.xz"
+    # The suffixes of the tarballs compressed with each of the codecs the
+    # Pbench Agent supports, ".tar.xz" by default.
+    TARBALL_SUFFIXES = TARBALL_SUFFIXES
 
     @staticmethod
     def is_tarball(path: Union[Path, str]) -> bool:
@@ -332,15 +338,15 @@ class Dataset(Database.Base):
         Pbench tarball.
 
         NOTE: The file represented by the path doesn't need to exist, only end
-        with the expected suffix.
+        with one of the expected suffixes.
 
         Args:
             path : file path
 
         Returns:
-            True if path ends with the supported suffix, False if not
+            True if path ends with a supported suffix, False if not
         """
-        return str(path).endswith(Dataset.TARBALL_SUFFIX)
+        return tarball_codec(path) is not None
 
     @staticmethod
     def stem(path: Union[str, Path]) -> str:
@@ -348,25 +354,22 @@ class Dataset(Database.Base):
 
         The Path.stem() removes a single suffix, so our standard "a.tar.xz"
         returns "a.tar" instead of "a". We could double-stem, but instead
-        this just checks for the expected 7 character suffix and strips it.
-
-        If the path does not end in ".tar.xz" then the full path.name is
-        returned.
+        this just checks for one of the expected suffixes and strips it.
 
         Args:
             path: A file path that might be a Pbench tarball
 
         Raises:
-            BadFilename: the path name does not end in TARBALL_SUFFIX
+            DatasetBadName: the path name does not end in one of the
+                TARBALL_SUFFIXES
 
         Returns:
             The stripped "stem" of the dataset
         """
-        p = Path(path)
-        if __class__.is_tarball(p):
-            return p.name[: -len(Dataset.TARBALL_SUFFIX)]
-        else:
-            raise DatasetBadName(p)
+        stem = tarball_stem(path)
+        if stem is None:
+            raise DatasetBadName(Path(path))
+        return stem
 
     @validates("access")
     def validate_access(self, key: str, value: str) -> str:
@@ -422,10 +425,26 @@ class Dataset(Database.Base):
             .filter(Operation.dataset_ref == self.id)
             .all()
         )
+        return self._as_dict(metadata_log, operations, self.owner)
+
+    def _as_dict(
+        self, metadata_log: Optional[JSON], operations: List["Operation"], owner: User
+    ) -> Dict[str, Any]:
+        """Return the dictionary representation of the dataset, given its
+        `metadata.log` data, operations, and owner.
+
+        Args:
+            metadata_log: The value of the dataset's "metalog" Metadata key
+            operations: The dataset's Operation objects
+            owner: The dataset's owning User
+
+        Returns
+            Dictionary representation of the DB object
+        """
         return {
             "access": self.access,
             "name": self.name,
-            "owner": self.owner.username,
+            "owner": owner.username,
             "uploaded": self.uploaded.isoformat(),
             "metalog": metadata_log,
             "operations": {
@@ -517,6 +536,8 @@ class Operation(Database.Base):
         name        Operation name (OperationName enum)
         status      Status of operation (OperationStatus enum)
         message     Message explaining operation status
+        params      Parameters of a queued operation (for example, the new
+                    access of a dataset UPDATE), or None
     """
 
     __tablename__ = "dataset_operations"
@@ -525,6 +546,7 @@ class Operation(Database.Base):
     name = Column(Enum(OperationName), index=True)
     state = Column(Enum(OperationState))
     message = Column(Text)
+    params = Column(JSON, nullable=True)
     dataset_ref = Column(Integer, ForeignKey("datasets.id"))
     dataset = relationship("Dataset", back_populates="operations")
 
@@ -634,17 +656,27 @@ class Metadata(Database.Base):
     # }
     TARBALL_PATH = "server.tarball-path"
 
-    # INDEX_MAP a dict recording the set of MD5 document IDs for each
-    # Elasticsearch index that contains documents for this dataset.
+    # INDEX_MAP a dict recording the number of documents in each
+    # Elasticsearch index that contains documents for this dataset. (The
+    # documents are found by querying the index for the dataset's resource ID
+    # as their "run.id" or "run_data_parent".)
     #
     # {
     #    "server.index-map": {
-    #      "drb.v6.run-data.2021-07": ["MD5"],
-    #      "drb.v6.run-toc.2021-07": ["MD5-1", "MD5-2"]
+    #      "drb.v6.run-data.2021-07": 1,
+    #      "drb.v6.run-toc.2021-07": 2
     #    }
     # }
     INDEX_MAP = "server.index-map"
 
+    # DOCUMENT_IDS the version of the scheme used to construct the IDs of the
+    # Elasticsearch documents indexed from this dataset, so that re-indexing
+    # the dataset generates the same document IDs. (A dataset indexed before
+    # the scheme was versioned doesn't record it, and uses version 1.)
+    #
+    # {"server.document-ids": 2}
+    DOCUMENT_IDS = "server.document-ids"
+
     # --- Standard Metadata keys
 
     # Metadata keys that clients can update
@@ -848,6 +880,118 @@ class Metadata(Database.Base):
             except MetadataNotFound:
                 return None
             value = meta.value
+        return Metadata._getpath(dataset, key, native_key, value, keys)
+
+    @staticmethod
+    def getvalues(
+        datasets: List[Dataset], keys: List[str], user: Optional[User] = None
+    ) -> Dict[int, Dict[str, Optional[JSON]]]:
+        """Returns the values of a list of metadata keys for a list of
+        datasets.
+
+        This gives the same values as calling `getvalue` for each key of each
+        dataset, except that a key which `getvalue` would reject with a
+        MetadataError has the value None. Rather than querying each key of
+        each dataset separately, we fetch the Metadata rows (and, for the
+        "dataset" namespace, the Operation and owning User rows) of all the
+        datasets together, so the number of SQL queries doesn't depend on the
+        number of datasets or keys.
+
+        Args:
+            datasets : associated datasets
+            keys : hierarchical key paths to fetch
+            user : User-specific key value (used only for "user." namespace)
+
+        Raises:
+            MetadataSqlError : SQL error in retrieval
+
+        Returns:
+            A dict mapping the ID of each dataset to a dict of key path values
+        """
+        ids = [d.id for d in datasets]
+        natives = {k.split(".")[0].lower() for k in keys}
+        rows = set(natives)
+        if Metadata.DATASET in natives:
+            rows.discard(Metadata.DATASET)
+            rows.add(Metadata.METALOG)
+        values: Dict[tuple[int, str], JSON] = {}
+        operations: Dict[int, List[Operation]] = {i: [] for i in ids}
+        owners: Dict[str, User] = {}
+        user_ref = user.id if user else None
+        try:
+            if ids and rows:
+                for meta in Database.db_session.query(Metadata).filter(
+                    Metadata.dataset_ref.in_(ids), Metadata.key.in_(rows)
+                ):
+                    # Only the "user" namespace is user-specific
+                    if meta.user_ref == (
+                        user_ref if meta.key == Metadata.USER else None
+                    ):
+                        values[(meta.dataset_ref, meta.key)] = meta.value
+            if ids and Metadata.DATASET in natives:
+                for o in Database.db_session.query(Operation).filter(
+                    Operation.dataset_ref.in_(ids)
+                ):
+                    operations[o.dataset_ref].append(o)
+                for u in Database.db_session.query(User).filter(
+                    User.id.in_({d.owner_id for d in datasets})
+                ):
+                    owners[u.id] = u
+        except SQLAlchemyError as e:
+            Metadata.logger.error(
+                "Can't get {} for {} datasets from DB: {}", keys, len(ids), str(e)
+            )
+            raise MetadataSqlError("getting", None, ",".join(keys)) from e
+
+        result = {}
+        for dataset in datasets:
+            ds_dict = None
+            metadata = {}
+            for key in keys:
+                path = key.split(".")
+                native_key = path.pop(0).lower()
+                if "" in path or not native_key:
+                    metadata[key] = None
+                    continue
+                if native_key == Metadata.DATASET:
+                    if ds_dict is None:
+                        ds_dict = dataset._as_dict(
+                            values.get((dataset.id, Metadata.METALOG)),
+                            operations[dataset.id],
+                            owners[dataset.owner_id],
+                        )
+                    value = ds_dict
+                elif (dataset.id, native_key) in values:
+                    value = values[(dataset.id, native_key)]
+                else:
+                    metadata[key] = None
+                    continue
+                try:
+                    metadata[key] = Metadata._getpath(
+                        dataset, key, native_key, value, path
+                    )
+                except MetadataError:
+                    metadata[key] = None
+            result[dataset.id] = metadata
+        return result
+
+    @staticmethod
+    def _getpath(
+        dataset: Dataset, key: str, native_key: str, value: JSON, keys: List[str]
+    ) -> Optional[JSON]:
+        """Returns the value of a metadata key path within the value of its
+        native key.
+
+        Args:
+            dataset : associated dataset
+            key : full hierarchical key path (for errors)
+            native_key : the native key (the first element of the path)
+            value : value of the native key
+            keys : the rest of the key path
+
+        Returns:
+            Value of the key path
+        """
         name = native_key
         for i in keys:
             # If we have a nested key, and the `value` at this level isn't
@@ -908,7 +1052,7 @@ class Metadata(Database.Base):
                 target = date_parser.parse(v).astimezone(datetime.timezone.utc)
             except date_parser.ParserError as p:
                 raise MetadataBadValue(dataset, key, v, "date/time") from p
-            max_retention = ServerSetting.get(key=OPTION_DATASET_LIFETIME)
+            max_retention = ServerSetting.get_value(key=OPTION_DATASET_LIFETIME)
 
             # If 'dataset' was omitted, then assume the current UTC timestamp.
             base_time = (
@@ -916,7 +1060,7 @@ class Metadata(Database.Base):
                 if dataset
                 else datetime.datetime.now(datetime.timezone.utc)
             )
-            maximum = base_time + datetime.timedelta(days=int(max_retention.value))
+            maximum = base_time + datetime.timedelta(days=int(max_retention))
             if target > maximum:
                 raise MetadataBadValue(
                     dataset, key, v, f"date/time before {maximum:%Y-%m-%d}"
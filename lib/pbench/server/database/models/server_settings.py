@@ -7,7 +7,10 @@ API calls over the life-time of a server deployment.
 The list of available settings are defined by the OPTION_* variables of this
 module.
 """
+import copy
 import re
+from threading import Lock
+import time
 from typing import Optional
 
 from sqlalchemy import Column, Integer, String
@@ -186,6 +189,56 @@ SERVER_SETTINGS_OPTIONS = {
 }
 
 
+class _SettingsCache:
+    """A process-wide cache of the values of the server settings.
+
+    The server state is checked on every API call, so rather than querying
+    the database each time we load all the settings at once and keep them
+    for a few seconds. A change made through ServerSetting in this process
+    invalidates the cache immediately; other processes (e.g., the other
+    gunicorn workers) see the change when their cached values expire.
+    """
+
+    # Fallback lifetime, in seconds, of the cached values, which we expect to
+    # be defined in pbench-server-default.cfg
+    LIFETIME = 5
+
+    def __init__(self):
+        self.lock = Lock()
+        self.values: Optional[JSONOBJECT] = None
+        self.expiration = 0.0
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def lookup(self) -> Optional[JSONOBJECT]:
+        """Return the cached setting values, or None if they've expired."""
+        with self.lock:
+            if self.values is not None and time.monotonic() < self.expiration:
+                self.counters["hits"] += 1
+                return self.values
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, values: JSONOBJECT, lifetime: int):
+        """Cache the setting values for the given number of seconds."""
+        with self.lock:
+            self.values = values
+            self.expiration = time.monotonic() + lifetime
+
+    def invalidate(self):
+        """Discard the cached setting values."""
+        with self.lock:
+            self.values = None
+            self.counters["invalidations"] += 1
+
+    def stats(self) -> dict[str, int]:
+        """Return a copy of the cache counters."""
+        with self.lock:
+            return dict(self.counters)
+
+
+_cache = _SettingsCache()
+
+
 class ServerSetting(Database.Base):
     """A simple key-value store used to manage runtime server settings.
 
@@ -272,6 +325,61 @@ class ServerSetting(Database.Base):
             raise ServerSettingSqlError("finding", key, str(e)) from e
         return setting
 
+    @staticmethod
+    def get_value(key: str) -> JSONVALUE:
+        """Return the value of the specified server setting, or its default
+        value if it has no definition, from the process-wide settings cache.
+
+        This is cheaper than ServerSetting.get, but a change made by another
+        process may not be seen until the cached values expire (after the
+        number of seconds given by the "server-settings-cache-seconds"
+        option of the "pbench-server" configuration section).
+
+        Args:
+            key : Server setting key name
+
+        Raises:
+            ServerSettingSqlError : problem interacting with Database
+
+        Returns:
+            The JSON value of the server setting
+        """
+        values = _cache.lookup()
+        if values is None:
+            try:
+                settings = Database.db_session.query(ServerSetting).all()
+            except SQLAlchemyError as e:
+                raise ServerSettingSqlError("loading", key, str(e)) from e
+            values = {s.key: copy.deepcopy(s.value) for s in settings}
+            lifetime = ServerSetting.config.getint(
+                "pbench-server",
+                "server-settings-cache-seconds",
+                fallback=_SettingsCache.LIFETIME,
+            )
+            _cache.store(values, lifetime)
+            stats = _cache.stats()
+            ServerSetting.logger.debug(
+                "Loaded {} server settings: {} cache hits, {} misses",
+                len(values),
+                stats["hits"],
+                stats["misses"],
+            )
+        value = values[key] if key in values else __class__._default(key)
+        return copy.deepcopy(value)
+
+    @staticmethod
+    def cache_stats() -> dict[str, int]:
+        """Return the counters of the process-wide settings cache: the number
+        of "hits" and "misses" of lookups, and of "invalidations".
+        """
+        return _cache.stats()
+
+    @staticmethod
+    def invalidate_cache():
+        """Discard the values of the process-wide settings cache, so that the
+        next lookup loads them from the database."""
+        _cache.invalidate()
+
     @staticmethod
     def set(key: str, value: JSONVALUE) -> "ServerSetting":
         """Update a ServerSetting key with the specified value.
@@ -309,9 +417,8 @@ class ServerSetting(Database.Base):
             requested access, the entire JSON value is returned and should be
             reported to a caller.
         """
-        state = __class__.get(key=OPTION_SERVER_STATE)
-        if state:
-            value = state.value
+        value = __class__.get_value(key=OPTION_SERVER_STATE)
+        if value:
             status = value[STATE_STATUS_KEY]
             if status == "disabled" or status == "readonly" and not readonly:
                 return value
@@ -363,6 +470,8 @@ class ServerSetting(Database.Base):
             if isinstance(e, IntegrityError):
                 raise self._decode(e) from e
             raise ServerSettingSqlError("adding", self.key, str(e)) from e
+        finally:
+            _cache.invalidate()
 
     def update(self):
         """Update the database row with the modified version of the
@@ -375,3 +484,5 @@ class ServerSetting(Database.Base):
             if isinstance(e, IntegrityError):
                 raise self._decode(e) from e
             raise ServerSettingSqlError("updating", self.key, str(e)) from e
+        finally:
+            _cache.invalidate()
@@ -0,0 +1,347 @@
+"""Background jobs operating on the Elasticsearch documents of datasets.
+
+Changing the access or owner of a dataset, or deleting it, requires updating
+or deleting every Elasticsearch document indexed from it, which for a large
+dataset can take far longer than an API call should. The datasets API
+therefore only validates the request and queues a job, by marking the Sync
+component operation (UPDATE or DELETE) of the dataset READY and recording the
+parameters of the job with it; the `pbench-dataset-jobs` worker then performs
+the queued jobs here, reporting their progress and outcome through the
+operation's state and message (the "dataset.operations" metadata).
+
+The documents of a dataset are found by query: each records the dataset's
+resource ID as its "run.id" or, for a table-of-contents document, its
+"run_data_parent"; the dataset's index map tells us which indices to search,
+and how many documents to expect.
+"""
+
+from collections import defaultdict
+from logging import Logger
+import time
+from typing import Callable, Optional
+
+from elasticsearch import Elasticsearch, VERSION
+
+from pbench.server import JSONOBJECT, OperationCode, PbenchServerConfig
+from pbench.server.cache_manager import CacheManager
+from pbench.server.database.models.audit import Audit, AuditStatus
+from pbench.server.database.models.datasets import (
+    Dataset,
+    Metadata,
+    OperationName,
+    OperationState,
+)
+from pbench.server.sync import Sync
+
+
+class DatasetJobs:
+    """Perform the queued Elasticsearch bulk jobs on datasets.
+
+    Each job is described by the parameters recorded with the READY Sync
+    component operation of the dataset:
+
+        UPDATE  {"access": <new access or None>, "owner": <new owner id or None>}
+        DELETE  {}
+    """
+
+    # The action of each of the queued operations
+    ACTIONS = {OperationName.UPDATE: "update", OperationName.DELETE: "delete"}
+
+    # The Operation API codes for the audit records of each operation
+    CODES = {
+        OperationName.UPDATE: OperationCode.UPDATE,
+        OperationName.DELETE: OperationCode.DELETE,
+    }
+
+    # Minimum interval, in seconds, between progress reports of a job
+    PROGRESS_INTERVAL = 10.0
+
+    # Interval, in seconds, between checks of a job's Elasticsearch task
+    POLL_INTERVAL = 1.0
+
+    # Update the "authorization" subdocument of each document with the
+    # "access" and/or "owner" of the job
+    UPDATE_SCRIPT = (
+        "if (ctx._source.authorization == null)"
+        " { ctx._source.authorization = new HashMap(); }"
+        " ctx._source.authorization.putAll(params.authorization);"
+    )
+
+    def __init__(self, config: PbenchServerConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+        self.elastic_uri = config.get("Indexing", "uri")
+
+    def run(self) -> int:
+        """Perform all the currently queued jobs.
+
+        Returns:
+            The number of jobs performed
+        """
+        jobs = 0
+        for operation in self.ACTIONS:
+            sync = Sync(self.logger, operation)
+            for dataset in sync.next():
+                try:
+                    self.run_job(sync, dataset)
+                except Exception as e:
+                    self.logger.exception(
+                        "Unexpected error on {} {}: {}", operation.name, dataset, e
+                    )
+                    sync.error(dataset, f"Unexpected error: {e!s}")
+                jobs += 1
+        return jobs
+
+    def run_job(self, sync: Sync, dataset: Dataset) -> Optional[JSONOBJECT]:
+        """Perform the queued job of a Sync component on a dataset.
+
+        Args:
+            sync: The Sync object of the job's operation
+            dataset: The dataset
+
+        Returns:
+            The summary of the job, or None if its Elasticsearch task failed:
+                ok      Count of documents updated or deleted
+                failure Count of documents which couldn't be updated or
+                        deleted
+        """
+        action = self.ACTIONS[sync.component]
+        job = sync.params(dataset) or {}
+        sync.update(dataset=dataset, state=OperationState.WORKING, message="Started")
+        audit = Audit.create(
+            operation=self.CODES[sync.component],
+            name=action,
+            status=AuditStatus.BEGIN,
+            user_name=Audit.BACKGROUND_USER,
+            dataset=dataset,
+        )
+
+        # If we don't have an Elasticsearch index-map, then the dataset isn't
+        # indexed and we skip the Elasticsearch actions.
+        map = Metadata.getvalue(dataset=dataset, key=Metadata.INDEX_MAP)
+        if map:
+            total = sum(map.values())
+            elastic = Elasticsearch(self.elastic_uri)
+            self.logger.info("Elasticsearch {} [{}]", elastic, VERSION)
+            started = last = time.time()
+
+            def progress(done: int, expected: int):
+                nonlocal last
+                now = time.time()
+                if now - last >= self.PROGRESS_INTERVAL:
+                    last = now
+                    sync.update(
+                        dataset=dataset,
+                        message=f"{done} of {expected or total} documents",
+                    )
+
+            try:
+                response = self.by_query(
+                    elastic, action, dataset, job, list(map), progress
+                )
+            except Exception as e:
+                self.logger.exception("{} of {} failed: {}", action, dataset, e)
+                sync.error(dataset, f"Unexpected backend error: {e!s}")
+                Audit.create(
+                    root=audit,
+                    status=AuditStatus.FAILURE,
+                    attributes={"message": str(e)},
+                )
+                return None
+            count = response.get("total", 0)
+            errors = response.get("version_conflicts", 0) + len(
+                response.get("failures", [])
+            )
+            self.logger.info(
+                "{} of {} documents of {} took {:.2f} seconds",
+                action,
+                count,
+                dataset,
+                time.time() - started,
+            )
+        else:
+            response = {}
+            count = errors = 0
+
+        summary: JSONOBJECT = {"ok": count - errors, "failure": errors}
+        attributes: JSONOBJECT = {"summary": summary}
+
+        # On any failure leave the dataset as it was, so that the job can be
+        # retried.
+        if errors:
+            message = f"Unable to {action} {errors} of {count} indexed documents"
+            self.logger.warning(
+                "{}: {}: {}", dataset, message, self._analyze_failures(response)
+            )
+            sync.error(dataset, message)
+            attributes["message"] = message
+            Audit.create(root=audit, status=AuditStatus.FAILURE, attributes=attributes)
+            return summary
+
+        try:
+            self.complete(sync, dataset, job, attributes)
+        except Exception as e:
+            attributes["message"] = str(e)
+            Audit.create(root=audit, status=AuditStatus.FAILURE, attributes=attributes)
+            raise
+        Audit.create(root=audit, status=AuditStatus.SUCCESS, attributes=attributes)
+        return summary
+
+    def by_query(
+        self,
+        elastic: Elasticsearch,
+        action: str,
+        dataset: Dataset,
+        job: JSONOBJECT,
+        indices: list[str],
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> JSONOBJECT:
+        """Update or delete the documents of a dataset with an Elasticsearch
+        update-by-query or delete-by-query task, and wait for it to finish.
+
+        Note that an update modifies only the "access" and/or "owner" field(s)
+        of the "authorization" subdocument: no other data will be modified.
+
+        Args:
+            elastic: The Elasticsearch client
+            action: The job action, "update" or "delete"
+            dataset: The dataset
+            job: The job parameters
+            indices: The indices containing the dataset's documents
+            progress: An optional callback, passed the count of documents done
+                so far and the count expected, while the task runs
+
+        Raises:
+            An Elasticsearch exception if the task can't be started, or
+            RuntimeError if it fails
+
+        Returns:
+            The response of the finished task, with the "total" count of the
+            documents found, and the "version_conflicts" and "failures" of
+            those it couldn't update or delete
+        """
+        body: JSONOBJECT = {"query": self.dataset_query(dataset)}
+        if action == "update":
+            authorization = {f: job[f] for f in ("access", "owner") if job.get(f)}
+            body["script"] = {
+                "source": self.UPDATE_SCRIPT,
+                "lang": "painless",
+                "params": {"authorization": authorization},
+            }
+            query = elastic.update_by_query
+        else:
+            query = elastic.delete_by_query
+
+        # Documents in an index which no longer exists are gone anyway, and
+        # a document changed while we're working on it is counted as a
+        # version conflict, which leaves the job to be retried.
+        task = query(
+            index=",".join(indices),
+            body=body,
+            conflicts="proceed",
+            ignore_unavailable=True,
+            refresh=True,
+            slices="auto",
+            wait_for_completion=False,
+        )["task"]
+        while True:
+            status = elastic.tasks.get(task_id=task)
+            if status.get("completed"):
+                break
+            if progress:
+                counts = status["task"]["status"]
+                progress(
+                    counts.get("updated", 0)
+                    + counts.get("deleted", 0)
+                    + counts.get("noops", 0),
+                    counts.get("total", 0),
+                )
+            time.sleep(self.POLL_INTERVAL)
+        if "error" in status:
+            error = status["error"]
+            raise RuntimeError(error.get("reason", error.get("type", str(error))))
+        return status["response"]
+
+    @staticmethod
+    def dataset_query(dataset: Dataset) -> JSONOBJECT:
+        """Return an Elasticsearch query matching the documents of a dataset.
+
+        Every document records the dataset's resource ID as its "run.id",
+        except for the table-of-contents documents, which record it as their
+        "run_data_parent".
+
+        Args:
+            dataset: The dataset
+
+        Returns:
+            An Elasticsearch query
+        """
+        return {
+            "bool": {
+                "should": [
+                    {"term": {"run.id": dataset.resource_id}},
+                    {"term": {"run_data_parent": dataset.resource_id}},
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+
+    def complete(
+        self, sync: Sync, dataset: Dataset, job: JSONOBJECT, attributes: JSONOBJECT
+    ):
+        """Complete a successful job by updating the access and owner of the
+        Dataset, or by deleting it.
+
+        Args:
+            sync: The Sync object of the job's operation
+            dataset: The dataset
+            job: The job parameters
+            attributes: The audit attributes of the job
+        """
+        if sync.component is OperationName.UPDATE:
+            access = job.get("access")
+            if access:
+                attributes["access"] = access
+                dataset.access = access
+            owner = job.get("owner")
+            if owner:
+                attributes["owner"] = owner
+                dataset.owner_id = owner
+            dataset.update()
+            sync.update(dataset=dataset, state=OperationState.OK, message="Done")
+        else:
+            cache_m = CacheManager(self.config, self.logger)
+            cache_m.delete(dataset.resource_id)
+            dataset.delete()
+
+    @staticmethod
+    def _analyze_failures(response: JSONOBJECT) -> JSONOBJECT:
+        """Summarize the failures of an Elasticsearch update-by-query or
+        delete-by-query task by reason and index: this will look something
+        like
+
+        {
+          "version conflict": {
+            "index2": 5
+          },
+          "elasticsearch failure reason 1": {
+            "index2": 5,
+            "index5": 10
+            ...
+          }
+        }
+
+        Args:
+            response: The response of the task
+
+        Returns:
+            The counts of failures for each reason and index
+        """
+        report = defaultdict(lambda: defaultdict(int))
+        if response.get("version_conflicts"):
+            report["version conflict"]["*"] = response["version_conflicts"]
+        for failure in response.get("failures", []):
+            cause = failure.get("cause", {})
+            reason = cause.get("reason", cause.get("type", "unknown"))
+            report[reason][failure.get("index", "*")] += 1
+        return {reason: dict(indices) for reason, indices in report.items()}
@@ -0,0 +1,232 @@
+"""A size-limited cache of individual files extracted from dataset tarballs.
+
+APIs like visualize and compare extract the same few files (for instance,
+"result.csv") from the same datasets over and over. The `ExtractCache` keeps
+a copy of each extracted file under the CACHE tree, so that it can be served
+from local disk next time.
+
+The cache is shared by all the server's worker processes, so it relies only
+on the file system for coordination:
+
+  * Each file is written under a temporary name and renamed into place, so
+    a reader never sees a partial file, and a reader which has opened a file
+    can keep reading it even if it's evicted.
+  * The modification time of a cached file records when it was last used,
+    and the least recently used files are evicted first.
+  * Eviction is serialized by an exclusive lock; a worker which finds the
+    lock already held leaves eviction to the holder.
+
+Each worker process evicts files after adding one to the cache, and every
+so many accesses, so that expired files go even if every access is a hit.
+The hit and miss counters are kept by each worker process in memory, and
+logged every so many accesses.
+"""
+
+from collections import defaultdict
+import errno
+import fcntl
+import hashlib
+from logging import Logger
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from threading import Lock
+import time
+from typing import Callable, IO, Optional
+
+# The counters of this process for each cache, by cache root directory: the
+# ExtractCache objects themselves are constructed for each request.
+_lock = Lock()
+_counters: dict[Path, dict[str, int]] = defaultdict(
+    lambda: {"hits": 0, "misses": 0, "evicted": 0}
+)
+
+
+class ExtractCache:
+    """A least-recently-used cache of files extracted from tarballs, limited
+    by total size and by the time since each file was last used.
+
+    Each file is keyed by the resource ID of its dataset and its path within
+    the dataset tarball.
+    """
+
+    # Name of the eviction lock file; cached files live in a directory for
+    # each dataset, named for its resource ID.
+    EVICT_LOCK = ".evict.lock"
+
+    # Numbers of accesses (hits and misses) between evictions, and between
+    # logging the counters, in each process.
+    EVICT_INTERVAL = 100
+    LOG_INTERVAL = 1000
+
+    def __init__(self, root: Path, max_bytes: int, max_age: int, logger: Logger):
+        """Construct an ExtractCache object
+
+        Args:
+            root: the directory holding the cache
+            max_bytes: the maximum total size of the cached files; 0 disables
+                the cache
+            max_age: the number of seconds after which an unused file is
+                evicted
+            logger: a Pbench python Logger
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.logger = logger
+
+    def _entry(self, resource_id: str, path: str) -> Path:
+        """Return the location of the cached copy of a tarball member
+
+        Args:
+            resource_id: the dataset resource ID
+            path: the path of the member within the tarball
+        """
+        return self.root / resource_id / hashlib.sha1(path.encode()).hexdigest()
+
+    def _count(self, counter: str, count: int = 1) -> int:
+        """Increment one of the cache counters of this process.
+
+        Args:
+            counter: the counter name
+            count: the amount to add
+
+        Returns:
+            The number of accesses (hits and misses) so far
+        """
+        with _lock:
+            counters = _counters[self.root]
+            counters[counter] += count
+            return counters["hits"] + counters["misses"]
+
+    def _access(self, counter: str):
+        """Count a hit or a miss, and every so many accesses, log the counters
+        and evict the files which are no longer wanted.
+
+        Args:
+            counter: "hits" or "misses"
+        """
+        accesses = self._count(counter)
+        if accesses % self.LOG_INTERVAL == 0:
+            self.logger.info("Extract cache {}: {}", self.root, self.stats)
+        if accesses % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Return the cache counters of this process: the number of "hits" and
+        "misses", and the number of files "evicted"."""
+        with _lock:
+            return dict(_counters[self.root])
+
+    def get(
+        self, resource_id: str, path: str, extract: Callable[[], Optional[IO[bytes]]]
+    ) -> Optional[IO[bytes]]:
+        """Return a stream of the contents of a tarball member, from the cache
+        if we have it, or otherwise by extracting it and caching a copy.
+
+        Args:
+            resource_id: the dataset resource ID
+            path: the path of the member within the tarball
+            extract: a function which extracts the member from the tarball,
+                returning a stream (or None, if the member has no data)
+
+        Returns:
+            A binary stream of the member's contents, or None
+        """
+        if not self.max_bytes:
+            return extract()
+
+        entry = self._entry(resource_id, path)
+        try:
+            stream = entry.open("rb")
+        except FileNotFoundError:
+            pass
+        else:
+            try:
+                os.utime(entry)
+            except FileNotFoundError:
+                # It's just been evicted, but we already have it open
+                pass
+            self._access("hits")
+            return stream
+
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        self._access("misses")
+        source = extract()
+        if source is None:
+            return None
+        fd, tmp = tempfile.mkstemp(dir=entry.parent, prefix=".")
+        try:
+            with source, os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(source, out)
+            stream = open(tmp, "rb")
+            os.rename(tmp, entry)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.evict()
+        return stream
+
+    def forget(self, resource_id: str):
+        """Remove all the cached files of a dataset.
+
+        Args:
+            resource_id: the dataset resource ID
+        """
+        shutil.rmtree(self.root / resource_id, ignore_errors=True)
+
+    def evict(self):
+        """Remove the files which haven't been used within the maximum age,
+        and then the least recently used files until the total size of the
+        cache is within its limit.
+
+        If another process is already evicting files, we leave it to do the
+        job.
+        """
+        try:
+            fd = os.open(self.root / self.EVICT_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            self.logger.warning("Unable to open extract cache lock: {}", e)
+            return
+        with os.fdopen(fd) as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return
+                raise
+
+            entries = []
+            for directory in self.root.iterdir():
+                if not directory.is_dir():
+                    continue
+                try:
+                    files = list(directory.iterdir())
+                except FileNotFoundError:
+                    # The dataset was forgotten as we looked
+                    continue
+                for file in files:
+                    try:
+                        st = file.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, file))
+
+            cutoff = time.time() - self.max_age
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for mtime, size, file in sorted(entries, key=lambda e: e[0]):
+                if mtime >= cutoff and total <= self.max_bytes:
+                    break
+                # A file still being written starts with "."; we only remove
+                # it once it's expired, as the writer must have died.
+                if file.name.startswith(".") and mtime >= cutoff:
+                    continue
+                file.unlink(missing_ok=True)
+                total -= size
+                evicted += 1
+        if evicted:
+            self.logger.debug("Evicted {} files from the extract cache", evicted)
+            self._count("evicted", evicted)
@@ -2,27 +2,35 @@
 result tar balls.
 """
 
+from bisect import bisect_left
 from collections import Counter
 import configparser
 import csv
 from datetime import datetime, timedelta
 import errno
 import hashlib
+from itertools import islice
 import json
 import logging
 import math
+import multiprocessing
 from operator import itemgetter
 import os
+from pathlib import Path
+import queue
 from random import SystemRandom
 import re
+import signal
 import socket
 import tarfile
 from time import sleep as _sleep
+from typing import List, Optional
 from urllib.parse import urlparse
 
 from urllib3 import Timeout
 
 from pbench.common import MetadataLog
+from pbench.common.compression import tarball_stem
 from pbench.common.exceptions import (
     BadConfig,
     BadDate,
@@ -33,6 +41,7 @@ from pbench.common.exceptions import (
     UnsupportedTarballFormat,
 )
 import pbench.server
+from pbench.server.cache_manager import make_tar_members
 from pbench.server.database.models.datasets import Dataset
 from pbench.server.templates import PbenchTemplates
 
@@ -87,12 +96,35 @@ _MAX_ERRMSG_LENGTH = 16384
 # existing records, allowing us to detect duplicates.
 _op_type = "create"
 
+# The version of the scheme used to construct the Elasticsearch document IDs
+# of the tool data and table-of-contents documents of new datasets.  Since we
+# rely on the document IDs being the same to detect duplicates, a dataset is
+# always re-indexed with the version it was first indexed with.
+#
+#   1: the MD5 hash of the JSON encoding of the document (for table-of-contents
+#      documents, the MD5 hash of the directory and the names of its files)
+#   2: a hash of the "structural" keys locating the document in the dataset:
+#      the run ID, and the iteration, sample, host, tool, file, and position
+#      in the file of a tool data document, or the directory of a
+#      table-of-contents document (see make_doc_id())
+DOCUMENT_ID_VERSION = 2
+
 # global - defaults to normal dict, ordered dict for unit tests
 _dict_const = dict
 
 _r = SystemRandom()
 _MAX_SLEEP_TIME = 120
 
+# Tool data workers send the documents they generate in batches of (at most)
+# this many documents, and each worker may have at most this many batches
+# queued before it blocks.
+_TOOL_DATA_BATCH_SIZE = 256
+_TOOL_DATA_QUEUE_BATCHES = 4
+
+# Seconds to wait for a result from the tool data workers before checking
+# that they are still alive.
+_TOOL_DATA_POLL_TIMEOUT = 5.0
+
 
 def _calc_backoff_sleep(backoff):
     global _r
@@ -168,6 +200,54 @@ def es_index(es, actions, errorsfp, logger, _dbg=0):
     return pyesbulk.streaming_bulk(es, actions, errorsfp, logger)
 
 
+class _SourceIdMaker:
+    """Compute the same source IDs as PbenchData.make_source_id() for many
+    documents which differ only in a few of their top-level fields.
+
+    The JSON encoding of a document with sorted keys is the concatenation of
+    the encodings of its top-level fields, in key order.  So given the
+    fields shared by a set of documents, we encode them once, as a "frame"
+    around the one field which differs, and then only need to encode that
+    field of each document.  The constant fields given to the constructor
+    (which must not be modified) are only ever encoded once.
+    """
+
+    def __init__(self, constant):
+        self.encode = json.JSONEncoder(sort_keys=True).encode
+        self.constant = constant
+        self.encoded = {key: self.encode(val) for key, val in constant.items()}
+
+    def frame(self, fields, key):
+        """Return the encoding of the given top-level fields of a set of
+        documents, split around the field with the given key (whose value in
+        fields is ignored).
+        """
+        before, after = [], []
+        parts = before
+        for k in sorted(fields):
+            if k == key:
+                parts = after
+                continue
+            val = fields[k]
+            if self.constant.get(k) is val:
+                encoded = self.encoded[k]
+            else:
+                encoded = self.encode(val)
+            parts.append(f"{self.encode(k)}: {encoded}")
+        before.append(f"{self.encode(key)}: ")
+        head = "{" + ", ".join(before)
+        tail = "".join(f", {p}" for p in after) + "}"
+        return head, tail
+
+    def source_id(self, frame, val):
+        """Return the source ID of the document with the given value for the
+        field around which the frame was split.
+        """
+        head, tail = frame
+        the_bytes = f"{head}{self.encode(val)}{tail}".encode("utf-8")
+        return hashlib.md5(the_bytes).hexdigest()
+
+
 class PbenchData:
     """Pbench Data abstract class - ToolData and ResultData inherit from it.
 
@@ -1813,10 +1893,22 @@ def _noop(arg):
     return arg
 
 
+def _single_getter(index):
+    """Like itemgetter() of a single index, but returning a 1-tuple."""
+
+    def getter(seq):
+        return (seq[index],)
+
+    return getter
+
+
 class ToolData(PbenchData):
     def __init__(self, ptb, iteration, sample, host, tool):
         super().__init__(ptb)
         self.toolname = tool
+        # The structural keys shared by the (version 2) document IDs of the
+        # documents of this tool data.
+        self.doc_keys = (self.run_metadata["id"], iteration, sample, host, tool)
         self.idxctx.opctx.append(
             _dict_const(
                 tbname=ptb.tbname,
@@ -1896,6 +1988,22 @@ class ToolData(PbenchData):
             self.basepath = basepath
             self.files = files
 
+    def make_tool_doc_id(self, source, path, *position):
+        """Return the document ID of a tool data document.
+
+        Args:
+            source: The tool data document
+            path: The path of the file from which the document was generated
+                (None for the documents unified from multiple .csv files)
+            position: The position of the document in the file
+
+        Returns:
+            The document ID, in the version of the scheme used for the dataset
+        """
+        if self.ptb.id_version < 2:
+            return PbenchData.make_source_id(source)
+        return make_doc_id(*self.doc_keys, path, *position)
+
     def _make_source_unified(self):
         """Create one JSON document per identifier, per timestamp from
         the data found in multiple csv files.
@@ -2069,18 +2177,60 @@ class ToolData(PbenchData):
         # At this point, we have processed all the data about csv files
         # and are ready to start reading the contents of all the csv
         # files and building the unified records.
+        #
+        # Rather than mapping each cell of each row to its document field
+        # one at a time, we precompute, for each .csv file, the groups of
+        # columns mapped to each identifier.  Each row read is converted in
+        # one pass, and the fields of an identifier are picked out of it in
+        # one step.  A group is one of three kinds:
+        #
+        #   * "sub": all of the columns have subfields, which are gathered
+        #     into a dictionary for the metric
+        #   * "val": none of the columns have subfields, and the value of the
+        #     (last) column is the value of the metric
+        #   * "mix": some of the columns have subfields, and each column is
+        #     mapped individually
+        plans = []
+        for csvf in self.files:
+            fname = csvf["basename"]
+            if fname not in metric_mapping:
+                # The .csv file was skipped above.
+                continue
+            groups = _dict_const()
+            for i, mapping in field_mapping[fname].items():
+                if mapping is None:
+                    continue
+                identifier, subfield = mapping
+                groups.setdefault(identifier, []).append((i - 1, subfield))
+            columns = []
+            for identifier, cols in groups.items():
+                subfields = [subfield for _, subfield in cols]
+                if all(subfields):
+                    indices = [i for i, _ in cols]
+                    if len(indices) > 1:
+                        picker = itemgetter(*indices)
+                    else:
+                        picker = _single_getter(indices[0])
+                    columns.append((identifier, "sub", subfields, picker))
+                elif not any(subfields):
+                    columns.append((identifier, "val", None, itemgetter(cols[-1][0])))
+                else:
+                    columns.append((identifier, "mix", cols, None))
+            plans.append((csvf, metric_mapping[fname], len(csvf["header"]), columns))
+
         def rows_generator():
             # We use this generator to highlight the process of reading from
-            # all the csv files, reading one row from each of the csv files,
-            # returning that as a dictionary of csv file to row read, which
-            # in turn is yielded by the generator.
+            # all the csv files in lock step, reading one row from each of the
+            # csv files, returning the plan and row read of each, which in
+            # turn is yielded by the generator.
+            readers = [(plan, plan[0]["reader"]) for plan in plans]
             idx = 0
             while True:
                 # Read a row from each .csv file
-                rows = _dict_const()
-                for csvf in self.files:
+                rows = []
+                for plan, reader in readers:
                     try:
-                        rows[csvf["basename"]] = next(csvf["reader"])
+                        rows.append((plan, next(reader)))
                     except StopIteration:
                         # This should handle the case of mismatched number of
                         # rows across all .csv files. All readers which have
@@ -2090,11 +2240,55 @@ class ToolData(PbenchData):
                     # None of the csv file readers returned any rows to
                     # process, so we're done.
                     break
-                # Yield the one dictionary that contains each newly read row
-                # from all the csv files.
+                # Yield the list of newly read rows from all the csv files.
                 yield idx, rows
                 idx += 1
 
+        # We are now ready to create a base document per identifier to hold
+        # all the fields from the various columns for each row.  Given the
+        # two input dictionaries, "identifiers" and "metadata", we precompute
+        # the fields of the tool's subdocument for each identifier which
+        # don't change from one row to the next.
+        #
+        # For example, given these inputs:
+        #   * identifiers = { "id0": True, "id1": True }
+        #   * metadata = { "id0": { "f1": "foo", "f2": "bar" },
+        #                  "id1": { "f1": "faz", "f2": "baz" } }
+        # For each row, we generate the following dictionary:
+        #   * datum = { "id0": { "@timestamp": ts_str,
+        #                        "run": self.run_metadata,
+        #                        "sample": self.sample_metadata,
+        #                        "iteration": self.iteration_metadata,
+        #                        self.toolname: { "id": "id0",
+        #                                         "@idx": idx,
+        #                                         "f1": "foo",
+        #                                         "f2": "bar" } },
+        #               "id1": { "@timestamp": ts_str,
+        #                        "run": self.run_metadata,
+        #                        "sample": self.sample_metadata,
+        #                        "iteration": self.iteration_metadata,
+        #                        self.toolname: { "id": "id1",
+        #                                         "@idx": idx,
+        #                                         "f1": "faz",
+        #                                         "f2": "baz" } },
+        id_fields = _dict_const()
+        for identifier in identifiers.keys():
+            id_fields[identifier] = (
+                [] if identifier == "__none__" else [("id", identifier)],
+                metadata.get(identifier),
+            )
+        classes = list(class_list.keys())
+        # With the version 1 document IDs, all the documents of a row differ
+        # only in their tool subdocument.
+        structural = self.ptb.id_version >= 2
+        ids = _SourceIdMaker(
+            _dict_const(
+                run=self.run_metadata,
+                iteration=self.iteration_metadata,
+                sample=self.sample_metadata,
+            )
+        )
+
         self.logger.info(
             "tool-data-indexing: tool {}, gen unified begin for {}",
             self.toolname,
@@ -2104,13 +2298,9 @@ class ToolData(PbenchData):
         prev_ts_val = None
         for idx, rows in rows_generator():
             # Verify timestamps are all the same for this row.
-            tstamp = None
-            first = None
-            for fname in rows.keys():
-                tstamp = rows[fname][0]
-                if first is None:
-                    first = tstamp
-                elif first != tstamp:
+            first = rows[0][1][0]
+            for _, row in rows:
+                if row[0] != first:
                     self.logger.warning(
                         "tool-data-indexing: {} csv files have"
                         " inconsistent timestamps per row ({})",
@@ -2119,31 +2309,6 @@ class ToolData(PbenchData):
                     )
                     self.counters["inconsistent_timestamps_across_csv_files"] += 1
                     break
-            # We are now ready to create a base document per identifier to
-            # hold all the fields from the various columns. Given the two
-            # input dictionaries, "identifiers" and "metadata", we create
-            # an output dictionary, "datum", which has keys for all the
-            # identifiers and a base dictionary for forming the JSON docs.
-
-            # For example, given these inputs:
-            #   * identifiers = { "id0": True, "id1": True }
-            #   * metadata = { "id0": { "f1": "foo", "f2": "bar" },
-            #                  "id1": { "f1": "faz", "f2": "baz" } }
-            # The for loop below would generate the following dictionary:
-            #   * datum = { "id0": { "@timestamp": ts_str,
-            #                        "run": self.run_metadata,
-            #                        "sample": self.sample_metadata,
-            #                        "iteration": self.iteration_metadata,
-            #                        self.toolname: { "id": "id0",
-            #                                         "f1": "foo",
-            #                                         "f2": "bar" } },
-            #               "id1": { "@timestamp": ts_str,
-            #                        "run": self.run_metadata,
-            #                        "sample": self.sample_metadata,
-            #                        "iteration": self.iteration_metadata,
-            #                        self.toolname: { "id": "id1",
-            #                                         "f1": "faz",
-            #                                         "f2": "baz" } },
 
             # The timestamp is taken from the "first" timestamp, converted
             # to a floating point value in seconds, and then formatted as a
@@ -2160,59 +2325,89 @@ class ToolData(PbenchData):
                 )
             prev_first = first
             prev_ts_val = ts_val
+            ts_orig = str(first)
+            if not structural:
+                frame = ids.frame(
+                    _dict_const(
+                        [
+                            ("@timestamp", ts_val),
+                            ("@timestamp_original", ts_orig),
+                            ("run", self.run_metadata),
+                            ("iteration", self.iteration_metadata),
+                            ("sample", self.sample_metadata),
+                            (self.toolname, None),
+                        ]
+                    ),
+                    self.toolname,
+                )
             datum = _dict_const()
-            for identifier in identifiers.keys():
+            tools = {}
+            for identifier, (head, md) in id_fields.items():
+                tools[identifier] = tool = _dict_const(head)
+                tool["@idx"] = idx
+                if md:
+                    tool.update(md)
+                for klass in classes:
+                    tool[klass] = _dict_const()
                 datum[identifier] = _dict_const(
                     [
                         # Since they are all the same, we use the first to
                         # generate the real timestamp.
                         ("@timestamp", ts_val),
-                        ("@timestamp_original", str(first)),
+                        ("@timestamp_original", ts_orig),
                         ("run", self.run_metadata),
                         ("iteration", self.iteration_metadata),
                         ("sample", self.sample_metadata),
-                        (self.toolname, _dict_const()),
+                        (self.toolname, tool),
                     ]
                 )
-                if identifier != "__none__":
-                    datum[identifier][self.toolname]["id"] = identifier
-                datum[identifier][self.toolname]["@idx"] = idx
-                try:
-                    md = metadata[identifier]
-                except KeyError:
-                    pass
-                else:
-                    datum[identifier][self.toolname].update(md)
-                for klass in class_list.keys():
-                    datum[identifier][self.toolname][klass] = _dict_const()
             # Now we can perform the mapping from multiple .csv files to JSON
             # documents using a known field hierarchy (no identifiers in field
             # names) with the identifiers as additional metadata. Note that we
             # are constructing this document just from the current row of data
             # taken from all .csv files (assumes timestamps are the same).
-            for fname, row in rows.items():
-                klass, metric, converter = metric_mapping[fname]
-                for i, val in enumerate(row):
-                    if i == 0:
-                        continue
-                    # Given an fname and a column offset, return the
-                    # identifier from the header
-                    identifier, subfield = field_mapping[fname][i]
+            for (csvf, (klass, metric, converter), width, columns), row in rows:
+                if len(row) != width:
+                    # A short (or long) row can't use the precomputed column
+                    # groups, so map what we have one cell at a time.
+                    self._unify_cells(
+                        tools,
+                        field_mapping[csvf["basename"]],
+                        row,
+                        klass,
+                        metric,
+                        converter,
+                    )
+                    continue
+                vals = list(map(converter, islice(row, 1, None)))
+                for identifier, kind, subfields, picker in columns:
+                    _d = tools[identifier]
                     if klass is not None:
-                        _d = datum[identifier][self.toolname][klass]
-                    else:
-                        _d = datum[identifier][self.toolname]
-                    if subfield:
-                        if metric not in _d:
-                            _d[metric] = _dict_const()
-                        _d[metric][subfield] = converter(val)
+                        _d = _d[klass]
+                    if kind == "sub":
+                        fields = zip(subfields, picker(vals))
+                        if metric in _d:
+                            _d[metric].update(fields)
+                        else:
+                            _d[metric] = _dict_const(fields)
+                    elif kind == "val":
+                        _d[metric] = picker(vals)
                     else:
-                        _d[metric] = converter(val)
+                        for i, subfield in subfields:
+                            if subfield:
+                                if metric not in _d:
+                                    _d[metric] = _dict_const()
+                                _d[metric][subfield] = vals[i]
+                            else:
+                                _d[metric] = vals[i]
             # At this point we have fully mapped all data from all .csv files
             # to their proper fields for each identifier. Now we can yield
             # records for each of the identifiers.
             for _id, source in datum.items():
-                source_id = PbenchData.make_source_id(source)
+                if structural:
+                    source_id = make_doc_id(*self.doc_keys, None, idx, _id)
+                else:
+                    source_id = ids.source_id(frame, tools[_id])
                 yield source, source_id
         self.logger.info(
             "tool-data-indexing: tool {}, end unified for {}",
@@ -2221,6 +2416,27 @@ class ToolData(PbenchData):
         )
         return
 
+    @staticmethod
+    def _unify_cells(tools, fmap, row, klass, metric, converter):
+        """Map the cells of a row of a .csv file, one at a time, to the fields
+        of the tool subdocuments of each identifier.
+        """
+        for i, val in enumerate(row):
+            if i == 0:
+                continue
+            # Given an fname and a column offset, return the identifier from
+            # the header
+            identifier, subfield = fmap[i]
+            _d = tools[identifier]
+            if klass is not None:
+                _d = _d[klass]
+            if subfield:
+                if metric not in _d:
+                    _d[metric] = _dict_const()
+                _d[metric][subfield] = converter(val)
+            else:
+                _d[metric] = converter(val)
+
     def _make_source_individual(self):
         """Read .csv files individually, emitting records for each row and
         column coordinate."""
@@ -2292,7 +2508,7 @@ class ToolData(PbenchData):
                         column = header[col]
                         _d[metric][column] = converter(val)
 
-                source_id = PbenchData.make_source_id(datum)
+                source_id = self.make_tool_doc_id(datum, csvf["path"], idx)
                 yield datum, source_id
                 idx += 1
             self.logger.info(
@@ -2609,8 +2825,9 @@ class ToolData(PbenchData):
                 continue
             path = os.path.join(self.ptb.extracted_root, output_file["path"])
             with open(path, "r") as file_object:
-                for record in func(self, file_object, converter, output_file["path"]):
-                    source_id = PbenchData.make_source_id(record)
+                records = func(self, file_object, converter, output_file["path"])
+                for seq, record in enumerate(records):
+                    source_id = self.make_tool_doc_id(record, output_file["path"], seq)
                     yield record, source_id
 
     def _make_source_json(self):
@@ -2723,7 +2940,7 @@ class ToolData(PbenchData):
 
                 # Any further transformations needed should be done here.
 
-                source_id = PbenchData.make_source_id(source)
+                source_id = self.make_tool_doc_id(source, df["path"], idx)
                 yield source, source_id
                 idx += 1
             self.logger.info(
@@ -2857,6 +3074,16 @@ class ToolData(PbenchData):
 # Various helper methods.
 
 
+def make_doc_id(*keys):
+    """Construct a (version 2) document ID from the structural keys locating
+    the document in a dataset.
+
+    Since the keys are only a few short strings and integers, this is much
+    cheaper than encoding and hashing the entire document.
+    """
+    return hashlib.blake2b(repr(keys).encode("utf-8"), digest_size=16).hexdigest()
+
+
 def get_md5sum_of_dir(dir, parentid):
     """Calculate the md5 sum of all the names in the toc"""
     h = hashlib.md5()
@@ -3180,6 +3407,35 @@ class Sample:
         self.path = os.path.join(iteration.path, name)
 
 
+class TarballMemberIndex:
+    """A prefix index of the names of the files in a tar ball.
+
+    The tool data lookups ask for all the files found under a partial path
+    (e.g., "<run>/1-iter/sample1/tools-default/<host>/sar/csv") once for
+    every tool, host, iteration, and sample of a run, so scanning all the
+    tar ball members for each lookup is quadratic in the number of members.
+    Instead we keep the file names sorted, so that all the names sharing a
+    prefix can be located with a binary search.
+    """
+
+    def __init__(self, members):
+        self.names = sorted(m.name for m in members if m.isfile())
+        # The number of lookups served by the index.
+        self.lookups = 0
+
+    def files_by_prefix(self, prefix):
+        """Generator for all the file names starting with the given prefix,
+        in sorted order.
+        """
+        self.lookups += 1
+        names = self.names
+        for i in range(bisect_left(names, prefix), len(names)):
+            name = names[i]
+            if not name.startswith(prefix):
+                break
+            yield name
+
+
 class PbenchTarBall:
     """Encapsulation of the data structures representing the contents of a
     pbench tar ball.
@@ -3192,6 +3448,8 @@ class PbenchTarBall:
         tbarg: str,
         tmpdir: str,
         extracted_root: str,
+        members: Optional[List[tarfile.TarInfo]] = None,
+        id_version: int = DOCUMENT_ID_VERSION,
     ):
         """Context for indexing a tarball.
 
@@ -3201,8 +3459,14 @@ class PbenchTarBall:
             tbarg:  The filesystem path to the tarball (as a string)
             tmpdir: The path to a temporary directory (as a string)
             extracted_root: The path to the extracted tarball data (as a string)
+            members: The tarball members captured when the tarball was
+                unpacked; if not given, they are derived from the files under
+                extracted_root
+            id_version: The version of the document ID scheme to use for
+                the dataset (see DOCUMENT_ID_VERSION)
         """
         self.idxctx = idxctx
+        self.id_version = id_version
         self.authorization = {"owner": str(dataset.owner_id), "access": dataset.access}
         self.tbname = tbarg
         self.controller_dir = os.path.basename(os.path.dirname(self.tbname))
@@ -3214,19 +3478,15 @@ class PbenchTarBall:
         tb_stat = os.stat(self.tbname)
         mtime = datetime.utcfromtimestamp(tb_stat.st_mtime)
 
-        # TODO: Although we index from unpacked files on the file
-        # system, we repeatedly reference the list of TarInfo records from the
-        # Python tarfile package rather than navigating the file tree directly.
-        # This could likely be improved.
-        self.tb = tarfile.open(self.tbname)
-
-        # Build a map showing the documents in each Elasticsearch index so we
-        # can find them later to UPDATE or DELETE without searching all
-        # indices.
+        # Build a map counting the documents in each Elasticsearch index so
+        # we can find them later to UPDATE or DELETE without searching all
+        # indices. (The documents themselves are found by query, as each
+        # records the dataset's resource ID as its "run.id" or, for a TOC
+        # document, its "run_data_parent".)
         #
         # {
-        #     "jam-pbench.v6.run-data.2021-05": ["<doc-id>"],
-        #     "jam-pbench.v6.run-toc.2021-05": ["<doc-id>", "<doc-id>"],
+        #     "jam-pbench.v6.run-data.2021-05": 1,
+        #     "jam-pbench.v6.run-toc.2021-05": 2,
         #     [...]
         # }
         self.index_map = {}
@@ -3234,14 +3494,31 @@ class PbenchTarBall:
         # This is the top-level name of the run - it should be the common
         # first component of every member of the tar ball.
         dirname = os.path.basename(self.tbname)
-        self.dirname = dirname[: dirname.rfind(".tar.xz")]
-        # ... but let's make sure ...
+        self.dirname = tarball_stem(dirname) or dirname
+
+        self.extracted_root = extracted_root
+        if not os.path.isdir(os.path.join(self.extracted_root, self.dirname)):
+            raise UnsupportedTarballFormat(
+                '{} - extracted tar ball directory "{}" does not'
+                " exist.".format(
+                    self.tbname, os.path.join(self.extracted_root, self.dirname)
+                )
+            )
+
+        # We index from the unpacked files, and we describe them with the
+        # list of tar ball members captured when the tar ball was unpacked
+        # (or, failing that, from the unpacked tree itself) rather than
+        # reading and decompressing the tar ball again.
+        if members is None:
+            members = make_tar_members(Path(self.extracted_root))
+        self.members = members
+
+        # ... but let's make sure every member has the run directory prefix ...
         #
         # ... while we are at it, we verify we have a metadata.log file in the
-        # tar ball before we start extracting.
+        # tar ball before we start indexing.
         metadata_log_path = "%s/metadata.log" % (self.dirname)
         metadata_log_found = False
-        self.members = self.tb.getmembers()
         for m in self.members:
             if m.name == metadata_log_path:
                 metadata_log_found = True
@@ -3259,15 +3536,8 @@ class PbenchTarBall:
             raise UnsupportedTarballFormat(
                 '{} - tar ball is missing "{}".'.format(self.tbname, metadata_log_path)
             )
+        self.member_index = TarballMemberIndex(self.members)
 
-        self.extracted_root = extracted_root
-        if not os.path.isdir(os.path.join(self.extracted_root, self.dirname)):
-            raise UnsupportedTarballFormat(
-                '{} - extracted tar ball directory "{}" does not'
-                " exist.".format(
-                    self.tbname, os.path.join(self.extracted_root, self.dirname)
-                )
-            )
         # Open the MD5 file of the tar ball and read the MD5 sum from it.
         md5sum = open("%s.md5" % (self.tbname)).read().split()[0]
         # Construct the @metadata and run metadata dictionaries from the
@@ -3426,26 +3696,29 @@ class PbenchTarBall:
         # additional context to add.
         self._tbctx = f"{self.controller_dir}/{os.path.basename(tbarg)}({md5sum})"
 
-    def map_document(self, index: str, id: str) -> None:
+    def map_document(self, index: str) -> None:
         """
-        Create an entry in the document indexing dictionary to record the index
-        name and document ID. This map will be stored as Dataset metadata to be
-        retrieved later when we want to locate the documents for UPDATE and
-        DELETE operations.
+        Count a document in the document indexing dictionary for its index.
+        This map will be stored as Dataset metadata to be retrieved later when
+        we want to locate the documents for UPDATE and DELETE operations.
 
         Args:
             index: Fully qualified index in which the document is stored
-            id: The Elasticsearch document ID
         """
-        try:
-            self.index_map[index].append(id)
-        except KeyError:
-            self.index_map[index] = [id]
+        self.index_map[index] = self.index_map.get(index, 0) + 1
 
     def gen_files_by_partial_path(self, path):
         """Generator for all files in the tar ball which match the given path
         pattern.
+
+        Since every member of the tar ball starts with the run directory
+        name, a path which also starts with it can only match as a prefix,
+        and we can use the member index to find the files; otherwise we fall
+        back to scanning all the members.
         """
+        if path.startswith(f"{self.dirname}/"):
+            yield from self.member_index.files_by_prefix(path)
+            return
         for member in self.members:
             if member.isfile() and member.name.find(path) >= 0:
                 yield member.name
@@ -3666,7 +3939,7 @@ class PbenchTarBall:
         # make a simple action for indexing
         pd = PbenchData(self)
         idx_name = pd.generate_index_name("run", source)
-        self.map_document(idx_name, self.run_metadata["id"])
+        self.map_document(idx_name)
         action = _dict_const(
             _op_type=_op_type,
             _index=idx_name,
@@ -3796,8 +4069,11 @@ class PbenchTarBall:
         count = 0
         for source in self.gen_toc():
             source["@timestamp"] = tstamp
-            source_id = get_md5sum_of_dir(source, self.run_metadata["id"])
-            self.map_document(idx_name, source_id)
+            if self.id_version < 2:
+                source_id = get_md5sum_of_dir(source, self.run_metadata["id"])
+            else:
+                source_id = make_doc_id(self.run_metadata["id"], source["directory"])
+            self.map_document(idx_name)
             action = _dict_const(
                 _id=source_id,
                 _op_type=_op_type,
@@ -3979,41 +4255,194 @@ class PbenchTarBall:
         return
 
     def mk_tool_data_actions(self):
-        """Generate all the tool data actions from the entire run hierarchy."""
+        """Generate all the tool data actions from the entire run hierarchy.
+
+        Generating the source documents of the tool data means parsing all
+        the tool data files of the run, which can take far longer than
+        indexing the documents. When the "tool-data-workers" option of the
+        "pbench-index" configuration section is greater than one, the
+        ToolData units are divided among that many forked worker processes
+        (see _tool_data_parallel()), otherwise they are handled serially in
+        this process.
+        """
         self.idxctx.logger.debug("start")
+        workers = max(
+            self.idxctx.config.getint("pbench-index", "tool-data-workers", fallback=1),
+            1,
+        )
         count = 0
-        for td in self.mk_tool_data():
-            # Each ToolData object, td, that is returned here represents how
-            # data collected for that tool across all hosts is to be returned.
-            # The make_source method returns a generator that will emit each
-            # source document for the appropriate unit of tool data.  Each has
-            # the option of constructing that data as best fits its tool data.
-            # The tool data for each tool is kept in its own index to allow
-            # for different curation policies for each tool.
-            asource = td.make_source()
-            if not asource:
+        if workers > 1:
+            docs = self._tool_data_parallel(list(self.mk_tool_data()), workers)
+        else:
+            docs = (
+                doc for td in self.mk_tool_data() for doc in self._tool_data_docs(td)
+            )
+        for idx_name, source_id, source in docs:
+            self.map_document(idx_name)
+            source["@generated-by"] = self.idxctx.get_tracking_id()
+            source["authorization"] = self.authorization
+            action = _dict_const(
+                _op_type=_op_type,
+                _index=idx_name,
+                _id=source_id,
+                _source=source,
+            )
+            count += 1
+            yield action
+        self.idxctx.logger.debug(
+            "end [{:d} tool data documents, {:d} member index lookups]",
+            count,
+            self.member_index.lookups,
+        )
+        return
+
+    @staticmethod
+    def _tool_data_docs(td):
+        """Generate the (index name, source ID, source) tuple of each tool
+        data document of a ToolData unit.
+
+        Each ToolData object, td, represents how data collected for that tool
+        across all hosts is to be returned.  The make_source method returns a
+        generator that will emit each source document for the appropriate unit
+        of tool data.  Each has the option of constructing that data as best
+        fits its tool data.  The tool data for each tool is kept in its own
+        index to allow for different curation policies for each tool.
+        """
+        asource = td.make_source()
+        if not asource:
+            return
+        for source, source_id in asource:
+            try:
+                idx_name = td.generate_index_name(
+                    "tool-data", source, toolname=td.toolname
+                )
+            except BadDate:
+                # Already counted in the ToolData object's counters.
                 continue
-            for source, source_id in asource:
+            yield idx_name, source_id, source
+
+    def _tool_data_parallel(self, units, workers):
+        """Generate the tool data documents of the given ToolData units using a
+        pool of forked worker processes.
+
+        The workers inherit the ToolData units, take the index of the next
+        unit to handle from a shared task queue, and send back the documents
+        of that unit in batches over a bounded result queue, so that a worker
+        blocks when the bulk indexing falls behind, rather than accumulating
+        documents in memory.  Once it has sent all the documents of a unit,
+        the worker sends the unit's counters, which we add to those of our
+        own copy of the unit (already recorded in the operational context).
+
+        The documents of each unit are generated in order, but the documents
+        of different units are interleaved in the order the workers produce
+        them.
+
+        Args:
+            units: The list of ToolData objects
+            workers: The maximum number of worker processes
+
+        Raises:
+            RuntimeError: if a worker fails to generate the documents of a
+                unit, or exits unexpectedly
+
+        Returns:
+            A generator of (index name, source ID, source) tuples
+        """
+        if not units:
+            return
+        mp = multiprocessing.get_context("fork")
+        tasks = mp.Queue()
+        results = mp.Queue(maxsize=workers * _TOOL_DATA_QUEUE_BATCHES)
+        processes = [
+            mp.Process(target=self._tool_data_worker, args=(units, tasks, results))
+            for _ in range(min(workers, len(units)))
+        ]
+        for i in range(len(units)):
+            tasks.put(i)
+        for _ in processes:
+            tasks.put(None)
+        for process in processes:
+            process.start()
+        self.idxctx.logger.debug(
+            "started {:d} tool data workers for {:d} tool data units",
+            len(processes),
+            len(units),
+        )
+
+        pending = len(units)
+        try:
+            while pending:
                 try:
-                    idx_name = td.generate_index_name(
-                        "tool-data", source, toolname=td.toolname
-                    )
-                except BadDate:
-                    pass
+                    kind, i, payload = results.get(timeout=_TOOL_DATA_POLL_TIMEOUT)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in processes):
+                        raise RuntimeError(
+                            "Tool data workers exited unexpectedly with"
+                            f" {pending:d} tool data units pending"
+                        )
+                    continue
+                if kind == "docs":
+                    yield from payload
+                elif kind == "done":
+                    units[i].counters.update(payload)
+                    pending -= 1
                 else:
-                    self.map_document(idx_name, source_id)
-                    source["@generated-by"] = self.idxctx.get_tracking_id()
-                    source["authorization"] = self.authorization
-                    action = _dict_const(
-                        _op_type=_op_type,
-                        _index=idx_name,
-                        _id=source_id,
-                        _source=source,
+                    raise RuntimeError(
+                        f"Tool data worker failed on {units[i].toolname!r}"
+                        f" tool data: {payload}"
                     )
-                    count += 1
-                    yield action
-        self.idxctx.logger.debug("end [{:d} tool data documents]", count)
-        return
+        finally:
+            # Reap the workers, which have exited if all went well; otherwise,
+            # if we failed or the caller stopped early, don't wait for them.
+            for process in processes:
+                if pending and process.is_alive():
+                    process.terminate()
+                process.join()
+            tasks.cancel_join_thread()
+            tasks.close()
+            results.close()
+
+    @classmethod
+    def _tool_data_worker(cls, units, tasks, results):
+        """The main loop of a forked tool data worker process.
+
+        The worker takes the index of a ToolData unit from the task queue,
+        and sends the documents of that unit over the result queue in
+        batches, followed by the counters of the unit.  A None task ends the
+        loop.
+
+        Signals are handled by the parent, which terminates the workers when
+        it is interrupted.
+
+        Args:
+            units: The list of ToolData objects
+            tasks: The queue of unit indices
+            results: The (bounded) queue of results
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        while True:
+            i = tasks.get()
+            if i is None:
+                break
+            td = units[i]
+            batch = []
+            try:
+                for doc in cls._tool_data_docs(td):
+                    batch.append(doc)
+                    if len(batch) >= _TOOL_DATA_BATCH_SIZE:
+                        results.put(("docs", i, batch))
+                        batch = []
+            except Exception as e:
+                results.put(("error", i, f"{e!r}"))
+                break
+            if batch:
+                results.put(("docs", i, batch))
+            results.put(("done", i, td.counters))
+        results.close()
+        results.join_thread()
 
     def mk_result_data_actions(self):
         """Generate all the result data actions."""
@@ -4049,7 +4478,7 @@ class PbenchTarBall:
                     _id=source_id,
                     _source=source,
                 )
-                self.map_document(idx_name, source_id)
+                self.map_document(idx_name)
                 if parent_id is None:
                     # Only the parent result data documents hold the tracking IDs.
                     source["@generated-by"] = self.idxctx.get_tracking_id()
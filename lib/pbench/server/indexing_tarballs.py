@@ -2,11 +2,13 @@
 
 from argparse import Namespace
 from collections import deque
+import multiprocessing
+from multiprocessing.connection import Connection, wait
 import os
 from pathlib import Path
 import signal
 import tempfile
-from typing import Callable, List, NamedTuple, Optional, Tuple
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
 
 from pbench.common.exceptions import (
     BadDate,
@@ -16,6 +18,7 @@ from pbench.common.exceptions import (
 )
 from pbench.server import OperationCode, tstos
 from pbench.server.cache_manager import CacheManager, Tarball, TarballNotFound
+from pbench.server.database.database import Database
 from pbench.server.database.models.audit import Audit, AuditStatus
 from pbench.server.database.models.datasets import (
     Dataset,
@@ -24,7 +27,14 @@ from pbench.server.database.models.datasets import (
     OperationName,
     OperationState,
 )
-from pbench.server.indexer import es_index, IdxContext, PbenchTarBall, VERSION
+from pbench.server.indexer import (
+    DOCUMENT_ID_VERSION,
+    es_index,
+    get_es,
+    IdxContext,
+    PbenchTarBall,
+    VERSION,
+)
 from pbench.server.report import Report
 from pbench.server.sync import Sync
 
@@ -156,6 +166,18 @@ class Index:
         # Manage synchronization between components
         self.sync: Sync = Sync(idxctx.logger, self.operation)  # Build a sync object
 
+        # Number of worker processes indexing tarballs concurrently; a value
+        # of 1 (the default) indexes tarballs serially in this process.
+        self.workers: int = max(
+            idxctx.config.getint("pbench-index", "workers", fallback=1), 1
+        )
+
+        # The version of the document ID scheme used for datasets indexed for
+        # the first time.
+        self.id_version: int = idxctx.config.getint(
+            "Indexing", "document_id_version", fallback=DOCUMENT_ID_VERSION
+        )
+
     def collect_tb(self) -> Tuple[int, List[TarballData]]:
         """Collect tarballs that need indexing
 
@@ -291,9 +313,546 @@ class Index:
 
         return res
 
+    def _tmp_file(self, tmpdir: str, suffix: str) -> Path:
+        """Construct the path of one of the temporary status files recording
+        the progress of this indexing run.
+
+        Args:
+            tmpdir: the temporary directory for this indexing run
+            suffix: the kind of status file ("indexed", "erred", etc.)
+
+        Returns:
+            The Path of the status file
+        """
+        return Path(tmpdir, f"{self.name}.{self.idxctx.TS}.{suffix}")
+
+    def index_tarball(self, tbinfo: TarballData, tmpdir: str) -> Optional[ErrorCode]:
+        """Unpack, index, and record the state of a single tarball.
+
+        This is the unit of work of both the serial indexing loop and of each
+        worker process of the parallel indexing mode.
+
+        Args:
+            tbinfo: the description of the tarball to index
+            tmpdir: the temporary directory for this indexing run
+
+        Raises:
+            SigTermException: if indexing was interrupted by a SIGTERM
+
+        Returns:
+            The resulting ErrorCode, or None if the tarball was skipped and
+            should remain eligible for indexing (for example, because the
+            indexing operation was interrupted by a SIGINT).
+        """
+        idxctx = self.idxctx
+        error_code = self.error_code
+        size = tbinfo.size
+        dataset = tbinfo.dataset
+        tb = tbinfo.tarball
+
+        indexed = self._tmp_file(tmpdir, "indexed")
+        erred = self._tmp_file(tmpdir, "erred")
+        skipped = self._tmp_file(tmpdir, "skipped")
+        # Each worker process of the parallel mode needs its own errors file.
+        ie_filepath = self._tmp_file(tmpdir, f"{os.getpid()}.indexing-errors.json")
+
+        idxctx.logger.info("Starting {} (size {:d})", tb, size)
+        audit = None
+        ptb = None
+        tarobj: Optional[Tarball] = None
+        tb_res = error_code["OK"]
+        try:
+            path = os.path.realpath(tb)
+
+            # Dynamically unpack the tarball for indexing.
+            try:
+                tarobj = self.cache_manager.unpack(dataset.resource_id)
+                if not tarobj.unpacked:
+                    idxctx.logger.warning("{} has not been unpacked", dataset)
+                    return None
+                unpacked = tarobj.cache  # The indexer needs the root
+            except TarballNotFound as e:
+                self.sync.error(
+                    dataset,
+                    f"Unable to unpack dataset: {e!s}",
+                )
+                return None
+
+            audit = Audit.create(
+                operation=OperationCode.UPDATE,
+                name="index",
+                status=AuditStatus.BEGIN,
+                user_name=Audit.BACKGROUND_USER,
+                dataset=dataset,
+            )
+
+            # A dataset which has already been indexed must be re-indexed
+            # with the same document IDs, so that we detect the duplicates.
+            id_version = Metadata.getvalue(dataset, Metadata.DOCUMENT_IDS)
+            if not id_version:
+                if Metadata.getvalue(dataset, Metadata.INDEX_MAP):
+                    id_version = 1
+                else:
+                    id_version = self.id_version
+
+            # "Open" the tar ball represented by the tar ball object
+            idxctx.logger.debug("open tar ball")
+            ptb = PbenchTarBall(
+                idxctx,
+                dataset,
+                path,
+                tmpdir,
+                unpacked,
+                members=tarobj.members,
+                id_version=id_version,
+            )
+
+            # Construct the generator for emitting all actions.
+            # The `idxctx` dictionary is passed along to each
+            # generator so that it can add its context for
+            # error handling to the list.
+            idxctx.logger.debug("generator setup")
+            if self.options.index_tool_data:
+                actions = ptb.mk_tool_data_actions()
+            else:
+                actions = ptb.make_all_actions()
+
+            # Create a file where the pyesbulk package will
+            # record all indexing errors that can't/won't be
+            # retried.
+            with ie_filepath.open(mode="w") as fp:
+                idxctx.logger.debug("begin indexing")
+                try:
+                    signal.signal(signal.SIGINT, sigint_handler)
+                    es_res = es_index(
+                        idxctx.es,
+                        actions,
+                        fp,
+                        idxctx.logger,
+                        idxctx._dbg,
+                    )
+                except SigIntException:
+                    idxctx.logger.exception(
+                        "Indexing interrupted by SIGINT, continuing to next tarball"
+                    )
+                    return None
+                finally:
+                    # Turn off the SIGINT handler when not indexing.
+                    signal.signal(signal.SIGINT, signal.SIG_IGN)
+        except UnsupportedTarballFormat as e:
+            tb_res = self.emit_error(idxctx.logger.warning, "TB_META_ABSENT", e)
+        except BadDate as e:
+            tb_res = self.emit_error(idxctx.logger.warning, "BAD_DATE", e)
+        except FileNotFoundError as e:
+            tb_res = self.emit_error(idxctx.logger.warning, "FILE_NOT_FOUND_ERROR", e)
+        except BadMDLogFormat as e:
+            tb_res = self.emit_error(idxctx.logger.warning, "BAD_METADATA", e)
+        except SigTermException:
+            idxctx.logger.exception("Indexing interrupted by SIGTERM, terminating")
+            raise
+        except Exception as e:
+            tb_res = self.emit_error(idxctx.logger.exception, "GENERIC_ERROR", e)
+        else:
+            beg, end, successes, duplicates, failures, retries = es_res
+            idxctx.logger.info(
+                "done indexing (start ts: {}, end ts: {}, duration:"
+                " {:.2f}s, successes: {:d}, duplicates: {:d},"
+                " failures: {:d}, retries: {:d})",
+                tstos(beg),
+                tstos(end),
+                end - beg,
+                successes,
+                duplicates,
+                failures,
+                retries,
+            )
+            tb_res = error_code["OP_ERROR" if failures > 0 else "OK"]
+        finally:
+            # Remove the unpacked data
+            if tarobj:
+                tarobj.uncache()
+            if tb_res.success:
+                try:
+
+                    # Because we're on the `finally` path, we can get here
+                    # without a PbenchTarBall object, so don't try to write an
+                    # index map if there is none.
+                    if ptb:
+                        # A pbench-index --tool-data follows a pbench-index and
+                        # generates only the tool-specific documents: we want
+                        # to merge that with the existing document map. On the
+                        # other hand, a re-index should replace the entire
+                        # index. We accomplish this by overwriting each
+                        # duplicate index key separately.
+                        try:
+                            map = Metadata.getvalue(dataset, Metadata.INDEX_MAP)
+                            assert type(ptb.index_map) is dict
+                            if map:
+                                assert type(map) is dict
+                                map.update(ptb.index_map)
+                            else:
+                                map = ptb.index_map
+                            Metadata.setvalue(dataset, Metadata.INDEX_MAP, map)
+                            Metadata.setvalue(
+                                dataset, Metadata.DOCUMENT_IDS, ptb.id_version
+                            )
+                        except Exception as e:
+                            idxctx.logger.exception(
+                                "Unexpected Metadata error on {}: {}",
+                                ptb.tbname,
+                                e,
+                            )
+                except DatasetError as e:
+                    idxctx.logger.exception("Dataset error on {}: {}", ptb.tbname, e)
+                except Exception as e:
+                    idxctx.logger.exception("Unexpected error on {}: {}", ptb.tbname, e)
+            if audit:
+                doneness = AuditStatus.SUCCESS
+                attributes = None
+
+                # TODO: can we categorize anything as "WARNING"?
+                if tb_res != error_code["OK"]:
+                    doneness = AuditStatus.FAILURE
+                    attributes = {"message": tb_res.message}
+                Audit.create(root=audit, status=doneness, attributes=attributes)
+        try:
+            ie_len = ie_filepath.stat().st_size
+        except FileNotFoundError:
+            # Above operation never made it to actual indexing, ignore.
+            pass
+        except SigTermException:
+            # Re-raise a SIGTERM to avoid it being lumped in with
+            # general exception handling below.
+            raise
+        except Exception:
+            idxctx.logger.exception(
+                "Unexpected error handling" " indexing errors file: {}",
+                ie_filepath,
+            )
+        else:
+            # Success fetching indexing error file size.
+            if ie_len > len(tb) + 1:
+                try:
+                    self.report.post_status(tstos(end), "errors", ie_filepath)
+                except Exception:
+                    idxctx.logger.exception(
+                        "Unexpected error issuing" " report status with errors: {}",
+                        ie_filepath,
+                    )
+        finally:
+            # Unconditionally remove the indexing errors file.
+            try:
+                os.remove(ie_filepath)
+            except SigTermException:
+                # Re-raise a SIGTERM to avoid it being lumped in with
+                # general exception handling below.
+                raise
+            except Exception:
+                pass
+
+        # Distinguish failure cases, so we can retry the indexing
+        # easily if possible.
+        #
+        # Only if the indexing was successful do we request the
+        # next operation (tool indexing). Otherwise we record
+        # the error in the `server.errors.index` metadata and
+        # leave the dataset in INDEXING state.
+        if tb_res.success:
+            idxctx.logger.info(
+                "{}: {}: success",
+                idxctx.TS,
+                os.path.basename(tb),
+            )
+            # Success
+            with indexed.open(mode="a") as fp:
+                print(tb, file=fp)
+            self.sync.update(
+                dataset=dataset,
+                state=OperationState.OK,
+                enabled=self.enabled,
+            )
+        elif tb_res is error_code["OP_ERROR"]:
+            with erred.open(mode="a") as fp:
+                print(tb, file=fp)
+            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
+        elif tb_res in (error_code["CFG_ERROR"], error_code["BAD_CFG"]):
+            assert False, (
+                f"Unexpected tar ball handling "
+                f"result status {tb_res.value:d} for dataset {dataset}"
+            )
+        elif tb_res.tarball_error:
+            # # Quietly skip these errors
+            with skipped.open(mode="a") as fp:
+                print(tb, file=fp)
+            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
+        else:
+            with erred.open(mode="a") as fp:
+                print(tb, file=fp)
+            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
+        return tb_res
+
+    def _process_serial(self, tb_deque: Deque[TarballData], tmpdir: str):
+        """Index each tarball in turn, in this process.
+
+        Args:
+            tb_deque: the size-sorted tarballs to index
+            tmpdir: the temporary directory for this indexing run
+        """
+        idxctx = self.idxctx
+        erred = self._tmp_file(tmpdir, "erred")
+
+        # We use a list object here so that when we close over this
+        # variable in the handler, the list object will be closed over,
+        # but not its contents.
+        sigquit_interrupt = [False]
+
+        def sigquit_handler(*args):
+            sigquit_interrupt[0] = True
+
+        sighup_interrupt = [False]
+
+        def sighup_handler(*args):
+            sighup_interrupt[0] = True
+
+        signal.signal(signal.SIGQUIT, sigquit_handler)
+        signal.signal(signal.SIGHUP, sighup_handler)
+        count_processed_tb = 0
+
+        try:
+            while len(tb_deque) > 0:
+                tbinfo: TarballData = tb_deque.popleft()
+                count_processed_tb += 1
+                try:
+                    tb_res = self.index_tarball(tbinfo, tmpdir)
+                except SigTermException:
+                    break
+                if tb_res is None:
+                    continue
+
+                idxctx.logger.info(
+                    "Finished{} {} (size {:d})",
+                    "[SIGQUIT]" if sigquit_interrupt[0] else "",
+                    tbinfo.tarball,
+                    tbinfo.size,
+                )
+
+                if sigquit_interrupt[0]:
+                    break
+                if sighup_interrupt[0]:
+                    status, new_tb = self.collect_tb()
+                    if status == 0:
+                        if not set(new_tb).issuperset(tb_deque):
+                            idxctx.logger.info(
+                                "Tarballs previously marked for indexing are no longer present",
+                                set(tb_deque).difference(new_tb),
+                            )
+                        tb_deque = deque(sorted(new_tb))
+                    idxctx.logger.info(
+                        "SIGHUP status (Current tar ball indexed: ({}), Remaining: {}, Completed: {}, Errors_encountered: {}, Status: {})",
+                        Path(tbinfo.tarball).name,
+                        len(tb_deque),
+                        count_processed_tb,
+                        _count_lines(erred),
+                        tb_res,
+                    )
+                    sighup_interrupt[0] = False
+                    continue
+        except SigTermException:
+            idxctx.logger.exception(
+                "Indexing interrupted by SIGQUIT, stop processing tarballs"
+            )
+        finally:
+            # Turn off the SIGQUIT and SIGHUP handler when not indexing.
+            signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def _worker(self, conn: Connection, tmpdir: str):
+        """The main loop of a forked indexing worker process.
+
+        The worker receives (size, resource_id, tarball) work items from the
+        parent over the given pipe, indexes each one using its own database
+        and Elasticsearch connections, and replies with the name of the
+        resulting error code (None if the tarball was skipped). A None work
+        item, or the parent closing its end of the pipe, ends the loop.
+
+        SIGQUIT and SIGHUP are handled by the parent, which controls the
+        distribution of work; a SIGINT interrupts the tarball the worker is
+        currently indexing, and a SIGTERM terminates the worker.
+
+        Args:
+            conn: the worker's end of the pipe to the parent
+            tmpdir: the temporary directory for this indexing run
+        """
+        idxctx = self.idxctx
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        # Don't share the parent's connections: each worker needs its own.
+        Database.reset_after_fork()
+        idxctx.es = get_es(idxctx.config, idxctx.logger)
+        if self.report:
+            self.report.es = idxctx.es
+        idxctx.opctx = []
+
+        try:
+            while True:
+                try:
+                    work = conn.recv()
+                except EOFError:
+                    break
+                if work is None:
+                    break
+                size, resource_id, tb = work
+                try:
+                    dataset = Dataset.query(resource_id=resource_id)
+                except Exception as e:
+                    idxctx.logger.error("Unable to find dataset {}: {}", resource_id, e)
+                    conn.send(None)
+                    continue
+                tb_res = self.index_tarball(
+                    TarballData(size=size, dataset=dataset, tarball=tb), tmpdir
+                )
+                conn.send(tb_res.name if tb_res else None)
+        except SigTermException:
+            pass
+        finally:
+            idxctx.dump_opctx()
+            conn.close()
+
+    def _process_parallel(self, tb_deque: Deque[TarballData], tmpdir: str):
+        """Index tarballs concurrently using a pool of forked worker processes.
+
+        The parent process retains ownership of the size-sorted work queue,
+        handing the next tarball to each worker as it becomes idle. Signals
+        retain their serial mode semantics:
+
+            SIGQUIT: stop handing out work, wait for in-progress tarballs
+            SIGHUP: re-evaluate the list of tarballs to index after the next
+                tarball completes
+            SIGINT: forwarded to busy workers, interrupting the tarballs
+                being indexed
+            SIGTERM: forwarded to all workers, terminating them
+
+        Args:
+            tb_deque: the size-sorted tarballs to index
+            tmpdir: the temporary directory for this indexing run
+        """
+        idxctx = self.idxctx
+        erred = self._tmp_file(tmpdir, "erred")
+        mp = multiprocessing.get_context("fork")
+
+        sigquit_interrupt = [False]
+
+        def sigquit_handler(*args):
+            sigquit_interrupt[0] = True
+
+        sighup_interrupt = [False]
+
+        def sighup_handler(*args):
+            sighup_interrupt[0] = True
+
+        # Maps each worker's pipe to its process and to the tarball it is
+        # currently indexing (None when idle).
+        workers: Dict[Connection, multiprocessing.Process] = {}
+        busy: Dict[Connection, TarballData] = {}
+
+        def sigint_forwarder(*args):
+            for conn in list(busy):
+                os.kill(workers[conn].pid, signal.SIGINT)
+
+        def dispatch(conn: Connection) -> bool:
+            if sigquit_interrupt[0] or not tb_deque:
+                return False
+            tbinfo: TarballData = tb_deque.popleft()
+            busy[conn] = tbinfo
+            conn.send((tbinfo.size, tbinfo.dataset.resource_id, tbinfo.tarball))
+            return True
+
+        for _ in range(min(self.workers, len(tb_deque))):
+            conn, child_conn = mp.Pipe()
+            process = mp.Process(target=self._worker, args=(child_conn, tmpdir))
+            process.start()
+            child_conn.close()
+            workers[conn] = process
+        idxctx.logger.info("Started {:d} indexing workers", len(workers))
+
+        signal.signal(signal.SIGQUIT, sigquit_handler)
+        signal.signal(signal.SIGHUP, sighup_handler)
+        signal.signal(signal.SIGINT, sigint_forwarder)
+        count_processed_tb = 0
+        try:
+            for conn in workers:
+                dispatch(conn)
+            while busy:
+                for conn in wait(list(busy)):
+                    tbinfo = busy.pop(conn)
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        idxctx.logger.error(
+                            "Indexing worker {} exited unexpectedly while indexing {}",
+                            workers[conn].pid,
+                            tbinfo.tarball,
+                        )
+                        continue
+                    count_processed_tb += 1
+                    if result is None:
+                        dispatch(conn)
+                        continue
+
+                    idxctx.logger.info(
+                        "Finished{} {} (size {:d})",
+                        "[SIGQUIT]" if sigquit_interrupt[0] else "",
+                        tbinfo.tarball,
+                        tbinfo.size,
+                    )
+                    if sighup_interrupt[0]:
+                        status, new_tb = self.collect_tb()
+                        if status == 0:
+                            # Don't queue tarballs currently being indexed.
+                            active = {t.dataset.resource_id for t in busy.values()}
+                            tb_deque = deque(
+                                sorted(
+                                    t
+                                    for t in new_tb
+                                    if t.dataset.resource_id not in active
+                                )
+                            )
+                        idxctx.logger.info(
+                            "SIGHUP status (Current tar ball indexed: ({}), Remaining: {}, Completed: {}, Errors_encountered: {}, Status: {})",
+                            Path(tbinfo.tarball).name,
+                            len(tb_deque),
+                            count_processed_tb,
+                            _count_lines(erred),
+                            self.error_code[result],
+                        )
+                        sighup_interrupt[0] = False
+                    dispatch(conn)
+        except SigTermException:
+            idxctx.logger.exception("Indexing interrupted by SIGTERM, terminating")
+            for process in workers.values():
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+        finally:
+            signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            for conn, process in workers.items():
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                conn.close()
+                process.join()
+
     def process_tb(self, tarballs: List[TarballData]) -> int:
         """Process Tarballs For Indexing and create a summary report.
 
+        When the `[pbench-index]` configuration section specifies more than
+        one worker, the tarballs are indexed concurrently by a pool of worker
+        processes; otherwise they are indexed serially by this process.
+
         Args:
             tarballs:   List of tarball information tuples
 
@@ -318,6 +877,9 @@ class Index:
         ) as tmpdir:
             idxctx.logger.debug("start processing list of tar balls")
             tb_list = Path(tmpdir, f"{self.name}.{idxctx.TS}.list")
+            indexed = self._tmp_file(tmpdir, "indexed")
+            erred = self._tmp_file(tmpdir, "erred")
+            skipped = self._tmp_file(tmpdir, "skipped")
             try:
                 with tb_list.open(mode="w") as lfp:
                     # Write out all the tar balls we are processing so external
@@ -325,317 +887,10 @@ class Index:
                     for size, dataset, tb in tarballs:
                         print(f"{size:20d} {dataset.name} {tb}", file=lfp)
 
-                indexed = Path(tmpdir, f"{self.name}.{idxctx.TS}.indexed")
-                erred = Path(tmpdir, f"{self.name}.{idxctx.TS}.erred")
-                skipped = Path(tmpdir, f"{self.name}.{idxctx.TS}.skipped")
-                ie_filepath = Path(
-                    tmpdir, f"{self.name}.{idxctx.TS}.indexing-errors.json"
-                )
-
-                # We use a list object here so that when we close over this
-                # variable in the handler, the list object will be closed over,
-                # but not its contents.
-                sigquit_interrupt = [False]
-
-                def sigquit_handler(*args):
-                    sigquit_interrupt[0] = True
-
-                sighup_interrupt = [False]
-
-                def sighup_handler(*args):
-                    sighup_interrupt[0] = True
-
-                signal.signal(signal.SIGQUIT, sigquit_handler)
-                signal.signal(signal.SIGHUP, sighup_handler)
-                count_processed_tb = 0
-
-                try:
-                    while len(tb_deque) > 0:
-                        tbinfo: TarballData = tb_deque.popleft()
-                        size = tbinfo.size
-                        dataset = tbinfo.dataset
-                        tb = tbinfo.tarball
-                        count_processed_tb += 1
-
-                        idxctx.logger.info("Starting {} (size {:d})", tb, size)
-                        audit = None
-                        ptb = None
-                        tarobj: Optional[Tarball] = None
-                        tb_res = error_code["OK"]
-                        try:
-                            path = os.path.realpath(tb)
-
-                            # Dynamically unpack the tarball for indexing.
-                            try:
-                                tarobj = self.cache_manager.unpack(dataset.resource_id)
-                                if not tarobj.unpacked:
-                                    idxctx.logger.warning(
-                                        "{} has not been unpacked", dataset
-                                    )
-                                    continue
-                                unpacked = tarobj.cache  # The indexer needs the root
-                            except TarballNotFound as e:
-                                self.sync.error(
-                                    dataset,
-                                    f"Unable to unpack dataset: {e!s}",
-                                )
-                                continue
-
-                            audit = Audit.create(
-                                operation=OperationCode.UPDATE,
-                                name="index",
-                                status=AuditStatus.BEGIN,
-                                user_name=Audit.BACKGROUND_USER,
-                                dataset=dataset,
-                            )
-
-                            # "Open" the tar ball represented by the tar ball object
-                            idxctx.logger.debug("open tar ball")
-                            ptb = PbenchTarBall(idxctx, dataset, path, tmpdir, unpacked)
-
-                            # Construct the generator for emitting all actions.
-                            # The `idxctx` dictionary is passed along to each
-                            # generator so that it can add its context for
-                            # error handling to the list.
-                            idxctx.logger.debug("generator setup")
-                            if self.options.index_tool_data:
-                                actions = ptb.mk_tool_data_actions()
-                            else:
-                                actions = ptb.make_all_actions()
-
-                            # Create a file where the pyesbulk package will
-                            # record all indexing errors that can't/won't be
-                            # retried.
-                            with ie_filepath.open(mode="w") as fp:
-                                idxctx.logger.debug("begin indexing")
-                                try:
-                                    signal.signal(signal.SIGINT, sigint_handler)
-                                    es_res = es_index(
-                                        idxctx.es,
-                                        actions,
-                                        fp,
-                                        idxctx.logger,
-                                        idxctx._dbg,
-                                    )
-                                except SigIntException:
-                                    idxctx.logger.exception(
-                                        "Indexing interrupted by SIGINT, continuing to next tarball"
-                                    )
-                                    continue
-                                finally:
-                                    # Turn off the SIGINT handler when not indexing.
-                                    signal.signal(signal.SIGINT, signal.SIG_IGN)
-                        except UnsupportedTarballFormat as e:
-                            tb_res = self.emit_error(
-                                idxctx.logger.warning, "TB_META_ABSENT", e
-                            )
-                        except BadDate as e:
-                            tb_res = self.emit_error(
-                                idxctx.logger.warning, "BAD_DATE", e
-                            )
-                        except FileNotFoundError as e:
-                            tb_res = self.emit_error(
-                                idxctx.logger.warning, "FILE_NOT_FOUND_ERROR", e
-                            )
-                        except BadMDLogFormat as e:
-                            tb_res = self.emit_error(
-                                idxctx.logger.warning, "BAD_METADATA", e
-                            )
-                        except SigTermException:
-                            idxctx.logger.exception(
-                                "Indexing interrupted by SIGTERM, terminating"
-                            )
-                            break
-                        except Exception as e:
-                            tb_res = self.emit_error(
-                                idxctx.logger.exception, "GENERIC_ERROR", e
-                            )
-                        else:
-                            beg, end, successes, duplicates, failures, retries = es_res
-                            idxctx.logger.info(
-                                "done indexing (start ts: {}, end ts: {}, duration:"
-                                " {:.2f}s, successes: {:d}, duplicates: {:d},"
-                                " failures: {:d}, retries: {:d})",
-                                tstos(beg),
-                                tstos(end),
-                                end - beg,
-                                successes,
-                                duplicates,
-                                failures,
-                                retries,
-                            )
-                            tb_res = error_code["OP_ERROR" if failures > 0 else "OK"]
-                        finally:
-                            # Remove the unpacked data
-                            if tarobj:
-                                tarobj.uncache()
-                            if tb_res.success:
-                                try:
-
-                                    # Because we're on the `finally` path, we
-                                    # can get here without a PbenchTarBall
-                                    # object, so don't try to write an index
-                                    # map if there is none.
-                                    if ptb:
-                                        # A pbench-index --tool-data follows a
-                                        # pbench-index and generates only the
-                                        # tool-specific documents: we want to
-                                        # merge that with the existing document
-                                        # map. On the other hand, a re-index
-                                        # should replace the entire index. We
-                                        # accomplish this by overwriting each
-                                        # duplicate index key separately.
-                                        try:
-                                            map = Metadata.getvalue(
-                                                dataset, Metadata.INDEX_MAP
-                                            )
-                                            assert type(ptb.index_map) is dict
-                                            if map:
-                                                assert type(map) is dict
-                                                map.update(ptb.index_map)
-                                            else:
-                                                map = ptb.index_map
-                                            Metadata.setvalue(
-                                                dataset, Metadata.INDEX_MAP, map
-                                            )
-                                        except Exception as e:
-                                            idxctx.logger.exception(
-                                                "Unexpected Metadata error on {}: {}",
-                                                ptb.tbname,
-                                                e,
-                                            )
-                                except DatasetError as e:
-                                    idxctx.logger.exception(
-                                        "Dataset error on {}: {}", ptb.tbname, e
-                                    )
-                                except Exception as e:
-                                    idxctx.logger.exception(
-                                        "Unexpected error on {}: {}", ptb.tbname, e
-                                    )
-                            if audit:
-                                doneness = AuditStatus.SUCCESS
-                                attributes = None
-
-                                # TODO: can we categorize anything as "WARNING"?
-                                if tb_res != error_code["OK"]:
-                                    doneness = AuditStatus.FAILURE
-                                    attributes = {"message": tb_res.message}
-                                Audit.create(
-                                    root=audit, status=doneness, attributes=attributes
-                                )
-                        try:
-                            ie_len = ie_filepath.stat().st_size
-                        except FileNotFoundError:
-                            # Above operation never made it to actual indexing, ignore.
-                            pass
-                        except SigTermException:
-                            # Re-raise a SIGTERM to avoid it being lumped in with
-                            # general exception handling below.
-                            raise
-                        except Exception:
-                            idxctx.logger.exception(
-                                "Unexpected error handling" " indexing errors file: {}",
-                                ie_filepath,
-                            )
-                        else:
-                            # Success fetching indexing error file size.
-                            if ie_len > len(tb) + 1:
-                                try:
-                                    self.report.post_status(
-                                        tstos(end), "errors", ie_filepath
-                                    )
-                                except Exception:
-                                    idxctx.logger.exception(
-                                        "Unexpected error issuing"
-                                        " report status with errors: {}",
-                                        ie_filepath,
-                                    )
-                        finally:
-                            # Unconditionally remove the indexing errors file.
-                            try:
-                                os.remove(ie_filepath)
-                            except SigTermException:
-                                # Re-raise a SIGTERM to avoid it being lumped in with
-                                # general exception handling below.
-                                raise
-                            except Exception:
-                                pass
-
-                        # Distinguish failure cases, so we can retry the indexing
-                        # easily if possible.
-                        #
-                        # Only if the indexing was successful do we request the
-                        # next operation (tool indexing). Otherwise we record
-                        # the error in the `server.errors.index` metadata and
-                        # leave the dataset in INDEXING state.
-                        if tb_res.success:
-                            idxctx.logger.info(
-                                "{}: {}: success",
-                                idxctx.TS,
-                                os.path.basename(tb),
-                            )
-                            # Success
-                            with indexed.open(mode="a") as fp:
-                                print(tb, file=fp)
-                            self.sync.update(
-                                dataset=dataset,
-                                state=OperationState.OK,
-                                enabled=self.enabled,
-                            )
-                        elif tb_res is error_code["OP_ERROR"]:
-                            with erred.open(mode="a") as fp:
-                                print(tb, file=fp)
-                            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
-                        elif tb_res in (error_code["CFG_ERROR"], error_code["BAD_CFG"]):
-                            assert False, (
-                                f"Unexpected tar ball handling "
-                                f"result status {tb_res.value:d} for dataset {dataset}"
-                            )
-                        elif tb_res.tarball_error:
-                            # # Quietly skip these errors
-                            with skipped.open(mode="a") as fp:
-                                print(tb, file=fp)
-                            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
-                        else:
-                            with erred.open(mode="a") as fp:
-                                print(tb, file=fp)
-                            self.sync.error(dataset, f"{tb_res.value}:{tb_res.message}")
-                        idxctx.logger.info(
-                            "Finished{} {} (size {:d})",
-                            "[SIGQUIT]" if sigquit_interrupt[0] else "",
-                            tb,
-                            size,
-                        )
-
-                        if sigquit_interrupt[0]:
-                            break
-                        if sighup_interrupt[0]:
-                            status, new_tb = self.collect_tb()
-                            if status == 0:
-                                if not set(new_tb).issuperset(tb_deque):
-                                    idxctx.logger.info(
-                                        "Tarballs previously marked for indexing are no longer present",
-                                        set(tb_deque).difference(new_tb),
-                                    )
-                                tb_deque = deque(sorted(new_tb))
-                            idxctx.logger.info(
-                                "SIGHUP status (Current tar ball indexed: ({}), Remaining: {}, Completed: {}, Errors_encountered: {}, Status: {})",
-                                Path(tb).name,
-                                len(tb_deque),
-                                count_processed_tb,
-                                _count_lines(erred),
-                                tb_res,
-                            )
-                            sighup_interrupt[0] = False
-                            continue
-                except SigTermException:
-                    idxctx.logger.exception(
-                        "Indexing interrupted by SIGQUIT, stop processing tarballs"
-                    )
-                finally:
-                    # Turn off the SIGQUIT and SIGHUP handler when not indexing.
-                    signal.signal(signal.SIGQUIT, signal.SIG_IGN)
-                    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                if self.workers > 1 and len(tb_deque) > 1:
+                    self._process_parallel(tb_deque, tmpdir)
+                else:
+                    self._process_serial(tb_deque, tmpdir)
             except SigTermException:
                 # Re-raise a SIGTERM to avoid it being lumped in with general
                 # exception handling below.
@@ -0,0 +1,466 @@
+"""Background transfers of dataset tarballs from relay servers.
+
+The relay API validates the relay manifest of a tarball and creates the new
+dataset, but streaming a large tarball from the relay server would tie up a
+server process for as long as the transfer takes; when many agents relay
+their results at once, the server would run out of processes for other API
+calls. The API therefore only marks the UPLOAD operation of the new dataset
+READY, recording the relay URI and name of the tarball with it; the
+`pbench-relay-pull` worker then performs the queued transfers here, a bounded
+number at a time, and completes the intake of the datasets, reporting their
+progress and outcome through the operation's state and message (the
+"dataset.operations" metadata).
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+from http import HTTPStatus
+from logging import Logger
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Optional
+
+from humanize import naturalsize
+import requests
+from urllib3.exceptions import HTTPError
+
+from pbench.common.utils import Cleanup
+from pbench.server import JSONOBJECT, OperationCode, PbenchServerConfig
+from pbench.server.cache_manager import CacheManager, DuplicateTarball, MetadataError
+from pbench.server.database.models.audit import Audit, AuditReason, AuditStatus
+from pbench.server.database.models.datasets import (
+    Dataset,
+    Metadata,
+    OperationName,
+    OperationState,
+)
+from pbench.server.sync import Sync
+
+
+class RelayPullError(Exception):
+    """A failure to transfer a tarball which retrying won't fix"""
+
+
+class RelayRetry(Exception):
+    """A failure to transfer a tarball which may be retried"""
+
+
+class RelayPull:
+    """Perform the queued transfers of dataset tarballs from relay servers.
+
+    Each transfer is described by the parameters recorded with the READY
+    UPLOAD operation of the dataset:
+
+        {
+            "uri": <relay URI of the tarball>,
+            "name": <tarball file name>,
+            "audit": <ID of the root audit record of the relay API call>,
+            "attributes": <audit attributes of the relay API call>
+        }
+
+    The tarballs are transferred by a pool of threads, each reusing its
+    connections to the relay servers; an interrupted transfer is retried,
+    resuming from the data already received. All database operations are
+    performed by the thread calling `run`.
+    """
+
+    # Size of the chunks read from the relay server
+    CHUNK_SIZE = 65536
+
+    # Defaults for the number of concurrent transfers, the number of times a
+    # failed transfer is retried, and the number of seconds to wait for data
+    # from a relay server
+    WORKERS = 4
+    RETRIES = 5
+    TIMEOUT = 60
+
+    # Delay, in seconds, before the first retry of a failed transfer, doubled
+    # for each further retry
+    DELAY = 1.0
+
+    def __init__(self, config: PbenchServerConfig, logger: Logger):
+        self.config = config
+        self.logger = logger
+        self.temporary = config.ARCHIVE / CacheManager.TEMPORARY
+        self.workers = config.getint(
+            "pbench-server", "relay-pull-workers", fallback=self.WORKERS
+        )
+        self.retries = config.getint(
+            "pbench-server", "relay-pull-retries", fallback=self.RETRIES
+        )
+        self.timeout = config.getint(
+            "pbench-server", "relay-pull-timeout", fallback=self.TIMEOUT
+        )
+        self.sync = Sync(logger, OperationName.UPLOAD)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="relay-pull"
+        )
+        self.local = threading.local()
+
+        # The dataset of each transfer in progress, and the counts of bytes
+        # received and expected by each (by resource ID), as updated by the
+        # transfer threads and last reported
+        self.transfers: dict[Future, Dataset] = {}
+        self.progress: dict[str, tuple[int, int]] = {}
+        self.reported: dict[str, tuple[int, int]] = {}
+
+    def session(self) -> requests.Session:
+        """Return the requests session of the current thread, so that each
+        thread reuses its connections to the relay servers.
+
+        Returns:
+            A requests session
+        """
+        session = getattr(self.local, "session", None)
+        if not session:
+            session = requests.Session()
+            self.local.session = session
+        return session
+
+    def recover(self) -> int:
+        """Queue again any transfers interrupted by stopping the worker.
+
+        Returns:
+            The number of transfers queued again
+        """
+        datasets = self.sync.next(OperationState.WORKING)
+        for dataset in datasets:
+            self.sync.update(
+                dataset=dataset, state=OperationState.READY, message="Requeued"
+            )
+        return len(datasets)
+
+    def run(self) -> int:
+        """Start the currently queued transfers, report the progress of those
+        in progress, and complete those which have finished.
+
+        Returns:
+            The number of transfers completed
+        """
+        for dataset in self.sync.next():
+            try:
+                self.start(dataset)
+            except Exception as e:
+                self.logger.exception("Unexpected error on relay {}: {}", dataset, e)
+                self.sync.error(dataset, f"Unexpected error: {e!s}")
+        done = 0
+        for future, dataset in list(self.transfers.items()):
+            if future.done():
+                del self.transfers[future]
+                self.progress.pop(dataset.resource_id, None)
+                self.reported.pop(dataset.resource_id, None)
+                self.complete(dataset, future)
+                done += 1
+            else:
+                self.report(dataset)
+        return done
+
+    def start(self, dataset: Dataset):
+        """Start the queued transfer of a dataset's tarball.
+
+        Args:
+            dataset: The dataset
+        """
+        params = self.sync.params(dataset) or {}
+        try:
+            uri = params["uri"]
+            name = params["name"]
+        except KeyError as e:
+            self.fail(dataset, params, f"Relay parameter {e!s} is missing")
+            return
+        path = self.temporary / dataset.resource_id / name
+        self.sync.update(
+            dataset=dataset, state=OperationState.WORKING, message="Transferring"
+        )
+        future = self.executor.submit(self.pull, uri, path, dataset.resource_id)
+        self.transfers[future] = dataset
+
+    def report(self, dataset: Dataset):
+        """Report the progress of a dataset's transfer, if it has changed.
+
+        Args:
+            dataset: The dataset
+        """
+        progress = self.progress.get(dataset.resource_id)
+        if progress and progress != self.reported.get(dataset.resource_id):
+            self.reported[dataset.resource_id] = progress
+            self.sync.update(
+                dataset=dataset,
+                message=f"{naturalsize(progress[0])} of {naturalsize(progress[1])} received",
+            )
+
+    def pull(self, uri: str, path: Path, md5: str):
+        """Transfer a tarball from a relay server, retrying the transfer on
+        failure, and verify its MD5 hash.
+
+        NOTE: this runs in a thread of the pool, so it must not use the
+        database.
+
+        Args:
+            uri: The relay URI of the tarball
+            path: The file to which the tarball is transferred
+            md5: The MD5 hash of the tarball, which is the dataset's resource
+                ID
+
+        Raises:
+            RelayPullError on failure
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        attempt = 0
+        while True:
+            try:
+                digest = self.transfer(uri, path, md5)
+                break
+            except (RelayRetry, requests.RequestException, HTTPError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise RelayPullError(
+                        f"Unable to retrieve relay tarball after {attempt} attempts: {e!s}"
+                    ) from e
+                self.logger.warning(
+                    "Retrying transfer of {} ({}): {}", uri, attempt, str(e)
+                )
+                time.sleep(self.DELAY * 2 ** (attempt - 1))
+        if digest != md5:
+            path.unlink()
+            raise RelayPullError(f"MD5 checksum {digest} does not match expected {md5}")
+
+    def transfer(self, uri: str, path: Path, md5: str) -> str:
+        """Transfer a tarball from a relay server, resuming a partial
+        transfer.
+
+        If the file already holds part of the tarball, we ask the relay server
+        for the rest of it, with a range request; if the server sends the
+        whole tarball instead, we start over.
+
+        Args:
+            uri: The relay URI of the tarball
+            path: The file to which the tarball is transferred
+            md5: The resource ID of the dataset, which identifies its progress
+
+        Raises:
+            RelayRetry, or a requests or urllib3 exception, on a failure which
+            may be retried; RelayPullError on any other failure
+
+        Returns:
+            The MD5 hash of the transferred tarball
+        """
+        hash_md5 = hashlib.md5()
+        offset = path.stat().st_size if path.exists() else 0
+        headers = {"Accept": "application/octet-stream"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        with self.session().get(
+            uri, stream=True, headers=headers, timeout=self.timeout
+        ) as response:
+            if offset and response.status_code == HTTPStatus.PARTIAL_CONTENT:
+                mode = "ab"
+            elif offset and (
+                response.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+            ):
+                # We may already have the whole tarball; otherwise the partial
+                # file doesn't match the tarball, and we start over.
+                if response.headers.get("Content-Range") == f"bytes */{offset}":
+                    self._hash(path, hash_md5)
+                    return hash_md5.hexdigest()
+                path.unlink()
+                raise RelayRetry(f"Unable to resume at {offset} bytes")
+            elif response.ok:
+                offset = 0
+                mode = "wb"
+            elif (
+                response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+                or response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+            ):
+                raise RelayRetry(f"Relay server problem: {response.reason!r}")
+            else:
+                raise RelayPullError(
+                    f"Unable to retrieve relay tarball: {response.reason!r}"
+                )
+
+            try:
+                length = offset + int(response.headers["Content-length"])
+            except Exception as e:
+                raise RelayPullError(
+                    f"Unable to retrieve relay tarball: {str(e)!r}"
+                ) from e
+
+            if mode == "ab":
+                self._hash(path, hash_md5)
+            received = offset
+            with path.open(mode=mode) as ofp:
+                while True:
+                    chunk = response.raw.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    ofp.write(chunk)
+                    hash_md5.update(chunk)
+                    received += len(chunk)
+                    self.progress[md5] = (received, length)
+
+        if received != length:
+            raise RelayRetry(f"Expected {length} bytes but received {received} bytes")
+        return hash_md5.hexdigest()
+
+    def _hash(self, path: Path, hash_md5: "hashlib._Hash"):
+        """Add the contents of a file to an MD5 hash.
+
+        Args:
+            path: The file
+            hash_md5: The MD5 hash object
+        """
+        with path.open(mode="rb") as ifp:
+            while True:
+                chunk = ifp.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                hash_md5.update(chunk)
+
+    def complete(self, dataset: Dataset, future: Future):
+        """Complete the intake of a dataset once its transfer has finished.
+
+        The tarball is moved into the ARCHIVE tree, the dataset's metalog is
+        recorded, and the dataset is made ready for indexing, just as when
+        the tarball is uploaded.
+
+        Args:
+            dataset: The dataset
+            future: The finished transfer
+        """
+        params = self.sync.params(dataset) or {}
+        attributes: JSONOBJECT = params.get("attributes") or {}
+        directory = self.temporary / dataset.resource_id
+        recovery = Cleanup(self.logger)
+        try:
+            future.result()
+            self.store(dataset, directory / params["name"], attributes, recovery)
+        except Exception as e:
+            if isinstance(e, RelayPullError):
+                message = str(e)
+                reason = AuditReason.CONSISTENCY
+                self.logger.warning("Relay of {} failed: {}", dataset, message)
+            else:
+                message = f"Unexpected error: {e!s}"
+                reason = AuditReason.INTERNAL
+                self.logger.exception("Relay of {} failed: {}", dataset, e)
+            recovery.cleanup()
+            self.fail(dataset, params, message, reason)
+            return
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        should_index = not Metadata.getvalue(
+            dataset=dataset, key=Metadata.SERVER_ARCHIVE
+        )
+        self.sync.update(
+            dataset=dataset,
+            state=OperationState.OK,
+            message="Done",
+            enabled=[OperationName.INDEX] if should_index else None,
+        )
+        self.audit(dataset, params, AuditStatus.SUCCESS, attributes)
+        self.logger.info("Relay of {} completed", dataset)
+
+    def store(
+        self,
+        dataset: Dataset,
+        path: Path,
+        attributes: JSONOBJECT,
+        recovery: Cleanup,
+    ):
+        """Move a transferred tarball into the ARCHIVE tree and record its
+        metalog.
+
+        If the tarball has no metadata.log file, we record a minimal metalog
+        identifying the dataset as a "foreign" benchmark script, and disable
+        indexing, which requires the metadata.
+
+        Args:
+            dataset: The dataset
+            path: The transferred tarball
+            attributes: The audit attributes of the relay
+            recovery: The actions to undo the steps taken on failure
+
+        Raises:
+            RelayPullError if the tarball is a duplicate or is invalid
+        """
+        Path(f"{path}.md5").write_text(f"{dataset.resource_id} {path.name}\n")
+        cache_m = CacheManager.get_instance(self.config, self.logger)
+        try:
+            tarball = cache_m.create(path)
+        except DuplicateTarball as e:
+            raise RelayPullError(
+                f"A tarball with the name {dataset.name!r} already exists"
+            ) from e
+        except MetadataError as e:
+            raise RelayPullError(
+                f"Tarball {dataset.name!r} is invalid or missing required metadata.log: {e}"
+            ) from e
+        recovery.add(tarball.delete)
+
+        metalog = tarball.metadata
+        if not metalog:
+            metalog = {"pbench": {"script": "Foreign"}}
+            Metadata.setvalue(dataset=dataset, key=Metadata.SERVER_ARCHIVE, value=True)
+            attributes["missing_metadata"] = True
+        Metadata.create(dataset=dataset, key=Metadata.METALOG, value=metalog)
+        Metadata.setvalue(
+            dataset=dataset,
+            key=Metadata.TARBALL_PATH,
+            value=str(tarball.tarball_path),
+        )
+
+    def fail(
+        self,
+        dataset: Dataset,
+        params: JSONOBJECT,
+        message: str,
+        reason: AuditReason = AuditReason.CONSISTENCY,
+    ):
+        """Record the failure of a dataset's relay.
+
+        The dataset is left with a FAILED UPLOAD operation reporting the
+        problem; relaying or uploading the tarball again replaces it.
+
+        Args:
+            dataset: The dataset
+            params: The parameters of the relay
+            message: The failure message
+            reason: The audit reason of the failure
+        """
+        self.sync.error(dataset, message)
+        self.audit(dataset, params, AuditStatus.FAILURE, {"message": message}, reason)
+
+    def audit(
+        self,
+        dataset: Dataset,
+        params: JSONOBJECT,
+        status: AuditStatus,
+        attributes: JSONOBJECT,
+        reason: Optional[AuditReason] = None,
+    ):
+        """Finish the audit of a dataset's relay, started by the relay API.
+
+        Args:
+            dataset: The dataset
+            params: The parameters of the relay
+            status: The audit status
+            attributes: The audit attributes
+            reason: The audit reason of a failure
+        """
+        root = None
+        if params.get("audit"):
+            roots = Audit.query(id=params["audit"])
+            root = roots[0] if roots else None
+        Audit.create(
+            root=root,
+            operation=OperationCode.CREATE,
+            name="relay",
+            dataset=dataset,
+            user_name=None if root else Audit.BACKGROUND_USER,
+            status=status,
+            reason=reason,
+            attributes=attributes,
+        )
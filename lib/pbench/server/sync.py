@@ -4,6 +4,7 @@ from typing import Optional
 
 from sqlalchemy import or_
 
+from pbench.server import JSONOBJECT
 from pbench.server.database.database import Database
 from pbench.server.database.models.datasets import (
     Dataset,
@@ -39,10 +40,10 @@ class Sync:
     def __str__(self) -> str:
         return f"<Synchronizer for component {self.component.name!r}>"
 
-    def next(self) -> list[Dataset]:
+    def next(self, state: OperationState = OperationState.READY) -> list[Dataset]:
         """
         This is a specialized query to return a list of datasets with the READY
-        OperationState for the Sync component.
+        (or another) OperationState for the Sync component.
 
         NOTE:
 
@@ -57,16 +58,19 @@ class Sync:
         transporting only the resource IDs across the barrier and fetching
         new proxy objects using the general session.
 
+        Args:
+            state: The OperationState of the component Operation
+
         Returns:
             A list of Dataset objects which have an associated
-            Operation object in READY state.
+            Operation object in the state.
         """
         try:
             with Database.maker.begin() as session:
                 query = session.query(Dataset).join(Operation)
                 query = query.filter(
                     Operation.name == self.component,
-                    Operation.state == OperationState.READY,
+                    Operation.state == state,
                 )
                 query = query.order_by(Dataset.resource_id)
                 Database.dump_query(query, self.logger)
@@ -82,6 +86,7 @@ class Sync:
         state: Optional[OperationState] = None,
         enabled: Optional[list[OperationName]] = None,
         message: Optional[str] = None,
+        params: Optional[JSONOBJECT] = None,
     ):
         """Advertise the operations for which the dataset is now ready.
 
@@ -91,6 +96,8 @@ class Sync:
             enabled: A list (if any) of operations for which the dataset is now
                 eligible.
             message: An optional status message
+            params: Optional parameters of the component Operation, for the
+                component which will perform it
         """
 
         if enabled is None:
@@ -113,7 +120,7 @@ class Sync:
         # of SQLAlchemy AUTOFLUSH semantics, we're going to gather a set of all
         # the operation rows we might need to update at the beginning.
         match_set: set[OperationName] = set()
-        if state or message:
+        if state or message or params:
             match_set.add(self.component)
         if enabled:
             match_set.update(enabled)
@@ -130,19 +137,22 @@ class Sync:
                     matches = query.all()
                     ops: dict[OperationName, Operation] = {o.name: o for o in matches}
 
-                    if state or message:
+                    if state or message or params:
                         op: Operation = ops.get(self.component)
                         if op:
                             if state:
                                 op.state = state
                             if message:
                                 op.message = message
+                            if params:
+                                op.params = params
                         else:
                             op = Operation(
                                 dataset_ref=ds_id,
                                 name=self.component,
                                 state=state if state else OperationState.FAILED,
                                 message=message,
+                                params=params,
                             )
                             session.add(op)
 
@@ -168,6 +178,30 @@ class Sync:
             time.sleep(self.DELAY)
         raise SyncSqlError(self.component, "update") from last_error
 
+    def params(self, dataset: Dataset) -> Optional[JSONOBJECT]:
+        """Return the parameters of the component Operation of a dataset.
+
+        Args:
+            dataset: The dataset
+
+        Returns:
+            The parameters recorded by `update`, or None
+        """
+        try:
+            with Database.maker.begin() as session:
+                op = (
+                    session.query(Operation)
+                    .filter(
+                        Operation.name == self.component,
+                        Operation.dataset_ref == dataset.id,
+                    )
+                    .first()
+                )
+                return op.params if op else None
+        except Exception as e:
+            self.logger.exception("Failed to find 'params' for {}", self.component.name)
+            raise SyncSqlError(self.component, "params") from e
+
     def error(self, dataset: Dataset, message: str):
         """
         Record an error in the component for which the Sync object was created.
@@ -121,7 +121,7 @@ class TestPut:
         ), f"upload returned unexpected status {response.status_code}, {response.text}"
         assert (
             response.json()["message"]
-            == "File extension not supported, must be .tar.xz"
+            == "File extension not supported, must be one of .tar.xz, .tar.zst, .tar"
         )
 
     @staticmethod
@@ -127,11 +127,18 @@ class TestCopyResults:
 
     @responses.activate
     @pytest.mark.parametrize("access", ("public", "private", None))
-    def test_relay(self, access: str, monkeypatch, agent_logger):
+    @pytest.mark.parametrize("known", (True, False))
+    def test_relay(self, access: str, known: bool, monkeypatch, agent_logger):
+        """Test a push to a relay server, with the SHA256 hash of the tar ball
+        given by the caller (in which case a made-up value shows that it isn't
+        computed again) or computed by the push.
+        """
         tb_name = "test_tarball.tar.xz"
         tb_contents = b"I'm a result!"
         metadata = ["dataset.name:foo", "global.server:FOO"]
-        sha256 = hashlib.sha256(tb_contents).hexdigest()
+        sha256 = (
+            "0123456789abcdef" if known else hashlib.sha256(tb_contents).hexdigest()
+        )
         md5 = hashlib.md5(tb_contents).hexdigest()
         uri = "http://relay.example.com"
 
@@ -167,7 +174,7 @@ class TestCopyResults:
             )
 
             res = CopyResultToRelay(agent_logger, uri, access, metadata).push(
-                Path(tb_name), md5
+                Path(tb_name), md5, sha256 if known else None
             )
 
         assert res.status_code == HTTPStatus.CREATED
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import logging
 import os
 from pathlib import Path
@@ -8,8 +9,9 @@ import tempfile
 import pytest
 
 from pbench.agent import PbenchAgentConfig
-from pbench.agent.results import MakeResultTb
+from pbench.agent.results import MakeResultTb, tarball_record
 from pbench.common import MetadataLog
+from pbench.common.compression import get_codec
 from pbench.common.utils import md5sum
 from pbench.test.unit.agent.task.common import MockDatetime
 
@@ -97,20 +99,31 @@ class TestMakeResultTb:
                 )
                 mrt.make_result_tb()
 
-    def test_make_tb(self, monkeypatch, agent_logger):
+    @pytest.mark.parametrize(
+        "compression,suffix", (("xz", ".tar.xz"), ("xz:1", ".tar.xz"), ("none", ".tar"))
+    )
+    def test_make_tb(self, monkeypatch, agent_logger, compression, suffix):
         monkeypatch.setattr(datetime, "datetime", MockDatetime)
-        expected_tb = self.target_dir / f"{self.name}.tar.xz"
+        self.config.compression = get_codec(compression)
+        expected_tb = self.target_dir / f"{self.name}{suffix}"
         mrt = MakeResultTb(
             self.result_dir, self.target_dir, self.controller, self.config, agent_logger
         )
-        tarball, tarball_len, tarball_md5 = mrt.make_result_tb()
+        tarball, tarball_len, tarball_md5, tarball_sha256 = mrt.make_result_tb()
         assert tarball.samefile(expected_tb), f"{tarball} {expected_tb}"
         assert tarball.exists()
         assert tarball.stat().st_size == tarball_len and tarball_len > 0
         calc_len, calc_md5 = md5sum(tarball)
         assert tarball_len == calc_len
         assert calc_md5 == tarball_md5
-        with tarfile.open(str(tarball), "r:xz") as tf:
+        assert hashlib.sha256(tarball.read_bytes()).hexdigest() == tarball_sha256
+        assert tarball_record(tarball) == (
+            tarball,
+            tarball_len,
+            tarball_md5,
+            tarball_sha256,
+        )
+        with tarfile.open(str(tarball), "r:*") as tf:
             for tf_entry in tf:
                 assert tf_entry.name.startswith(
                     self.name
@@ -45,6 +45,9 @@ class TestResultsMove:
     DELY_SWITCH = "--delete"
     DELN_SWITCH = "--no-delete"
     XZST_SWITCH = "--xz-single-threaded"
+    PIPE_SWITCH = "--pipeline"
+    PKGJ_SWITCH = "--package-jobs"
+    UPLJ_SWITCH = "--upload-jobs"
     RELAY_SWITCH = "--relay"
     SRVR_SWITCH = "--server"
     CTRL_TEXT = "ctrl"
@@ -382,3 +385,95 @@ class TestResultsMove:
         )
         # This should raise an unexpected exception if it was not created.
         (pbrun / f"{name}.copied").unlink()
+
+    @staticmethod
+    def make_runs(pbrun, count: int) -> list:
+        """Make the given number of result directories, returning their names"""
+        names = []
+        for i in range(count):
+            script = "pbench-user-benchmark"
+            config = f"test-results-move-{i}"
+            date = "YYYY.MM.DDTHH.MM.SS"
+            name = f"{script}_{config}_{date}"
+            res_dir = pbrun / name
+            res_dir.mkdir(parents=True, exist_ok=True)
+            (res_dir / "metadata.log").write_text(mdlog_tmpl.format(**locals()))
+            names.append(name)
+        return names
+
+    @staticmethod
+    @responses.activate
+    def test_results_move_pipeline(monkeypatch, caplog, setup):
+        monkeypatch.setenv("_pbench_full_hostname", "localhost")
+        monkeypatch.setattr(datetime, "datetime", MockDatetime)
+        pbrun = setup["tmp"] / "var" / "lib" / "pbench-agent"
+        names = TestResultsMove.make_runs(pbrun, 5)
+        for name in names:
+            responses.add(
+                responses.PUT,
+                f"{TestResultsMove.URL}/upload/{name}.tar.xz",
+                status=200,
+            )
+
+        runner = CliRunner(mix_stderr=False)
+        result = runner.invoke(
+            main,
+            args=[
+                TestResultsMove.CTRL_SWITCH,
+                TestResultsMove.CTRL_TEXT,
+                TestResultsMove.TOKN_SWITCH,
+                TestResultsMove.TOKN_TEXT,
+                TestResultsMove.DELN_SWITCH,
+                TestResultsMove.PKGJ_SWITCH,
+                "2",
+                TestResultsMove.UPLJ_SWITCH,
+                "3",
+            ],
+        )
+        assert (
+            result.exit_code == 0
+        ), f"Expected a successful operation, exit_code = {result.exit_code:d}, stderr: {result.stderr}, stdout: {result.stdout}"
+        assert (
+            result.stdout
+            == "Status: total # of result directories considered 5, successfully copied 5, encountered 0 failures\n"
+        )
+        assert sorted(c.request.url.split("?")[0] for c in responses.calls) == sorted(
+            f"{TestResultsMove.URL}/upload/{name}.tar.xz" for name in names
+        )
+        for name in names:
+            # This should raise an unexpected exception if it was not created.
+            (pbrun / f"{name}.copied").unlink()
+
+    @staticmethod
+    @responses.activate
+    def test_results_move_pipeline_fail(monkeypatch, caplog, setup):
+        """A failed upload stops the pipeline"""
+        monkeypatch.setenv("_pbench_full_hostname", "localhost")
+        monkeypatch.setattr(datetime, "datetime", MockDatetime)
+        pbrun = setup["tmp"] / "var" / "lib" / "pbench-agent"
+        names = TestResultsMove.make_runs(pbrun, 3)
+        responses.add(
+            responses.PUT,
+            re.compile(f"{TestResultsMove.URL}/upload/.*"),
+            status=500,
+            json={"message": "broken"},
+        )
+
+        runner = CliRunner(mix_stderr=False)
+        result = runner.invoke(
+            main,
+            args=[
+                TestResultsMove.CTRL_SWITCH,
+                TestResultsMove.CTRL_TEXT,
+                TestResultsMove.TOKN_SWITCH,
+                TestResultsMove.TOKN_TEXT,
+                TestResultsMove.PIPE_SWITCH,
+            ],
+        )
+        assert result.exit_code == 1
+        assert (
+            result.stdout
+            == "Status: total # of result directories considered 3, successfully moved 0, encountered 1 failures\n"
+        )
+        assert len(responses.calls) == 1
+        assert all((pbrun / name).is_dir() for name in names)
@@ -5,15 +5,18 @@ from http import HTTPStatus
 from io import BytesIO
 import logging
 import shutil
+from socketserver import ThreadingMixIn
 from threading import Condition, Lock, Thread
 import time
 from unittest.mock import patch
-from wsgiref.simple_server import WSGIRequestHandler
+from urllib.request import urlopen
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
 
 import pytest
 
 from pbench.agent import tool_data_sink
 from pbench.agent.tool_data_sink import (
+    _read_chunked,
     BenchmarkRunDir,
     DataSinkWsgiServer,
     ToolDataSinkError,
@@ -113,6 +116,34 @@ class TestBenchmarkRunDir:
         assert exp_err == str(exc.value)
 
 
+class TestReadChunked:
+    """Verify the decoding of "chunked" request bodies."""
+
+    def test_read_chunked(self):
+        body = BytesIO(
+            b"5\r\nHello\r\n"
+            b"8;ext=val\r\n, world!\r\n"
+            b"0\r\nTrailer: ignored\r\n\r\n"
+            b"next request"
+        )
+        assert b"".join(_read_chunked(body)) == b"Hello, world!"
+        assert body.read() == b"next request"
+
+    @pytest.mark.parametrize(
+        "body,message",
+        (
+            (b"", "Invalid chunk size line, b''"),
+            (b"zz\r\n", "Invalid chunk size line, b'zz\\r\\n'"),
+            (b"5\r\nHel", "Unexpected end of chunked data"),
+            (b"5\r\nHello!\r\n0\r\n\r\n", "Missing end of chunk"),
+        ),
+    )
+    def test_read_chunked_errors(self, body, message):
+        with pytest.raises(ToolDataSinkError) as exc:
+            b"".join(_read_chunked(BytesIO(body)))
+        assert str(exc.value) == message
+
+
 def _test_app(environ, start_response):
     start_response(
         "200 OK",
@@ -136,6 +167,9 @@ class TestDataSinkWsgiServer:
         assert wsgi.options.get("handler_class", "missing") != "missing"
         klass = wsgi.options.get("handler_class")
         assert isinstance(klass, type(WSGIRequestHandler))
+        klass = wsgi.options.get("server_class")
+        assert issubclass(klass, ThreadingMixIn)
+        assert issubclass(klass, WSGIServer)
         assert wsgi._server is None
         assert wsgi._err_code is None
         assert wsgi._err_text is None
@@ -480,3 +514,45 @@ class TestDataSinkWsgiServer:
                     assert len(mocked_servers) == 0
                     caplog_idx += 1
                 assert len(caplog.records) == caplog_idx
+
+    def test_max_receivers(self):
+        """test_max_receivers - verify that requests are handled concurrently,
+        but by no more than the given number of threads at a time.
+        """
+        logger = logging.getLogger("test_max_receivers")
+        lock = Lock()
+        active = []
+        counts = []
+
+        def slow_app(environ, start_response):
+            with lock:
+                active.append(1)
+                counts.append(len(active))
+            time.sleep(0.2)
+            with lock:
+                active.pop()
+            return _test_app(environ, start_response)
+
+        wsgi_server = DataSinkWsgiServer(
+            host="localhost", port=0, logger=logger, max_receivers=2
+        )
+        wsgithr = Thread(target=wsgi_server.run, args=(slow_app,))
+        wsgithr.start()
+        err_text, err_code = wsgi_server.wait()
+        assert err_code == 0, err_text
+        url = f"http://localhost:{wsgi_server._server.server_port}/"
+        responses = []
+
+        def get():
+            with urlopen(url) as response:
+                responses.append(response.read())
+
+        clients = [Thread(target=get) for _ in range(5)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        wsgi_server.stop()
+        wsgithr.join()
+        assert responses == [b"Hello, world! 42"] * 5
+        assert max(counts) == 2
@@ -1,8 +1,10 @@
 """Tests for the Tool Meister module.
 """
 
+import hashlib
 from http import HTTPStatus
 import io
+import json
 import logging
 from pathlib import Path
 import shutil
@@ -1079,8 +1081,28 @@ class TestCreateTar:
     """Test the ToolMeister._create_tar() method behaviors."""
 
     @staticmethod
-    def test_create_tar(tool_meister, monkeypatch):
-        """Test create tar file"""
+    @pytest.mark.parametrize(
+        "compression,expected",
+        (
+            (None, ["--use-compress-program=xz -T0"]),
+            ("zstd:3", ["--use-compress-program=zstd -T0 -q -3"]),
+            ("none", []),
+        ),
+    )
+    def test_create_tar(monkeypatch, compression, expected):
+        """Test create tar file, compressed with the configured codec"""
+        params = tm_params.copy()
+        if compression:
+            params["compression"] = compression
+        tool_meister = ToolMeister(
+            pbench_install_dir=MockedPath(),
+            tmp_dir=MockedPath(),
+            tar_path="tar_path",
+            sysinfo_dump=None,
+            tm_params=ToolMeister.fetch_params(params),
+            redis_server=None,
+            logger=logging.getLogger(),
+        )
 
         def mock_run(*args, **kwargs):
             assert kwargs["cwd"] == tmp_dir.parent
@@ -1088,16 +1110,14 @@ class TestCreateTar:
             assert kwargs["stderr"] == subprocess.STDOUT
             assert kwargs["stdout"] == subprocess.PIPE
             c = subprocess.CompletedProcess(args, returncode=0, stdout=b"", stderr=None)
-            assert all(
-                x in c.args[0]
-                for x in [
-                    "tar_path",
-                    "--create",
-                    "--xz",
-                    "--force-local",
-                    f"--file={tar_file}",
-                ]
-            )
+            assert c.args[0] == [
+                "tar_path",
+                "--create",
+                *expected,
+                "--force-local",
+                f"--file={tar_file}",
+                tmp_dir.name,
+            ]
             return c
 
         monkeypatch.setattr(subprocess, "run", mock_run)
@@ -1106,6 +1126,22 @@ class TestCreateTar:
         assert cp.returncode == 0
         assert cp.stdout == b""
 
+    @staticmethod
+    def test_bad_compression():
+        """Test that an invalid compression codec is rejected"""
+        params = tm_params.copy()
+        params["compression"] = "bzip2"
+        with pytest.raises(ToolMeisterError, match="Unknown compression codec"):
+            ToolMeister(
+                pbench_install_dir=MockedPath(),
+                tmp_dir=MockedPath(),
+                tar_path="tar_path",
+                sysinfo_dump=None,
+                tm_params=ToolMeister.fetch_params(params),
+                redis_server=None,
+                logger=logging.getLogger(),
+            )
+
     @staticmethod
     def test_create_tar_ignore_warnings(tool_meister, monkeypatch):
         """Test creating tar with warning=none option specified"""
@@ -1247,3 +1283,131 @@ class TestSendDirectory:
         assert f"Failed to create an empty tar {self.directory}.tar.xz" in str(
             exc.value
         )
+
+
+class TestStreamDirectory:
+    """Test ToolMeister._send_directory() streaming the tool data"""
+
+    @pytest.fixture
+    def streaming_tool_meister(self, tmp_path):
+        tool_data = tmp_path / "tool-data" / tm_params["hostname"]
+        tool_data.mkdir(parents=True)
+        (tool_data / "mpstat.txt").write_text("some tool data\n")
+        tm = ToolMeister(
+            pbench_install_dir=MockedPath(),
+            tmp_dir=MockedPath(),
+            tar_path=shutil.which("tar"),
+            sysinfo_dump=None,
+            tm_params=ToolMeister.fetch_params({**tm_params, "stream_data": True}),
+            redis_server=None,
+            logger=logging.getLogger(),
+        )
+        return tm, tool_data
+
+    @staticmethod
+    def put_callback(received: List[bytes], md5: str = None):
+        """Mimic the Tool Data Sink receiving streamed data: the body arrives
+        as an iterable of chunks, and the response reports its MD5."""
+
+        def callback(request):
+            assert "md5sum" not in request.headers
+            data = b"".join(request.body)
+            received.append(data)
+            body = {"md5": md5 or hashlib.md5(data).hexdigest(), "size": len(data)}
+            return HTTPStatus.OK, {}, json.dumps(body)
+
+        return callback
+
+    url = (
+        f"http://{tm_params['tds_hostname']}:{tm_params['tds_port']}/uri"
+        f"/ctx/{tm_params['hostname']}"
+    )
+
+    @responses.activate
+    def test_stream(self, streaming_tool_meister, tmp_path):
+        """Stream the tar data, and remove the tool data once it's received"""
+        tool_meister, tool_data = streaming_tool_meister
+        received = []
+        responses.add_callback(
+            responses.PUT, self.url, callback=self.put_callback(received)
+        )
+
+        failures = tool_meister._send_directory(tool_data, "uri", "ctx")
+        assert failures == 0
+        assert not tool_data.parent.exists()
+        assert not (tool_data.parent / f"{tool_data.name}.tar.xz").exists()
+        out = tmp_path / "out"
+        out.mkdir()
+        subprocess.run(
+            ["tar", "--extract", "--xz", "--file=-"],
+            cwd=out,
+            input=received[0],
+            check=True,
+        )
+        content = out / tm_params["hostname"] / "mpstat.txt"
+        assert content.read_text() == "some tool data\n"
+
+    @responses.activate
+    def test_stream_md5_mismatch(self, streaming_tool_meister):
+        """Report a failure, and keep the tool data, if the Tool Data Sink
+        received data which doesn't match what we sent"""
+        tool_meister, tool_data = streaming_tool_meister
+        received = []
+        responses.add_callback(
+            responses.PUT, self.url, callback=self.put_callback(received, "bad")
+        )
+
+        failures = tool_meister._send_directory(tool_data, "uri", "ctx")
+        assert failures == 1
+        assert len(received) == 1
+        assert tool_data.exists()
+
+    @staticmethod
+    def failing_tar(tmp_path: Path, always: bool) -> str:
+        """Create a `tar` command which writes the whole tar ball but exits
+        with an error, unless (if not `always`) warnings are suppressed"""
+        tar = tmp_path / "tar"
+        retry = (
+            "" if always else 'case "$*" in *--warning=none*) exec {0} "$@";; esac\n'
+        )
+        tar.write_text(
+            f'#!/bin/sh\n{retry.format(shutil.which("tar"))}'
+            f'{shutil.which("tar")} "$@"\necho "file changed as we read it" >&2\n'
+            "exit 1\n"
+        )
+        tar.chmod(0o755)
+        return str(tar)
+
+    @responses.activate
+    def test_stream_tar_retry(self, streaming_tool_meister, tmp_path, caplog):
+        """Abandon the request if tar fails, and re-try with all warnings
+        suppressed"""
+        tool_meister, tool_data = streaming_tool_meister
+        tool_meister.tar_path = self.failing_tar(tmp_path, always=False)
+        received = []
+        responses.add_callback(
+            responses.PUT, self.url, callback=self.put_callback(received)
+        )
+
+        failures = tool_meister._send_directory(tool_data, "uri", "ctx")
+        assert failures == 0
+        assert len(received) == 1
+        assert not tool_data.parent.exists()
+        assert "Tarball creation failed with 1" in caplog.text
+        assert "file changed as we read it" in caplog.text
+
+    @responses.activate
+    def test_stream_tar_failure(self, streaming_tool_meister, tmp_path):
+        """Report a failure, and keep the tool data, if tar fails even with
+        all warnings suppressed"""
+        tool_meister, tool_data = streaming_tool_meister
+        tool_meister.tar_path = self.failing_tar(tmp_path, always=True)
+        received = []
+        responses.add_callback(
+            responses.PUT, self.url, callback=self.put_callback(received)
+        )
+
+        failures = tool_meister._send_directory(tool_data, "uri", "ctx")
+        assert failures == 1
+        assert received == []
+        assert tool_data.exists()
@@ -0,0 +1,56 @@
+"""Tests for the Tool Meister "start" module.
+"""
+import pytest
+
+from pbench.agent.tool_meister_start import tool_data_compression
+from pbench.common.compression import DEFAULT_CODEC
+from pbench.common.exceptions import BadConfig
+from pbench.test.unit.agent.conftest import agent_cfg_tmpl
+
+
+class TestToolDataCompression:
+    """Verify the choice of codec for the tool data by Tool Meister "start"."""
+
+    @staticmethod
+    def write_config(setup, compression: str):
+        """Write an agent configuration file with the given compression setting,
+        and point the _PBENCH_AGENT_CONFIG environment variable at it.
+        """
+        cfg_file = setup["cfg_dir"] / "pbench-agent-compression.cfg"
+        cfg_file.write_text(
+            agent_cfg_tmpl.format(TMP=setup["tmp"]).replace(
+                "[pbench-agent]\n", f"[pbench-agent]\ncompression = {compression}\n"
+            )
+        )
+        return cfg_file
+
+    def test_default(self, monkeypatch):
+        monkeypatch.delenv("PBENCH_TOOL_DATA_COMPRESSION", raising=False)
+        assert tool_data_compression() == "xz"
+        monkeypatch.delenv("_PBENCH_AGENT_CONFIG")
+        assert tool_data_compression() == DEFAULT_CODEC
+
+    def test_config(self, setup, monkeypatch):
+        monkeypatch.delenv("PBENCH_TOOL_DATA_COMPRESSION", raising=False)
+        monkeypatch.setenv(
+            "_PBENCH_AGENT_CONFIG", str(self.write_config(setup, "zstd:3"))
+        )
+        assert tool_data_compression() == "zstd:3"
+
+    def test_environment(self, setup, monkeypatch):
+        monkeypatch.setenv(
+            "_PBENCH_AGENT_CONFIG", str(self.write_config(setup, "zstd:3"))
+        )
+        monkeypatch.setenv("PBENCH_TOOL_DATA_COMPRESSION", "none")
+        assert tool_data_compression() == "none"
+
+    def test_invalid(self, setup, monkeypatch):
+        monkeypatch.setenv("PBENCH_TOOL_DATA_COMPRESSION", "gzip")
+        with pytest.raises(ValueError):
+            tool_data_compression()
+        monkeypatch.delenv("PBENCH_TOOL_DATA_COMPRESSION")
+        monkeypatch.setenv(
+            "_PBENCH_AGENT_CONFIG", str(self.write_config(setup, "gzip"))
+        )
+        with pytest.raises(BadConfig):
+            tool_data_compression()
@@ -0,0 +1,80 @@
+from http import HTTPStatus
+
+import pytest
+import responses
+
+from pbench.client import OperationFailed
+
+
+class TestOperations:
+    """Verify that the client waits for the background operations of the
+    dataset update and delete APIs, and reports their failure."""
+
+    @pytest.fixture()
+    def client(self, connect):
+        connect.POLL_INTERVAL = 0.0
+        connect.endpoints["uri"] = {
+            "datasets": {
+                "template": f"{connect.url}/api/v1/datasets/{{dataset}}",
+                "params": {"dataset": {"type": "string"}},
+            },
+            "datasets_metadata": {
+                "template": f"{connect.url}/api/v1/datasets/{{dataset}}/metadata",
+                "params": {"dataset": {"type": "string"}},
+            },
+        }
+        return connect
+
+    @staticmethod
+    def operation(rsp: responses.RequestsMock, client, name: str, state: str):
+        """Report the queued and then final states of an operation"""
+        url = f"{client.url}/api/v1/datasets/md5/metadata"
+        for status in ("READY", state):
+            rsp.add(
+                responses.GET,
+                url,
+                json={"dataset.operations": {name: {"state": status, "message": "x"}}},
+            )
+
+    @pytest.mark.parametrize("state", ("OK", "FAILED"))
+    def test_update(self, client, state):
+        with responses.RequestsMock() as rsp:
+            rsp.add(
+                responses.POST,
+                f"{client.url}/api/v1/datasets/md5",
+                status=HTTPStatus.ACCEPTED,
+                json={"message": "Update queued"},
+            )
+            self.operation(rsp, client, "UPDATE", state)
+            if state == "FAILED":
+                with pytest.raises(OperationFailed) as e:
+                    client.update("md5", access="public")
+                assert str(e.value) == "UPDATE of md5 failed: x"
+            else:
+                response = client.update("md5", access="public")
+                assert response == {"message": "Update queued"}
+            assert len(rsp.calls) == 3
+
+    @pytest.mark.parametrize("failed", (False, True))
+    def test_remove(self, client, failed):
+        with responses.RequestsMock() as rsp:
+            rsp.add(
+                responses.DELETE,
+                f"{client.url}/api/v1/datasets/md5",
+                status=HTTPStatus.ACCEPTED,
+                json={"message": "Delete queued"},
+            )
+            if failed:
+                self.operation(rsp, client, "DELETE", "FAILED")
+                with pytest.raises(OperationFailed):
+                    client.remove("md5")
+            else:
+                # A DELETE finishes when the dataset is gone
+                rsp.add(
+                    responses.GET,
+                    f"{client.url}/api/v1/datasets/md5/metadata",
+                    status=HTTPStatus.NOT_FOUND,
+                    json={"message": "Dataset not found"},
+                )
+                response = client.remove("md5")
+                assert response.status_code == HTTPStatus.ACCEPTED
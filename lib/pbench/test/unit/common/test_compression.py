@@ -0,0 +1,67 @@
+import pytest
+
+from pbench.common.compression import (
+    get_codec,
+    tarball_codec,
+    tarball_stem,
+    TARBALL_SUFFIXES,
+)
+
+
+class TestCompression:
+    @pytest.mark.parametrize(
+        "spec,name,suffix,command",
+        (
+            (None, "xz", ".tar.xz", ["xz", "-T0"]),
+            ("xz:9", "xz", ".tar.xz", ["xz", "-T0", "-9"]),
+            ("zstd", "zstd", ".tar.zst", ["zstd", "-T0", "-q"]),
+            (" zstd:19 ", "zstd", ".tar.zst", ["zstd", "-T0", "-q", "-19"]),
+            ("none", "none", ".tar", None),
+        ),
+    )
+    def test_get_codec(self, spec, name, suffix, command):
+        codec = get_codec(spec)
+        assert codec.name == name
+        assert codec.suffix == suffix
+        assert codec.compress_command() == command
+        if command:
+            assert codec.tar_create_args(threads=1) == [
+                f"--use-compress-program={' '.join(command).replace('-T0', '-T1')}"
+            ]
+            assert codec.tar_extract_args() == [f"--use-compress-program={name}"]
+        else:
+            assert codec.tar_create_args() == []
+            assert codec.tar_extract_args() == []
+
+    @pytest.mark.parametrize(
+        "spec,message",
+        (
+            ("gzip", "Unknown compression codec 'gzip'"),
+            ("xz:10", "Invalid compression level '10' for 'xz'"),
+            ("zstd:0", "Invalid compression level '0' for 'zstd'"),
+            ("zstd:fast", "Invalid compression level 'fast' for 'zstd'"),
+            ("none:1", "Invalid compression level '1' for 'none'"),
+        ),
+    )
+    def test_get_codec_invalid(self, spec, message):
+        with pytest.raises(ValueError, match=message):
+            get_codec(spec)
+
+    @pytest.mark.parametrize(
+        "path,name,stem",
+        (
+            ("/a/b/run.tar.xz", "xz", "run"),
+            ("run.tar.zst", "zstd", "run"),
+            ("run.tar", "none", "run"),
+            ("run.tar.gz", None, None),
+            (".tar.xz", None, None),
+            ("run", None, None),
+        ),
+    )
+    def test_tarball_names(self, path, name, stem):
+        codec = tarball_codec(path)
+        assert (codec.name if codec else None) == name
+        assert tarball_stem(path) == stem
+
+    def test_suffixes(self):
+        assert TARBALL_SUFFIXES == (".tar.xz", ".tar.zst", ".tar")
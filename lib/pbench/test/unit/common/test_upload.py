@@ -0,0 +1,124 @@
+from http import HTTPStatus
+import json
+import re
+import threading
+from typing import List
+
+import pytest
+import requests
+import responses
+
+from pbench.common import upload
+
+URL = "http://pbench.example.com/api/v1/upload/test.tar.xz"
+
+
+class FakeServer:
+    """Mimic the Pbench Server's handling of a chunked upload."""
+
+    def __init__(self, size: int, received: List[List[int]] = ()):
+        self.size = size
+        self.received = [tuple(r) for r in received]
+        self.puts = []
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def ranges(self) -> List[List[int]]:
+        ranges = []
+        for start, end in sorted(self.received):
+            if ranges and start <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def get(self, request: requests.PreparedRequest):
+        if not self.received:
+            return HTTPStatus.NOT_FOUND, {}, json.dumps({"message": "none"})
+        body = {"size": self.size, "received": self.ranges()}
+        return HTTPStatus.OK, {}, json.dumps(body)
+
+    def put(self, request: requests.PreparedRequest):
+        match = re.fullmatch(
+            r"bytes (\d+)-(\d+)/(\d+)", request.headers["Content-Range"]
+        )
+        start, end, size = (int(g) for g in match.groups())
+        assert size == self.size
+        assert len(request.body) == end - start + 1
+        assert request.headers["Content-MD5"] == "md5"
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                return HTTPStatus.SERVICE_UNAVAILABLE, {}, "{}"
+            self.puts.append((start, end))
+            self.received.append((start, end))
+            if self.ranges() == [[0, size - 1]]:
+                return HTTPStatus.CREATED, {}, json.dumps({"message": "uploaded"})
+        body = {"message": "Chunk received", "size": size, "received": self.ranges()}
+        return HTTPStatus.ACCEPTED, {}, json.dumps(body)
+
+
+class TestChunkedUpload:
+    @pytest.mark.parametrize(
+        "size,received,expected",
+        (
+            (10, [], [(0, 3), (4, 7), (8, 9)]),
+            (10, [[0, 9]], []),
+            (10, [[2, 5]], [(0, 1), (6, 9)]),
+            (10, [[0, 1], [6, 6]], [(2, 5), (7, 9)]),
+        ),
+    )
+    def test_missing_chunks(self, size, received, expected):
+        assert upload.missing_chunks(size, received, 4) == expected
+
+    @responses.activate
+    @pytest.mark.parametrize("workers", (1, 3))
+    @pytest.mark.parametrize(
+        "received,expected",
+        (
+            ([], [(0, 99), (100, 199), (200, 249)]),
+            ([[0, 99], [200, 220]], [(100, 199), (221, 249)]),
+            ([[0, 249]], [(0, 99)]),
+        ),
+    )
+    def test_upload(self, tmp_path, monkeypatch, workers, received, expected):
+        """Show that we send only the missing chunks, retrying a chunk which
+        fails, and return the response which completes the upload."""
+        monkeypatch.setattr(upload, "RETRY_DELAY", 0)
+        tarball = tmp_path / "test.tar.xz"
+        data = bytes(range(250))
+        tarball.write_bytes(data)
+        server = FakeServer(len(data), received)
+        server.failures = 1
+        responses.add_callback(responses.GET, URL, callback=server.get)
+        responses.add_callback(responses.PUT, URL, callback=server.put)
+
+        response = upload.upload_chunks(
+            requests,
+            URL,
+            tarball,
+            headers={"Content-MD5": "md5"},
+            params={"access": "public"},
+            chunk_size=100,
+            workers=workers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+        assert sorted(server.puts) == expected
+        assert server.failures == 0
+
+    @responses.activate
+    def test_upload_failure(self, tmp_path, monkeypatch):
+        """Show that we report a chunk which fails, after retrying."""
+        monkeypatch.setattr(upload, "RETRY_DELAY", 0)
+        tarball = tmp_path / "test.tar.xz"
+        tarball.write_bytes(bytes(250))
+        server = FakeServer(250)
+        server.failures = 100
+        responses.add_callback(responses.GET, URL, callback=server.get)
+        responses.add_callback(responses.PUT, URL, callback=server.put)
+
+        response = upload.upload_chunks(
+            requests, URL, tarball, {"Content-MD5": "md5"}, {}, chunk_size=100
+        )
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert server.failures == 100 - 3 * upload.ATTEMPTS
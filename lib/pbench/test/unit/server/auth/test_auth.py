@@ -1,9 +1,11 @@
 import configparser
 from dataclasses import dataclass
 from http import HTTPStatus
+import time
 from typing import Any, Dict, Optional, Tuple
 
 from flask import current_app, Flask
+from freezegun import freeze_time
 import jwt
 import pytest
 import requests
@@ -14,6 +16,7 @@ from pbench.server import JSON
 import pbench.server.auth
 from pbench.server.auth import Connection, OpenIDClient, OpenIDClientError
 import pbench.server.auth.auth as Auth
+from pbench.server.database.models.users import User
 from pbench.test.unit.server import DRB_USER_ID
 from pbench.test.unit.server.conftest import jwt_secret
 
@@ -496,6 +499,11 @@ class TestAuthModule:
     and also the Pbench server API key verification.
     """
 
+    @pytest.fixture(autouse=True)
+    def clear_token_cache(self):
+        """Don't let a token verified by one test be remembered by another."""
+        Auth.token_cache.clear()
+
     def test_get_auth_token_succ(self, monkeypatch, make_logger):
         """Verify behaviors of fetching the authorization token from HTTP
         headers works properly
@@ -646,6 +654,87 @@ class TestAuthModule:
         assert user.roles == ["ROLE"]
         assert user.username == "new_dummy"
 
+    def test_verify_auth_oidc_cached(
+        self, monkeypatch, db_session, rsa_keys, make_logger
+    ):
+        """Verify that a verified OIDC token is remembered, and that the user
+        isn't updated when nothing changed."""
+        client_id = "us"
+        token, expected_payload = gen_rsa_token(
+            client_id, rsa_keys["private_key"], oidc_client_roles=["ROLE"]
+        )
+
+        # Mock the Connection object and generate an OpenIDClient object,
+        # installing it as Auth module's OIDC client.
+        config = mock_connection(
+            monkeypatch, client_id, public_key=rsa_keys["public_key"]
+        )
+        oidc_client = OpenIDClient.construct_oidc_client(config)
+        monkeypatch.setattr(Auth, "oidc_client", oidc_client)
+
+        introspected = []
+        token_introspect = oidc_client.token_introspect
+
+        def tio_count(token: str) -> JSON:
+            introspected.append(token)
+            return token_introspect(token)
+
+        updated = []
+
+        def update(self, **kwargs):
+            updated.append(kwargs)
+
+        monkeypatch.setattr(oidc_client, "token_introspect", tio_count)
+        monkeypatch.setattr(User, "update", update)
+
+        app = Flask("test-verify-auth-oidc-cached")
+        app.logger = make_logger
+        with app.app_context():
+            user = Auth.verify_auth(token)
+            assert user.id == "12345"
+            assert len(introspected) == 1
+            stats = Auth.token_cache.stats()
+
+            user = Auth.verify_auth(token)
+            assert user.id == "12345"
+            assert user.username == "dummy"
+            assert user.roles == ["ROLE"]
+            assert len(introspected) == 1
+            assert Auth.token_cache.stats()["hits"] == stats["hits"] + 1
+
+            # Once forgotten, the token is verified again, but the unchanged
+            # user isn't updated.
+            Auth.token_cache.clear()
+            user = Auth.verify_auth(token)
+            assert user.id == "12345"
+            assert len(introspected) == 2
+        assert updated == []
+
+    def test_token_cache_limits(self, db_session, make_logger):
+        """Verify that the token cache is bounded by its size, its lifetime,
+        and the expiration of the tokens.
+        """
+        cache = Auth.TokenCache(size=2, lifetime=60)
+        user = User(id="1", username="one", roles=["ROLE"])
+        app = Flask("test-token-cache-limits")
+        app.logger = make_logger
+        with freeze_time("2026-01-01") as frozen, app.app_context():
+            now = time.time()
+            cache.put("a", user)
+            cache.put("b", user, expiration=now + 10)
+            cache.put("c", user)
+            assert cache.get("a") is None
+            assert cache.get("b").roles == ["ROLE"]
+            assert cache.get("c").username == "one"
+
+            frozen.tick(10)
+            assert cache.get("b") is None
+            assert cache.get("c").id == "1"
+
+            frozen.tick(50)
+            assert cache.get("c") is None
+        assert cache.stats() == {"hits": 3, "misses": 3}
+
     def test_verify_auth_oidc_invalid(self, monkeypatch, rsa_keys, make_logger):
         """Verify OIDC token offline verification via Auth.verify_auth() fails
         gracefully with an invalid token
@@ -694,6 +783,38 @@ class TestAuthModule:
             user = Auth.verify_auth(pbench_drb_api_key.key)
         assert user.id == DRB_USER_ID
 
+    def test_verify_auth_api_key_deleted(
+        self, monkeypatch, rsa_keys, make_logger, pbench_drb_api_key
+    ):
+        """Verify that a deleted API key is refused at once by every server
+        process, each with its own token cache.
+        """
+        config = mock_connection(monkeypatch, "us", public_key=rsa_keys["public_key"])
+        oidc_client = OpenIDClient.construct_oidc_client(config)
+        monkeypatch.setattr(Auth, "oidc_client", oidc_client)
+
+        def tio_exc(token: str) -> JSON:
+            raise Exception("OIDC validation is disabled")
+
+        deleting_cache = Auth.token_cache
+        other_cache = Auth.TokenCache()
+        app = Flask("test_verify_auth_api_key_deleted")
+        app.logger = make_logger
+        with app.app_context():
+            monkeypatch.setattr(oidc_client, "token_introspect", tio_exc)
+            current_app.secret_key = jwt_secret
+            for cache in (other_cache, deleting_cache):
+                monkeypatch.setattr(Auth, "token_cache", cache)
+                user = Auth.verify_auth(pbench_drb_api_key.key)
+                assert user.id == DRB_USER_ID
+
+            api_key = pbench_drb_api_key.key
+            pbench_drb_api_key.delete()
+
+            for cache in (deleting_cache, other_cache):
+                monkeypatch.setattr(Auth, "token_cache", cache)
+                assert Auth.verify_auth(api_key) is None
+
     def test_verify_auth_api_key_invalid(
         self, monkeypatch, rsa_keys, make_logger, pbench_invalid_api_key
     ):
@@ -11,7 +11,6 @@ from stat import ST_MTIME
 import tarfile
 from typing import Dict, Optional
 from urllib.parse import urljoin
-import uuid
 
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
@@ -26,10 +25,12 @@ from pbench.common.logger import get_pbench_logger
 from pbench.server import PbenchServerConfig
 from pbench.server.api import create_app
 import pbench.server.auth.auth as Auth
+from pbench.server.cache_manager import CacheManager
 from pbench.server.database import init_db
 from pbench.server.database.database import Database
 from pbench.server.database.models.api_keys import APIKey
 from pbench.server.database.models.datasets import Dataset, Metadata
+from pbench.server.database.models.server_settings import ServerSetting
 from pbench.server.database.models.templates import Template
 from pbench.server.database.models.users import User
 from pbench.test import on_disk_config
@@ -188,6 +189,11 @@ def client(monkeypatch, server_config, add_auth_connection_mock):
     For test cases that require the DB but not a full Flask app context, use
     the db_session fixture instead, which adds DB cleanup after the test.
     """
+    # Don't let settings, tokens, or datasets cached by a previous test leak
+    # into this one
+    ServerSetting.invalidate_cache()
+    Auth.token_cache.clear()
+    CacheManager.clear_instance()
     app = create_app(server_config)
     app.config["PREFERRED_URL_SCHEME"] = "https"
 
@@ -248,6 +254,8 @@ def db_session(request, server_config, make_logger):
         make_logger: produce a Pbench Server logger
     """
     if "client" not in request.fixturenames:
+        ServerSetting.invalidate_cache()
+        Auth.token_cache.clear()
         init_db(server_config, make_logger)
     yield
     Database.db_session.remove()
@@ -465,9 +473,9 @@ def provide_metadata(attach_dataset):
         dataset=drb,
         key="server.index-map",
         value={
-            "unit-test.v6.run-data.2020-08": ["random_md5_string1"],
-            "unit-test.v5.result-data-sample.2020-08": ["random_document_uuid"],
-            "unit-test.v6.run-toc.2020-05": ["random_md5_string1"],
+            "unit-test.v6.run-data.2020-08": 1,
+            "unit-test.v5.result-data-sample.2020-08": 1,
+            "unit-test.v6.run-toc.2020-05": 1,
         },
     )
     Metadata.create(
@@ -515,15 +523,16 @@ def get_document_map(monkeypatch, attach_dataset):
         attach_dataset:  create a mock Dataset object
     """
     mapping = {
-        "unit-test.v6.run-data.2021-06": [uuid.uuid4().hex],
-        "unit-test.v6.run-toc.2021-06": [uuid.uuid4().hex for _ in range(10)],
-        "unit-test.v5.result-data-sample.2021-06": [
-            uuid.uuid4().hex for _ in range(20)
-        ],
+        "unit-test.v6.run-data.2021-06": 1,
+        "unit-test.v6.run-toc.2021-06": 10,
+        "unit-test.v5.result-data-sample.2021-06": 20,
     }
 
+    getvalue = Metadata.getvalue
+
     def get_document_map(dataset: Dataset, key: str) -> Metadata:
-        assert key == Metadata.INDEX_MAP
+        if key != Metadata.INDEX_MAP:
+            return getvalue(dataset, key)
         return mapping
 
     with monkeypatch.context() as m:
@@ -1,7 +1,11 @@
 from freezegun.api import freeze_time
 import pytest
 
-from pbench.server.database.models.datasets import Dataset, DatasetNotFound
+from pbench.server.database.models.datasets import (
+    Dataset,
+    DatasetBadName,
+    DatasetNotFound,
+)
 
 
 class TestDatasets:
@@ -73,3 +77,22 @@ class TestDatasets:
 
         with pytest.raises(DatasetNotFound):
             Dataset.query(resource_id=ds1.resource_id)
+
+    @pytest.mark.parametrize(
+        "path,stem",
+        (
+            ("/a/b/fio.tar.xz", "fio"),
+            ("fio.tar.zst", "fio"),
+            ("fio.tar", "fio"),
+            ("fio.tar.gz", None),
+            ("fio.tar.xz.md5", None),
+        ),
+    )
+    def test_tarball_names(self, path, stem):
+        """Test that we recognize the suffixes of each compression codec"""
+        assert Dataset.is_tarball(path) == (stem is not None)
+        if stem:
+            assert Dataset.stem(path) == stem
+        else:
+            with pytest.raises(DatasetBadName, match="does not end in one of"):
+                Dataset.stem(path)
@@ -149,9 +149,9 @@ class TestInternalMetadata:
         assert metadata == {
             "deletion": "2022-12-26",
             "index-map": {
-                "unit-test.v6.run-data.2020-08": ["random_md5_string1"],
-                "unit-test.v5.result-data-sample.2020-08": ["random_document_uuid"],
-                "unit-test.v6.run-toc.2020-05": ["random_md5_string1"],
+                "unit-test.v6.run-data.2020-08": 1,
+                "unit-test.v5.result-data-sample.2020-08": 1,
+                "unit-test.v6.run-toc.2020-05": 1,
             },
         }
 
@@ -161,9 +161,9 @@ class TestInternalMetadata:
         assert metadata == "2022-12-26"
         metadata = Metadata.getvalue(ds, "server.index-map")
         assert metadata == {
-            "unit-test.v6.run-data.2020-08": ["random_md5_string1"],
-            "unit-test.v5.result-data-sample.2020-08": ["random_document_uuid"],
-            "unit-test.v6.run-toc.2020-05": ["random_md5_string1"],
+            "unit-test.v6.run-data.2020-08": 1,
+            "unit-test.v5.result-data-sample.2020-08": 1,
+            "unit-test.v6.run-toc.2020-05": 1,
         }
         metadata = Metadata.getvalue(ds, "server.webbwantsthistest")
         assert metadata is None
@@ -368,6 +368,55 @@ class TestMetadataNamespace:
             "contact": "Wilma"
         }
 
+    def test_getvalues(self, attach_dataset):
+        """Verify that getvalues gives the same values as getvalue for each
+        dataset, except that a key error gives None.
+        """
+        drb = Dataset.query(name="drb")
+        test = Dataset.query(name="test")
+        user1 = User.query(username="drb")
+        Metadata.setvalue(dataset=drb, key="global.contact", value="Barney")
+        Metadata.setvalue(dataset=test, key="global", value="not a dict")
+        Metadata.setvalue(dataset=drb, key="user.contact", value="Fred")
+        Metadata.setvalue(dataset=drb, key="user.contact", value="Wilma", user=user1)
+        Metadata.create(dataset=test, key=Metadata.METALOG, value={"pbench": {}})
+        keys = [
+            "global.contact",
+            "user",
+            "server.deletion",
+            "dataset.owner",
+            "dataset.metalog.pbench",
+            "global..bad",
+        ]
+        values = Metadata.getvalues(datasets=[drb, test], keys=keys, user=user1)
+        assert values == {
+            drb.id: {
+                "global.contact": "Barney",
+                "user": {"contact": "Wilma"},
+                "server.deletion": None,
+                "dataset.owner": "drb",
+                "dataset.metalog.pbench": None,
+                "global..bad": None,
+            },
+            test.id: {
+                "global.contact": None,
+                "user": None,
+                "server.deletion": None,
+                "dataset.owner": "test",
+                "dataset.metalog.pbench": {},
+                "global..bad": None,
+            },
+        }
+        for ds in (drb, test):
+            for key in keys[:-1]:
+                user = user1 if key.startswith("user") else None
+                try:
+                    value = Metadata.getvalue(dataset=ds, key=key, user=user)
+                except MetadataBadStructure:
+                    value = None
+                assert values[ds.id][key] == value
+        assert Metadata.getvalues(datasets=[], keys=keys) == {}
+
     @pytest.mark.parametrize(
         "value",
         [
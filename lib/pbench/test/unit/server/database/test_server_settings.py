@@ -1,3 +1,4 @@
+from freezegun import freeze_time
 import pytest
 from sqlalchemy.exc import IntegrityError
 
@@ -17,7 +18,7 @@ class TestServerSetting:
     session = None
 
     @pytest.fixture(autouse=True, scope="function")
-    def fake_db(self, monkeypatch, server_config):
+    def fake_db(self, monkeypatch, server_config, make_logger):
         """
         Fixture to mock a DB session for testing.
 
@@ -28,6 +29,8 @@ class TestServerSetting:
         self.session = FakeSession(ServerSetting)
         monkeypatch.setattr(Database, "db_session", self.session)
         Database.Base.config = server_config
+        monkeypatch.setattr(Database.Base, "logger", make_logger, raising=False)
+        ServerSetting.invalidate_cache()
         yield
 
     def test_bad_key(self):
@@ -151,6 +154,65 @@ class TestServerSetting:
             ],
         )
 
+    def test_get_value_cached(self):
+        """Test that get_value loads all the settings once, and answers from
+        the cache until a setting is changed.
+        """
+        ServerSetting.create(key="dataset-lifetime", value="2")
+        ServerSetting.create(
+            key="server-state", value={"status": "readonly", "message": "Busy"}
+        )
+        stats = ServerSetting.cache_stats()
+        assert ServerSetting.get_value("dataset-lifetime") == "2"
+        assert ServerSetting.get_value("server-banner") is None
+        assert ServerSetting.get_disabled() == {
+            "status": "readonly",
+            "message": "Busy",
+        }
+        assert ServerSetting.get_disabled(readonly=True) is None
+        assert len(self.session.queries) == 1
+        after = ServerSetting.cache_stats()
+        assert after["misses"] - stats["misses"] == 1
+        assert after["hits"] - stats["hits"] == 3
+
+        # Changing a setting invalidates the cache
+        ServerSetting.set(key="server-state", value={"status": "enabled"})
+        assert ServerSetting.get_disabled() is None
+        assert ServerSetting.get_value("dataset-lifetime") == "2"
+        assert len(self.session.queries) == 3
+        final = ServerSetting.cache_stats()
+        assert final["invalidations"] - after["invalidations"] == 1
+        assert final["misses"] - after["misses"] == 1
+
+    def test_get_value_copy(self):
+        """Test that modifying a value returned by get_value doesn't modify
+        the cached value.
+        """
+        ServerSetting.create(key="server-banner", value={"message": "Mine"})
+        banner = ServerSetting.get_value("server-banner")
+        banner["message"] = "Yours"
+        assert ServerSetting.get_value("server-banner") == {"message": "Mine"}
+        assert len(self.session.queries) == 1
+
+    def test_get_value_expired(self, server_config):
+        """Test that the cached values expire"""
+        lifetime = server_config.getint(
+            "pbench-server", "server-settings-cache-seconds"
+        )
+        with freeze_time("2026-01-01") as frozen:
+            assert ServerSetting.get_value("dataset-lifetime") == "3650"
+            frozen.tick(lifetime - 1)
+            assert ServerSetting.get_value("dataset-lifetime") == "3650"
+            assert len(self.session.queries) == 1
+            frozen.tick(1)
+            assert ServerSetting.get_value("dataset-lifetime") == "3650"
+            assert len(self.session.queries) == 2
+
+    def test_get_value_bad_key(self):
+        """Test that get_value rejects an unknown key"""
+        with pytest.raises(ServerSettingBadKey):
+            ServerSetting.get_value("not-a-key")
+
     def test_missing(self):
         """Check that 'create' complains about a missing key"""
         with pytest.raises(ServerSettingMissingKey):
@@ -1,13 +1,20 @@
 from http import HTTPStatus
 from logging import Logger
-from typing import Iterator
 
 import elasticsearch
+from elasticsearch.client.tasks import TasksClient
 import pytest
 
 from pbench.server import JSON, PbenchServerConfig
 from pbench.server.cache_manager import CacheManager
-from pbench.server.database.models.datasets import Dataset, DatasetNotFound
+from pbench.server.database.models.datasets import (
+    Dataset,
+    DatasetNotFound,
+    Metadata,
+    OperationName,
+)
+from pbench.server.dataset_jobs import DatasetJobs
+from pbench.server.sync import Sync
 from pbench.test.unit.server.headertypes import HeaderTypes
 
 
@@ -21,78 +28,103 @@ class TestDatasetsDelete:
     """
 
     tarball_deleted = None
+    body = None
 
-    def fake_elastic(self, monkeypatch, map: JSON, partial_fail: bool):
+    def check_queued(self, response, dataset: Dataset, make_logger):
         """
-        Pytest helper to install a mock for the Elasticsearch streaming_bulk
-        helper API for testing.
+        Check that the API queued the delete job.
+
+        Args:
+            response: The API response
+            dataset: The dataset
+            make_logger: A logger
+        """
+        assert response.status_code == HTTPStatus.ACCEPTED
+        status = f"/api/v1/datasets/{dataset.resource_id}/metadata?metadata=dataset.operations"
+        assert response.json == {"message": "delete queued", "status": status}
+        assert response.headers["Location"] == status
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "DELETE": {"state": "READY", "message": "Queued"}
+        }
+        assert Sync(make_logger, OperationName.DELETE).params(dataset) == {}
+
+    def fake_elastic(
+        self, monkeypatch, map: JSON, partial_fail: bool, error: bool = False
+    ):
+        """
+        Pytest helper to install mocks for the Elasticsearch delete_by_query
+        and tasks APIs for testing.
 
         Args:
             monkeypatch: The monkeypatch fixture from the test case
             map: The generated document index map from the test case
-            partial_fail: A boolean indicating whether some bulk operations
+            partial_fail: A boolean indicating whether some documents
                 should be marked as failures.
-
-        Yields:
-            Response documents from the mocked streaming_bulk helper
+            error: A boolean indicating whether the task should fail
         """
-        expected_results = []
-        expected_ids = []
-
-        for index in map:
-            first = True
-            for docid in map[index]:
-                delete = {
-                    "_index": index,
-                    "_type": "_doc",
-                    "_id": docid,
-                    "_version": 11,
-                    "result": "noop",
-                    "_shards": {"total": 2, "successful": 2, "failed": 0},
-                    "_seq_no": 10,
-                    "_primary_term": 3,
-                    "status": 200,
+        total = sum(map.values())
+        failures = []
+        if partial_fail:
+            failures = [
+                {
+                    "index": index,
+                    "id": "doc",
+                    "cause": {"reason": "Just kidding", "type": "KIDDING"},
+                    "status": 400,
                 }
-                if first and partial_fail:
-                    status = False
-                    first = False
-                    delete["error"] = {"reason": "Just kidding", "type": "KIDDING"}
-                else:
-                    status = True
-                expected_results.append((status, {"delete": delete}))
-                expected_ids.append(docid)
-
-        def fake_bulk(
-            elastic: elasticsearch.Elasticsearch,
-            stream: Iterator[dict],
-            raise_on_error: bool = True,
-            raise_on_exception: bool = True,
-        ):
+                for index in map
+            ]
+        status = {"completed": True, "task": {"status": {"total": total}}}
+        if error:
+            status["error"] = {"type": "KIDDING", "reason": "Just kidding"}
+        else:
+            status["response"] = {
+                "total": total,
+                "deleted": total - len(failures),
+                "version_conflicts": 0,
+                "failures": failures,
+            }
+
+        def fake_delete_by_query(
+            elastic: elasticsearch.Elasticsearch, index: str, body: JSON, **kwargs
+        ) -> JSON:
             """
-            Helper function to mock the Elasticsearch helper streaming_bulk API,
-            which will validate the input actions and generate expected responses.
+            Helper function to mock the Elasticsearch delete_by_query API,
+            which will validate the query and start a (fake) task.
 
             Args:
                 elastic: An Elasticsearch object
-                stream: The input stream of bulk action dicts
-                raise_on_error: indicates whether errors should be raised
-                raise_on_exception: indicates whether exceptions should propagate
-                    or be trapped
+                index: The indices to search
+                body: The query
+                kwargs: The query parameters
 
-            Yields:
-                Response documents from the mocked streaming_bulk helper
+            Returns:
+                The task ID
             """
-            # Consume and validate the command generator
-            for cmd in stream:
-                assert cmd["_op_type"] == "delete"
-                assert cmd["_id"] in expected_ids
+            assert index == ",".join(map)
+            assert kwargs["wait_for_completion"] is False
+            TestDatasetsDelete.body = body
+            return {"task": "node:1"}
 
-            # Generate a sequence of result documents more or less as we'd
-            # expect to see from Elasticsearch
-            for item in expected_results:
-                yield item
+        def fake_get(tasks: TasksClient, task_id: str) -> JSON:
+            """
+            Helper function to mock the Elasticsearch tasks get API, reporting
+            the response of the task.
+
+            Args:
+                tasks: An Elasticsearch TasksClient object
+                task_id: The task ID
 
-        monkeypatch.setattr("elasticsearch.helpers.streaming_bulk", fake_bulk)
+            Returns:
+                The status of the task
+            """
+            assert task_id == "node:1"
+            return status
+
+        monkeypatch.setattr(
+            elasticsearch.Elasticsearch, "delete_by_query", fake_delete_by_query
+        )
+        monkeypatch.setattr(TasksClient, "get", fake_get)
 
     def fake_cache_manager(self, monkeypatch):
         def fake_constructor(self, options: PbenchServerConfig, logger: Logger):
@@ -112,6 +144,7 @@ class TestDatasetsDelete:
         build_auth_header,
         client,
         get_document_map,
+        make_logger,
         monkeypatch,
         owner,
         server_config,
@@ -130,7 +163,7 @@ class TestDatasetsDelete:
         elif owner != "drb" and not is_admin:
             expected_status = HTTPStatus.FORBIDDEN
         else:
-            expected_status = HTTPStatus.OK
+            expected_status = HTTPStatus.ACCEPTED
 
         ds = Dataset.query(name=owner)
 
@@ -139,9 +172,22 @@ class TestDatasetsDelete:
             headers=build_auth_header["header"],
         )
         assert response.status_code == expected_status
-        if expected_status == HTTPStatus.OK:
-            assert response.json == {"ok": 31, "failure": 0}
+        if expected_status == HTTPStatus.ACCEPTED:
+            self.check_queued(response, ds, make_logger)
+            assert TestDatasetsDelete.tarball_deleted is None
+            assert DatasetJobs(server_config, make_logger).run() == 1
             assert TestDatasetsDelete.tarball_deleted == ds.resource_id
+            assert TestDatasetsDelete.body == {
+                "query": {
+                    "bool": {
+                        "should": [
+                            {"term": {"run.id": ds.resource_id}},
+                            {"term": {"run_data_parent": ds.resource_id}},
+                        ],
+                        "minimum_should_match": 1,
+                    }
+                }
+            }
 
             # On success, the Dataset should be gone
             with pytest.raises(DatasetNotFound):
@@ -154,15 +200,15 @@ class TestDatasetsDelete:
     def test_partial(
         self,
         client,
-        capinternal,
         get_document_map,
+        make_logger,
         monkeypatch,
         server_config,
         pbench_drb_token,
     ):
         """
-        Check the delete API when some document updates fail. We expect an
-        internal error with a report of success and failure counts.
+        Check the delete job when some document deletions fail. We expect the
+        operation to fail with a count of the failures.
         """
         self.fake_elastic(monkeypatch, get_document_map, True)
         self.fake_cache_manager(monkeypatch)
@@ -171,11 +217,18 @@ class TestDatasetsDelete:
             f"{server_config.rest_uri}/datasets/{ds.resource_id}",
             headers={"authorization": f"Bearer {pbench_drb_token}"},
         )
-        assert response.status_code == HTTPStatus.OK
-        assert response.json == {"ok": 28, "failure": 3}
+        self.check_queued(response, ds, make_logger)
+        assert DatasetJobs(server_config, make_logger).run() == 1
 
         # Verify that the Dataset still exists
-        Dataset.query(name="drb")
+        ds = Dataset.query(name="drb")
+        assert TestDatasetsDelete.tarball_deleted is None
+        assert Metadata.getvalue(ds, "dataset.operations") == {
+            "DELETE": {
+                "state": "FAILED",
+                "message": "Unable to delete 3 of 31 indexed documents",
+            }
+        }
 
     def test_no_dataset(
         self, client, get_document_map, monkeypatch, pbench_drb_token, server_config
@@ -193,7 +246,13 @@ class TestDatasetsDelete:
         assert response.json["message"] == "Dataset 'badwolf' not found"
 
     def test_no_index(
-        self, client, monkeypatch, attach_dataset, pbench_drb_token, server_config
+        self,
+        client,
+        make_logger,
+        monkeypatch,
+        attach_dataset,
+        pbench_drb_token,
+        server_config,
     ):
         """
         Check the delete API if the dataset has no INDEX_MAP. It should
@@ -207,42 +266,40 @@ class TestDatasetsDelete:
         )
 
         # Verify the report and status
-        assert response.status_code == HTTPStatus.OK
-        assert response.json == {"ok": 0, "failure": 0}
+        self.check_queued(response, ds, make_logger)
+        assert DatasetJobs(server_config, make_logger).run() == 1
         with pytest.raises(DatasetNotFound):
             Dataset.query(name="drb")
 
     def test_exception(
         self,
         attach_dataset,
-        capinternal,
         client,
+        make_logger,
         monkeypatch,
         get_document_map,
         pbench_drb_token,
         server_config,
     ):
         """
-        Check the delete API response if the bulk helper throws an exception.
-
-        (It shouldn't do this as we've set raise_on_exception=False, but we
-        check the code path anyway.)
+        Check the delete job if the Elasticsearch delete task fails.
         """
-
-        def fake_bulk(
-            elastic: elasticsearch.Elasticsearch,
-            stream: Iterator[dict],
-            raise_on_error: bool = True,
-            raise_on_exception: bool = True,
-        ):
-            raise elasticsearch.helpers.BulkIndexError("test")
-
-        monkeypatch.setattr("elasticsearch.helpers.streaming_bulk", fake_bulk)
+        self.fake_elastic(monkeypatch, get_document_map, False, error=True)
+        self.fake_cache_manager(monkeypatch)
 
         response = client.delete(
             f"{server_config.rest_uri}/datasets/random_md5_string1",
             headers={"authorization": f"Bearer {pbench_drb_token}"},
         )
 
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert DatasetJobs(server_config, make_logger).run() == 1
+
         # Verify the failure
-        capinternal("Unexpected backend error", response)
+        ds = Dataset.query(name="drb")
+        assert Metadata.getvalue(ds, "dataset.operations") == {
+            "DELETE": {
+                "state": "FAILED",
+                "message": "Unexpected backend error: Just kidding",
+            }
+        }
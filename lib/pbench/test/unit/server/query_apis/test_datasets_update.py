@@ -1,11 +1,14 @@
 from http import HTTPStatus
-from typing import Iterator
+from typing import Optional
 
 import elasticsearch
+from elasticsearch.client.tasks import TasksClient
 import pytest
 
 from pbench.server import JSON
-from pbench.server.database.models.datasets import Dataset
+from pbench.server.database.models.datasets import Dataset, Metadata, OperationName
+from pbench.server.dataset_jobs import DatasetJobs
+from pbench.server.sync import Sync
 from pbench.test.unit.server.headertypes import HeaderTypes
 
 
@@ -20,90 +23,131 @@ class TestDatasetsUpdate:
 
     PAYLOAD = {"access": "public"}
 
-    def fake_elastic(self, monkeypatch, map: JSON, partial_fail: bool):
+    def check_queued(self, response, dataset: Dataset, make_logger, job: JSON):
         """
-        Pytest helper to install a mock for the Elasticsearch streaming_bulk
-        helper API for testing.
+        Check that the API queued the update job, with the expected job
+        parameters.
+
+        Args:
+            response: The API response
+            dataset: The dataset
+            make_logger: A logger
+            job: The expected job parameters
+        """
+        assert response.status_code == HTTPStatus.ACCEPTED
+        status = f"/api/v1/datasets/{dataset.resource_id}/metadata?metadata=dataset.operations"
+        assert response.json == {"message": "update queued", "status": status}
+        assert response.headers["Location"] == status
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPDATE": {"state": "READY", "message": "Queued"}
+        }
+        assert Sync(make_logger, OperationName.UPDATE).params(dataset) == job
+
+    def fake_elastic(
+        self,
+        monkeypatch,
+        map: JSON,
+        partial_fail: bool,
+        progress: Optional[list[int]] = None,
+    ):
+        """
+        Pytest helper to install mocks for the Elasticsearch update_by_query
+        and tasks APIs for testing.
 
         Args:
             monkeypatch: The monkeypatch fixture from the test case
             map: The generated document index map from the test case
-            partial_fail: A boolean indicating whether some bulk operations
+            partial_fail: A boolean indicating whether some documents
                 should be marked as failures.
-
-        Yields:
-            Response documents from the mocked streaming_bulk helper
+            progress: The counts of updated documents to report while the
+                task runs
         """
-        expected_results = []
-        expected_ids = []
-
-        for index in map:
-            first = True
-            for docid in map[index]:
-                update = {
-                    "_index": index,
-                    "_type": "_doc",
-                    "_id": docid,
-                    "_version": 11,
-                    "result": "noop",
-                    "_shards": {"total": 2, "successful": 2, "failed": 0},
-                    "_seq_no": 10,
-                    "_primary_term": 3,
-                    "status": 200,
+        total = sum(map.values())
+        failures = []
+        if partial_fail:
+            failures = [
+                {
+                    "index": index,
+                    "id": "doc",
+                    "cause": {"reason": "Just kidding", "type": "KIDDING"},
+                    "status": 400,
                 }
-                if first and partial_fail:
-                    status = False
-                    first = False
-                    update["error"] = {"reason": "Just kidding", "type": "KIDDING"}
-                else:
-                    status = True
-                expected_results.append((status, {"update": update}))
-                expected_ids.append(docid)
-
-        def fake_bulk(
-            elastic: elasticsearch.Elasticsearch,
-            stream: Iterator[dict],
-            raise_on_error: bool = True,
-            raise_on_exception: bool = True,
-        ):
+                for index in map
+            ]
+        statuses = [
+            {"completed": False, "task": {"status": {"total": total, "updated": n}}}
+            for n in progress or []
+        ]
+        statuses.append(
+            {
+                "completed": True,
+                "task": {"status": {"total": total}},
+                "response": {
+                    "total": total,
+                    "updated": total - len(failures),
+                    "version_conflicts": 0,
+                    "failures": failures,
+                },
+            }
+        )
+        TestDatasetsUpdate.body = None
+
+        def fake_update_by_query(
+            elastic: elasticsearch.Elasticsearch, index: str, body: JSON, **kwargs
+        ) -> JSON:
             """
-            Helper function to mock the Elasticsearch helper streaming_bulk API,
-            which will validate the input actions and generate expected responses.
+            Helper function to mock the Elasticsearch update_by_query API,
+            which will validate the query and start a (fake) task.
 
             Args:
                 elastic: An Elasticsearch object
-                stream: The input stream of bulk action dicts
-                raise_on_error: indicates whether errors should be raised
-                raise_on_exception: indicates whether exceptions should propagate
-                    or be trapped
+                index: The indices to search
+                body: The query and update script
+                kwargs: The query parameters
+
+            Returns:
+                The task ID
+            """
+            assert index == ",".join(map)
+            assert kwargs["wait_for_completion"] is False
+            assert kwargs["conflicts"] == "proceed"
+            TestDatasetsUpdate.body = body
+            return {"task": "node:1"}
 
-            Yields:
-                Response documents from the mocked streaming_bulk helper
+        def fake_get(tasks: TasksClient, task_id: str) -> JSON:
             """
-            # Consume and validate the command generator
-            for cmd in stream:
-                assert cmd["_op_type"] == "update"
-                assert cmd["_id"] in expected_ids
+            Helper function to mock the Elasticsearch tasks get API, reporting
+            the progress and then the response of the task.
 
-            # Generate a sequence of result documents more or less as we'd
-            # expect to see from Elasticsearch
-            for item in expected_results:
-                yield item
+            Args:
+                tasks: An Elasticsearch TasksClient object
+                task_id: The task ID
+
+            Returns:
+                The status of the task
+            """
+            assert task_id == "node:1"
+            return statuses.pop(0)
 
-        monkeypatch.setattr("elasticsearch.helpers.streaming_bulk", fake_bulk)
+        monkeypatch.setattr(DatasetJobs, "POLL_INTERVAL", 0)
+        monkeypatch.setattr(
+            elasticsearch.Elasticsearch, "update_by_query", fake_update_by_query
+        )
+        monkeypatch.setattr(TasksClient, "get", fake_get)
 
     def test_partial(
         self,
         attach_dataset,
         client,
         get_document_map,
+        make_logger,
         monkeypatch,
         pbench_drb_token,
         server_config,
     ):
         """
-        Check the datasets_update API when some document updates fail. We expect an
-        internal error with a report of success and failure counts.
+        Check the datasets_update job when some document updates fail. We
+        expect the operation to fail with a count of the failures.
         """
         self.fake_elastic(monkeypatch, get_document_map, True)
 
@@ -112,12 +156,63 @@ class TestDatasetsUpdate:
             headers={"authorization": f"Bearer {pbench_drb_token}"},
             query_string=self.PAYLOAD,
         )
-        assert response.status_code == HTTPStatus.OK
-        assert response.json == {"ok": 28, "failure": 3}
+        dataset = Dataset.query(name="drb")
+        self.check_queued(
+            response, dataset, make_logger, {"access": "public", "owner": None}
+        )
+        assert DatasetJobs(server_config, make_logger).run() == 1
 
         # Verify that the Dataset access didn't change
         dataset = Dataset.query(name="drb")
         assert dataset.access == Dataset.PRIVATE_ACCESS
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPDATE": {
+                "state": "FAILED",
+                "message": "Unable to update 3 of 31 indexed documents",
+            }
+        }
+
+    def test_progress(
+        self,
+        attach_dataset,
+        client,
+        get_document_map,
+        make_logger,
+        monkeypatch,
+        pbench_drb_token,
+        server_config,
+    ):
+        """
+        Check that the datasets_update job reports its progress through the
+        operation message.
+        """
+        self.fake_elastic(monkeypatch, get_document_map, False, [10, 20])
+        messages = []
+        update = Sync.update
+
+        def fake_update(self, dataset: Dataset, *args, **kwargs):
+            messages.append(kwargs.get("message"))
+            update(self, dataset, *args, **kwargs)
+
+        monkeypatch.setattr(DatasetJobs, "PROGRESS_INTERVAL", 0)
+        monkeypatch.setattr(Sync, "update", fake_update)
+
+        response = client.post(
+            f"{server_config.rest_uri}/datasets/random_md5_string1",
+            headers={"authorization": f"Bearer {pbench_drb_token}"},
+            query_string=self.PAYLOAD,
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert DatasetJobs(server_config, make_logger).run() == 1
+        assert messages == [
+            "Queued",
+            "Started",
+            "10 of 31 documents",
+            "20 of 31 documents",
+            "Done",
+        ]
+        dataset = Dataset.query(name="drb")
+        assert dataset.access == Dataset.PUBLIC_ACCESS
 
     def test_no_dataset(
         self, client, get_document_map, monkeypatch, pbench_drb_token, server_config
@@ -161,29 +256,26 @@ class TestDatasetsUpdate:
     def test_exception(
         self,
         attach_dataset,
-        capinternal,
         client,
+        make_logger,
         monkeypatch,
         get_document_map,
         pbench_drb_token,
         server_config,
     ):
         """
-        Check the datasets_update API response if the bulk helper throws an exception.
-
-        (It shouldn't do this as we've set raise_on_exception=False, but we
-        check the code path anyway.)
+        Check the datasets_update job if Elasticsearch can't start the
+        update task.
         """
 
-        def fake_bulk(
-            elastic: elasticsearch.Elasticsearch,
-            stream: Iterator[dict],
-            raise_on_error: bool = True,
-            raise_on_exception: bool = True,
+        def fake_update_by_query(
+            elastic: elasticsearch.Elasticsearch, index: str, body: JSON, **kwargs
         ):
-            raise elasticsearch.helpers.BulkIndexError("test")
+            raise elasticsearch.exceptions.TransportError(500, "test")
 
-        monkeypatch.setattr("elasticsearch.helpers.streaming_bulk", fake_bulk)
+        monkeypatch.setattr(
+            elasticsearch.Elasticsearch, "update_by_query", fake_update_by_query
+        )
 
         response = client.post(
             f"{server_config.rest_uri}/datasets/random_md5_string1",
@@ -191,8 +283,39 @@ class TestDatasetsUpdate:
             query_string=self.PAYLOAD,
         )
 
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert DatasetJobs(server_config, make_logger).run() == 1
+
         # Verify the failure
-        capinternal("Unexpected backend error", response)
+        dataset = Dataset.query(name="drb")
+        assert dataset.access == Dataset.PRIVATE_ACCESS
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPDATE": {
+                "state": "FAILED",
+                "message": "Unexpected backend error: TransportError(500, 'test')",
+            }
+        }
+
+    def test_queued(
+        self,
+        attach_dataset,
+        client,
+        get_document_map,
+        pbench_drb_token,
+        server_config,
+    ):
+        """
+        Check that the datasets_update API rejects an update of a dataset
+        which already has one queued.
+        """
+        for expected in (HTTPStatus.ACCEPTED, HTTPStatus.CONFLICT):
+            response = client.post(
+                f"{server_config.rest_uri}/datasets/random_md5_string1",
+                headers={"authorization": f"Bearer {pbench_drb_token}"},
+                query_string=self.PAYLOAD,
+            )
+            assert response.status_code == expected
+        assert response.json == {"message": "Dataset UPDATE is already queued"}
 
     @pytest.mark.parametrize("ds_name", ("drb", "test"))
     @pytest.mark.parametrize("owner", ("drb", "test", None))
@@ -207,6 +330,7 @@ class TestDatasetsUpdate:
         create_user,
         ds_name,
         get_document_map,
+        make_logger,
         monkeypatch,
         owner,
         server_config,
@@ -232,7 +356,7 @@ class TestDatasetsUpdate:
         elif not query_json:
             expected_status = HTTPStatus.BAD_REQUEST
         else:
-            expected_status = HTTPStatus.OK
+            expected_status = HTTPStatus.ACCEPTED
 
         ds = Dataset.query(name=ds_name)
         response = client.post(
@@ -242,13 +366,41 @@ class TestDatasetsUpdate:
         )
 
         assert response.status_code == expected_status
-        if expected_status == HTTPStatus.OK:
-            assert response.json == {"ok": 31, "failure": 0}
+        if expected_status == HTTPStatus.ACCEPTED:
+            self.check_queued(
+                response,
+                ds,
+                make_logger,
+                {"access": access, "owner": str(assert_id) if owner else None},
+            )
+            assert DatasetJobs(server_config, make_logger).run() == 1
             dataset = Dataset.query(name=ds_name)
+            assert Metadata.getvalue(dataset, "dataset.operations") == {
+                "UPDATE": {"state": "OK", "message": "Done"}
+            }
             if access:
                 assert dataset.access == access
             if owner:
                 assert dataset.owner_id == assert_id
+            authorization = {"access": access} if access else {}
+            if owner:
+                authorization["owner"] = str(assert_id)
+            assert TestDatasetsUpdate.body == {
+                "query": {
+                    "bool": {
+                        "should": [
+                            {"term": {"run.id": ds.resource_id}},
+                            {"term": {"run_data_parent": ds.resource_id}},
+                        ],
+                        "minimum_should_match": 1,
+                    }
+                },
+                "script": {
+                    "source": DatasetJobs.UPDATE_SCRIPT,
+                    "lang": "painless",
+                    "params": {"authorization": authorization},
+                },
+            }
 
     def test_invalid_owner_params(
         self,
@@ -775,7 +775,7 @@ class TestSampleValues(Commons):
         Metadata.setvalue(
             dataset=test,
             key=Metadata.INDEX_MAP,
-            value={"unit-test.v6.run-data.2020-08": ["random_md5_string1"]},
+            value={"unit-test.v6.run-data.2020-08": 1},
         )
 
         # When server index_map doesn't have mappings for result-data-sample
@@ -283,6 +283,27 @@ class TestAPIKeyDelete:
         keys = APIKey.query(id=pbench_drb_secondary_api_key.id)
         assert keys[0].key == pbench_drb_secondary_api_key.key
 
+    def test_delete_api_key_revoked(
+        self,
+        client,
+        server_config,
+        query_delete_as,
+        pbench_drb_api_key,
+        pbench_drb_secondary_api_key,
+    ):
+        """Verify that a deleted API key is no longer accepted, although it
+        was remembered by the token cache.
+        """
+        uri = f"{server_config.rest_uri}/key"
+        headers = {"authorization": f"bearer {pbench_drb_api_key.key}"}
+        response = client.get(uri, headers=headers)
+        assert response.status_code == HTTPStatus.OK
+        query_delete_as(
+            pbench_drb_secondary_api_key.key, pbench_drb_api_key.id, HTTPStatus.OK
+        )
+        response = client.get(uri, headers=headers)
+        assert response.status_code == HTTPStatus.UNAUTHORIZED
+
     def test_unauthorized_delete(
         self, query_delete_as, pbench_drb_token_invalid, pbench_drb_api_key
     ):
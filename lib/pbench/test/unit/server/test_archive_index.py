@@ -0,0 +1,148 @@
+import io
+import lzma
+from pathlib import Path
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from pbench.server.archive_index import ArchiveIndex, open_tarball, read_xz_blocks
+
+
+@pytest.fixture()
+def source_tree(tmp_path: Path) -> Path:
+    """Create a directory tree with a mix of small and large files, links,
+    and an empty directory."""
+    root = tmp_path / "src" / "dataset"
+    (root / "sub" / "empty").mkdir(parents=True)
+    for i in range(8):
+        # Large enough, and incompressible enough, to span xz blocks
+        data = bytes((i * j) & 0xFF for j in range(3001)) * 100
+        (root / "sub" / f"f{i}.bin").write_bytes(data)
+    (root / "result.csv").write_text("a,b\n1,2\n")
+    (root / "link.csv").symlink_to("result.csv")
+    (root / "sub" / "up.csv").symlink_to("../link.csv")
+    (root / "dangling").symlink_to("nonexistent")
+    (root / "hard.csv").hardlink_to(root / "result.csv")
+    return root
+
+
+def make_tar(tmp_path: Path, root: Path) -> Path:
+    tar = tmp_path / "dataset.tar"
+    with tarfile.open(tar, "w") as t:
+        t.add(root, arcname=root.name)
+    return tar
+
+
+def check_members(tarball: Path, index: ArchiveIndex, reference: Path = None):
+    """Check that every member of the tarball reads the same through the
+    index as it does through tarfile, from the tarball itself or from an
+    uncompressed reference copy. (A dangling link, which tarfile can't
+    extract, has no data in the index.)"""
+    with tarfile.open(reference or tarball) as t:
+        for member in t.getmembers():
+            try:
+                expected = t.extractfile(member)
+            except KeyError:
+                expected = None
+            actual = index.open(tarball, member.name)
+            if expected is None:
+                assert actual is None, member.name
+            else:
+                assert actual.read() == expected.read(), member.name
+                actual.close()
+
+
+class TestArchiveIndex:
+    def test_single_block(self, tmp_path, source_tree):
+        """The tarfile module writes an xz stream with a single block."""
+        tarball = tmp_path / "dataset.tar.xz"
+        with tarfile.open(tarball, "w:xz") as t:
+            t.add(source_tree, arcname=source_tree.name)
+        with tarball.open("rb") as fp:
+            assert len(read_xz_blocks(fp)) == 1
+        index = ArchiveIndex.build(tarball)
+        assert index.members["dataset/sub/empty"] is None
+        assert index.members["dataset/dangling"] is None
+        assert (
+            index.members["dataset/link.csv"]
+            == index.members["dataset/sub/up.csv"]
+            == index.members["dataset/hard.csv"]
+            == index.members["dataset/result.csv"]
+        )
+        check_members(tarball, index)
+
+    @pytest.mark.skipif(shutil.which("xz") is None, reason="needs xz")
+    def test_multiple_blocks(self, tmp_path, source_tree):
+        """Show that we read the right data when members span several xz
+        blocks."""
+        tar = make_tar(tmp_path, source_tree)
+        subprocess.run(["xz", "-T2", "--block-size=100000", str(tar)], check=True)
+        tarball = tmp_path / "dataset.tar.xz"
+        with tarball.open("rb") as fp:
+            assert len(read_xz_blocks(fp)) > 10
+        check_members(tarball, ArchiveIndex.build(tarball))
+
+    def test_concatenated_streams(self, tmp_path, source_tree):
+        """Show that we fall back to decompressing from the start when there
+        is no block index covering the whole file."""
+        tar = make_tar(tmp_path, source_tree)
+        data = tar.read_bytes()
+        tarball = tmp_path / "dataset.tar.xz"
+        tarball.write_bytes(lzma.compress(data[:100000]) + lzma.compress(data[100000:]))
+        with tarball.open("rb") as fp:
+            assert read_xz_blocks(fp) is None
+        check_members(tarball, ArchiveIndex.build(tarball))
+
+    def test_uncompressed(self, tmp_path, source_tree):
+        """Show that we read the members of an uncompressed tarball."""
+        tarball = make_tar(tmp_path, source_tree)
+        check_members(tarball, ArchiveIndex.build(tarball))
+
+    @pytest.mark.skipif(shutil.which("zstd") is None, reason="needs zstd")
+    def test_zstd(self, tmp_path, source_tree):
+        """Show that we read the members of a zstd tarball, which tarfile
+        can't, through a zstd process."""
+        tar = make_tar(tmp_path, source_tree)
+        tarball = tmp_path / "dataset.tar.zst"
+        subprocess.run(["zstd", "-q", "-T0", str(tar), "-o", str(tarball)], check=True)
+        with open_tarball(tarball) as t:
+            names = [m.name for m in t]
+        with tarfile.open(tar) as t:
+            assert names == t.getnames()
+        index = ArchiveIndex.build(tarball)
+        check_members(tarball, index, reference=tar)
+
+        # Closing a member stream part way through stops the zstd process.
+        stream = index.open(tarball, "dataset/sub/f7.bin")
+        assert len(stream.read(10)) == 10
+        stream.close()
+
+    @pytest.mark.parametrize(
+        "data", (b"", b"not an xz file", b"\xfd7zXZ\x00" + bytes(30))
+    )
+    def test_read_xz_blocks_bad(self, data):
+        assert read_xz_blocks(io.BytesIO(data)) is None
+
+    def test_save_load(self, tmp_path, source_tree):
+        tarball = tmp_path / "dataset.tar.xz"
+        with tarfile.open(tarball, "w:xz") as t:
+            t.add(source_tree, arcname=source_tree.name)
+        path = tmp_path / "dataset.tar.xz.idx"
+        assert ArchiveIndex.load(path) is None
+        index = ArchiveIndex.build(tarball)
+        index.save(path)
+        assert list(tmp_path.glob("*.tmp")) == []
+        loaded = ArchiveIndex.load(path)
+        assert loaded.members == index.members
+        assert loaded.entries == index.entries
+        with tarfile.open(tarball) as t:
+            expected = t.getmembers()
+        assert [(m.name, m.type, m.size, m.linkname) for m in expected] == [
+            (m.name, m.type, m.size, m.linkname) for m in loaded.tar_members()
+        ]
+        path.write_text('{"version": 1, "members": {}}')
+        assert ArchiveIndex.load(path) is None
+        with pytest.raises(KeyError):
+            index.open(tarball, "dataset/nonexistent")
@@ -1,5 +1,7 @@
+import errno
 import hashlib
 import io
+import json
 from logging import Logger
 import os
 from pathlib import Path
@@ -10,13 +12,18 @@ import tarfile
 
 import pytest
 
+from pbench.server.archive_index import ArchiveIndex
 from pbench.server.cache_manager import (
     BadDirpath,
     BadFilename,
+    cache_map_from_manifest,
+    cache_map_to_manifest,
     CacheManager,
     CacheType,
     Controller,
     DuplicateTarball,
+    make_cache_map_from_members,
+    make_tar_members,
     MetadataError,
     Tarball,
     TarballModeChangeError,
@@ -247,6 +254,66 @@ class TestCacheManager:
             cm.create(source_tarball)
         assert exc.value.tarball == Dataset.stem(source_tarball)
 
+    def test_create_links(self, selinux_disabled, server_config, make_logger, tarball):
+        """Test that creating a dataset links the uploaded files into place
+        rather than copying them.
+        """
+        source_tarball, source_md5, md5 = tarball
+        inodes = {f.name: f.stat().st_ino for f in (source_tarball, source_md5)}
+        cm = CacheManager(server_config, make_logger)
+        with pytest.MonkeyPatch.context() as m:
+            m.setattr(Tarball, "_get_metadata", fake_get_metadata)
+            m.setattr(shutil, "copy2", None)
+            tarball = cm.create(source_tarball)
+        assert tarball.tarball_path.stat().st_ino == inodes[source_tarball.name]
+        assert tarball.md5_path.stat().st_ino == inodes[source_md5.name]
+        assert not source_tarball.exists()
+        assert not source_md5.exists()
+
+    def test_create_copies(
+        self, monkeypatch, selinux_disabled, server_config, make_logger, tarball
+    ):
+        """Test that creating a dataset copies the uploaded files when they
+        can't be linked into place, and that a failure to copy the tarball
+        removes the imported MD5 file.
+        """
+        source_tarball, source_md5, md5 = tarball
+        monkeypatch.setattr(Tarball, "_get_metadata", fake_get_metadata)
+        controller = server_config.ARCHIVE / "ABC"
+        link = os.link
+
+        def cross_device(source: Path, destination: Path):
+            if Path(source).parent != controller:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            link(source, destination)
+
+        copies = []
+        copy2 = shutil.copy2
+
+        def fail_tarball(source: Path, destination: Path):
+            copies.append(Path(source).name)
+            if source == source_tarball:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return copy2(source, destination)
+
+        monkeypatch.setattr(os, "link", cross_device)
+        monkeypatch.setattr(shutil, "copy2", fail_tarball)
+        cm = CacheManager(server_config, make_logger)
+        with pytest.raises(OSError):
+            cm.create(source_tarball)
+        assert copies == [source_md5.name, source_tarball.name]
+        assert list(controller.iterdir()) == []
+        assert source_tarball.exists()
+        assert source_md5.exists()
+
+        monkeypatch.setattr(shutil, "copy2", copy2)
+        tarball = cm.create(source_tarball)
+        assert sorted(f.name for f in controller.iterdir()) == sorted(
+            [source_tarball.name, source_md5.name]
+        )
+        assert tarball.md5_path.read_text() == md5
+        assert not source_tarball.exists()
+
     def test_tarball_subprocess_run_with_exception(self, monkeypatch):
         """Test to check the subprocess_run functionality of the Tarball when
         an Exception occured"""
@@ -491,6 +558,9 @@ class TestCacheManager:
 
         with monkeypatch.context() as m:
             m.setattr(Path, "mkdir", lambda path, parents: None)
+            m.setattr(
+                "pbench.server.cache_manager.make_tar_members", lambda root, order: []
+            )
             m.setattr(Tarball, "subprocess_run", staticmethod(mock_run))
             m.setattr(shutil, "rmtree", mock_rmtree)
             m.setattr(Tarball, "__init__", TestCacheManager.MockTarball.__init__)
@@ -525,13 +595,88 @@ class TestCacheManager:
             m.setattr(Path, "mkdir", lambda path, parents: None)
             m.setattr(subprocess, "run", mock_run)
             m.setattr(Path, "resolve", lambda path, strict: path)
+            m.setattr(
+                "pbench.server.cache_manager.make_tar_members", lambda root, order: []
+            )
+            m.setattr(Tarball, "save_cache_map", lambda self: call.append("save"))
             m.setattr(Tarball, "__init__", TestCacheManager.MockTarball.__init__)
             m.setattr(Controller, "__init__", TestCacheManager.MockController.__init__)
             tb = Tarball(tar, Controller(Path("/mock/archive"), cache, None))
             tb.unpack()
-            assert call == ["tar", "find"]
+            assert call == ["tar", "find", "save"]
             assert tb.unpacked == cache / "ABC" / tb.name
 
+    def test_make_tar_members(self, tmp_path):
+        """Show that the members described from an unpacked tree match those
+        of a tarball of the same tree."""
+        tar_dir = TestCacheManager.MockController.generate_test_result_tree(
+            tmp_path / "unpacked", "dir_name"
+        )
+        (tar_dir / "f1.json").write_text('{"a": 1}')
+        os.link(tar_dir / "f1.json", tar_dir / "subdir1" / "f13_link")
+        tar = tmp_path / "dir_name.tar"
+        with tarfile.open(tar, "w") as tf:
+            tf.add(tar_dir, arcname="dir_name")
+        with tarfile.open(tar) as tf:
+            expected = {m.name: m for m in tf.getmembers()}
+
+        members = make_tar_members(tar_dir.parent)
+        names = [m.name for m in members]
+        assert sorted(names) == sorted(expected)
+        for m in members:
+            if m.isdir():
+                assert all(
+                    names.index(m.name) < names.index(n)
+                    for n in names
+                    if n.startswith(f"{m.name}/")
+                )
+            e = expected[m.name]
+            assert (m.type, m.mode, m.mtime, m.linkname) == (
+                e.type,
+                e.mode,
+                int(e.mtime),
+                e.linkname,
+            ), m.name
+            if m.isfile():
+                assert m.size == e.size
+
+    def test_unpack_members(self, monkeypatch, tmp_path):
+        """Show that the members captured when a tarball is unpacked match
+        those of the tarball, in archive order and with the archive's modes,
+        regardless of the umask."""
+        src = tmp_path / "src" / "dir_name"
+        (src / "sub").mkdir(parents=True)
+        (src / "metadata.log").write_text("[pbench]\n")
+        (src / "z_first").write_text("data")
+        (src / "z_first").chmod(0o777)
+        os.link(src / "z_first", src / "a_link")
+        (src / "sub" / "sym").symlink_to("../z_first")
+        tar = tmp_path / "dir_name.tar.xz"
+        with tarfile.open(tar, "w:xz") as tf:
+            for name in ("", "z_first", "sub", "sub/sym", "metadata.log", "a_link"):
+                tf.add(
+                    src / name, arcname=f"dir_name/{name}".rstrip("/"), recursive=False
+                )
+        with tarfile.open(tar) as tf:
+            expected = tf.getmembers()
+
+        cache = tmp_path / "cache"
+        with monkeypatch.context() as m:
+            m.setattr(Tarball, "save_cache_map", lambda self: None)
+            m.setattr(Tarball, "__init__", TestCacheManager.MockTarball.__init__)
+            m.setattr(Controller, "__init__", TestCacheManager.MockController.__init__)
+            tb = Tarball(tar, Controller(tmp_path / "archive", cache, None))
+            old_umask = os.umask(0o077)
+            try:
+                tb.unpack()
+            finally:
+                os.umask(old_umask)
+
+        assert [m.name for m in tb.members] == [e.name for e in expected]
+        for m, e in zip(tb.members, expected):
+            assert (m.type, m.mode, m.linkname) == (e.type, e.mode, e.linkname)
+        assert tb.members[1].mode == 0o777
+
     def test_cache_map_success(self, monkeypatch, tmp_path):
         """Test to build the cache map of the root directory"""
         tar = Path("/mock/dir_name.tar.xz")
@@ -556,6 +701,122 @@ class TestCacheManager:
                 == CacheType.SYMLINK
             )
 
+    def test_cache_map_from_members(self, monkeypatch, tmp_path):
+        """Show that the cache map built from the members of a tarball, and
+        the one rebuilt from a manifest, match the cache map of the unpacked
+        tree."""
+        tar = Path("/mock/dir_name.tar.xz")
+        cache = Path("/mock/.cache")
+
+        with monkeypatch.context() as m:
+            m.setattr(Tarball, "__init__", TestCacheManager.MockTarball.__init__)
+            m.setattr(Controller, "__init__", TestCacheManager.MockController.__init__)
+            tb = Tarball(tar, Controller(Path("/mock/archive"), cache, None))
+            tar_dir = TestCacheManager.MockController.generate_test_result_tree(
+                tmp_path, "dir_name"
+            )
+            tb.cache_map(tar_dir)
+
+        tar_file = tmp_path / "dir_name.tar"
+        with tarfile.open(tar_file, "w") as t:
+            t.add(tar_dir, arcname="dir_name")
+        with tarfile.open(tar_file) as t:
+            members = t.getmembers()
+
+        # Without the unpacked tree we can't follow the absolute symlink
+        # target of f1412_sym (which the unpacked tree happens to contain), so
+        # the relative link to it is reported as unresolved.
+        cmap = make_cache_map_from_members(members)
+        assert cmap == make_cache_map_from_members(
+            ArchiveIndex.build(tar_file).tar_members()
+        )
+        subdir141 = ["dir_name", "subdir1", "subdir14", "subdir141"]
+        entries = cmap
+        for d in subdir141:
+            entries = entries[d]["children"]
+        details = entries.pop("f1415_sym")["details"]
+        assert details.resolve_path == Path("f1412_sym")
+        assert details.resolve_type == CacheType.OTHER
+        entries = tb.cachemap
+        for d in subdir141:
+            entries = entries[d]["children"]
+        details = entries.pop("f1415_sym")["details"]
+        assert details.resolve_type == CacheType.FILE
+        assert cmap == tb.cachemap
+
+        manifest = json.loads(json.dumps(cache_map_to_manifest(tb.cachemap)))
+        assert cache_map_from_manifest(manifest) == tb.cachemap
+
+    def test_load_cache_map(self, monkeypatch, tmp_path, make_logger):
+        """Show that the cache map of a tarball which isn't unpacked is built
+        from its archive index and saved, and is then loaded from the
+        manifest, without ever reading the tarball."""
+        tar_dir = TestCacheManager.MockController.generate_test_result_tree(
+            tmp_path / "source", "dir_name"
+        )
+        tar = tmp_path / "dir_name.tar.xz"
+        with tarfile.open(tar, "w:xz") as t:
+            t.add(tar_dir, arcname="dir_name")
+        cache = tmp_path / "cache"
+        cache.mkdir()
+
+        def make_tarball() -> Tarball:
+            tb = Tarball(tar, Controller(tmp_path / "archive", cache, None))
+            tb.logger = make_logger
+            tb.cachemap = None
+            tb.cachemap_path = cache / "ABC.map.json"
+            tb.index_path = Tarball.archive_index_path(tar)
+            return tb
+
+        with monkeypatch.context() as m:
+            m.setattr(Tarball, "__init__", TestCacheManager.MockTarball.__init__)
+            m.setattr(Controller, "__init__", TestCacheManager.MockController.__init__)
+
+            # Without a manifest, an unpacked tree, or an archive index, we
+            # don't decompress the tarball to build the map.
+            tb = make_tarball()
+            with pytest.raises(TarballUnpackError) as exc:
+                tb.get_info(Path("dir_name/subdir1"))
+            assert "No cache map manifest or archive index" in str(exc.value)
+
+            ArchiveIndex.build(tar).save(Tarball.archive_index_path(tar))
+            m.setattr(tarfile, "open", lambda *a, **k: pytest.fail("tarfile.open"))
+            info = tb.get_info(Path("dir_name/subdir1"))
+            assert info["files"] == ["f11.txt"]
+            assert tb.cachemap_path.exists()
+            assert not tb.cachemap_path.with_suffix(".json.tmp").exists()
+
+            # A new Tarball object gets the map from the manifest.
+            Tarball.archive_index_path(tar).unlink()
+            new = make_tarball()
+            assert new.get_info(Path("dir_name/subdir1")) == info
+            assert new.cachemap == tb.cachemap
+
+    @pytest.mark.skipif(shutil.which("zstd") is None, reason="needs zstd")
+    def test_extract_not_indexed(self, tmp_path):
+        """Show that a member which isn't in the archive index (e.g., a
+        sparse file) is extracted by reading the tarball, even when it's a
+        zstd tarball which tarfile can't read."""
+        tar_dir = TestCacheManager.MockController.generate_test_result_tree(
+            tmp_path / "source", "dir_name"
+        )
+        (tar_dir / "result.csv").write_text("a,b\n1,2\n")
+        tar = tmp_path / "dir_name.tar"
+        with tarfile.open(tar, "w") as t:
+            t.add(tar_dir, arcname="dir_name")
+        tarball = tmp_path / "dir_name.tar.zst"
+        subprocess.run(["zstd", "-q", str(tar), "-o", str(tarball)], check=True)
+
+        index = ArchiveIndex.build(tarball)
+        del index.members["dir_name/result.csv"]
+        index.save(Tarball.archive_index_path(tarball))
+
+        stream = Tarball.extract(tarball, Path("dir_name/result.csv"))
+        assert stream.read() == b"a,b\n1,2\n"
+        stream.close()
+        with pytest.raises(BadDirpath):
+            Tarball.extract(tarball, Path("dir_name/nonexistent"))
+
     @pytest.mark.parametrize(
         "file_path, expected_msg",
         [
@@ -1060,6 +1321,14 @@ class TestCacheManager:
         assert list(cm.tarballs) == [dataset_name]
         assert list(cm.datasets) == [md5]
 
+        # Extracting a file builds and saves the archive index
+        indexfile = archive / f"{source_tarball.name}.idx"
+        assert not indexfile.exists()
+        stream = Tarball.extract(tarfile, f"{dataset_name}/metadata.log")
+        assert stream.read().startswith(b"[pbench]")
+        stream.close()
+        assert indexfile.exists()
+
         # Now "unpack" the tarball and check that the incoming directory and
         # results link are set up.
         cm.unpack(md5)
@@ -1105,3 +1374,106 @@ class TestCacheManager:
         assert not archive.exists()
         assert not cm.controllers
         assert not cm.datasets
+
+    @staticmethod
+    def make_fake_tarballs(archive: Path, controller: str, count: int) -> list[str]:
+        """Create fake tarballs (which can be found, but not unpacked) with
+        their MD5 files in a controller directory.
+
+        Returns:
+            The resource IDs of the tarballs
+        """
+        directory = archive / controller
+        directory.mkdir(parents=True, exist_ok=True)
+        ids = []
+        for i in range(count):
+            name = f"{controller}_{i}.tar.xz"
+            md5 = hashlib.md5(name.encode()).hexdigest()
+            (directory / name).write_bytes(b"")
+            (directory / f"{name}.md5").write_text(f"{md5} {name}\n")
+            ids.append(md5)
+        return ids
+
+    def test_find_index(
+        self, selinux_enabled, server_config, make_logger, tarball, monkeypatch
+    ):
+        """Test that a created dataset is found through the tarball index,
+        without searching the ARCHIVE tree, and that deleting it removes it
+        from the index.
+        """
+        monkeypatch.setattr(Tarball, "_get_metadata", fake_get_metadata)
+        source_tarball, _, md5 = tarball
+        cm = CacheManager(server_config, make_logger)
+        cm.create(source_tarball)
+        entry = cm.archive_root / "INDEX" / md5
+        assert os.readlink(entry) == f"../ABC/{source_tarball.name}"
+
+        def no_search(directory: Path) -> bool:
+            raise AssertionError(f"Unexpected search of {directory}")
+
+        monkeypatch.setattr(CacheManager, "_is_controller", no_search)
+        new = CacheManager(server_config, make_logger)
+        tarball = new.find_dataset(md5)
+        assert tarball.tarball_path == cm.archive_root / "ABC" / source_tarball.name
+        assert list(new.controllers) == ["ABC"]
+        assert list(new.datasets) == [md5]
+
+        new.delete(md5)
+        assert not entry.is_symlink()
+        monkeypatch.undo()
+        with pytest.raises(TarballNotFound):
+            CacheManager(server_config, make_logger).find_dataset(md5)
+
+    def test_find_unindexed(self, server_config, make_logger):
+        """Test that a dataset missing from the index is found by searching
+        the ARCHIVE tree, which indexes the tarballs it checks, and that a
+        stale index entry is ignored and removed.
+        """
+        archive = server_config.ARCHIVE
+        ids = self.make_fake_tarballs(archive, "ctrl", 3)
+        cm = CacheManager(server_config, make_logger)
+        tarball = cm.find_dataset(ids[-1])
+        assert tarball.name == "ctrl_2"
+        assert list(cm.datasets) == [ids[-1]]
+        assert cm.index.find(ids[-1]) == archive / "ctrl" / "ctrl_2.tar.xz"
+
+        (archive / "ctrl" / "ctrl_2.tar.xz").unlink()
+        with pytest.raises(TarballNotFound):
+            cm.find_dataset(ids[-1])
+        assert not (archive / "INDEX" / ids[-1]).is_symlink()
+        assert not cm.datasets
+
+        # The search indexed all the remaining tarballs
+        for i, resource_id in enumerate(ids[:-1]):
+            assert cm.index.find(resource_id) == archive / "ctrl" / f"ctrl_{i}.tar.xz"
+
+        # Full discovery ignores the index directory
+        cm.full_discovery()
+        assert list(cm.controllers) == ["ctrl"]
+
+    def test_instance(self, server_config, make_logger):
+        """Test that the process-wide CacheManager remembers only the most
+        recently used datasets, and notices datasets deleted by another
+        CacheManager.
+        """
+        CacheManager.clear_instance()
+        ids = self.make_fake_tarballs(server_config.ARCHIVE, "ctrl", 3)
+        cm = CacheManager.get_instance(server_config, make_logger)
+        assert CacheManager.get_instance(server_config, make_logger) is cm
+        assert cm.max_datasets == CacheManager.INSTANCE_DATASETS
+        cm.max_datasets = 2
+
+        first = cm.find_dataset(ids[0])
+        cm.find_dataset(ids[1])
+        assert cm.find_dataset(ids[0]) is first
+        cm.find_dataset(ids[2])
+        assert sorted(cm.datasets) == sorted([ids[0], ids[2]])
+        assert sorted(cm.controllers["ctrl"].datasets) == sorted([ids[0], ids[2]])
+
+        CacheManager(server_config, make_logger).delete(ids[0])
+        with pytest.raises(TarballNotFound):
+            cm.find_dataset(ids[0])
+        assert list(cm.datasets) == [ids[2]]
+        CacheManager.clear_instance()
+        assert CacheManager.get_instance(server_config, make_logger) is not cm
+        CacheManager.clear_instance()
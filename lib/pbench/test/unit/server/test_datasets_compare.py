@@ -1,12 +1,16 @@
 from http import HTTPStatus
+import io
+import json
 from pathlib import Path
-from typing import Optional
+import shutil
+from typing import IO, Optional
 
-from pquisby.lib.post_processing import QuisbyProcessing
+from pquisby.lib.post_processing import BenchmarkName, InputType, QuisbyProcessing
 import pytest
 import requests
 
 from pbench.server import JSON
+from pbench.server.api.resources.quisby_cache import compare_quisby_data
 from pbench.server.cache_manager import CacheManager, TarballUnpackError
 from pbench.server.database.models.datasets import Dataset, DatasetNotFound, Metadata
 from pbench.server.database.models.users import User
@@ -18,6 +22,10 @@ def mock_get_value(dataset: Dataset, key: str, user: Optional[User] = None) -> s
     return "uperf"
 
 
+def mock_extract_data(self, test_name, dataset_name, input_type, data) -> JSON:
+    return {"status": "success", "json_data": {"dataset_name": dataset_name}}
+
+
 class TestCompareDatasets:
     @pytest.fixture()
     def query_get_as(self, client, server_config, more_datasets, get_token_func):
@@ -32,6 +40,10 @@ class TestCompareDatasets:
             get_token_func: Pbench token fixture
         """
 
+        # Processed Quisby results are cached, so start each test without
+        # the results of earlier tests.
+        shutil.rmtree(server_config.CACHE / CacheManager.EXTRACTED, ignore_errors=True)
+
         def query_api(
             datasets: list, user: str, expected_status: HTTPStatus
         ) -> requests.Response:
@@ -60,8 +72,8 @@ class TestCompareDatasets:
         name = "tarball"
 
         @staticmethod
-        def extract(_tarball_path: Path, _path: str) -> str:
-            return "CSV_file_as_a_string"
+        def extract(_tarball_path: Path, _path: str) -> IO[bytes]:
+            return io.BytesIO(b"CSV_file_as_a_string")
 
     def mock_find_dataset(self, dataset) -> MockTarball:
         # Validate the resource_id
@@ -75,8 +87,8 @@ class TestCompareDatasets:
 
     def test_unsuccessful_get_with_incorrect_data(self, query_get_as, monkeypatch):
         @staticmethod
-        def mock_extract(_tarball_path: Path, _path: str) -> str:
-            return "IncorrectData"
+        def mock_extract(_tarball_path: Path, _path: str) -> IO[bytes]:
+            return io.BytesIO(b"IncorrectData")
 
         def mock_compare_csv_to_json(
             self, benchmark_name, input_type, data_stream
@@ -150,10 +162,13 @@ class TestCompareDatasets:
         def mock_compare_csv_to_json(
             self, benchmark_name, input_type, data_stream
         ) -> JSON:
+            for n, d in data_stream.items():
+                self.extract_data(benchmark_name, n, input_type, d)
             return {"status": "success", "json_data": "quisby_data"}
 
         monkeypatch.setattr(CacheManager, "find_dataset", self.mock_find_dataset)
         monkeypatch.setattr(Metadata, "getvalue", mock_get_value)
+        monkeypatch.setattr(QuisbyProcessing, "extract_data", mock_extract_data)
         monkeypatch.setattr(
             QuisbyProcessing, "compare_csv_to_json", mock_compare_csv_to_json
         )
@@ -164,3 +179,87 @@ class TestCompareDatasets:
             assert response.json["json_data"] == "quisby_data"
         else:
             assert response.json["message"] == exp_message
+
+    def test_cached_results(self, query_get_as, monkeypatch):
+        """Show that each dataset's Quisby processing is only done once, and
+        that the comparison is built from the processed results."""
+        processed = []
+        compared = []
+
+        def mock_extract_data_count(
+            self, test_name, dataset_name, input_type, data
+        ) -> JSON:
+            processed.append(dataset_name)
+            return mock_extract_data(self, test_name, dataset_name, input_type, data)
+
+        def mock_compare_csv_to_json(
+            self, benchmark_name, input_type, data_stream
+        ) -> JSON:
+            compared.append(
+                {
+                    n: self.extract_data(benchmark_name, n, input_type, d)
+                    for n, d in data_stream.items()
+                }
+            )
+            return {"status": "success", "json_data": "quisby_data"}
+
+        monkeypatch.setattr(CacheManager, "find_dataset", self.mock_find_dataset)
+        monkeypatch.setattr(Metadata, "getvalue", mock_get_value)
+        monkeypatch.setattr(QuisbyProcessing, "extract_data", mock_extract_data_count)
+        monkeypatch.setattr(
+            QuisbyProcessing, "compare_csv_to_json", mock_compare_csv_to_json
+        )
+        for _ in range(2):
+            query_get_as(["uperf_1", "uperf_2"], "test", HTTPStatus.OK)
+        assert sorted(processed) == ["uperf_1", "uperf_2"]
+        expected = {
+            n: {"status": "success", "json_data": {"dataset_name": n}}
+            for n in ("uperf_1", "uperf_2")
+        }
+        assert compared == [expected, expected]
+
+    def test_quisby_bypassed(self, query_get_as, monkeypatch):
+        """Show that we fail, rather than return a wrong comparison, if
+        Quisby doesn't compare the processed results we give it."""
+
+        def mock_compare_csv_to_json(
+            self, benchmark_name, input_type, data_stream
+        ) -> JSON:
+            return {"status": "success", "json_data": "quisby_data"}
+
+        monkeypatch.setattr(CacheManager, "find_dataset", self.mock_find_dataset)
+        monkeypatch.setattr(Metadata, "getvalue", mock_get_value)
+        monkeypatch.setattr(QuisbyProcessing, "extract_data", mock_extract_data)
+        monkeypatch.setattr(
+            QuisbyProcessing, "compare_csv_to_json", mock_compare_csv_to_json
+        )
+        query_get_as(["uperf_1", "uperf_2"], "test", HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def test_compare_quisby_data(self):
+        """Show that the comparison built from processed results matches the
+        comparison Quisby builds from the CSV data.
+
+        This depends on how Quisby's `compare_csv_to_json` processes each
+        dataset's data, so it should be checked on each pquisby upgrade.
+        """
+        csv = (
+            "iteration_id,iteration_name,Gb_sec:all,trans_sec:all,usec:all\n"
+            "1,tcp_stream-64B-1i,1.5,,\n"
+            "2,tcp_stream-64B-8i,3.0,,\n"
+            "3,tcp_rr-64B-1i,,1000,20\n"
+        )
+        data = {"uperf_1": csv, "uperf_2": csv.replace("1.5", "1.7")}
+        quisby = QuisbyProcessing()
+        processed = {
+            n: json.loads(
+                json.dumps(
+                    quisby.extract_data(BenchmarkName.UPERF, n, InputType.STREAM, d)
+                )
+            )
+            for n, d in data.items()
+        }
+        expected = quisby.compare_csv_to_json(
+            BenchmarkName.UPERF, InputType.STREAM, data
+        )
+        assert expected["status"] == "success"
+        assert compare_quisby_data(BenchmarkName.UPERF, processed) == expected
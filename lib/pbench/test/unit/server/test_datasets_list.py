@@ -2,10 +2,11 @@ import datetime
 from http import HTTPStatus
 import re
 from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 import requests
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, event
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import aliased, Query
 
@@ -13,7 +14,7 @@ from pbench.server import JSON, JSONARRAY, JSONOBJECT
 from pbench.server.api.resources import APIAbort, ApiParams
 from pbench.server.api.resources.datasets_list import DatasetsList, urlencode_json
 from pbench.server.database.database import Database
-from pbench.server.database.models.datasets import Dataset, Metadata
+from pbench.server.database.models.datasets import Dataset, Metadata, MetadataError
 from pbench.server.database.models.users import User
 from pbench.test.unit.server import DRB_USER_ID
 
@@ -822,6 +823,32 @@ class TestDatasetsList:
                 assert error in m
                 break
 
+    def test_metadata_fallback(self, monkeypatch, query_as):
+        """Test that a failure to fetch the metadata of a whole page falls
+        back to fetching the metadata of each dataset, so that only the
+        datasets whose metadata can't be fetched report none.
+        """
+        get_dataset_metadata = DatasetsList._get_dataset_metadata
+
+        def page_error(self, datasets: list[Dataset], keys: list[str]) -> JSON:
+            raise MetadataError(datasets[0], keys[0])
+
+        def dataset_error(self, dataset: Dataset, keys: list[str]) -> JSON:
+            if dataset.name == "drb":
+                raise MetadataError(dataset, keys[0])
+            return get_dataset_metadata(self, dataset, keys)
+
+        monkeypatch.setattr(DatasetsList, "_get_datasets_metadata", page_error)
+        monkeypatch.setattr(DatasetsList, "_get_dataset_metadata", dataset_error)
+        response = query_as({"metadata": "dataset.name"}, "drb", HTTPStatus.OK)
+        results = response.json["results"]
+        assert len(results) > 1
+        for result in results:
+            if result["name"] == "drb":
+                assert result["metadata"] is None
+            else:
+                assert result["metadata"] == {"dataset.name": result["name"]}
+
     def test_key_summary(self, query_as):
         """Test keyspace summary.
 
@@ -1117,3 +1144,158 @@ class TestDatasetsList:
         query = {"sort": sort}
         result = query_as(query, "test", HTTPStatus.BAD_REQUEST)
         assert result.json["message"] == message
+
+    def test_statement_count(self, query_as):
+        """Count the SQL statements made by a listing with metadata.
+
+        The metadata of a page of datasets is fetched together, so the number
+        of statements doesn't depend on the size of the page.
+
+        We count only the statements on the dataset tables: whether a lookup
+        of a user by ID reaches the database depends on whether the session's
+        (weakly referenced) identity map still holds that user.
+
+        Args:
+            query_as: A fixture to provide a helper that executes the API call
+        """
+        statements = []
+        tables = re.compile(r"\bFROM (datasets|dataset_metadata|dataset_operations)\b")
+
+        def count(conn, cursor, statement, *args):
+            if tables.search(statement):
+                statements.append(statement)
+
+        def query(limit: int) -> JSONOBJECT:
+            return query_as(
+                {
+                    "limit": limit,
+                    "metadata": [
+                        "dataset.name",
+                        "dataset.owner",
+                        "dataset.metalog.pbench.script",
+                        "global.test",
+                        "server.deletion",
+                        "user.favorite",
+                    ],
+                },
+                "test",
+                HTTPStatus.OK,
+            ).json
+
+        # The first query may also load the authenticated user
+        query(1)
+        counts = {}
+        engine = Database.db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            for limit in (1, 3, 6):
+                statements.clear()
+                assert len(query(limit)["results"]) == limit
+                counts[limit] = len(statements)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        assert counts[1] == counts[3] == counts[6], counts
+
+    @pytest.mark.parametrize(
+        "sort,total",
+        [
+            (None, True),
+            ("dataset.name", True),
+            ("dataset.name:desc", False),
+            ("dataset.access,dataset.name:desc", True),
+            ("dataset.uploaded:desc", True),
+        ],
+    )
+    def test_cursor_pagination(self, query_as, sort, total):
+        """Test `datasets/list?cursor` pagination
+
+        Walking the pages by cursor should return the same datasets in the
+        same order as a single listing, and report the total only if asked.
+
+        Args:
+            query_as: A fixture to provide a helper that executes the API call
+            sort: The sort query parameter value
+            total: The total query parameter value
+        """
+        query = {"total": total}
+        if sort:
+            query["sort"] = sort
+        expected = [
+            d["name"] for d in query_as(query, "test", HTTPStatus.OK).json["results"]
+        ]
+        # Datasets with the same sort keys are ordered by resource_id
+        if sort and "name" not in sort:
+            expected = [
+                d["name"]
+                for d in query_as(
+                    {"sort": f"{sort},dataset.resource_id"}, "test", HTTPStatus.OK
+                ).json["results"]
+            ]
+        assert len(expected) == 7
+
+        names = []
+        query.update({"limit": 2, "cursor": ""})
+        pages = 0
+        while True:
+            page = query_as(query, "test", HTTPStatus.OK).json
+            pages += 1
+            assert len(page["results"]) <= 2
+            names.extend(d["name"] for d in page["results"])
+            if total:
+                assert page["total"] == 7
+            else:
+                assert "total" not in page
+            if not page["next_url"]:
+                break
+            assert "offset" not in page["next_url"]
+            query["cursor"] = parse_qs(urlparse(page["next_url"]).query)["cursor"][0]
+        assert pages == 4
+        assert names == expected
+
+    def test_offset_no_total(self, query_as):
+        """Test offset pagination without a total count
+
+        Args:
+            query_as: A fixture to provide a helper that executes the API call
+        """
+        query = {"limit": 3, "total": False, "sort": "dataset.name"}
+        response = query_as(query, "test", HTTPStatus.OK).json
+        assert "total" not in response
+        assert [d["name"] for d in response["results"]] == ["fio_1", "fio_2", "test"]
+        assert parse_qs(urlparse(response["next_url"]).query)["offset"] == ["3"]
+        query["offset"] = 6
+        response = query_as(query, "test", HTTPStatus.OK).json
+        assert [d["name"] for d in response["results"]] == ["uperf_4"]
+        assert response["next_url"] == ""
+
+    @pytest.mark.parametrize(
+        "query,message",
+        [
+            (
+                {"cursor": "", "offset": 2},
+                "'cursor' and 'offset' cannot be used together",
+            ),
+            (
+                {"cursor": "", "sort": "global.test"},
+                "'cursor' pagination can only sort on dataset columns",
+            ),
+            ({"cursor": "xyzzy"}, "Invalid cursor 'xyzzy'"),
+            (
+                {
+                    "cursor": "eyJzb3J0IjpbInJlc291cmNlX2lkOmFzYyJdLCJhZnRlciI6WyJhIl19",
+                    "sort": "dataset.name",
+                },
+                "The cursor doesn't match the query's sort order",
+            ),
+        ],
+    )
+    def test_cursor_errors(self, query_as, query, message):
+        """Test `datasets/list?cursor` error cases
+
+        Args:
+            query_as: A fixture to provide a helper that executes the API call
+            query: The query parameters
+            message: The expected error message
+        """
+        response = query_as(query, "test", HTTPStatus.BAD_REQUEST)
+        assert response.json["message"] == message
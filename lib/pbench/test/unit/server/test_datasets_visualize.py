@@ -1,5 +1,8 @@
 from http import HTTPStatus
+import io
 from pathlib import Path
+import shutil
+from typing import IO
 
 from pquisby.lib.post_processing import QuisbyProcessing
 import pytest
@@ -25,6 +28,10 @@ class TestVisualize:
             get_token_func: Pbench token fixture
         """
 
+        # Processed Quisby results are cached, so start each test without
+        # the results of earlier tests.
+        shutil.rmtree(server_config.CACHE / CacheManager.EXTRACTED, ignore_errors=True)
+
         def query_api(
             dataset: str, user, expected_status: HTTPStatus
         ) -> requests.Response:
@@ -46,8 +53,8 @@ class TestVisualize:
         class Tarball(object):
             tarball_path = Path("/dataset/tarball.tar.xz")
 
-            def extract(_tarball_path: Path, _path: str) -> str:
-                return "CSV_file_as_a_byte_stream"
+            def extract(_tarball_path: Path, _path: str) -> IO[bytes]:
+                return io.BytesIO(b"CSV_file_as_a_byte_stream")
 
         return Tarball
 
@@ -72,6 +79,7 @@ class TestVisualize:
 
     def test_successful_get(self, query_get_as, monkeypatch):
         def mock_extract_data(self, test_name, dataset_name, input_type, data) -> JSON:
+            assert data == "CSV_file_as_a_byte_stream"
             return {"status": "success", "json_data": "quisby_data"}
 
         monkeypatch.setattr(CacheManager, "find_dataset", self.mock_find_dataset)
@@ -89,8 +97,8 @@ class TestVisualize:
             class Tarball(object):
                 tarball_path = Path("/dataset/tarball.tar.xz")
 
-                def extract(tarball_path, path) -> str:
-                    return "IncorrectData"
+                def extract(tarball_path, path) -> IO[bytes]:
+                    return io.BytesIO(b"IncorrectData")
 
             return Tarball
 
@@ -0,0 +1,114 @@
+import io
+import os
+from pathlib import Path
+import time
+
+import pytest
+
+from pbench.server.extract_cache import ExtractCache
+
+
+@pytest.fixture()
+def cache(tmp_path: Path, make_logger) -> ExtractCache:
+    return ExtractCache(tmp_path / "EXTRACT", 100, 3600, make_logger)
+
+
+class TestExtractCache:
+    def test_hit_miss(self, cache):
+        """Show that a file is extracted only once, and then served from the
+        cache."""
+        calls = []
+
+        def extract():
+            calls.append(1)
+            return io.BytesIO(b"a,b\n1,2\n")
+
+        with cache.get("md5", "ds/result.csv", extract) as stream:
+            assert stream.read() == b"a,b\n1,2\n"
+        with cache.get("md5", "ds/result.csv", extract) as stream:
+            assert stream.read() == b"a,b\n1,2\n"
+        assert len(calls) == 1
+        assert cache.stats == {"hits": 1, "misses": 1, "evicted": 0}
+
+        # The counters are kept for the process, not the ExtractCache object
+        other = ExtractCache(cache.root, 100, 3600, cache.logger)
+        assert other.stats == cache.stats
+
+        # A different dataset or path is a different entry
+        with cache.get("md5", "ds/other.csv", extract) as stream:
+            assert stream.read() == b"a,b\n1,2\n"
+        with cache.get("md5x", "ds/result.csv", extract) as stream:
+            assert stream.read() == b"a,b\n1,2\n"
+        assert len(calls) == 3
+
+    def test_no_data(self, cache):
+        assert cache.get("md5", "ds/dir", lambda: None) is None
+        assert cache.stats["misses"] == 1
+
+    def test_extract_error(self, cache):
+        """Show that a failed extraction leaves nothing behind."""
+
+        class BadStream(io.RawIOBase):
+            def readable(self):
+                return True
+
+            def readinto(self, b):
+                raise OSError("corrupt")
+
+        with pytest.raises(OSError):
+            cache.get("md5", "ds/result.csv", BadStream)
+        assert list((cache.root / "md5").iterdir()) == []
+
+    def test_evict_size(self, cache):
+        """Show that the least recently used files are evicted to keep the
+        cache within its size limit."""
+        now = time.time()
+        for i, name in enumerate(("a", "b", "c")):
+            cache.get("md5", name, lambda: io.BytesIO(b"x" * 40)).close()
+            os.utime(cache._entry("md5", name), (now - 100 + i, now - 100 + i))
+
+        # Adding "c" made the cache too big, so the oldest entry, "a", was
+        # evicted. Using "b" makes "c" the least recently used entry, so it
+        # goes when we add "d".
+        assert not cache._entry("md5", "a").exists()
+        cache.get("md5", "b", lambda: pytest.fail("b is cached")).close()
+        cache.get("md5", "d", lambda: io.BytesIO(b"x" * 40)).close()
+        assert cache._entry("md5", "b").exists()
+        assert not cache._entry("md5", "c").exists()
+        assert cache._entry("md5", "d").exists()
+        assert cache.stats["evicted"] == 2
+
+    def test_evict_age(self, cache):
+        """Show that files unused for longer than the maximum age are
+        evicted."""
+        cache.get("md5", "old", lambda: io.BytesIO(b"old")).close()
+        old = time.time() - 7200
+        os.utime(cache._entry("md5", "old"), (old, old))
+        cache.get("md5", "new", lambda: io.BytesIO(b"new")).close()
+        assert not cache._entry("md5", "old").exists()
+        assert cache._entry("md5", "new").exists()
+
+    def test_evict_interval(self, cache):
+        """Show that expired files are evicted every so many accesses, even
+        when every access is a hit."""
+        cache.EVICT_INTERVAL = 3
+        cache.get("md5", "old", lambda: io.BytesIO(b"old")).close()
+        cache.get("md5", "new", lambda: io.BytesIO(b"new")).close()
+        old = time.time() - 7200
+        os.utime(cache._entry("md5", "old"), (old, old))
+        assert cache._entry("md5", "old").exists()
+        cache.get("md5", "new", lambda: pytest.fail("new is cached")).close()
+        assert not cache._entry("md5", "old").exists()
+        assert cache.stats == {"hits": 1, "misses": 2, "evicted": 1}
+
+    def test_disabled(self, tmp_path, make_logger):
+        cache = ExtractCache(tmp_path / "EXTRACT", 0, 3600, make_logger)
+        with cache.get("md5", "f", lambda: io.BytesIO(b"data")) as stream:
+            assert stream.read() == b"data"
+        assert not cache.root.exists()
+
+    def test_forget(self, cache):
+        cache.get("md5", "f", lambda: io.BytesIO(b"data")).close()
+        cache.forget("md5")
+        assert not (cache.root / "md5").exists()
+        cache.forget("md5")
@@ -1,7 +1,24 @@
+from collections import Counter
+import csv
+from datetime import datetime
+import io
+import tarfile
+from types import SimpleNamespace
+
 import pytest
 
+from pbench.common.exceptions import BadDate
 import pbench.server.indexer
-from pbench.server.indexer import init_indexing, ResultData
+from pbench.server.indexer import (
+    _known_tool_handlers,
+    init_indexing,
+    make_doc_id,
+    PbenchData,
+    PbenchTarBall,
+    ResultData,
+    TarballMemberIndex,
+    ToolData,
+)
 
 
 class TestResultData_expand_uid_template:
@@ -77,3 +94,250 @@ def test_init_indexing(monkeypatch, server_config, make_logger):
     except Exception as exc:
         pytest.fail(f"Unexpected exception raised: {exc}")
     assert called[0], "Mocked update_templates() was not called"
+
+
+class TestTarballMemberIndex:
+    @staticmethod
+    def make_members(names: list[str]) -> list[tarfile.TarInfo]:
+        members = []
+        for name in names:
+            m = tarfile.TarInfo(name)
+            if name.endswith("/"):
+                m.type = tarfile.DIRTYPE
+            members.append(m)
+        return members
+
+    def test_files_by_prefix(self):
+        index = TarballMemberIndex(
+            self.make_members(
+                [
+                    "run/",
+                    "run/metadata.log",
+                    "run/1-iter/sample1/tools-default/host/sar/",
+                    "run/1-iter/sample1/tools-default/host/sar/csv/",
+                    "run/1-iter/sample1/tools-default/host/sar/csv/b.csv",
+                    "run/1-iter/sample1/tools-default/host/sar/csv/a.csv",
+                    "run/1-iter/sample1/tools-default/host/sar/sar-stdout.txt",
+                    "run/1-iter/sample1/tools-default/host/iostat/csv/a.csv",
+                ]
+            )
+        )
+        sar = "run/1-iter/sample1/tools-default/host/sar"
+        assert list(index.files_by_prefix(f"{sar}/csv")) == [
+            f"{sar}/csv/a.csv",
+            f"{sar}/csv/b.csv",
+        ]
+        assert list(index.files_by_prefix(f"{sar}/sar-stdout.txt")) == [
+            f"{sar}/sar-stdout.txt"
+        ]
+        assert list(index.files_by_prefix(f"{sar}/json")) == []
+        assert list(index.files_by_prefix("run/z")) == []
+        assert index.lookups == 4
+
+
+class TestToolDataActions:
+    """Verify that the tool data actions are the same whether the tool data
+    documents are generated serially or by a pool of worker processes."""
+
+    class MockToolData:
+        def __init__(self, tool: str, docs: int, fail: bool = False):
+            self.toolname = tool
+            self.docs = docs
+            self.fail = fail
+            self.counters = Counter()
+
+        def make_source(self):
+            for i in range(self.docs):
+                if self.fail:
+                    raise ValueError(f"bad {self.toolname} data")
+                yield {"@timestamp": f"2022-10-{i % 2 + 1:02d}", "i": i}, (
+                    f"{self.toolname}-{i}"
+                )
+
+        def generate_index_name(self, template_name, source, toolname=None):
+            assert template_name == "tool-data"
+            if source["i"] % 10 == 9:
+                self.counters["bad_date"] += 1
+                raise BadDate("bad date")
+            return f"tool-data-{toolname}.{source['@timestamp']}"
+
+    class MockIdxContext:
+        def __init__(self, server_config, logger):
+            self.config = server_config
+            self.logger = logger
+
+        def get_tracking_id(self):
+            return "tracking-id"
+
+    def make_ptb(self, monkeypatch, server_config, logger, units, workers):
+        monkeypatch.setattr(
+            server_config,
+            "getint",
+            lambda s, o, fallback=None: workers
+            if (s, o) == ("pbench-index", "tool-data-workers")
+            else fallback,
+        )
+        monkeypatch.setattr(pbench.server.indexer, "_TOOL_DATA_BATCH_SIZE", 7)
+        ptb = PbenchTarBall.__new__(PbenchTarBall)
+        ptb.idxctx = self.MockIdxContext(server_config, logger)
+        ptb.authorization = {"owner": "1", "access": "private"}
+        ptb.index_map = {}
+        ptb.member_index = TarballMemberIndex([])
+        ptb.mk_tool_data = lambda: iter(units)
+        return ptb
+
+    @pytest.mark.parametrize("workers", [2, 3, 8])
+    def test_parallel(self, monkeypatch, server_config, make_logger, workers):
+        def units():
+            return [
+                self.MockToolData("sar", 40),
+                self.MockToolData("iostat", 3),
+                self.MockToolData("perf", 0),
+                self.MockToolData("vmstat", 25),
+            ]
+
+        serial_units = units()
+        serial = self.make_ptb(monkeypatch, server_config, make_logger, serial_units, 1)
+        expected = list(serial.mk_tool_data_actions())
+        assert len(expected) == 62
+
+        parallel_units = units()
+        ptb = self.make_ptb(
+            monkeypatch, server_config, make_logger, parallel_units, workers
+        )
+        actions = list(ptb.mk_tool_data_actions())
+
+        def key(action):
+            return action["_id"]
+
+        assert sorted(actions, key=key) == sorted(expected, key=key)
+        assert ptb.index_map == serial.index_map
+        assert sum(ptb.index_map.values()) == 62
+        assert [u.counters for u in parallel_units] == [
+            u.counters for u in serial_units
+        ]
+        assert parallel_units[0].counters == Counter(bad_date=4)
+
+        # The documents of each unit are generated in order
+        sar = [a["_id"] for a in actions if a["_id"].startswith("sar-")]
+        assert sar == [a["_id"] for a in expected if a["_id"].startswith("sar-")]
+
+    def test_worker_failure(self, monkeypatch, server_config, make_logger):
+        units = [self.MockToolData("sar", 40), self.MockToolData("iostat", 3, True)]
+        ptb = self.make_ptb(monkeypatch, server_config, make_logger, units, 2)
+        with pytest.raises(RuntimeError, match="Tool data worker failed on 'iostat'"):
+            list(ptb.mk_tool_data_actions())
+
+
+class TestToolDataUnified:
+    """Verify the documents generated from "unified" .csv files."""
+
+    @staticmethod
+    def make_tool_data(
+        make_logger, files: dict[str, str], id_version: int = 1
+    ) -> ToolData:
+        handler = _known_tool_handlers["iostat"]
+        td = ToolData.__new__(ToolData)
+        td.toolname = "iostat"
+        td.handler = handler
+        td.logger = make_logger
+        td.counters = Counter()
+        td.basepath = "run/1-iter/sample1/tools-default/host/iostat"
+        td.ptb = SimpleNamespace(
+            _tbctx="ctx",
+            start_run_ts=datetime(2022, 10, 1),
+            end_run_ts=datetime(2022, 10, 2),
+            id_version=id_version,
+        )
+        td.doc_keys = ("md5", "1-iter", "sample1", "host", "iostat")
+        td.run_metadata = {"id": "md5", "name": "run"}
+        td.iteration_metadata = {"name": "1-iter", "number": 1}
+        td.sample_metadata = {"name": "sample1", "hostname": "host"}
+        td.files = []
+        for name, contents in files.items():
+            reader = csv.reader(io.StringIO(contents))
+            rec = next(r for r in handler["patterns"] if r["pattern"].match(name))
+            td.files.append(
+                {
+                    "basename": name,
+                    "handler_rec": rec,
+                    "reader": reader,
+                    "header": next(reader),
+                }
+            )
+        return td
+
+    FILES = {
+        "disk_IOPS.csv": "timestamp_ms,sda-read,sda-write,sdb-read,sdb-write\n"
+        "1664582400000,1,2,3,4\n"
+        "1664582401000,5,6,7\n"
+        "1664582402000,9,10,11,12\n",
+        "disk_Queue_Size.csv": "timestamp_ms,sda,sdb\n"
+        "1664582400000,0.5,1.5\n"
+        "1664582401500,2.5,3.5\n",
+    }
+
+    def test_unified(self, make_logger):
+        td = self.make_tool_data(make_logger, self.FILES)
+        docs = list(td.make_source())
+        for source, source_id in docs:
+            assert source_id == PbenchData.make_source_id(source)
+        assert [(s["@timestamp"], s["iostat"]) for s, _ in docs] == [
+            (
+                "2022-10-01T00:00:00.000000",
+                {
+                    "id": "sda",
+                    "@idx": 0,
+                    "iops": {"read": 1.0, "write": 2.0},
+                    "qsize": 0.5,
+                },
+            ),
+            (
+                "2022-10-01T00:00:00.000000",
+                {
+                    "id": "sdb",
+                    "@idx": 0,
+                    "iops": {"read": 3.0, "write": 4.0},
+                    "qsize": 1.5,
+                },
+            ),
+            (
+                "2022-10-01T00:00:01.000000",
+                {
+                    "id": "sda",
+                    "@idx": 1,
+                    "iops": {"read": 5.0, "write": 6.0},
+                    "qsize": 2.5,
+                },
+            ),
+            (
+                "2022-10-01T00:00:01.000000",
+                {"id": "sdb", "@idx": 1, "iops": {"read": 7.0}, "qsize": 3.5},
+            ),
+            (
+                "2022-10-01T00:00:02.000000",
+                {"id": "sda", "@idx": 2, "iops": {"read": 9.0, "write": 10.0}},
+            ),
+            (
+                "2022-10-01T00:00:02.000000",
+                {"id": "sdb", "@idx": 2, "iops": {"read": 11.0, "write": 12.0}},
+            ),
+        ]
+        assert docs[0][0]["@timestamp_original"] == "1664582400000"
+        assert docs[0][0]["run"] is td.run_metadata
+        assert td.counters == Counter(inconsistent_timestamps_across_csv_files=1)
+
+    def test_unified_structural_ids(self, make_logger):
+        """With version 2 document IDs, the documents are the same but their
+        IDs are derived from the identifier and row of each."""
+        expected = list(self.make_tool_data(make_logger, self.FILES).make_source())
+        td = self.make_tool_data(make_logger, self.FILES, id_version=2)
+        docs = list(td.make_source())
+        assert [s for s, _ in docs] == [s for s, _ in expected]
+        ids = [i for _, i in docs]
+        assert len(set(ids)) == len(ids)
+        assert ids[3] == make_doc_id(
+            "md5", "1-iter", "sample1", "host", "iostat", None, 1, "sdb"
+        )
+        again = self.make_tool_data(make_logger, self.FILES, id_version=2)
+        assert [i for _, i in again.make_source()] == ids
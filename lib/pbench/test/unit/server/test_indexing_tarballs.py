@@ -34,14 +34,21 @@ from pbench.server.templates import TemplateError
 
 
 class FakeDataset:
+    datasets: dict[str, "FakeDataset"] = {}
+
     def __init__(self, name: str, resource_id: str):
         self.name = name
         self.resource_id = resource_id
         self.owner_id = 1
+        __class__.datasets[resource_id] = self
 
     def __repr__(self) -> str:
         return self.name
 
+    @classmethod
+    def query(cls, resource_id: str) -> "FakeDataset":
+        return cls.datasets[resource_id]
+
     @classmethod
     def reset(cls):
         cls.new_state = None
@@ -50,10 +57,11 @@ class FakeDataset:
 class FakeMetadata:
     INDEX_MAP = Metadata.INDEX_MAP
     TARBALL_PATH = Metadata.TARBALL_PATH
-    INDEX_MAP = Metadata.INDEX_MAP
+    DOCUMENT_IDS = Metadata.DOCUMENT_IDS
 
     no_tarball: list[str] = []
     index_map: dict[str, JSONOBJECT] = {}
+    document_ids: dict[str, int] = {}
     set_values: dict[str, dict[str, Any]] = {}
 
     @staticmethod
@@ -65,6 +73,8 @@ class FakeMetadata:
                 return f"{dataset.name}.tar.xz"
         elif key == Metadata.INDEX_MAP:
             return __class__.index_map.get(dataset.name)
+        elif key == Metadata.DOCUMENT_IDS:
+            return __class__.document_ids.get(dataset.name)
         else:
             raise MetadataBadKey(key)
 
@@ -79,6 +89,7 @@ class FakeMetadata:
     def reset(cls):
         cls.no_tarball = []
         cls.index_map = {}
+        cls.document_ids = {}
         cls.set_values = {}
 
 
@@ -183,13 +194,16 @@ class FakePbenchTarBall:
         tbarg: str,
         tmpdir: str,
         extracted_root: str,
+        members: Optional[list[str]] = None,
+        id_version: int = 2,
     ):
         self.idxctx = idxctx
         self.tbname = tbarg
+        self.id_version = id_version
         self.name = Path(tbarg).name
         self.username = username
         self.extracted_root = extracted_root
-        self.index_map = {"idx1": ["id1", "id2"]}
+        self.index_map = {"idx1": 2}
 
     def mk_tool_data_actions(self) -> JSONARRAY:
         __class__.make_tool_called += 1
@@ -257,6 +271,7 @@ class FakeTarball:
         self.controller = controller
         self.cache = controller.cache / "ABC"
         self.unpacked = self.cache / self.name
+        self.members = None
         self.uncache = lambda: None
 
 
@@ -302,6 +317,12 @@ class FakeAudit:
         cls.sequence = 1
 
 
+class FakeDatabase:
+    @staticmethod
+    def reset_after_fork():
+        pass
+
+
 @pytest.fixture()
 def mocks(monkeypatch, make_logger):
     FakeDataset.logger = make_logger
@@ -511,7 +532,7 @@ class TestIndexingTarballs:
         def fake_es_index(es, actions, errorsfp, logger, _dbg=0):
             return (1000, 2000, 1, 0, 0, 0)
 
-        FakeMetadata.index_map = {"ds1": {"idx": ["a", "b"]}}
+        FakeMetadata.index_map = {"ds1": {"idx": 2}}
         mocks.setattr("pbench.server.indexing_tarballs.es_index", fake_es_index)
         stat = index.process_tb(tarballs=[tarball_1])
         assert (
@@ -521,10 +542,66 @@ class TestIndexingTarballs:
         )
         assert FakeMetadata.set_values == {
             "ds1": {
-                Metadata.INDEX_MAP: {"idx": ["a", "b"], "idx1": ["id1", "id2"]},
+                Metadata.INDEX_MAP: {"idx": 2, "idx1": 2},
+                Metadata.DOCUMENT_IDS: 1,
             }
         }
 
+    @pytest.mark.parametrize(
+        "index_map,document_ids,expected",
+        [
+            (None, None, 2),
+            ({"idx": 2}, None, 1),
+            ({"idx": 2}, 2, 2),
+            ({"idx": 2}, 1, 1),
+        ],
+    )
+    def test_process_tb_document_ids(
+        self, mocks, index, index_map, document_ids, expected
+    ):
+        """A dataset is indexed with the current document ID scheme, unless it
+        was already indexed with another."""
+
+        def fake_es_index(es, actions, errorsfp, logger, _dbg=0):
+            return (1000, 2000, 1, 0, 0, 0)
+
+        if index_map:
+            FakeMetadata.index_map = {"ds1": index_map}
+        if document_ids:
+            FakeMetadata.document_ids = {"ds1": document_ids}
+        mocks.setattr("pbench.server.indexing_tarballs.es_index", fake_es_index)
+        stat = index.process_tb(tarballs=[tarball_1])
+        assert stat == 0
+        assert FakeMetadata.set_values["ds1"][Metadata.DOCUMENT_IDS] == expected
+
+    def test_process_tb_parallel(self, mocks, index, tmp_path):
+        """Test indexing with a pool of worker processes.
+
+        Each worker is a forked process, so we can't observe the effects of
+        the mocks directly: instead the mock es_index records the actions it
+        is given, and the process that indexed them, in a file.
+        """
+        record = tmp_path / "indexed"
+
+        def fake_es_index(es, actions, errorsfp, logger, _dbg=0):
+            with record.open("a") as fp:
+                print(os.getpid(), actions[0]["name"], file=fp)
+            return (1000, 2000, 1, 0, 0, 0)
+
+        mocks.setattr("pbench.server.indexing_tarballs.es_index", fake_es_index)
+        mocks.setattr("pbench.server.indexing_tarballs.Database", FakeDatabase)
+        index.workers = 2
+        stat = index.process_tb(tarballs=[tarball_2, tarball_1, tarball_3])
+        assert stat == 0
+        lines = [line.split() for line in record.read_text().splitlines()]
+        assert sorted(name for _, name in lines) == [
+            f"{ds1.name}.tar.xz",
+            f"{ds2.name}.tar.xz",
+            f"{ds3.name}.tar.xz",
+        ]
+        pids = {int(pid) for pid, _ in lines}
+        assert os.getpid() not in pids and len(pids) <= 2
+
     def test_process_tb(self, mocks, index):
         index_actions = []
 
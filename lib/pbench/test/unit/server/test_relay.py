@@ -1,3 +1,4 @@
+import concurrent.futures
 from http import HTTPStatus
 from logging import Logger
 from pathlib import Path
@@ -17,15 +18,24 @@ from pbench.server.database.models.audit import (
     AuditStatus,
     AuditType,
 )
-from pbench.server.database.models.datasets import Dataset
+from pbench.server.database.models.datasets import (
+    Dataset,
+    Metadata,
+    OperationName,
+    OperationState,
+)
+from pbench.server.relay_pull import RelayPull
+from pbench.server.sync import Sync
 from pbench.test.unit.server import DRB_USER_ID
 
 
 class TestRelay:
-    """Test the Relay API.
+    """Test the Relay API, and the background transfers of the relayed
+    tarballs.
 
-    This focuses on testing the unique aspects of the _prepare and _access
-    methods rather than repeating coverage of all the common base class code.
+    This focuses on testing the unique aspects of the _identify and _defer
+    methods, and of the RelayPull worker, rather than repeating coverage of
+    all the common base class code.
 
     In particular, failure of either of the two external GET operations to the
     relay, and problems in the Relay configuration file.
@@ -45,6 +55,33 @@ class TestRelay:
         headers = {"Authorization": "Bearer " + auth_token}
         return headers
 
+    @staticmethod
+    def pull(server_config, make_logger) -> RelayPull:
+        """Perform the queued transfers, and wait for them to complete"""
+        pull = RelayPull(server_config, make_logger)
+        pull.DELAY = 0.0
+        pull.run()
+        concurrent.futures.wait(list(pull.transfers))
+        pull.run()
+        assert not pull.transfers
+        return pull
+
+    @staticmethod
+    def manifest(file: Path, md5: str, metadata: list[str] = []):
+        """Serve the relay manifest and tarball of a test dataset"""
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri1",
+            status=HTTPStatus.OK,
+            json={
+                "uri": "https://relay.example.com/uri2",
+                "name": file.name,
+                "md5": md5,
+                "access": "private",
+                "metadata": metadata,
+            },
+        )
+
     @pytest.fixture(scope="function", autouse=True)
     def fake_cache_manager(self, monkeypatch):
         class FakeTarball:
@@ -88,25 +125,15 @@ class TestRelay:
         assert not self.cachemanager_created
 
     @responses.activate
-    def test_relay(self, client, server_config, pbench_drb_token, tarball):
+    def test_relay(self, client, server_config, make_logger, pbench_drb_token, tarball):
         """Verify the success path
 
         Ensure successful completion when the primary relay URI returns a valid
-        relay manifest referencing a secondary relay URI containing a tarball.
+        relay manifest referencing a secondary relay URI containing a tarball:
+        the API queues the transfer, and the worker completes it.
         """
         file, md5file, md5 = tarball
-        responses.add(
-            responses.GET,
-            "https://relay.example.com/uri1",
-            status=HTTPStatus.OK,
-            json={
-                "uri": "https://relay.example.com/uri2",
-                "name": file.name,
-                "md5": md5,
-                "access": "private",
-                "metadata": ["global.pbench.test:data"],
-            },
-        )
+        self.manifest(file, md5, ["global.pbench.test:data"])
         responses.add(
             responses.GET,
             "https://relay.example.com/uri2",
@@ -120,8 +147,35 @@ class TestRelay:
             headers=self.gen_headers(pbench_drb_token),
         )
         assert (
-            response.status_code == HTTPStatus.CREATED
+            response.status_code == HTTPStatus.ACCEPTED
         ), f"Unexpected result, {response.text}"
+        status = f"/api/v1/datasets/{md5}/metadata?metadata=dataset.operations"
+        assert response.json == {"message": "relay queued", "status": status}
+        assert response.headers["location"] == status
+        assert len(responses.calls) == 1
+
+        dataset = Dataset.query(resource_id=md5)
+        assert Metadata.getvalue(dataset, "global") == {"pbench": {"test": "data"}}
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPLOAD": {"state": "READY", "message": "Queued"},
+        }
+        assert not self.cachemanager_created
+        assert len(Audit.query()) == 1
+
+        self.pull(server_config, make_logger)
+        assert len(responses.calls) == 2
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "INDEX": {"state": "READY", "message": None},
+            "UPLOAD": {"state": "OK", "message": "Done"},
+        }
+        assert self.cachemanager_create_path.name == file.name
+        assert Metadata.getvalue(dataset, "server.tarball-path") == str(
+            self.cachemanager_create_path
+        )
+        assert Metadata.getvalue(dataset, "metalog") == {
+            "pbench": {"date": "2002-05-16T00:00:00"}
+        }
+        assert not (self.cachemanager_create_path.parent).exists()
 
         audit = Audit.query()
         assert len(audit) == 2
@@ -157,21 +211,12 @@ class TestRelay:
         }
 
     @responses.activate
-    def test_relay_tar_fail(self, client, server_config, pbench_drb_token, tarball):
+    def test_relay_tar_fail(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
+    ):
         """Verify failure when secondary relay URI is not found"""
         file, md5file, md5 = tarball
-        responses.add(
-            responses.GET,
-            "https://relay.example.com/uri1",
-            status=HTTPStatus.OK,
-            json={
-                "uri": "https://relay.example.com/uri2",
-                "name": file.name,
-                "md5": md5,
-                "access": "private",
-                "metadata": [],
-            },
-        )
+        self.manifest(file, md5)
         responses.add(
             responses.GET, "https://relay.example.com/uri2", status=HTTPStatus.NOT_FOUND
         )
@@ -180,9 +225,19 @@ class TestRelay:
             headers=self.gen_headers(pbench_drb_token),
         )
         assert (
-            response.status_code == HTTPStatus.NOT_FOUND
+            response.status_code == HTTPStatus.ACCEPTED
         ), f"Unexpected result, {response.text}"
 
+        self.pull(server_config, make_logger)
+        dataset = Dataset.query(resource_id=md5)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPLOAD": {
+                "state": "FAILED",
+                "message": "Unable to retrieve relay tarball: 'Not Found'",
+            },
+        }
+        assert not self.cachemanager_created
+
         audit = Audit.query()
         assert len(audit) == 2
         assert audit[0].id == 1
@@ -215,6 +270,185 @@ class TestRelay:
             "message": "Unable to retrieve relay tarball: 'Not Found'"
         }
 
+    @responses.activate
+    def test_relay_retry(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
+    ):
+        """Verify that an interrupted transfer is retried, resuming from the
+        data already received, and that a relay server error is retried.
+        """
+        file, md5file, md5 = tarball
+        data = file.read_bytes()
+        half = len(data) // 2
+        self.manifest(file, md5)
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.OK,
+            body=data[:half],
+            headers={"content-length": f"{len(data)}"},
+            auto_calculate_content_length=False,
+        )
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.SERVICE_UNAVAILABLE,
+        )
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.PARTIAL_CONTENT,
+            body=data[half:],
+            headers={"content-length": f"{len(data) - half}"},
+            match=[responses.matchers.header_matcher({"Range": f"bytes={half}-"})],
+        )
+        response = client.post(
+            self.gen_uri(server_config, "https://relay.example.com/uri1"),
+            headers=self.gen_headers(pbench_drb_token),
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+
+        self.pull(server_config, make_logger)
+        assert len(responses.calls) == 4
+        dataset = Dataset.query(resource_id=md5)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "INDEX": {"state": "READY", "message": None},
+            "UPLOAD": {"state": "OK", "message": "Done"},
+        }
+        audit = Audit.query()
+        assert len(audit) == 2
+        assert audit[1].status == AuditStatus.SUCCESS
+
+    @responses.activate
+    def test_relay_duplicate(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
+    ):
+        """Verify that a dataset can't be relayed again while its transfer is
+        queued, but can be once the transfer has failed.
+        """
+        file, md5file, md5 = tarball
+        self.manifest(file, md5)
+        responses.add(
+            responses.GET, "https://relay.example.com/uri2", status=HTTPStatus.NOT_FOUND
+        )
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.OK,
+            body=file.read_bytes(),
+            headers={"content-length": f"{file.stat().st_size}"},
+        )
+        uri = self.gen_uri(server_config, "https://relay.example.com/uri1")
+        headers = self.gen_headers(pbench_drb_token)
+        response = client.post(uri, headers=headers)
+        assert response.status_code == HTTPStatus.ACCEPTED
+        response = client.post(uri, headers=headers)
+        assert response.status_code == HTTPStatus.CONFLICT
+        assert response.json["message"] == (
+            f"Dataset {Dataset.stem(file)!r} is already being uploaded"
+        )
+
+        self.pull(server_config, make_logger)
+        dataset = Dataset.query(resource_id=md5)
+        operation = Metadata.getvalue(dataset, "dataset.operations")["UPLOAD"]
+        assert operation["state"] == "FAILED"
+
+        response = client.post(uri, headers=headers)
+        assert response.status_code == HTTPStatus.ACCEPTED
+        dataset = Dataset.query(resource_id=md5)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPLOAD": {"state": "READY", "message": "Queued"},
+        }
+        self.pull(server_config, make_logger)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "INDEX": {"state": "READY", "message": None},
+            "UPLOAD": {"state": "OK", "message": "Done"},
+        }
+        response = client.post(uri, headers=headers)
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["message"] == "Dataset already exists"
+        assert [a.status for a in Audit.query()] == [
+            AuditStatus.BEGIN,
+            AuditStatus.FAILURE,
+            AuditStatus.BEGIN,
+            AuditStatus.SUCCESS,
+        ]
+
+    @responses.activate
+    def test_relay_bad_md5(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
+    ):
+        """Verify failure when the tarball doesn't match the manifest MD5"""
+        file, md5file, md5 = tarball
+        self.manifest(file, md5)
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.OK,
+            body=b"not the tarball",
+            headers={"content-length": "15"},
+        )
+        response = client.post(
+            self.gen_uri(server_config, "https://relay.example.com/uri1"),
+            headers=self.gen_headers(pbench_drb_token),
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+
+        self.pull(server_config, make_logger)
+        dataset = Dataset.query(resource_id=md5)
+        operation = Metadata.getvalue(dataset, "dataset.operations")["UPLOAD"]
+        assert operation["state"] == "FAILED"
+        assert operation["message"].endswith(f"does not match expected {md5}")
+        assert not self.cachemanager_created
+        assert not (server_config.ARCHIVE / CacheManager.TEMPORARY / md5).exists()
+        audit = Audit.query()
+        assert len(audit) == 2
+        assert audit[1].status == AuditStatus.FAILURE
+        assert audit[1].reason == AuditReason.CONSISTENCY
+
+    @responses.activate
+    def test_relay_recover(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
+    ):
+        """Verify that a transfer interrupted by stopping the worker is queued
+        again, and resumed.
+        """
+        file, md5file, md5 = tarball
+        data = file.read_bytes()
+        self.manifest(file, md5)
+        responses.add(
+            responses.GET,
+            "https://relay.example.com/uri2",
+            status=HTTPStatus.PARTIAL_CONTENT,
+            body=data[10:],
+            headers={"content-length": f"{len(data) - 10}"},
+            match=[responses.matchers.header_matcher({"Range": "bytes=10-"})],
+        )
+        response = client.post(
+            self.gen_uri(server_config, "https://relay.example.com/uri1"),
+            headers=self.gen_headers(pbench_drb_token),
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+
+        # Simulate a worker stopped part way through the transfer
+        dataset = Dataset.query(resource_id=md5)
+        Sync(make_logger, OperationName.UPLOAD).update(
+            dataset=dataset, state=OperationState.WORKING
+        )
+        partial = server_config.ARCHIVE / CacheManager.TEMPORARY / md5 / file.name
+        partial.parent.mkdir(parents=True)
+        partial.write_bytes(data[:10])
+
+        pull = RelayPull(server_config, make_logger)
+        assert pull.run() == 0
+        assert not pull.transfers
+        assert pull.recover() == 1
+        self.pull(server_config, make_logger)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "INDEX": {"state": "READY", "message": None},
+            "UPLOAD": {"state": "OK", "message": "Done"},
+        }
+
     @responses.activate
     def test_relay_no_manifest(self, client, server_config, pbench_drb_token):
         """Verify behavior when the primary relay URI isn't found"""
@@ -291,33 +525,37 @@ class TestRelay:
         ), f"Unexpected result, {response.text}"
 
     @responses.activate
-    def test_relay_bad_stream(
-        self, client, server_config, pbench_drb_token, monkeypatch
+    def test_relay_bad_store(
+        self, client, server_config, make_logger, pbench_drb_token, tarball
     ):
-        """Verify behavior when an unexpected error occurs in the _stream
-        helper.
+        """Verify behavior when an unexpected error occurs completing the
+        intake of a transferred tarball.
         """
-
-        def throw(self, args: ApiParams, request: Request) -> Intake:
-            raise Exception("An exception that's not APIAbort")
-
-        monkeypatch.setattr(Relay, "_stream", throw)
+        file, md5file, md5 = tarball
+        self.manifest(file, md5)
         responses.add(
             responses.GET,
-            "https://relay.example.com/uri1",
+            "https://relay.example.com/uri2",
             status=HTTPStatus.OK,
-            json={
-                "name": "tarball.tar.xz",
-                "md5": "badmd5",
-                "access": "private",
-                "metadata": [],
-                "uri": "https://relay.example.com/uri2",
-            },
+            body=file.open("rb"),
+            headers={"content-length": f"{file.stat().st_size}"},
         )
         response = client.post(
             self.gen_uri(server_config, "https://relay.example.com/uri1"),
             headers=self.gen_headers(pbench_drb_token),
         )
-        assert (
-            response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
-        ), f"Unexpected result, {response.text}"
+        assert response.status_code == HTTPStatus.ACCEPTED
+
+        TestRelay.cachemanager_create_fail = Exception("Not the cache manager")
+        self.pull(server_config, make_logger)
+        dataset = Dataset.query(resource_id=md5)
+        assert Metadata.getvalue(dataset, "dataset.operations") == {
+            "UPLOAD": {
+                "state": "FAILED",
+                "message": "Unexpected error: Not the cache manager",
+            },
+        }
+        audit = Audit.query()
+        assert len(audit) == 2
+        assert audit[1].status == AuditStatus.FAILURE
+        assert audit[1].reason == AuditReason.INTERNAL
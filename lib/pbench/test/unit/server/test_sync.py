@@ -89,6 +89,24 @@ class TestSync:
             "INDEX": {"state": "OK", "message": None},
         }
 
+    def test_update_params(self, make_logger, more_datasets):
+        """Test that the sync update operation records the parameters of the
+        component operation, and leaves them when they're not specified.
+        """
+        drb = Dataset.query(name="drb")
+        sync = Sync(make_logger, OperationName.UPDATE)
+        assert sync.params(drb) is None
+        sync.update(
+            drb, OperationState.READY, message="Queued", params={"access": "public"}
+        )
+        assert Metadata.getvalue(drb, "dataset.operations") == {
+            "UPDATE": {"state": "READY", "message": "Queued"}
+        }
+        assert sync.params(drb) == {"access": "public"}
+        sync.update(drb, OperationState.WORKING)
+        assert sync.params(drb) == {"access": "public"}
+        assert Sync(make_logger, OperationName.DELETE).params(drb) is None
+
     def test_update_state_new(self, make_logger, more_datasets):
         """Test that the sync update operation updates component state when the
         specified component wasn't present.
@@ -236,6 +254,19 @@ class TestSync:
         list = sync.next()
         assert ["drb", "fio_1"] == sorted(d.name for d in list)
 
+    def test_next_state(self, make_logger, more_datasets):
+        """Test that the sync next operation returns the datasets with the
+        requested operation in the requested state
+        """
+        drb = Dataset.query(name="drb")
+        fio_1 = Dataset.query(name="fio_1")
+        sync = Sync(make_logger, OperationName.INDEX)
+        sync.update(drb, None, [OperationName.INDEX])
+        sync.update(fio_1, OperationState.WORKING)
+        assert ["drb"] == [d.name for d in sync.next()]
+        list = sync.next(OperationState.WORKING)
+        assert ["fio_1"] == [d.name for d in list]
+
     def test_next_failure(self, fake_raise_session, make_logger):
         """Test the behavior of the sync next behavior when a DB failure
         occurs.
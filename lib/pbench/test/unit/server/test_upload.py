@@ -1,8 +1,12 @@
+from datetime import timedelta
 import errno
+import fcntl
 from http import HTTPStatus
 from io import BytesIO
 from logging import Logger
+import os
 from pathlib import Path
+import time
 from typing import Any
 
 from flask import Request
@@ -10,7 +14,7 @@ import pytest
 
 from pbench.server import OperationCode, PbenchServerConfig
 from pbench.server.api.resources.intake_base import Access, Intake
-from pbench.server.api.resources.upload import Upload
+from pbench.server.api.resources.upload import Upload, UploadSession
 from pbench.server.cache_manager import CacheManager, DuplicateTarball
 from pbench.server.database.models.audit import (
     Audit,
@@ -23,7 +27,11 @@ from pbench.server.database.models.datasets import (
     DatasetNotFound,
     Metadata,
     MetadataProtectedKey,
+    OperationName,
+    OperationState,
 )
+from pbench.server.database.models.users import User
+from pbench.server.sync import Sync
 from pbench.test.unit.server import DRB_USER_ID
 
 
@@ -137,19 +145,43 @@ class TestUpload:
         self.verify_logs(caplog)
         assert not self.cachemanager_created
 
+    @pytest.mark.parametrize(
+        "md5", ("../../x", "D41D8CD98F00B204E9800998ECF8427E", "d41d8cd98f00b204")
+    )
+    def test_bad_md5(self, client, server_config, pbench_drb_token, md5):
+        """Show that a malformed MD5, which names the upload's directories,
+        is rejected by a chunk upload and by a progress query."""
+        headers = {"Authorization": "Bearer " + pbench_drb_token}
+        response = client.put(
+            self.gen_uri(server_config),
+            data=b"junk",
+            headers=headers | {"Content-MD5": md5, "Content-Range": "bytes 0-3/4"},
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json.get("message") == f"Invalid MD5 {md5!r}"
+        response = client.get(
+            self.gen_uri(server_config), headers=headers, query_string={"md5": md5}
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json.get("message") == f"Invalid MD5 {md5!r}"
+        assert list(server_config.ARCHIVE.rglob("*.chunks")) == []
+        assert not self.cachemanager_created
+
     def test_missing_filename_extension(
         self, client, caplog, server_config, pbench_drb_token
     ):
         """Test with URL uploading a file named "f" which is missing the
         required filename extension"""
-        expected_message = "File extension not supported, must be .tar.xz"
+        expected_message = (
+            "File extension not supported, must be one of .tar.xz, .tar.zst, .tar"
+        )
         with BytesIO(b"junk") as f:
             response = client.put(
                 f"{server_config.rest_uri}/upload/f",
                 data=f,
                 headers={
                     "Authorization": "Bearer " + pbench_drb_token,
-                    "Content-MD5": "abcde",
+                    "Content-MD5": "d41d8cd98f00b204e9800998ecf8427e",
                 },
             )
         assert response.status_code == HTTPStatus.BAD_REQUEST
@@ -165,7 +197,7 @@ class TestUpload:
             self.gen_uri(server_config),
             headers={
                 "Authorization": "Bearer " + pbench_drb_token,
-                "Content-MD5": "ANYMD5",
+                "Content-MD5": "d41d8cd98f00b204e9800998ecf8427e",
             },
         )
         assert response.status_code == HTTPStatus.LENGTH_REQUIRED
@@ -181,7 +213,7 @@ class TestUpload:
             self.gen_uri(server_config),
             headers={
                 "Authorization": "Bearer " + pbench_drb_token,
-                "Content-MD5": "ANYMD5",
+                "Content-MD5": "d41d8cd98f00b204e9800998ecf8427e",
                 "Content-Length": "string",
             },
         )
@@ -198,7 +230,7 @@ class TestUpload:
                 data=f,
                 headers={
                     "Authorization": "Bearer " + pbench_drb_token,
-                    "Content-MD5": "ANYMD5",
+                    "Content-MD5": "d41d8cd98f00b204e9800998ecf8427e",
                 },
                 query_string={
                     "metadata": "global.xyz#A@b=z:y,foobar.badpath:data,server.deletion:3000-12-25T23:59:59+00:00"
@@ -220,13 +252,15 @@ class TestUpload:
     ):
         filename = "log.tar.xz"
         datafile = Path("./lib/pbench/test/unit/server/fixtures/upload/", filename)
-        expected_message = "MD5 checksum 9d5a479f6f75fa9b3bab27ef79ad5b29 does not match expected md5sum"
+        expected_message = "MD5 checksum 9d5a479f6f75fa9b3bab27ef79ad5b29 does not match expected d41d8cd98f00b204e9800998ecf8427e"
         with datafile.open("rb") as data_fp:
             response = client.put(
                 self.gen_uri(server_config, filename),
                 data=data_fp,
                 # Content-Length header set automatically
-                headers=self.gen_headers(pbench_drb_token, "md5sum"),
+                headers=self.gen_headers(
+                    pbench_drb_token, "d41d8cd98f00b204e9800998ecf8427e"
+                ),
             )
         assert response.status_code == HTTPStatus.BAD_REQUEST
         assert response.json.get("message") == expected_message
@@ -235,7 +269,9 @@ class TestUpload:
         with pytest.raises(DatasetNotFound):
             Dataset.query(name="log")
 
-    @pytest.mark.parametrize("bad_extension", ("test.tar.bad", "test.tar", "test.tar."))
+    @pytest.mark.parametrize(
+        "bad_extension", ("test.tar.bad", "test.tar.gz", "test.tar.")
+    )
     def test_bad_extension_upload(
         self,
         client,
@@ -247,13 +283,17 @@ class TestUpload:
     ):
         datafile = tmp_path / bad_extension
         datafile.write_text("compressed tar ball")
-        expected_message = "File extension not supported, must be .tar.xz"
+        expected_message = (
+            "File extension not supported, must be one of .tar.xz, .tar.zst, .tar"
+        )
         with datafile.open("rb") as data_fp:
             response = client.put(
                 self.gen_uri(server_config, bad_extension),
                 data=data_fp,
                 # Content-Length header set automatically
-                headers=self.gen_headers(pbench_drb_token, "md5sum"),
+                headers=self.gen_headers(
+                    pbench_drb_token, "d41d8cd98f00b204e9800998ecf8427e"
+                ),
             )
         assert response.status_code == HTTPStatus.BAD_REQUEST
         assert response.json.get("message") == expected_message
@@ -292,7 +332,9 @@ class TestUpload:
             response = client.put(
                 self.gen_uri(server_config, "name.tar.xz"),
                 data=data_fp,
-                headers=self.gen_headers(pbench_drb_token, "md5sum"),
+                headers=self.gen_headers(
+                    pbench_drb_token, "d41d8cd98f00b204e9800998ecf8427e"
+                ),
             )
         assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
         assert response.json.get("message").startswith(
@@ -305,7 +347,9 @@ class TestUpload:
         # Upload with invalid token
         response = client.put(
             self.gen_uri(server_config),
-            headers=self.gen_headers(pbench_drb_token_invalid, "md5sum"),
+            headers=self.gen_headers(
+                pbench_drb_token_invalid, "d41d8cd98f00b204e9800998ecf8427e"
+            ),
         )
         assert response.status_code == HTTPStatus.UNAUTHORIZED
         for record in caplog.records:
@@ -719,3 +763,265 @@ class TestUpload:
             "metadata": {"server.archiveonly": True, "server.origin": "test"},
             "missing_metadata": True,
         }
+
+    @staticmethod
+    def put_chunk(client, server_config, token, datafile, md5, start, end):
+        """Upload a chunk of a tarball, from `start` up to and including
+        `end`."""
+        data = datafile.read_bytes()
+        headers = {
+            "Authorization": "Bearer " + token,
+            "Content-MD5": md5,
+            "Content-Type": "application/octet-stream",
+            "Content-Range": f"bytes {start}-{end}/{len(data)}",
+        }
+        return client.put(
+            TestUpload.gen_uri(server_config, datafile.name),
+            data=data[start : end + 1],
+            headers=headers,
+            query_string={"metadata": "global.pbench.test:data"},
+        )
+
+    @pytest.mark.freeze_time("1970-01-01")
+    def test_upload_chunks(self, client, pbench_drb_token, server_config, tarball):
+        """Test a dataset upload in overlapping chunks sent out of order, and
+        the reporting of upload progress along the way."""
+        datafile, _, md5 = tarball
+        size = datafile.stat().st_size
+        assert size > 250
+        progress_uri = self.gen_uri(server_config, datafile.name)
+        headers = {"Authorization": "Bearer " + pbench_drb_token}
+
+        response = client.get(progress_uri, headers=headers, query_string={"md5": md5})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+        for start, end, received in (
+            (200, size - 1, [[200, size - 1]]),
+            (0, 99, [[0, 99], [200, size - 1]]),
+            (50, 149, [[0, 149], [200, size - 1]]),
+        ):
+            response = self.put_chunk(
+                client, server_config, pbench_drb_token, datafile, md5, start, end
+            )
+            assert response.status_code == HTTPStatus.ACCEPTED, repr(response.text)
+            assert response.json == {
+                "message": "Chunk received",
+                "size": size,
+                "received": received,
+            }
+        response = client.get(progress_uri, headers=headers, query_string={"md5": md5})
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["received"] == [[0, 149], [200, size - 1]]
+        assert Audit.query() == []
+
+        # The start of the tarball has been assembled and hashed, leaving only
+        # the chunk which doesn't yet continue it.
+        session = server_config.ARCHIVE / CacheManager.TEMPORARY / f"{md5}.chunks"
+        assert (session / "data").read_bytes() == datafile.read_bytes()[:150]
+        assert [p.name for p in session.glob("[0-9]*")] == [f"200-{size - 1}"]
+
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 150, 199
+        )
+        assert response.status_code == HTTPStatus.CREATED, repr(response.text)
+        dataset = Dataset.query(resource_id=md5)
+        assert dataset.name == Dataset.stem(datafile)
+        assert Metadata.getvalue(dataset, "global") == {"pbench": {"test": "data"}}
+        assert self.cachemanager_create_path.name == datafile.name
+        assert [a.status for a in Audit.query()] == [
+            AuditStatus.BEGIN,
+            AuditStatus.SUCCESS,
+        ]
+        assert not (server_config.ARCHIVE / CacheManager.TEMPORARY / md5).exists()
+        assert not (
+            server_config.ARCHIVE / CacheManager.TEMPORARY / f"{md5}.chunks"
+        ).exists()
+
+        # Once the dataset exists, a chunk is a duplicate upload
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 99
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["message"] == "Dataset already exists"
+
+    @pytest.mark.parametrize(
+        "state,status",
+        (
+            (OperationState.READY, HTTPStatus.CONFLICT),
+            (OperationState.WORKING, HTTPStatus.CONFLICT),
+            (OperationState.FAILED, HTTPStatus.CREATED),
+            (OperationState.OK, HTTPStatus.OK),
+        ),
+    )
+    def test_upload_chunks_duplicate(
+        self,
+        client,
+        make_logger,
+        pbench_drb_token,
+        server_config,
+        tarball,
+        state,
+        status,
+    ):
+        """Test that a chunked upload of a dataset which is being relayed is
+        refused, and that one whose relay failed is replaced."""
+        datafile, _, md5 = tarball
+        size = datafile.stat().st_size
+        dataset = Dataset(
+            owner=User.query(id=DRB_USER_ID),
+            name=Dataset.stem(datafile),
+            resource_id=md5,
+        )
+        dataset.add()
+        Sync(make_logger, OperationName.UPLOAD).update(dataset=dataset, state=state)
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, size - 1
+        )
+        assert response.status_code == status, repr(response.text)
+        operations = Metadata.getvalue(
+            Dataset.query(resource_id=md5), "dataset.operations"
+        )
+        if state == OperationState.FAILED:
+            assert operations["UPLOAD"]["state"] == "OK"
+        else:
+            assert operations["UPLOAD"]["state"] == state.name
+
+    def test_upload_chunks_bad_md5(
+        self, client, pbench_drb_token, server_config, tarball
+    ):
+        """Test that a chunked upload whose data doesn't match its MD5 fails
+        once all the chunks are received, and is discarded."""
+        datafile, _, _ = tarball
+        md5 = "0" * 32
+        size = datafile.stat().st_size
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 99
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 100, size - 1
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json["message"].startswith("MD5 checksum ")
+        assert not (
+            server_config.ARCHIVE / CacheManager.TEMPORARY / f"{md5}.chunks"
+        ).exists()
+        with pytest.raises(DatasetNotFound):
+            Dataset.query(resource_id=md5)
+
+    def test_upload_chunks_internal_error(
+        self, client, pbench_drb_token, server_config, tarball
+    ):
+        """Test that the chunks of an upload which fails with an internal
+        error are kept, so that the upload can be completed later."""
+        datafile, _, md5 = tarball
+        size = datafile.stat().st_size
+        TestUpload.cachemanager_create_fail = Exception("broken")
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, size - 1
+        )
+        assert response.status_code == HTTPStatus.INTERNAL_SERVER_ERROR
+        TestUpload.cachemanager_create_fail = None
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 9
+        )
+        assert response.status_code == HTTPStatus.CREATED, repr(response.text)
+
+    def test_upload_chunks_expired(
+        self, client, pbench_drb_token, server_config, tarball
+    ):
+        """Test that a chunked upload which has received nothing for too long
+        is discarded when another chunk is received."""
+        datafile, _, md5 = tarball
+        temporary = server_config.ARCHIVE / CacheManager.TEMPORARY
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 99
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        abandoned = temporary / "d41d8cd98f00b204e9800998ecf8427e.chunks"
+        abandoned.mkdir()
+        (abandoned / "0-9").write_bytes(b"x" * 10)
+        stale = time.time() - (Upload.SESSION_MAX_AGE_HOURS + 1) * 60 * 60
+        os.utime(abandoned, (stale, stale))
+
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 100, 199
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert response.json["received"] == [[0, 199]]
+        assert not abandoned.exists()
+
+        session = temporary / f"{md5}.chunks"
+        os.utime(session, (stale, stale))
+        assert UploadSession.expire(
+            temporary, timedelta(hours=Upload.SESSION_MAX_AGE_HOURS)
+        ) == [session]
+        assert not session.exists()
+
+    def test_upload_chunks_claimed(
+        self, client, pbench_drb_token, server_config, tarball
+    ):
+        """Test that a chunked upload is completed by only one request at a
+        time, but that a claim left by a server process which died while
+        completing the upload doesn't stop a later request completing it."""
+        datafile, _, md5 = tarball
+        size = datafile.stat().st_size
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 99
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        session = server_config.ARCHIVE / CacheManager.TEMPORARY / f"{md5}.chunks"
+        with (session / UploadSession.ASSEMBLING).open("w") as claimed:
+            fcntl.flock(claimed, fcntl.LOCK_EX)
+            response = self.put_chunk(
+                client, server_config, pbench_drb_token, datafile, md5, 100, size - 1
+            )
+            assert response.status_code == HTTPStatus.ACCEPTED
+            assert response.json["message"] == "Upload is being completed"
+        assert (session / UploadSession.ASSEMBLING).exists()
+
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 9
+        )
+        assert response.status_code == HTTPStatus.CREATED, repr(response.text)
+        assert not session.exists()
+
+    @pytest.mark.parametrize(
+        "content_range,status,message",
+        (
+            ("0-9/100", HTTPStatus.BAD_REQUEST, "Invalid 'Content-Range' header"),
+            ("bytes 9-0/100", HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, "Invalid"),
+            ("bytes 0-100/100", HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, "Invalid"),
+            ("bytes 0-19/100", HTTPStatus.BAD_REQUEST, "Expected 20 bytes but"),
+        ),
+    )
+    def test_upload_chunk_bad_range(
+        self, client, pbench_drb_token, server_config, content_range, status, message
+    ):
+        headers = self.gen_headers(pbench_drb_token, "d41d8cd98f00b204e9800998ecf8427e")
+        headers["Content-Range"] = content_range
+        response = client.put(
+            self.gen_uri(server_config), data=b"x" * 10, headers=headers
+        )
+        assert response.status_code == status
+        assert response.json["message"].startswith(message)
+
+    def test_upload_chunks_other_user(
+        self, client, pbench_drb_token, pbench_admin_token, server_config, tarball
+    ):
+        """Test that another user can't add to or see a chunked upload."""
+        datafile, _, md5 = tarball
+        response = self.put_chunk(
+            client, server_config, pbench_drb_token, datafile, md5, 0, 99
+        )
+        assert response.status_code == HTTPStatus.ACCEPTED
+        response = self.put_chunk(
+            client, server_config, pbench_admin_token, datafile, md5, 100, 199
+        )
+        assert response.status_code == HTTPStatus.FORBIDDEN
+        response = client.get(
+            self.gen_uri(server_config, datafile.name),
+            headers={"Authorization": "Bearer " + pbench_admin_token},
+            query_string={"md5": md5},
+        )
+        assert response.status_code == HTTPStatus.NOT_FOUND
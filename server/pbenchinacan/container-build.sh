@@ -70,14 +70,18 @@ buildah run $container rm /etc/logrotate.d/nginx
 # Setup the Pbench Server systemd service.
 buildah run $container cp \
     ${SERVER_LIB}/systemd/pbench-server.service \
+    ${SERVER_LIB}/systemd/pbench-dataset-jobs.service \
     ${SERVER_LIB}/systemd/pbench-index.service \
     ${SERVER_LIB}/systemd/pbench-index.timer \
+    ${SERVER_LIB}/systemd/pbench-relay-pull.service \
     /etc/systemd/system/
 
 buildah run $container systemctl enable nginx
 buildah run $container systemctl enable rsyslog
 buildah run $container systemctl enable pbench-server
 buildah run $container systemctl enable pbench-index.timer
+buildah run $container systemctl enable pbench-dataset-jobs
+buildah run $container systemctl enable pbench-relay-pull
 
 # Create the container image.
 buildah commit $container ${PB_CONTAINER_REG}/${PB_SERVER_IMAGE_NAME}:${PB_SERVER_IMAGE_TAG}